@@ -0,0 +1,205 @@
+"""
+Bulk loader for large upserts.
+
+On PostgreSQL a batch is streamed with COPY into a temporary staging table and
+merged into the target with a single INSERT ... SELECT ... ON CONFLICT, so the
+server parses one small statement instead of thousands of literals. Other
+dialects (SQLite in the tests) fall back to a multi-row INSERT ... ON CONFLICT.
+
+Conflicting rows are only rewritten when one of the update columns actually
+differs (IS DISTINCT FROM), so re-syncing unchanged data produces no dead
+tuples, WAL or index churn. Every merge reports how many rows it sent, how
+many were inserted or changed and how many were left untouched; on request,
+RETURNING also tells the inserted rows from the updated ones.
+"""
+import io
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from sqlalchemy import delete, func, or_, select
+
+from app import db
+
+STAGING_PREFIX = 'stg_'
+
+
+def _insert_for_dialect(table):
+    if db.engine.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def _apply_python_defaults(table, rows, columns):
+    """Fill client-side column defaults (default=...) that COPY would otherwise leave NULL."""
+    extra = []
+    for column in table.columns:
+        if column.name in columns or column.primary_key or column.default is None:
+            continue
+        default = column.default
+        if default.is_scalar:
+            value = default.arg
+        elif default.is_callable:
+            value = default.arg(None)
+        else:
+            continue
+        extra.append(column.name)
+        for row in rows:
+            row[column.name] = value
+    return columns + extra
+
+
+def _copy_value(value):
+    """Format one value for COPY ... (FORMAT csv). Unquoted empty is NULL, so strings are always quoted."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_buffer(rows, columns):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(_copy_value(row.get(column)) for column in columns))
+        buffer.write('\n')
+    buffer.seek(0)
+    return buffer
+
+
+def merge_stats(sent=0, changed=0, inserted=None):
+    """Counters returned by bulk_merge; they add up with collections.Counter.update."""
+    stats = {'sent': sent, 'changed': changed, 'unchanged': sent - changed}
+    if inserted is not None:
+        stats.update(inserted=inserted, updated=changed - inserted)
+    return stats
+
+
+def bulk_merge(model, rows, index_elements, update_columns, extra_set=None, purge_match=None, purge_filter=None,
+               skip_unchanged=True, count_inserts=False, fill_columns=None):
+    """
+    Upsert a batch of row dicts into model's table.
+
+    index_elements is the conflict target and update_columns the columns overwritten on conflict;
+    fill_columns are only written on conflict where the stored value is NULL, and extra_set adds
+    literal values to the UPDATE (e.g. updated_at). With skip_unchanged, a conflicting row is only
+    updated (and extra_set only applied) when an update column differs or a fill column gets a value. When purge_match
+    is given, target rows matching purge_filter ({column: value}) whose purge_match value appears in
+    the batch are deleted in the same statement, so replacing provisional rows is atomic.
+
+    Returns merge_stats: rows sent, rows inserted or changed, rows left unchanged, plus the rows
+    inserted and updated when count_inserts is set.
+    """
+    if not rows:
+        return merge_stats(inserted=0 if count_inserts else None)
+    if db.engine.name == 'postgresql':
+        merge = _copy_merge
+    else:
+        merge = _values_merge
+    changed, inserted = merge(model.__table__, rows, index_elements, update_columns, extra_set,
+                              purge_match, purge_filter, skip_unchanged, count_inserts, fill_columns or [])
+    return merge_stats(len(rows), changed, inserted)
+
+
+def _values_merge(table, rows, index_elements, update_columns, extra_set, purge_match, purge_filter,
+                  skip_unchanged, count_inserts, fill_columns):
+    if purge_match:
+        conditions = [table.c[purge_match].in_({row[purge_match] for row in rows})]
+        conditions += [table.c[column] == value for column, value in (purge_filter or {}).items()]
+        db.session.execute(delete(table).where(*conditions))
+
+    stmt = _insert_for_dialect(table).values(rows)
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    set_.update({column: func.coalesce(table.c[column], stmt.excluded[column]) for column in fill_columns})
+    set_.update(extra_set or {})
+    where = None
+    if skip_unchanged and (update_columns or fill_columns):
+        where = or_(
+            *[table.c[column].is_distinct_from(stmt.excluded[column]) for column in update_columns],
+            *[table.c[column].is_(None) & stmt.excluded[column].isnot(None) for column in fill_columns]
+        )
+    stmt = stmt.on_conflict_do_update(index_elements=index_elements, set_=set_, where=where)
+    if not count_inserts:
+        return db.session.execute(stmt).rowcount, None
+
+    # SQLite has no xmax: inserted rows are the ones whose rowid lies past the largest one before
+    primary_key = next(iter(table.primary_key.columns))
+    last_id = db.session.scalar(select(func.max(primary_key))) or 0
+    ids = db.session.execute(stmt.returning(primary_key)).scalars().all()
+    return len(ids), sum(1 for id_ in ids if id_ > last_id)
+
+
+def _copy_merge(table, rows, index_elements, update_columns, extra_set, purge_match, purge_filter,
+                skip_unchanged, count_inserts, fill_columns):
+    connection = db.session.connection()
+    quote = connection.dialect.identifier_preparer.quote
+    rows = [dict(row) for row in rows]
+    columns = [column.name for column in table.columns if column.name in rows[0]]
+    columns = _apply_python_defaults(table, rows, columns)
+
+    target = quote(table.name)
+    staging = quote(STAGING_PREFIX + table.name)
+    column_list = ', '.join(quote(column) for column in columns)
+
+    cursor = connection.connection.cursor()
+    try:
+        # Only the copied columns and no constraints: NOT NULL/unique checks happen on the merge
+        cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+        cursor.execute(
+            f'CREATE TEMP TABLE {staging} ON COMMIT DROP AS '
+            f'SELECT {column_list} FROM {target} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f'COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv)',
+            _copy_buffer(rows, columns)
+        )
+
+        params = {}
+        assignments = [f'{quote(column)} = EXCLUDED.{quote(column)}' for column in update_columns]
+        assignments += [
+            f'{quote(column)} = COALESCE({target}.{quote(column)}, EXCLUDED.{quote(column)})' for column in fill_columns
+        ]
+        for position, (column, value) in enumerate((extra_set or {}).items()):
+            params[f'extra_{position}'] = value
+            assignments.append(f'{quote(column)} = %(extra_{position})s')
+
+        purge_cte = ''
+        if purge_match:
+            conditions = [f'{target}.{quote(purge_match)} IN (SELECT {quote(purge_match)} FROM {staging})']
+            for position, (column, value) in enumerate((purge_filter or {}).items()):
+                params[f'purge_{position}'] = value
+                conditions.append(f'{target}.{quote(column)} = %(purge_{position})s')
+            purge_cte = f'WITH purged AS (DELETE FROM {target} WHERE {" AND ".join(conditions)}) '
+
+        unchanged_guard = ''
+        if skip_unchanged and (update_columns or fill_columns):
+            current = [f'{target}.{quote(column)}' for column in update_columns + fill_columns]
+            incoming = [f'EXCLUDED.{quote(column)}' for column in update_columns]
+            incoming += [f'COALESCE({target}.{quote(column)}, EXCLUDED.{quote(column)})' for column in fill_columns]
+            unchanged_guard = f' WHERE ROW({", ".join(current)}) IS DISTINCT FROM ROW({", ".join(incoming)})'
+
+        # xmax is 0 only for the row versions created by an INSERT
+        returning = ' RETURNING (xmax = 0)' if count_inserts else ''
+        cursor.execute(
+            f'{purge_cte}INSERT INTO {target} ({column_list}) '
+            f'SELECT {column_list} FROM {staging} '
+            f'ON CONFLICT ({", ".join(quote(column) for column in index_elements)}) '
+            f'DO UPDATE SET {", ".join(assignments)}{unchanged_guard}{returning}',
+            params
+        )
+        # Rows skipped by the guard are neither inserted nor updated, so they are not counted
+        if count_inserts:
+            flags = cursor.fetchall()
+            return len(flags), sum(1 for (inserted,) in flags if inserted)
+        changed = cursor.rowcount
+    finally:
+        cursor.close()
+    return changed, None
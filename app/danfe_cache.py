@@ -0,0 +1,207 @@
+"""
+On-disk cache for locally rendered DANFE PDFs.
+
+An authorized NFe never changes, so the PDF rendered from its XML can be kept
+on disk keyed by the chave and reused on every later request. The cache is
+bounded by size and evicts the least recently used files first (the file
+mtime is bumped on every hit). New NFes can optionally be pre-rendered in a
+small background pool right after ingestion.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Bump when the renderer or its options change so stale PDFs are not served.
+DANFE_RENDER_VERSION = 1
+
+_CHAVE_PATTERN = re.compile(r'^[0-9A-Za-z]{1,64}$')
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _setting(name, default=None):
+    """Read a setting from the active app config, falling back to Config."""
+    if has_app_context():
+        return current_app.config.get(name, getattr(Config, name, default))
+    return getattr(Config, name, default)
+
+
+def _cache_dir():
+    return _setting('DANFE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'danfe_cache')
+
+
+def _max_bytes():
+    return int(_setting('DANFE_CACHE_MAX_MB', 512)) * 1024 * 1024
+
+
+def cache_path(chave, cache_dir=None):
+    """Return the cache file path for a chave, or None if the key is not cacheable."""
+    if not chave or not _CHAVE_PATTERN.match(chave):
+        return None
+    return os.path.join(cache_dir or _cache_dir(), f'{chave}.v{DANFE_RENDER_VERSION}.pdf')
+
+
+def etag_for(chave):
+    """Strong ETag for a cached DANFE. The NFe is immutable, so chave + renderer version is enough."""
+    digest = hashlib.sha1(f'{chave}:{DANFE_RENDER_VERSION}'.encode('ascii')).hexdigest()
+    return f'danfe-{digest}'
+
+
+def render_danfe_pdf(xml_content):
+    """Render the DANFE for an NFe XML and return the PDF bytes."""
+    from brazilfiscalreport.danfe import Danfe
+
+    danfe = Danfe(xml=xml_content)
+    pdf_output = danfe.output(dest='S')
+    return pdf_output.encode('latin1') if isinstance(pdf_output, str) else bytes(pdf_output)
+
+
+def get_cached_pdf_path(chave):
+    """Return the path of a cached PDF (bumping its LRU position) or None on a miss."""
+    path = cache_path(chave)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return path
+
+
+def store_pdf(chave, pdf_bytes, cache_dir=None, max_bytes=None):
+    """Atomically write a PDF into the cache and enforce the size cap."""
+    cache_dir = cache_dir or _cache_dir()
+    path = cache_path(chave, cache_dir)
+    if not path:
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(pdf_bytes)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    evict(cache_dir, max_bytes if max_bytes is not None else _max_bytes())
+    return path
+
+
+def evict(cache_dir, max_bytes):
+    """Remove least recently used PDFs until the cache fits in max_bytes."""
+    entries = []
+    total = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.endswith('.pdf'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    except FileNotFoundError:
+        return 0
+
+    removed = 0
+    if total <= max_bytes:
+        return removed
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except FileNotFoundError:
+            total -= size
+    return removed
+
+
+def get_or_render_pdf(nfe_data):
+    """
+    Return the DANFE PDF bytes for an NFEData row, rendering and caching on a miss.
+
+    Returns:
+        tuple: (pdf_bytes, cache_hit)
+    """
+    path = get_cached_pdf_path(nfe_data.chave)
+    if path:
+        with open(path, 'rb') as f:
+            return f.read(), True
+
+    pdf_bytes = render_danfe_pdf(nfe_data.xml_content)
+    try:
+        store_pdf(nfe_data.chave, pdf_bytes)
+    except OSError as e:
+        logger.warning(f"Could not cache DANFE for {nfe_data.chave}: {e}")
+    return pdf_bytes, False
+
+
+def ensure_cached_pdf(nfe_data):
+    """Return the cached PDF path for an NFEData row, rendering it first if needed."""
+    path = get_cached_pdf_path(nfe_data.chave)
+    if path:
+        return path
+    pdf_bytes = render_danfe_pdf(nfe_data.xml_content)
+    return store_pdf(nfe_data.chave, pdf_bytes)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(_setting('DANFE_PRERENDER_WORKERS', 2))
+            _executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='danfe-prerender')
+        return _executor
+
+
+def _prerender(chave, xml_content, cache_dir, max_bytes):
+    try:
+        path = cache_path(chave, cache_dir)
+        if path and not os.path.exists(path):
+            store_pdf(chave, render_danfe_pdf(xml_content), cache_dir, max_bytes)
+    except Exception as e:
+        logger.warning(f"DANFE pre-render failed for {chave}: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(chave)
+
+
+def schedule_prerender(chave, xml_content):
+    """
+    Queue a background render of a newly ingested NFe when DANFE_PRERENDER is enabled.
+    Returns True if a job was queued.
+    """
+    if not _setting('DANFE_PRERENDER', False):
+        return False
+
+    cache_dir = _cache_dir()
+    path = cache_path(chave, cache_dir)
+    if not path or os.path.exists(path):
+        return False
+
+    with _pending_lock:
+        if chave in _pending:
+            return False
+        _pending.add(chave)
+
+    _get_executor().submit(_prerender, chave, xml_content, cache_dir, _max_bytes())
+    return True
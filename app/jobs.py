@@ -0,0 +1,327 @@
+"""
+Local background job runner.
+
+Jobs are persisted in the background_jobs table and executed by a thread pool
+inside the web process, so an HTTP request only has to enqueue the work and
+return. Jobs sharing a concurrency_key (e.g. one CNPJ) are limited to
+JOB_MAX_PER_KEY running at once across all workers; the rest stay queued in
+the table until a slot frees up. Running jobs are heartbeated, so jobs left
+queued or running by a stopped worker are recovered on startup. Handlers
+report progress through JobProgress, which commits it to the job row so it can
+be polled or streamed by any worker.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_, select, text, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+from app.models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('completed', 'failed')
+
+_handlers = {}
+
+
+def lock_concurrency_key(key):
+    """
+    Serialize work on a concurrency key until the current transaction ends. On PostgreSQL this is a
+    transaction-level advisory lock; SQLite already serializes writers, so it is a no-op there.
+    """
+    if db.engine.name == 'postgresql':
+        db.session.execute(text('SELECT pg_advisory_xact_lock(hashtext(:key))'), {'key': key})
+
+
+def job_handler(job_type):
+    """Register a function as the handler for a job type. It is called as handler(progress, **params)."""
+    def decorator(func):
+        _handlers[job_type] = func
+        return func
+    return decorator
+
+
+class JobProgress:
+    """Progress reporter handed to job handlers."""
+
+    def __init__(self, job):
+        self.job = job
+
+    def update(self, **fields):
+        progress = dict(self.job.progress or {})
+        progress.update(fields)
+        self.job.progress = progress
+        self.job.updated_at = datetime.now()
+        db.session.commit()
+
+    def publish(self, **fields):
+        """
+        Report progress without committing the handler's open transaction (e.g. an all-or-nothing
+        import). The row is written through a separate connection and never flagged dirty in the
+        session, so the handler's own flush cannot lock it. SQLite cannot write beside an open
+        transaction, so there the progress only becomes visible with the next update().
+        """
+        progress = dict(self.job.progress or {})
+        progress.update(fields)
+        set_committed_value(self.job, 'progress', progress)
+        if db.engine.name == 'sqlite':
+            return
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(BackgroundJob.__table__)
+                .where(BackgroundJob.__table__.c.id == self.job.id)
+                .values(progress=progress, updated_at=datetime.now())
+            )
+
+    @property
+    def data(self):
+        return dict(self.job.progress or {})
+
+
+class JobRunner:
+    """
+    Claims and runs jobs in this process. The background_jobs table is the queue: a job is claimed by
+    moving it from queued to running, with the per-key limit counted over the running rows of every
+    process, and whoever finishes a job of a key dispatches the next queued one.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._running = set()
+        self._heartbeat = None
+
+    def _get_executor(self, app):
+        with self._lock:
+            if self._executor is None:
+                workers = int(app.config.get('JOB_WORKERS', 4))
+                self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='job-runner')
+            return self._executor
+
+    def start(self, app):
+        """Recover jobs orphaned by a stopped process and start the heartbeat. Called by the web entry point."""
+        self.recover(app)
+        self._ensure_heartbeat(app)
+
+    def submit(self, job_type, params=None, concurrency_key=None, user_id=None):
+        """Persist a new job and schedule it. Returns the BackgroundJob row."""
+        if job_type not in _handlers:
+            raise ValueError(f'Unknown job type: {job_type}')
+
+        job = BackgroundJob(
+            job_type=job_type,
+            status='queued',
+            concurrency_key=concurrency_key,
+            params=params or {},
+            progress={},
+            created_by_id=user_id,
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        app = current_app._get_current_object()
+        self._dispatch(app, job.id)
+        if app.config.get('JOBS_EAGER'):
+            db.session.refresh(job)
+        return job
+
+    def _claim(self, app, job_id):
+        """
+        Move a queued job to running if its concurrency key has a free slot. On PostgreSQL the count and
+        the update run under a transaction-level advisory lock on the key, so concurrent claims from
+        other workers cannot both take the last slot. Returns True when this process owns the job.
+        """
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            if job is None or job.status != 'queued':
+                db.session.rollback()
+                return False
+
+            key = job.concurrency_key
+            if key:
+                lock_concurrency_key(key)
+                running = db.session.scalar(
+                    select(func.count(BackgroundJob.id))
+                    .where(BackgroundJob.concurrency_key == key, BackgroundJob.status == 'running')
+                )
+                if running >= int(app.config.get('JOB_MAX_PER_KEY', 1)):
+                    db.session.rollback()
+                    return False
+
+            now = datetime.now()
+            claimed = db.session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.id == job_id, BackgroundJob.status == 'queued')
+                .values(status='running', started_at=now, updated_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            return claimed == 1
+
+    def _dispatch(self, app, job_id):
+        """
+        Run a queued job in the pool (inline with JOBS_EAGER) if it can be claimed; otherwise it stays
+        queued for a slot of its key. Returns True when the job was claimed here.
+        """
+        if not self._claim(app, job_id):
+            return False
+        if app.config.get('JOBS_EAGER'):
+            self._execute(app, job_id)
+            return True
+        with self._lock:
+            self._running.add(job_id)
+        self._ensure_heartbeat(app)
+        self._get_executor(app).submit(self._run, app, job_id)
+        return True
+
+    def _run(self, app, job_id):
+        try:
+            concurrency_key = self._execute(app, job_id)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+        self._dispatch_next(app, concurrency_key)
+
+    def _dispatch_next(self, app, concurrency_key):
+        """Dispatch the oldest queued job of a key, whichever process submitted it."""
+        if not concurrency_key:
+            return
+        with app.app_context():
+            next_job_id = db.session.scalar(
+                select(BackgroundJob.id)
+                .where(BackgroundJob.concurrency_key == concurrency_key, BackgroundJob.status == 'queued')
+                .order_by(BackgroundJob.created_at, BackgroundJob.id)
+                .limit(1)
+            )
+            db.session.rollback()
+        if next_job_id is not None:
+            self._dispatch(app, next_job_id)
+
+    def _execute(self, app, job_id):
+        """Run the handler of a claimed job and record its outcome. Returns the job's concurrency key."""
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            if job is None:
+                return None
+            concurrency_key = job.concurrency_key
+            try:
+                handler = _handlers[job.job_type]
+                result = handler(JobProgress(job), **(job.params or {}))
+
+                job.status = 'completed'
+                job.result = result
+                job.finished_at = datetime.now()
+                db.session.commit()
+            except Exception as e:
+                logger.exception(f"Job {job_id} ({job.job_type}) failed")
+                db.session.rollback()
+                job = db.session.get(BackgroundJob, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+                job.finished_at = datetime.now()
+                db.session.commit()
+            return concurrency_key
+
+    def recover(self, app):
+        """
+        Fail running jobs whose heartbeat stopped for JOB_STALE_SECONDS (the process running them died)
+        and dispatch every queued job that can take a slot. Safe to run from several workers at once.
+        Returns (jobs failed, jobs dispatched).
+        """
+        with app.app_context():
+            failed = self.fail_stale()
+            queued = db.session.scalars(
+                select(BackgroundJob.id)
+                .where(BackgroundJob.status == 'queued')
+                .order_by(BackgroundJob.created_at, BackgroundJob.id)
+            ).all()
+            db.session.commit()
+
+        if failed:
+            logger.warning(f"Marked {failed} orphaned running jobs as failed.")
+        dispatched = sum(self._dispatch(app, job_id) for job_id in queued)
+        return failed, dispatched
+
+    def fail_stale(self, concurrency_key=None):
+        """
+        Mark running jobs (optionally of one key) whose heartbeat stopped for JOB_STALE_SECONDS as failed,
+        in the current session without committing. Returns the number of jobs failed.
+        """
+        now = datetime.now()
+        stale_after = timedelta(seconds=int(current_app.config.get('JOB_STALE_SECONDS', 300)))
+        with self._lock:
+            own = set(self._running)
+        stale = update(BackgroundJob)\
+            .where(BackgroundJob.status == 'running')\
+            .where(or_(BackgroundJob.updated_at.is_(None), BackgroundJob.updated_at < now - stale_after))\
+            .values(status='failed', error='Interrupted: the worker running this job stopped.', finished_at=now)\
+            .execution_options(synchronize_session=False)
+        if own:
+            stale = stale.where(BackgroundJob.id.notin_(own))
+        if concurrency_key is not None:
+            stale = stale.where(BackgroundJob.concurrency_key == concurrency_key)
+        return db.session.execute(stale).rowcount
+
+    def _ensure_heartbeat(self, app):
+        with self._lock:
+            if self._heartbeat is not None or app.config.get('JOBS_EAGER'):
+                return
+            self._heartbeat = threading.Thread(
+                target=self._heartbeat_loop, args=(app,), name='job-heartbeat', daemon=True
+            )
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self, app):
+        """Touch updated_at of the jobs running here, and periodically recover jobs orphaned elsewhere."""
+        interval = float(app.config.get('JOB_HEARTBEAT_SECONDS', 30))
+        stale_after = float(app.config.get('JOB_STALE_SECONDS', 300))
+        last_recover = time.monotonic()
+        while True:
+            time.sleep(interval)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                with app.app_context():
+                    if running:
+                        with db.engine.begin() as connection:
+                            connection.execute(
+                                update(BackgroundJob.__table__)
+                                .where(BackgroundJob.__table__.c.id.in_(running))
+                                .where(BackgroundJob.__table__.c.status == 'running')
+                                .values(updated_at=datetime.now())
+                            )
+                if time.monotonic() - last_recover >= stale_after:
+                    last_recover = time.monotonic()
+                    self.recover(app)
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+
+runner = JobRunner()
+
+
+def submit_job(job_type, params=None, concurrency_key=None, user_id=None):
+    return runner.submit(job_type, params=params, concurrency_key=concurrency_key, user_id=user_id)
+
+
+def serialize_job(job):
+    return {
+        'id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'concurrency_key': job.concurrency_key,
+        'params': job.params,
+        'progress': job.progress or {},
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    }
@@ -44,6 +44,13 @@ class PurchaseOrder(db.Model):
     tipo = db.Column(db.String, nullable=True)
     id_ped_focco = db.Column(db.Integer, nullable=True)
 
+    # Resumo derivado dos itens e ajustes, mantido por refresh_order_summaries
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    items_total = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    effective_total_excl_cancelled = db.Column(db.Float, nullable=False, default=0, server_default='0')
+    adjusted_total = db.Column(db.Float, nullable=True)
+    received_qty_ratio = db.Column(db.Float, nullable=True)
+
     items = db.relationship('PurchaseItem', backref='purchase_order', lazy=True)
 
     __table_args__ = (
@@ -137,6 +144,26 @@ class NFEntry(db.Model):
         ),
     )
 
+class PurchaseItemReceipt(db.Model):
+    """Quantidade recebida por linha de NF, tipada e vinculada ao item do pedido (derivada de NFEntry)."""
+    __tablename__ = 'purchase_item_receipts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    nf_entry_id = db.Column(db.Integer, db.ForeignKey('nf_entries.id', ondelete='CASCADE'), nullable=False, unique=True)
+    purchase_item_id = db.Column(db.Integer, db.ForeignKey('purchase_items.id', ondelete='SET NULL'), nullable=True, index=True)
+    cod_emp1 = db.Column(db.String(20), nullable=False)
+    cod_pedc = db.Column(db.String(20), nullable=False)
+    linha = db.Column(db.Integer, nullable=True)
+    num_nf = db.Column(db.String(20), nullable=False, index=True)
+    dt_ent = db.Column(db.Date, nullable=True)
+    quantity = db.Column(db.Float, nullable=True)
+
+    purchase_item = db.relationship('PurchaseItem', backref=db.backref('receipts', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_purchase_item_receipts_order_line', 'cod_emp1', 'cod_pedc', 'linha'),
+    )
+
 user_report_categories = db.Table('user_report_categories',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True),
     db.Column('category_id', db.Integer, db.ForeignKey('report_categories.id', ondelete='CASCADE'), primary_key=True)
@@ -257,6 +284,11 @@ class Quotation(db.Model):
     dt_entrega = db.Column(db.Date, nullable=True)
     cod_emp1 = db.Column(db.String, nullable=True)
 
+    __table_args__ = (
+        # Chave do upsert da importação RCOT0300
+        db.UniqueConstraint('cod_cot', 'item_id', 'fornecedor_id', name='uq_quotation_cot_item_fornecedor'),
+    )
+
 
 class Supplier(db.Model):
     __tablename__ = 'suppliers'
@@ -279,6 +311,12 @@ class Supplier(db.Model):
     bairro = db.Column(db.String(100))
     cf_fax = db.Column(db.String(50))
 
+    __table_args__ = (
+        # Chaves dos upserts: id_for na sincronização Oracle, cod_for na importação RFOR0302
+        db.UniqueConstraint('id_for', name='uq_supplier_id_for'),
+        db.UniqueConstraint('cod_for', name='uq_supplier_cod_for'),
+    )
+
 class PurchaseAdjustment(db.Model):
     __tablename__ = 'purchase_adjustments'
     
@@ -625,4 +663,82 @@ class RequestLog(db.Model):
     search_term = db.Column(db.String(500), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.now, index=True)
 
-    user = db.relationship('User', backref=db.backref('request_logs', lazy='dynamic'))
\ No newline at end of file
+    user = db.relationship('User', backref=db.backref('request_logs', lazy='dynamic'))
+
+class BackgroundJob(db.Model):
+    """Long-running work executed by app.jobs outside the request cycle, with persisted progress."""
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(100), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, completed, failed
+    concurrency_key = db.Column(db.String(100), nullable=True, index=True)  # E.g., 'cnpj:12345678000190'
+    params = db.Column(db.JSON, nullable=True, default=dict)
+    progress = db.Column(db.JSON, nullable=True, default=dict)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+    created_by = db.relationship('User', foreign_keys=[created_by_id])
+
+
+class CompanyNFECount(db.Model):
+    """NFe counters per CNPJ, maintained at ingest so tracked-company counts are a single-row lookup."""
+    __tablename__ = 'company_nfe_counts'
+
+    cnpj = db.Column(db.String(14), primary_key=True)
+    emitente_count = db.Column(db.Integer, nullable=False, default=0)
+    destinatario_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)  # NFes where the CNPJ is emitente or destinatário
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class PurchaseMonthlyRollup(db.Model):
+    """
+    Purchase orders aggregated per month, company, buyer and supplier, so the dashboard reads a few
+    hundred rows instead of scanning orders and items. Rebuilt per month by refresh_purchase_rollups.
+    """
+    __tablename__ = 'purchase_monthly_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    cod_emp1 = db.Column(db.String, nullable=True)
+    func_nome = db.Column(db.String, nullable=True)
+    fornecedor_id = db.Column(db.Integer, nullable=False)
+    fornecedor_descricao = db.Column(db.String, nullable=True)  # Descrição do fornecedor no mês (MAX, caso varie)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    fulfilled_count = db.Column(db.Integer, nullable=False, default=0)
+    total_value = db.Column(db.Float, nullable=False, default=0)  # Soma de total_pedido_com_ipi
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_purchase_monthly_rollups_period', 'year', 'month'),
+    )
+
+
+class NFEMonthlyRollup(db.Model):
+    """NFe count and value per emission month, maintained at ingest like company_nfe_counts."""
+    __tablename__ = 'nfe_monthly_rollups'
+
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    nfe_count = db.Column(db.Integer, nullable=False, default=0)
+    total_value = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class SyncState(db.Model):
+    """Per-stage watermark for the incremental Oracle sync (app/tasks/sync_oracle.py)."""
+    __tablename__ = 'sync_state'
+
+    stage = db.Column(db.String(50), primary_key=True)
+    watermark_scn = db.Column(db.BigInteger, nullable=True)  # Oracle SCN captured before the last successful run
+    last_run_at = db.Column(db.DateTime, nullable=True)
+    last_full_sync_at = db.Column(db.DateTime, nullable=True)
+    rows_synced = db.Column(db.Integer, nullable=True)
@@ -0,0 +1,437 @@
+"""
+Serialized response cache for stored NFes.
+
+An authorized NFe is written once by parse_and_store_nfe_xml and never
+updated afterwards, so the JSON built from it can be computed a single time
+and reused. Rows are loaded with every child relationship eager-loaded (a
+fixed number of queries regardless of item count) and the finished body is
+kept in a bounded per-app LRU together with a strong ETag.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy.orm import selectinload
+
+from app.models import NFEData
+
+# Bump when any payload shape below changes so cached bodies and client ETags are invalidated.
+NFE_PAYLOAD_VERSION = 2
+
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+
+class NFEResponseCache:
+    """Thread-safe LRU of serialized NFe responses keyed by (view, identifier)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, body, mimetype):
+        etag = hashlib.sha1(f'{NFE_PAYLOAD_VERSION}:'.encode('ascii') + body).hexdigest()
+        entry = (body, etag, mimetype)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_response_cache():
+    """Return the cache bound to the current app, creating it on first use."""
+    cache = current_app.extensions.get('nfe_response_cache')
+    if cache is None:
+        cache = NFEResponseCache(int(current_app.config.get('NFE_RESPONSE_CACHE_SIZE', 512)))
+        current_app.extensions['nfe_response_cache'] = cache
+    return cache
+
+
+def _eager_query():
+    return NFEData.query.options(
+        selectinload(NFEData.emitente),
+        selectinload(NFEData.destinatario),
+        selectinload(NFEData.transportadora),
+        selectinload(NFEData.itens),
+        selectinload(NFEData.volumes),
+        selectinload(NFEData.pagamentos),
+        selectinload(NFEData.duplicatas),
+    )
+
+
+def load_nfe_by_chave(chave):
+    """Load an NFEData row by chave with all child relationships eager-loaded."""
+    return _eager_query().filter(NFEData.chave == chave).first()
+
+
+def load_nfe_by_id(nfe_id):
+    """Load an NFEData row by primary key with all child relationships eager-loaded."""
+    return _eager_query().filter(NFEData.id == nfe_id).first()
+
+
+def _dumps(payload):
+    return current_app.json.dumps(payload).encode('utf-8')
+
+
+def get_or_build(view, identifier, loader, builder, mimetype='application/json'):
+    """
+    Return a cached (body, etag, mimetype) tuple for a view of an NFe, building it on a miss.
+    Returns None when the loader finds no NFe.
+    """
+    cache = get_response_cache()
+    key = (view, identifier)
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
+    nfe = loader(identifier)
+    if nfe is None:
+        return None
+
+    payload = builder(nfe)
+    body = payload.encode('utf-8') if isinstance(payload, str) else _dumps(payload)
+    return cache.set(key, body, mimetype)
+
+
+def build_danfe_data(nfe):
+    """
+    Payload for /get_danfe_data.
+    The emitente logo is not part of it: Company.logo_path can change, so it is served by /get_danfe_logo.
+    """
+    emit = nfe.emitente
+    dest = nfe.destinatario
+    trans = nfe.transportadora
+    volumes = [
+        {
+            'quantidade': v.quantidade,
+            'especie': v.especie,
+            'marca': v.marca,
+            'numeracao': v.numeracao,
+            'peso_bruto': v.peso_bruto,
+            'peso_liquido': v.peso_liquido,
+        } for v in nfe.volumes
+    ]
+    items = []
+    for it in nfe.itens:
+        items.append({
+            'numero_item': it.numero_item,
+            'codigo': it.codigo,
+            'descricao': it.descricao,
+            'ncm': it.ncm,
+            'cfop': it.cfop,
+            'unidade': it.unidade_comercial,
+            'quantidade': it.quantidade_comercial,
+            'valor_unitario': it.valor_unitario_comercial,
+            'valor_total': it.valor_total_bruto,
+            'icms': {
+                'vBC': it.icms_vbc,
+                'pICMS': it.icms_picms,
+                'vICMS': it.icms_vicms,
+                'origem': it.icms_origem,
+                'cst': it.icms_cst,
+            },
+            'ipi': {
+                'cEnq': it.ipi_cenq,
+                'cst': it.ipi_cst,
+            },
+            'pis': {
+                'cst': it.pis_cst,
+                'vBC': it.pis_vbc,
+                'pPIS': it.pis_ppis,
+                'vPIS': it.pis_vpis,
+            },
+            'cofins': {
+                'cst': it.cofins_cst,
+                'vBC': it.cofins_vbc,
+                'pCOFINS': it.cofins_pcofins,
+                'vCOFINS': it.cofins_vcofins,
+            },
+            'inf_ad_prod': it.inf_ad_prod,
+        })
+
+    emitente = {
+        'nome': emit.nome if emit else None,
+        'cnpj': emit.cnpj if emit else None,
+        'inscricao_estadual': emit.inscricao_estadual if emit else None,
+        'telefone': emit.telefone if emit else None,
+        'email': emit.email if emit else None,
+        'endereco': {
+            'logradouro': emit.logradouro if emit else None,
+            'numero': emit.numero if emit else None,
+            'complemento': emit.complemento if emit else None,
+            'bairro': emit.bairro if emit else None,
+            'municipio': emit.municipio if emit else None,
+            'uf': emit.uf if emit else None,
+            'cep': emit.cep if emit else None,
+        },
+    }
+
+    destinatario = {
+        'nome': dest.nome if dest else None,
+        'cpf_cnpj': dest.cpf or dest.cnpj if dest else None,
+        'inscricao_estadual': dest.inscricao_estadual if dest else None,
+        'telefone': dest.telefone if dest else None,
+        'email': dest.email if dest else None,
+        'endereco': {
+            'logradouro': dest.logradouro if dest else None,
+            'numero': dest.numero if dest else None,
+            'complemento': dest.complemento if dest else None,
+            'bairro': dest.bairro if dest else None,
+            'municipio': dest.municipio if dest else None,
+            'uf': dest.uf if dest else None,
+            'cep': dest.cep if dest else None,
+        },
+    }
+
+    transportadora = None
+    if trans:
+        transportadora = {
+            'nome': trans.nome,
+            'cnpj': trans.cnpj,
+            'inscricao_estadual': trans.inscricao_estadual,
+            'endereco': trans.endereco,
+            'municipio': trans.municipio,
+            'uf': trans.uf,
+            'placa': trans.placa,
+            'uf_veiculo': trans.uf_veiculo,
+            'rntc': trans.rntc,
+        }
+
+    impostos = {
+        'valor_total': nfe.valor_total,
+        'valor_produtos': nfe.valor_produtos,
+        'valor_frete': nfe.valor_frete,
+        'valor_seguro': nfe.valor_seguro,
+        'valor_desconto': nfe.valor_desconto,
+        'valor_icms': nfe.valor_icms,
+        'valor_icms_st': nfe.valor_icms_st,
+        'valor_ipi': nfe.valor_ipi,
+        'valor_pis': nfe.valor_pis,
+        'valor_cofins': nfe.valor_cofins,
+        'valor_outros': nfe.valor_outros,
+    }
+
+    result = {
+        'chave': nfe.chave,
+        'numero': nfe.numero,
+        'serie': nfe.serie,
+        'data_emissao': nfe.data_emissao.isoformat() if nfe.data_emissao else None,
+        'data_saida': nfe.data_saida.isoformat() if nfe.data_saida else None,
+        'natureza_operacao': nfe.natureza_operacao,
+        'tipo_operacao': nfe.tipo_operacao,
+        'protocolo': nfe.protocolo,
+        'data_autorizacao': nfe.data_autorizacao.isoformat() if nfe.data_autorizacao else None,
+        'ambiente': nfe.ambiente,
+        'modality_frete': nfe.modalidade_frete,
+        'informacoes_adicionais': nfe.informacoes_adicionais,
+        'emitente': emitente,
+        'destinatario': destinatario,
+        'transportador': transportadora,
+        'impostos': impostos,
+        'volumes': volumes,
+        'items': items,
+    }
+
+
+    return result
+
+
+def build_nfe_data(nfe):
+    """Payload for /get_nfe_data when the NFe is already stored."""
+    items_data = []
+    for item in nfe.itens:
+        items_data.append({
+            'numero_item': item.numero_item,
+            'codigo': item.codigo,
+            'descricao': item.descricao,
+            'ncm': item.ncm,
+            'cfop': item.cfop,
+            'unidade': item.unidade_comercial,
+            'quantidade': item.quantidade_comercial,
+            'valor_unitario': item.valor_unitario_comercial,
+            'valor_total': item.valor_total_bruto,
+            'icms_valor': item.icms_vicms,
+            'icms_aliquota': item.icms_picms,
+            'pis_valor': item.pis_vpis,
+            'pis_aliquota': item.pis_ppis,
+            'cofins_valor': item.cofins_vcofins,
+            'cofins_aliquota': item.cofins_pcofins
+        })
+
+    result = {
+        'source': 'database',
+        'chave': nfe.chave,
+        'numero': nfe.numero,
+        'serie': nfe.serie,
+        'data_emissao': nfe.data_emissao.isoformat() if nfe.data_emissao else None,
+        'natureza_operacao': nfe.natureza_operacao,
+        'status': nfe.status_motivo,
+        'protocolo': nfe.protocolo,
+        'valor_total': nfe.valor_total,
+        'valor_produtos': nfe.valor_produtos,
+        'valor_impostos': nfe.valor_imposto,
+
+        'emitente': {
+            'nome': nfe.emitente.nome if nfe.emitente else '',
+            'cnpj': nfe.emitente.cnpj if nfe.emitente else '',
+            'inscricao_estadual': nfe.emitente.inscricao_estadual if nfe.emitente else '',
+            'endereco': {
+                'logradouro': nfe.emitente.logradouro if nfe.emitente else '',
+                'numero': nfe.emitente.numero if nfe.emitente else '',
+                'complemento': nfe.emitente.complemento if nfe.emitente else '',
+                'bairro': nfe.emitente.bairro if nfe.emitente else '',
+                'municipio': nfe.emitente.municipio if nfe.emitente else '',
+                'uf': nfe.emitente.uf if nfe.emitente else '',
+                'cep': nfe.emitente.cep if nfe.emitente else '',
+                'telefone': nfe.emitente.telefone if nfe.emitente else '',
+            }
+        },
+
+        'destinatario': {
+            'nome': nfe.destinatario.nome if nfe.destinatario else '',
+            'cnpj': nfe.destinatario.cnpj if nfe.destinatario else '',
+            'cpf': nfe.destinatario.cpf if nfe.destinatario else '',
+            'inscricao_estadual': nfe.destinatario.inscricao_estadual if nfe.destinatario else '',
+            'email': nfe.destinatario.email if nfe.destinatario else '',
+            'endereco': {
+                'logradouro': nfe.destinatario.logradouro if nfe.destinatario else '',
+                'numero': nfe.destinatario.numero if nfe.destinatario else '',
+                'complemento': nfe.destinatario.complemento if nfe.destinatario else '',
+                'bairro': nfe.destinatario.bairro if nfe.destinatario else '',
+                'municipio': nfe.destinatario.municipio if nfe.destinatario else '',
+                'uf': nfe.destinatario.uf if nfe.destinatario else '',
+                'cep': nfe.destinatario.cep if nfe.destinatario else '',
+                'telefone': nfe.destinatario.telefone if nfe.destinatario else '',
+            }
+        },
+
+        'transporte': {
+            'modalidade': nfe.modalidade_frete,
+            'transportadora': {
+                'nome': nfe.transportadora.nome if nfe.transportadora else '',
+                'cnpj': nfe.transportadora.cnpj if nfe.transportadora else '',
+                'inscricao_estadual': nfe.transportadora.inscricao_estadual if nfe.transportadora else '',
+                'endereco': nfe.transportadora.endereco if nfe.transportadora else '',
+                'municipio': nfe.transportadora.municipio if nfe.transportadora else '',
+                'uf': nfe.transportadora.uf if nfe.transportadora else '',
+                'placa': nfe.transportadora.placa if nfe.transportadora else '',
+            },
+            'volumes': [{
+                'quantidade': vol.quantidade,
+                'especie': vol.especie,
+                'peso_bruto': vol.peso_bruto,
+                'peso_liquido': vol.peso_liquido
+            } for vol in nfe.volumes] if nfe.volumes else []
+        },
+
+        'pagamento': [{
+            'tipo': pag.tipo,
+            'valor': pag.valor
+        } for pag in nfe.pagamentos] if nfe.pagamentos else [],
+
+        'duplicatas': [{
+            'numero': dup.numero,
+            'vencimento': dup.data_vencimento.isoformat() if dup.data_vencimento else None,
+            'valor': dup.valor
+        } for dup in nfe.duplicatas] if nfe.duplicatas else [],
+
+        'itens': items_data,
+
+        'informacoes_adicionais': nfe.informacoes_adicionais,
+        'informacoes_fisco': nfe.informacoes_fisco,
+
+        'xml_content': nfe.xml_content
+    }
+
+
+    return result
+
+
+def build_danfe_template(nfe):
+    """HTML for /view_danfe_template."""
+    danfe_data = {
+        'chave': nfe.chave,
+        'numero': nfe.numero,
+        'serie': nfe.serie,
+        'data_emissao': nfe.data_emissao.strftime('%d/%m/%Y %H:%M:%S') if nfe.data_emissao else '',
+        'natureza_operacao': nfe.natureza_operacao,
+        'protocolo': nfe.protocolo,
+        'valor_total': nfe.valor_total,
+        'emitente': {
+            'nome': nfe.emitente.nome if nfe.emitente else '',
+            'cnpj': nfe.emitente.cnpj if nfe.emitente else '',
+            'endereco': f"{nfe.emitente.logradouro}, {nfe.emitente.numero}" if nfe.emitente else '',
+            'bairro': nfe.emitente.bairro if nfe.emitente else '',
+            'municipio': nfe.emitente.municipio if nfe.emitente else '',
+            'uf': nfe.emitente.uf if nfe.emitente else '',
+            'cep': nfe.emitente.cep if nfe.emitente else '',
+            'telefone': nfe.emitente.telefone if nfe.emitente else '',
+        },
+        'destinatario': {
+            'nome': nfe.destinatario.nome if nfe.destinatario else '',
+            'cnpj': nfe.destinatario.cnpj if nfe.destinatario else '',
+            'endereco': f"{nfe.destinatario.logradouro}, {nfe.destinatario.numero}" if nfe.destinatario else '',
+            'bairro': nfe.destinatario.bairro if nfe.destinatario else '',
+            'municipio': nfe.destinatario.municipio if nfe.destinatario else '',
+            'uf': nfe.destinatario.uf if nfe.destinatario else '',
+            'cep': nfe.destinatario.cep if nfe.destinatario else '',
+        },
+        'itens': [
+            {
+                'codigo': item.codigo,
+                'descricao': item.descricao,
+                'quantidade': item.quantidade_comercial,
+                'unidade': item.unidade_comercial,
+                'valor_unitario': item.valor_unitario_comercial,
+                'valor_total': item.valor_total_bruto,
+                'ncm': item.ncm,
+                'cfop': item.cfop,
+            } for item in nfe.itens
+        ]
+    }
+    
+    html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>DANFE - {nfe.numero}</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; }}
+            .danfe-container {{ border: 1px solid #ccc; padding: 20px; max-width: 800px; margin: 0 auto; }}
+            .header {{ display: flex; justify-content: space-between; border-bottom: 1px solid #ccc; padding-bottom: 10px; }}
+            .section {{ margin: 15px 0; }}
+            .section-title {{ font-weight: bold; background: #f5f5f5; padding: 5px; }}
+            .items-table {{ width: 100%; border-collapse: collapse; }}
+            .items-table th, .items-table td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
+            .items-table th {{ background-color: #f5f5f5; }}
+        </style>
+    </head>
+    <body>
+        <div class="danfe-container">
+            <div class="header">
+                <h2>DANFE</h2>
+                <p>Número: {danfe_data['numero']}</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    
+    return html
@@ -1,17 +1,35 @@
+import hashlib
+import mmap
+import re
 import tempfile
+import time
 import os
-import shutil
-import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
 from flask import request, jsonify, current_app
-from flask_login import login_required
+from flask_login import current_user, login_required
+from sqlalchemy import and_, or_
 from app import db
+from app.jobs import job_handler, lock_concurrency_key, runner, submit_job
+from app.models import BackgroundJob
 from app.routes.auth import token_required
-from app.utils import import_ruah, import_rpdc0250c, import_rcot0300, import_rfor0302
+from app.utils import (
+    import_ruah_stream, import_rpdc0250c, import_rcot0300, import_rfor0302, import_nfe_archive,
+    import_xml_files, sniff_xml_document_type
+)
 from app.routes.routes import bp
 
 
 UPLOAD_FOLDER = tempfile.gettempdir()
 ALLOWED_EXTENSIONS = {'xml'}
+IMPORT_JOB_TYPE = 'xml_import'
+# RUAH (RPDC0250) documents are streamed from the file by import_ruah_stream instead
+IMPORT_HANDLERS = {
+    'RPDC0250C': import_rpdc0250c,
+    'RCOT0300': import_rcot0300,
+    'RFOR0302': import_rfor0302,
+}
+SUPPORTED_DOCUMENT_TYPES = ('RPDC0250', *IMPORT_HANDLERS)
+FILE_ID_PATTERN = re.compile(r'^[\w-]{1,100}$')
 
 
 def allowed_file(filename):
@@ -19,13 +37,136 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def is_valid_xml(content):
-    """Validate XML content structure."""
+def upload_paths(file_id):
+    """The assembled file and the manifest of received chunks for an upload."""
+    return (
+        os.path.join(UPLOAD_FOLDER, f'{file_id}.part'),
+        os.path.join(UPLOAD_FOLDER, f'{file_id}.chunks'),
+    )
+
+
+def read_chunk_manifest(manifest_path):
+    """{chunk index: (offset, length)} from the manifest; a re-sent chunk keeps its last entry."""
+    chunks = {}
+    with open(manifest_path) as f:
+        for line in f:
+            index, offset, length = line.split()[:3]
+            chunks[int(index)] = (int(offset), int(length))
+    return chunks
+
+
+def recorded_total_size(manifest_path):
+    """The totalSize announced by the first chunk that sent one, or None."""
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 4 and int(fields[4]):
+                return int(fields[4])
+    return None
+
+
+@job_handler(IMPORT_JOB_TYPE)
+def run_xml_import(progress, path, filename, content_sha256):
+    """Background job: import a spooled FoccoERP XML file, reporting orders, items and throughput."""
+    started = time.monotonic()
+
+    def report(phase, counters):
+        elapsed = max(time.monotonic() - started, 0.001)
+        progress.publish(
+            phase=phase,
+            orders=counters['purchases'],
+            items=counters['items'],
+            orders_per_second=round(counters['purchases'] / elapsed, 1),
+            items_per_second=round(counters['items'] / elapsed, 1),
+        )
+
     try:
-        ET.fromstring(content)
-        return True
-    except ET.ParseError:
-        return False
+        progress.update(phase='parsing', filename=filename, orders=0, items=0, errors=[])
+        doc_type = sniff_xml_document_type(path)
+        if doc_type == 'RPDC0250':
+            # Parsed and validated in a single streaming pass, never loaded whole
+            response, status_code = import_ruah_stream(path, on_progress=report)
+        elif doc_type in IMPORT_HANDLERS:
+            progress.update(phase='importing')
+            # The parsers read the page cache through the mapping instead of a copy of the file
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                response, status_code = IMPORT_HANDLERS[doc_type](content)
+        else:
+            raise ValueError('Arquivo XML invalido ou não suportado')
+    except Exception as e:
+        db.session.rollback()
+        progress.update(phase='failed', errors=[str(e)])
+        raise
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    progress.update(phase='done', elapsed_seconds=round(time.monotonic() - started, 2))
+    return {'filename': filename, 'status_code': status_code, **response.get_json()}
+
+
+def previous_xml_import(concurrency_key):
+    """
+    The job that makes a new import of this content redundant: one that imported it successfully, or
+    one still in flight. Jobs that failed or returned an error do not count, nor do queued or running
+    jobs whose row went JOB_STALE_SECONDS untouched: those belong to a stopped worker, and the running
+    ones are failed here so they stop holding the key's slot.
+    """
+    runner.fail_stale(concurrency_key)
+    live_since = datetime.now() - timedelta(seconds=int(current_app.config.get('JOB_STALE_SECONDS', 300)))
+    candidates = BackgroundJob.query.filter(
+        BackgroundJob.job_type == IMPORT_JOB_TYPE,
+        BackgroundJob.concurrency_key == concurrency_key,
+        or_(
+            BackgroundJob.status == 'completed',
+            and_(BackgroundJob.status.in_(('queued', 'running')), BackgroundJob.updated_at >= live_since),
+        ),
+    ).order_by(BackgroundJob.id.desc())
+    for job in candidates:
+        if job.status != 'completed' or (job.result or {}).get('status_code', 200) < 400:
+            return job
+    return None
+
+
+def queue_xml_import(path, filename, content_sha256, user_id=None, force=False):
+    """
+    Queue an import job for a spooled file. Unless force is set, a file whose content was already
+    imported (or is being imported) is not queued again: the spool file is removed and the earlier
+    job is returned. The check and the insert run under the content's key lock, so two uploads of the
+    same file cannot both be queued. Returns (job, duplicate).
+    """
+    concurrency_key = f'import:{content_sha256}'
+    if not force:
+        lock_concurrency_key(concurrency_key)
+        previous = previous_xml_import(concurrency_key)
+        if previous is not None:
+            db.session.commit()
+            os.remove(path)
+            return previous, True
+
+    job = submit_job(
+        IMPORT_JOB_TYPE,
+        params={'path': path, 'filename': filename, 'content_sha256': content_sha256},
+        concurrency_key=concurrency_key,
+        user_id=user_id,
+    )
+    return job, False
+
+
+def import_job_payload(job, duplicate):
+    payload = {
+        'status': job.status,
+        'job_id': job.id,
+        'duplicate': duplicate,
+        'status_url': f'/api/jobs/{job.id}',
+        'stream_url': f'/api/jobs/{job.id}/stream',
+    }
+    if job.status in ('completed', 'failed'):
+        payload['result'] = job.result
+        payload['error'] = job.error
+    return payload
 
 
 # PHASE 4 ENDPOINTS
@@ -33,23 +174,59 @@ def is_valid_xml(content):
 @bp.route('/upload_chunk', methods=['POST'])
 @login_required
 def upload_chunk():
-    """Handle chunked file upload for large XML files."""
-    
+    """
+    Handle chunked file upload for large XML files.
+
+    Each chunk is written straight into the upload file at its offset (form field offset, or
+    chunkIndex * UPLOAD_CHUNK_SIZE), so chunks may arrive in any order and nothing has to be
+    concatenated afterwards. totalSize preallocates the file on the first chunk; checksum, the
+    SHA-256 of the chunk, is verified before anything is written. A chunk must lie within totalSize,
+    which must be the same for every chunk of a fileId, and no upload may exceed UPLOAD_MAX_MB.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
 
     file = request.files['file']
-    chunk_index = int(request.form['chunkIndex'])
     file_id = request.form['fileId']
+    if not FILE_ID_PATTERN.match(file_id):
+        return jsonify({'error': 'Invalid file ID'}), 400
+
+    try:
+        chunk_index = int(request.form['chunkIndex'])
+        offset = int(request.form.get('offset', chunk_index * current_app.config.get('UPLOAD_CHUNK_SIZE', 1024 * 1024)))
+        total_size = int(request.form.get('totalSize', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid chunk position'}), 400
 
     try:
-        chunk_dir = os.path.join(UPLOAD_FOLDER, file_id)
-        os.makedirs(chunk_dir, exist_ok=True)
+        data = file.read()
+        part_path, manifest_path = upload_paths(file_id)
+        recorded_size = recorded_total_size(manifest_path)
+        if total_size and recorded_size and total_size != recorded_size:
+            return jsonify({'error': 'totalSize differs from earlier chunks', 'totalSize': recorded_size}), 400
+        total_size = total_size or recorded_size or 0
+        max_size = current_app.config.get('UPLOAD_MAX_MB', 2048) * 1024 * 1024
+        if chunk_index < 0 or offset < 0 or offset + len(data) > (total_size or max_size) or total_size > max_size:
+            return jsonify({'error': 'Chunk outside the upload', 'chunkIndex': chunk_index}), 400
+
+        checksum = hashlib.sha256(data).hexdigest()
+        expected = request.form.get('checksum')
+        if expected and expected.lower() != checksum:
+            return jsonify({'error': 'Chunk checksum mismatch', 'chunkIndex': chunk_index}), 400
+
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if total_size and os.fstat(fd).st_size < total_size:
+                os.ftruncate(fd, total_size)
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
 
-        chunk_path = os.path.join(chunk_dir, f'chunk_{chunk_index}')
-        file.save(chunk_path)
+        # Recorded only once the data is in place, so process_file never sees a half-written chunk
+        with open(manifest_path, 'a') as manifest:
+            manifest.write(f'{chunk_index} {offset} {len(data)} {checksum} {total_size}\n')
 
-        return jsonify({'message': 'Chunk uploaded successfully'}), 200
+        return jsonify({'message': 'Chunk uploaded successfully', 'checksum': checksum}), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -58,51 +235,61 @@ def upload_chunk():
 @bp.route('/process_file', methods=['POST'])
 @login_required
 def process_file():
-    """Process uploaded XML file chunks and import data."""
-    file_id = request.json.get('fileId')
+    """
+    Assemble uploaded XML file chunks and queue their import.
+    Returns 202 with the job id; follow progress at /api/jobs/<id> or /api/jobs/<id>/stream.
+    A file with the same content as an earlier import is skipped (200, duplicate) unless force is set.
+    totalChunks, totalSize and sha256 (of the whole file), when given, are checked before queueing.
+    """
+    data = request.get_json() or {}
+    file_id = data.get('fileId')
     if not file_id:
         return jsonify({'error': 'No file ID provided'}), 400
+    if not FILE_ID_PATTERN.match(file_id):
+        return jsonify({'error': 'Invalid file ID'}), 400
 
-    chunk_dir = os.path.join(UPLOAD_FOLDER, file_id)
-    if not os.path.exists(chunk_dir):
+    part_path, manifest_path = upload_paths(file_id)
+    if not os.path.exists(manifest_path):
         return jsonify({'error': 'File chunks not found'}), 404
 
+    # An incomplete upload is kept so that the client can send the missing chunks and retry
+    chunks = read_chunk_manifest(manifest_path)
+    if data.get('totalChunks') is not None:
+        missing = sorted(set(range(int(data['totalChunks']))) - set(chunks))
+        if missing:
+            return jsonify({'error': 'Missing chunks', 'missing': missing}), 400
+
+    size = max((offset + length for offset, length in chunks.values()), default=0)
+    if data.get('totalSize') is not None and int(data['totalSize']) != size:
+        return jsonify({'error': 'Incomplete upload', 'received': size}), 400
+
     final_file_path = os.path.join(UPLOAD_FOLDER, f'{file_id}_complete.xml')
+    queued = False
 
     try:
-        chunks = sorted(os.listdir(chunk_dir), key=lambda x: int(x.split('_')[1]))
-        with open(final_file_path, 'wb') as outfile:
-            for chunk_name in chunks:
-                chunk_path = os.path.join(chunk_dir, chunk_name)
-                with open(chunk_path, 'rb') as infile:
-                    outfile.write(infile.read())
-        
-        assembled_size = os.path.getsize(final_file_path)
-        
-        with open(final_file_path, 'rb') as f:
-            content = f.read()
-        
-        if not is_valid_xml(content):
-            raise ValueError('Invalid XML file')
-
-        # Determine document type
-        if b'<RPDC0250_RUAH>' in content or b'<RPDC0250>' in content:
-            doc_type = 'RPDC0250'
-            handler = import_ruah
-        elif b'<RPDC0250C>' in content:
-            doc_type = 'RPDC0250C'
-            handler = import_rpdc0250c
-        elif b'<RCOT0300>' in content:
-            doc_type = 'RCOT0300'
-            handler = import_rcot0300
-        elif b'<RFOR0302>' in content:
-            doc_type = 'RFOR0302'
-            handler = import_rfor0302
-        else:
-            raise ValueError('Arquivo XML invalido ou não suportado')
-
-        result = handler(content)
-        return result
+        # Drops whatever the preallocation left past the last chunk
+        os.truncate(part_path, size)
+        os.replace(part_path, final_file_path)
+
+        digest = hashlib.sha256()
+        if size:
+            with open(final_file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                digest.update(content)
+        if data.get('sha256') and data['sha256'].lower() != digest.hexdigest():
+            return jsonify({'error': 'File checksum mismatch'}), 400
+
+        if sniff_xml_document_type(final_file_path) not in SUPPORTED_DOCUMENT_TYPES:
+            return jsonify({'error': 'Arquivo XML invalido ou não suportado'}), 400
+
+        job, duplicate = queue_xml_import(
+            final_file_path,
+            data.get('filename') or file_id,
+            digest.hexdigest(),
+            user_id=current_user.id,
+            force=bool(data.get('force')),
+        )
+        queued = True
+        return jsonify(import_job_payload(job, duplicate)), 200 if duplicate else 202
 
     except Exception as e:
         db.session.rollback()
@@ -110,9 +297,10 @@ def process_file():
         return jsonify({'error': str(e)}), 500
     
     finally:
-        shutil.rmtree(chunk_dir, ignore_errors=True)
-        if os.path.exists(final_file_path):
-            os.remove(final_file_path)
+        # Once queued, the import job owns the file and removes it
+        for path in (manifest_path, part_path) if queued else (manifest_path, part_path, final_file_path):
+            if os.path.exists(path):
+                os.remove(path)
 
 
 @bp.route('/import', methods=['POST'])
@@ -120,7 +308,10 @@ def process_file():
 def import_file_bulk(user):
     """
     Import and process XML files in bulk.
-    Accepts multiple files under the 'files' form key.
+    Accepts multiple files under the 'files' form key. Each file is queued as an import job and the
+    response is 202 with a job per file (see queue_bulk_import). With async=0 the files are imported
+    in the request instead: they are parsed concurrently (XML_IMPORT_WORKERS processes) and each one
+    is imported in its own transaction.
     """
     uploaded_files = request.files.getlist('files')
     if 'file' in request.files:
@@ -129,12 +320,16 @@ def import_file_bulk(user):
     if not uploaded_files or all(f.filename == '' for f in uploaded_files):
         return jsonify({'error': 'No files provided. Please upload XML files.'}), 400
 
+    if request.values.get('async', '').lower() not in ('0', 'false', 'no'):
+        return queue_bulk_import(uploaded_files, user, force=request.values.get('force', '').lower() in ('1', 'true', 'yes'))
+
     results = {
         'successful': [],
         'failed': [],
         'total_processed': 0
     }
 
+    files = []
     for file in uploaded_files:
         filename = file.filename
         if filename == '':
@@ -146,46 +341,118 @@ def import_file_bulk(user):
             results['failed'].append({'filename': filename, 'reason': 'Must be XML format'})
             continue
 
+        content = file.read()
+        if not content:
+            results['failed'].append({'filename': filename, 'reason': 'File is empty'})
+            continue
+
+        files.append((filename, content))
+
+    if files:
+        # Parsed in parallel worker processes, written here one file per transaction
+        imported = import_xml_files(files)
+        results['successful'].extend(imported['successful'])
+        results['failed'].extend(imported['failed'])
+
+    # Determine standard HTTP status code
+    if not results['failed']:
+        status_code = 200 # All good
+    elif not results['successful']:
+        status_code = 400 # All failed
+    else:
+        status_code = 207 # Multi-Status (Partial success)
+
+    return jsonify(results), status_code
+
+def queue_bulk_import(uploaded_files, user, force=False):
+    """Spool each uploaded file and queue its import job. Files already imported are reported as skipped."""
+    results = {
+        'queued': [],
+        'skipped': [],
+        'failed': [],
+        'total_processed': 0
+    }
+
+    for file in uploaded_files:
+        filename = file.filename
+        if filename == '':
+            continue
+
+        results['total_processed'] += 1
+
+        if not allowed_file(filename):
+            results['failed'].append({'filename': filename, 'reason': 'Must be XML format'})
+            continue
+
+        fd, path = tempfile.mkstemp(suffix='.xml', dir=UPLOAD_FOLDER)
         try:
-            content = file.read()
-            if not content:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as outfile:
+                for block in iter(lambda: file.stream.read(1024 * 1024), b''):
+                    digest.update(block)
+                    outfile.write(block)
+                    size += len(block)
+
+            if not size:
+                os.remove(path)
                 results['failed'].append({'filename': filename, 'reason': 'File is empty'})
                 continue
 
-            if not is_valid_xml(content):
-                results['failed'].append({'filename': filename, 'reason': 'Invalid XML structure'})
-                continue
-
-            if b'<RPDC0250_RUAH>' in content or b'<RPDC0250>' in content:
-                handler = import_ruah
-            elif b'<RPDC0250C>' in content:
-                handler = import_rpdc0250c
-            elif b'<RCOT0300>' in content:
-                handler = import_rcot0300
-            elif b'<RFOR0302>' in content:
-                handler = import_rfor0302
-            else:
+            if sniff_xml_document_type(path) not in SUPPORTED_DOCUMENT_TYPES:
+                os.remove(path)
                 results['failed'].append({'filename': filename, 'reason': 'Unsupported XML document type'})
                 continue
-         
-            handler_result = handler(content)
-            
-            results['successful'].append({
-                'filename': filename, 
-                'details': handler_result.get_json() if hasattr(handler_result, 'get_json') else 'Processed'
-            })
+
+            job, duplicate = queue_xml_import(path, filename, digest.hexdigest(), user_id=user.id, force=force)
+            entry = {'filename': filename, **import_job_payload(job, duplicate)}
+            results['skipped' if duplicate else 'queued'].append(entry)
 
         except Exception as e:
             db.session.rollback()
-            current_app.logger.exception(f"Bulk import failure | filename={filename}")
+            current_app.logger.exception(f"Bulk import queue failure | filename={filename}")
+            if os.path.exists(path):
+                os.remove(path)
             results['failed'].append({'filename': filename, 'reason': str(e)})
 
-    # Determine standard HTTP status code
+    if results['failed'] and not (results['queued'] or results['skipped']):
+        return jsonify(results), 400
+    return jsonify(results), 202 if results['queued'] else 200
+
+
+@bp.route('/import_nfe_zip', methods=['POST'])
+@token_required
+def import_nfe_zip(user):
+    """
+    Import a ZIP archive of NFe XMLs (e.g. received from an accountant).
+    Accepts the archive under the 'file' form key and returns a per-file report.
+    """
+    import zipfile
+
+    archive = request.files.get('file')
+    if archive is None or archive.filename == '':
+        return jsonify({'error': 'No file provided. Please upload a ZIP archive of NFe XMLs.'}), 400
+
+    if not archive.filename.lower().endswith('.zip'):
+        return jsonify({'error': 'Must be ZIP format'}), 400
+
+    try:
+        results = import_nfe_archive(archive.stream)
+    except zipfile.BadZipFile:
+        return jsonify({'error': 'Invalid ZIP archive'}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(f"NFe ZIP import failure | filename={archive.filename}")
+        return jsonify({'error': str(e)}), 500
+
+    if not results['total_processed']:
+        return jsonify({'error': 'ZIP archive contains no files'}), 400
+
     if not results['failed']:
-        status_code = 200 # All good
+        status_code = 200
     elif not results['successful']:
-        status_code = 400 # All failed
+        status_code = 400
     else:
-        status_code = 207 # Multi-Status (Partial success)
+        status_code = 207
 
-    return jsonify(results), status_code
\ No newline at end of file
+    return jsonify(results), status_code
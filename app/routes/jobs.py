@@ -0,0 +1,68 @@
+import json
+import time
+from flask import Response, current_app, jsonify, stream_with_context
+from flask_login import current_user, login_required
+
+from app import db
+from app.jobs import TERMINAL_STATUSES, serialize_job
+from app.models import BackgroundJob
+from app.routes.routes import bp
+
+
+def visible_job(job_id):
+    """The job if the current user queued it or is an admin, else None (reported as not found)."""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None or (job.created_by_id != current_user.id and current_user.role != 'admin'):
+        return None
+    return job
+
+
+@bp.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    """Poll the status and progress of a background job queued by the current user (any job for admins)."""
+    job = visible_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(serialize_job(job)), 200
+
+
+@bp.route('/jobs/<int:job_id>/stream', methods=['GET'])
+@login_required
+def stream_job_status(job_id):
+    """Stream job progress as Server-Sent Events until the job finishes (same access as get_job_status)."""
+    if not visible_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+
+    poll_seconds = float(current_app.config.get('JOB_STREAM_POLL_SECONDS', 1))
+
+    def generate():
+        last_payload = None
+        last_sent = time.time()
+        while True:
+            job = db.session.get(BackgroundJob, job_id, populate_existing=True)
+            db.session.commit()  # end the read transaction so the next poll sees new progress
+            if job is None:
+                return
+
+            payload = json.dumps(serialize_job(job))
+            if payload != last_payload:
+                yield f'event: progress\ndata: {payload}\n\n'
+                last_payload = payload
+                last_sent = time.time()
+            elif time.time() - last_sent > 15:
+                yield ': keep-alive\n\n'
+                last_sent = time.time()
+
+            if job.status in TERMINAL_STATUSES:
+                yield f'event: done\ndata: {payload}\n\n'
+                return
+
+            time.sleep(poll_seconds)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
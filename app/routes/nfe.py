@@ -3,16 +3,16 @@ import base64
 import requests
 from datetime import datetime, timedelta
 from fuzzywuzzy import fuzz
-from flask import request, jsonify
+from flask import request, jsonify, make_response, send_file
 from flask_login import login_required, current_user
 from sqlalchemy import and_, or_
 
-from app import db
+from app import db, danfe_cache, nfe_response_cache
 from app.models import (
     NFEData, NFEEmitente, NFEItem, NFEntry, NFEDestinatario, 
     PurchaseItemNFEMatch, PurchaseOrder, PurchaseItem, Company
 )
-from app.utils import parse_and_store_nfe_xml, apply_adjustments
+from app.utils import parse_and_store_nfe_xml
 from app.routes.routes import bp
 from config import Config
 
@@ -26,6 +26,29 @@ def _parse_date(date_obj):
     return str(date_obj)
 
 
+def _immutable_response(entry):
+    """Build a conditional response for a cached NFe payload (body, etag, mimetype)."""
+    body, etag, mimetype = entry
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = nfe_response_cache.IMMUTABLE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+
+def _sieg_pdf_base64(payload):
+    """Extract the base64 PDF from a SIEG GerarDanfeViaChave response, whatever key it comes under."""
+    if isinstance(payload, str):
+        return payload
+    if not isinstance(payload, dict):
+        return None
+    for key in ('arquivo', 'pdf', 'content'):
+        if isinstance(payload.get(key), str):
+            return payload[key]
+    candidates = [value for value in payload.values() if isinstance(value, str) and len(value) > 100]
+    return max(candidates, key=len) if candidates else None
+
+
 def _check_supplier_match(purchase_order, nfe_emitente):
     """
     Check if a purchase order's supplier matches an NFE emitente.
@@ -178,19 +201,22 @@ def get_danfe_pdf():
     if not xml_key:
         return jsonify({'error': 'xmlKey is required'}), 400
 
-    def _build_local_pdf_response(nfe_data, source):
-        from brazilfiscalreport.danfe import Danfe
-
-        danfe = Danfe(xml=nfe_data.xml_content)
-        pdf_output = danfe.output(dest='S')
-        pdf_bytes = (
-            pdf_output.encode('latin1')
-            if isinstance(pdf_output, str)
-            else pdf_output
-        )
+    raw = request.args.get('raw', 'false').lower() == 'true'
+
+    def _build_pdf_response(pdf_bytes, source):
+        if raw:
+            response = make_response(pdf_bytes)
+            response.headers['Content-Type'] = 'application/pdf'
+            response.headers['X-Danfe-Source'] = source
+            response.set_etag(danfe_cache.etag_for(xml_key))
+            return response.make_conditional(request)
         pdf_base64 = base64.b64encode(pdf_bytes).decode('ascii')
         return jsonify({'pdf': pdf_base64, 'source': source}), 200
-    
+
+    def _build_local_pdf_response(nfe_data, source):
+        pdf_bytes, _ = danfe_cache.get_or_render_pdf(nfe_data)
+        return _build_pdf_response(pdf_bytes, source)
+
     try:
         existing_nfe = NFEData.query.filter_by(chave=xml_key).first()
         
@@ -247,12 +273,48 @@ def get_danfe_pdf():
 
             return jsonify({'error': f'NFE not found: {str(e)}'}), 404
 
+        if raw:
+            pdf_base64 = _sieg_pdf_base64(pdf_response.json())
+            if not pdf_base64:
+                return jsonify({'error': 'Unrecognized SIEG DANFE response'}), 502
+            response = make_response(base64.b64decode(pdf_base64))
+            response.headers['Content-Type'] = 'application/pdf'
+            response.headers['X-Danfe-Source'] = 'sieg'
+            response.add_etag()
+            return response.make_conditional(request)
+
         return jsonify(pdf_response.json()), 200
     
     except Exception as e:
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
 
+@bp.route('/danfe_pdf/<chave>', methods=['GET'])
+@login_required
+def get_danfe_pdf_file(chave):
+    """Serve the locally rendered DANFE as raw PDF bytes from the on-disk cache."""
+    nfe_data = NFEData.query.filter_by(chave=chave).first()
+    if not nfe_data:
+        return jsonify({'error': 'NFE not found'}), 404
+
+    try:
+        path = danfe_cache.ensure_cached_pdf(nfe_data)
+    except Exception as e:
+        return jsonify({'error': f'Error rendering DANFE: {str(e)}'}), 500
+
+    if not path:
+        return jsonify({'error': 'Invalid NFE key'}), 400
+
+    return send_file(
+        path,
+        mimetype='application/pdf',
+        download_name=f'{chave}.pdf',
+        etag=danfe_cache.etag_for(chave),
+        conditional=True,
+        max_age=86400,
+    )
+
+
 @bp.route('/get_danfe_data', methods=['GET'])
 @login_required
 def get_danfe_data():
@@ -260,157 +322,35 @@ def get_danfe_data():
     if not chave:
         return jsonify({'error': 'Parametro "chave" é requerido'}), 400
 
-    nfe = NFEData.query.filter_by(chave=chave).first()
-    if not nfe:
+    entry = nfe_response_cache.get_or_build(
+        'danfe_data', chave, nfe_response_cache.load_nfe_by_chave, nfe_response_cache.build_danfe_data
+    )
+    if entry is None:
         return jsonify({'error': 'NFE não encontrada'}), 404
 
-    emit = nfe.emitente
-    dest = nfe.destinatario
-    trans = nfe.transportadora
-    volumes = [
-        {
-            'quantidade': v.quantidade,
-            'especie': v.especie,
-            'marca': v.marca,
-            'numeracao': v.numeracao,
-            'peso_bruto': v.peso_bruto,
-            'peso_liquido': v.peso_liquido,
-        } for v in nfe.volumes
-    ]
-    items = []
-    for it in nfe.itens:
-        items.append({
-            'numero_item': it.numero_item,
-            'codigo': it.codigo,
-            'descricao': it.descricao,
-            'ncm': it.ncm,
-            'cfop': it.cfop,
-            'unidade': it.unidade_comercial,
-            'quantidade': it.quantidade_comercial,
-            'valor_unitario': it.valor_unitario_comercial,
-            'valor_total': it.valor_total_bruto,
-            'icms': {
-                'vBC': it.icms_vbc,
-                'pICMS': it.icms_picms,
-                'vICMS': it.icms_vicms,
-                'origem': it.icms_origem,
-                'cst': it.icms_cst,
-            },
-            'ipi': {
-                'cEnq': it.ipi_cenq,
-                'cst': it.ipi_cst,
-            },
-            'pis': {
-                'cst': it.pis_cst,
-                'vBC': it.pis_vbc,
-                'pPIS': it.pis_ppis,
-                'vPIS': it.pis_vpis,
-            },
-            'cofins': {
-                'cst': it.cofins_cst,
-                'vBC': it.cofins_vbc,
-                'pCOFINS': it.cofins_pcofins,
-                'vCOFINS': it.cofins_vcofins,
-            },
-            'inf_ad_prod': it.inf_ad_prod,
-        })
+    return _immutable_response(entry)
 
-    emitente = {
-        'nome': emit.nome if emit else None,
-        'cnpj': emit.cnpj if emit else None,
-        'inscricao_estadual': emit.inscricao_estadual if emit else None,
-        'telefone': emit.telefone if emit else None,
-        'email': emit.email if emit else None,
-        'endereco': {
-            'logradouro': emit.logradouro if emit else None,
-            'numero': emit.numero if emit else None,
-            'complemento': emit.complemento if emit else None,
-            'bairro': emit.bairro if emit else None,
-            'municipio': emit.municipio if emit else None,
-            'uf': emit.uf if emit else None,
-            'cep': emit.cep if emit else None,
-        },
-        'logo_url': None
-    }
 
-    destinatario = {
-        'nome': dest.nome if dest else None,
-        'cpf_cnpj': dest.cpf or dest.cnpj if dest else None,
-        'inscricao_estadual': dest.inscricao_estadual if dest else None,
-        'telefone': dest.telefone if dest else None,
-        'email': dest.email if dest else None,
-        'endereco': {
-            'logradouro': dest.logradouro if dest else None,
-            'numero': dest.numero if dest else None,
-            'complemento': dest.complemento if dest else None,
-            'bairro': dest.bairro if dest else None,
-            'municipio': dest.municipio if dest else None,
-            'uf': dest.uf if dest else None,
-            'cep': dest.cep if dest else None,
-        },
-    }
-
-    transportadora = None
-    if trans:
-        transportadora = {
-            'nome': trans.nome,
-            'cnpj': trans.cnpj,
-            'inscricao_estadual': trans.inscricao_estadual,
-            'endereco': trans.endereco,
-            'municipio': trans.municipio,
-            'uf': trans.uf,
-            'placa': trans.placa,
-            'uf_veiculo': trans.uf_veiculo,
-            'rntc': trans.rntc,
-        }
+@bp.route('/get_danfe_logo', methods=['GET'])
+@login_required
+def get_danfe_logo():
+    """Logo of the NFe emitente's company. Kept out of the immutable get_danfe_data payload."""
+    chave = request.args.get('chave')
+    if not chave:
+        return jsonify({'error': 'Parametro "chave" é requerido'}), 400
 
-    impostos = {
-        'valor_total': nfe.valor_total,
-        'valor_produtos': nfe.valor_produtos,
-        'valor_frete': nfe.valor_frete,
-        'valor_seguro': nfe.valor_seguro,
-        'valor_desconto': nfe.valor_desconto,
-        'valor_icms': nfe.valor_icms,
-        'valor_icms_st': nfe.valor_icms_st,
-        'valor_ipi': nfe.valor_ipi,
-        'valor_pis': nfe.valor_pis,
-        'valor_cofins': nfe.valor_cofins,
-        'valor_outros': nfe.valor_outros,
-    }
+    nfe = NFEData.query.filter_by(chave=chave).first()
+    if not nfe:
+        return jsonify({'error': 'NFE não encontrada'}), 404
 
     logo_url = None
-    try:
-        if nfe.emitente and nfe.emitente.cnpj:
-            company = Company.query.filter((Company.cnpj == nfe.emitente.cnpj) | (Company.name == nfe.emitente.nome)).first()
-            if company and company.logo_path:
-                logo_url = company.logo_path
-    except Exception:
-        logo_url = None
-
-    emitente['logo_url'] = logo_url
-
-    result = {
-        'chave': nfe.chave,
-        'numero': nfe.numero,
-        'serie': nfe.serie,
-        'data_emissao': nfe.data_emissao.isoformat() if nfe.data_emissao else None,
-        'data_saida': nfe.data_saida.isoformat() if nfe.data_saida else None,
-        'natureza_operacao': nfe.natureza_operacao,
-        'tipo_operacao': nfe.tipo_operacao,
-        'protocolo': nfe.protocolo,
-        'data_autorizacao': nfe.data_autorizacao.isoformat() if nfe.data_autorizacao else None,
-        'ambiente': nfe.ambiente,
-        'modality_frete': nfe.modalidade_frete,
-        'informacoes_adicionais': nfe.informacoes_adicionais,
-        'emitente': emitente,
-        'destinatario': destinatario,
-        'transportador': transportadora,
-        'impostos': impostos,
-        'volumes': volumes,
-        'items': items,
-    }
+    emit = nfe.emitente
+    if emit and emit.cnpj:
+        company = Company.query.filter((Company.cnpj == emit.cnpj) | (Company.name == emit.nome)).first()
+        if company and company.logo_path:
+            logo_url = company.logo_path
 
-    return jsonify(result), 200
+    return jsonify({'logo_url': logo_url}), 200
 
 
 @bp.route('/get_nfe_data', methods=['GET'])
@@ -421,115 +361,11 @@ def get_nfe_data():
         return jsonify({'error': 'xmlKey is required'}), 400
     
     try:
-        existing_nfe = NFEData.query.filter_by(chave=xml_key).first()
-        
-        if existing_nfe:
-            items_data = []
-            for item in existing_nfe.itens:
-                items_data.append({
-                    'numero_item': item.numero_item,
-                    'codigo': item.codigo,
-                    'descricao': item.descricao,
-                    'ncm': item.ncm,
-                    'cfop': item.cfop,
-                    'unidade': item.unidade_comercial,
-                    'quantidade': item.quantidade_comercial,
-                    'valor_unitario': item.valor_unitario_comercial,
-                    'valor_total': item.valor_total_bruto,
-                    'icms_valor': item.icms_vicms,
-                    'icms_aliquota': item.icms_picms,
-                    'pis_valor': item.pis_vpis,
-                    'pis_aliquota': item.pis_ppis,
-                    'cofins_valor': item.cofins_vcofins,
-                    'cofins_aliquota': item.cofins_pcofins
-                })
-            
-            result = {
-                'source': 'database',
-                'chave': existing_nfe.chave,
-                'numero': existing_nfe.numero,
-                'serie': existing_nfe.serie,
-                'data_emissao': existing_nfe.data_emissao.isoformat() if existing_nfe.data_emissao else None,
-                'natureza_operacao': existing_nfe.natureza_operacao,
-                'status': existing_nfe.status_motivo,
-                'protocolo': existing_nfe.protocolo,
-                'valor_total': existing_nfe.valor_total,
-                'valor_produtos': existing_nfe.valor_produtos,
-                'valor_impostos': existing_nfe.valor_imposto,
-                
-                'emitente': {
-                    'nome': existing_nfe.emitente.nome if existing_nfe.emitente else '',
-                    'cnpj': existing_nfe.emitente.cnpj if existing_nfe.emitente else '',
-                    'inscricao_estadual': existing_nfe.emitente.inscricao_estadual if existing_nfe.emitente else '',
-                    'endereco': {
-                        'logradouro': existing_nfe.emitente.logradouro if existing_nfe.emitente else '',
-                        'numero': existing_nfe.emitente.numero if existing_nfe.emitente else '',
-                        'complemento': existing_nfe.emitente.complemento if existing_nfe.emitente else '',
-                        'bairro': existing_nfe.emitente.bairro if existing_nfe.emitente else '',
-                        'municipio': existing_nfe.emitente.municipio if existing_nfe.emitente else '',
-                        'uf': existing_nfe.emitente.uf if existing_nfe.emitente else '',
-                        'cep': existing_nfe.emitente.cep if existing_nfe.emitente else '',
-                        'telefone': existing_nfe.emitente.telefone if existing_nfe.emitente else '',
-                    }
-                },
-                
-                'destinatario': {
-                    'nome': existing_nfe.destinatario.nome if existing_nfe.destinatario else '',
-                    'cnpj': existing_nfe.destinatario.cnpj if existing_nfe.destinatario else '',
-                    'cpf': existing_nfe.destinatario.cpf if existing_nfe.destinatario else '',
-                    'inscricao_estadual': existing_nfe.destinatario.inscricao_estadual if existing_nfe.destinatario else '',
-                    'email': existing_nfe.destinatario.email if existing_nfe.destinatario else '',
-                    'endereco': {
-                        'logradouro': existing_nfe.destinatario.logradouro if existing_nfe.destinatario else '',
-                        'numero': existing_nfe.destinatario.numero if existing_nfe.destinatario else '',
-                        'complemento': existing_nfe.destinatario.complemento if existing_nfe.destinatario else '',
-                        'bairro': existing_nfe.destinatario.bairro if existing_nfe.destinatario else '',
-                        'municipio': existing_nfe.destinatario.municipio if existing_nfe.destinatario else '',
-                        'uf': existing_nfe.destinatario.uf if existing_nfe.destinatario else '',
-                        'cep': existing_nfe.destinatario.cep if existing_nfe.destinatario else '',
-                        'telefone': existing_nfe.destinatario.telefone if existing_nfe.destinatario else '',
-                    }
-                },
-                
-                'transporte': {
-                    'modalidade': existing_nfe.modalidade_frete,
-                    'transportadora': {
-                        'nome': existing_nfe.transportadora.nome if existing_nfe.transportadora else '',
-                        'cnpj': existing_nfe.transportadora.cnpj if existing_nfe.transportadora else '',
-                        'inscricao_estadual': existing_nfe.transportadora.inscricao_estadual if existing_nfe.transportadora else '',
-                        'endereco': existing_nfe.transportadora.endereco if existing_nfe.transportadora else '',
-                        'municipio': existing_nfe.transportadora.municipio if existing_nfe.transportadora else '',
-                        'uf': existing_nfe.transportadora.uf if existing_nfe.transportadora else '',
-                        'placa': existing_nfe.transportadora.placa if existing_nfe.transportadora else '',
-                    },
-                    'volumes': [{
-                        'quantidade': vol.quantidade,
-                        'especie': vol.especie,
-                        'peso_bruto': vol.peso_bruto,
-                        'peso_liquido': vol.peso_liquido
-                    } for vol in existing_nfe.volumes] if existing_nfe.volumes else []
-                },
-                
-                'pagamento': [{
-                    'tipo': pag.tipo,
-                    'valor': pag.valor
-                } for pag in existing_nfe.pagamentos] if existing_nfe.pagamentos else [],
-                
-                'duplicatas': [{
-                    'numero': dup.numero,
-                    'vencimento': dup.data_vencimento.isoformat() if dup.data_vencimento else None,
-                    'valor': dup.valor
-                } for dup in existing_nfe.duplicatas] if existing_nfe.duplicatas else [],
-                
-                'itens': items_data,
-                
-                'informacoes_adicionais': existing_nfe.informacoes_adicionais,
-                'informacoes_fisco': existing_nfe.informacoes_fisco,
-                
-                'xml_content': existing_nfe.xml_content
-            }
-            
-            return jsonify(result), 200
+        entry = nfe_response_cache.get_or_build(
+            'nfe_data', xml_key, nfe_response_cache.load_nfe_by_chave, nfe_response_cache.build_nfe_data
+        )
+        if entry is not None:
+            return _immutable_response(entry)
 
         xml_response = requests.post(
             f'https://api.sieg.com/BaixarXml?xmlType=1&downloadEvent=true&api_key={Config.SIEG_API_KEY}',
@@ -851,79 +687,14 @@ def manual_match_nfe():
 @login_required
 def view_danfe_template(nfe_id):
     """Render the DANFE template."""
-    nfe = db.session.get(NFEData, nfe_id)
-    if not nfe:
+    entry = nfe_response_cache.get_or_build(
+        'danfe_template', nfe_id, nfe_response_cache.load_nfe_by_id,
+        nfe_response_cache.build_danfe_template, mimetype='text/html'
+    )
+    if entry is None:
         return jsonify({'error': 'NFE not found'}), 404
-    
-    danfe_data = {
-        'chave': nfe.chave,
-        'numero': nfe.numero,
-        'serie': nfe.serie,
-        'data_emissao': nfe.data_emissao.strftime('%d/%m/%Y %H:%M:%S') if nfe.data_emissao else '',
-        'natureza_operacao': nfe.natureza_operacao,
-        'protocolo': nfe.protocolo,
-        'valor_total': nfe.valor_total,
-        'emitente': {
-            'nome': nfe.emitente.nome if nfe.emitente else '',
-            'cnpj': nfe.emitente.cnpj if nfe.emitente else '',
-            'endereco': f"{nfe.emitente.logradouro}, {nfe.emitente.numero}" if nfe.emitente else '',
-            'bairro': nfe.emitente.bairro if nfe.emitente else '',
-            'municipio': nfe.emitente.municipio if nfe.emitente else '',
-            'uf': nfe.emitente.uf if nfe.emitente else '',
-            'cep': nfe.emitente.cep if nfe.emitente else '',
-            'telefone': nfe.emitente.telefone if nfe.emitente else '',
-        },
-        'destinatario': {
-            'nome': nfe.destinatario.nome if nfe.destinatario else '',
-            'cnpj': nfe.destinatario.cnpj if nfe.destinatario else '',
-            'endereco': f"{nfe.destinatario.logradouro}, {nfe.destinatario.numero}" if nfe.destinatario else '',
-            'bairro': nfe.destinatario.bairro if nfe.destinatario else '',
-            'municipio': nfe.destinatario.municipio if nfe.destinatario else '',
-            'uf': nfe.destinatario.uf if nfe.destinatario else '',
-            'cep': nfe.destinatario.cep if nfe.destinatario else '',
-        },
-        'itens': [
-            {
-                'codigo': item.codigo,
-                'descricao': item.descricao,
-                'quantidade': item.quantidade_comercial,
-                'unidade': item.unidade_comercial,
-                'valor_unitario': item.valor_unitario_comercial,
-                'valor_total': item.valor_total_bruto,
-                'ncm': item.ncm,
-                'cfop': item.cfop,
-            } for item in nfe.itens
-        ]
-    }
-    
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>DANFE - {nfe.numero}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; }}
-            .danfe-container {{ border: 1px solid #ccc; padding: 20px; max-width: 800px; margin: 0 auto; }}
-            .header {{ display: flex; justify-content: space-between; border-bottom: 1px solid #ccc; padding-bottom: 10px; }}
-            .section {{ margin: 15px 0; }}
-            .section-title {{ font-weight: bold; background: #f5f5f5; padding: 5px; }}
-            .items-table {{ width: 100%; border-collapse: collapse; }}
-            .items-table th, .items-table td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-            .items-table th {{ background-color: #f5f5f5; }}
-        </style>
-    </head>
-    <body>
-        <div class="danfe-container">
-            <div class="header">
-                <h2>DANFE</h2>
-                <p>Número: {danfe_data['numero']}</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    return html
+
+    return _immutable_response(entry)
 
 
 @bp.route('/auto_match_nfes', methods=['GET'])
@@ -1602,17 +1373,12 @@ def search_nfe():
                         ).first()
                         nfe_item = _resolve_nfe_item_for_purchase(entry, item)
 
-                        # Calculate adjusted total from adjustments
-                        adjustments = getattr(po, 'adjustments', [])
-                        base_total = po.total_pedido_com_ipi or 0
-                        adjusted_total = apply_adjustments(base_total, adjustments) + (po.vlr_frete_tra or 0)
-                        
                         purchase_info = {
                             'cod_pedc': po.cod_pedc,
                             'cod_emp1': po.cod_emp1,
                             'fornecedor': po.fornecedor_descricao,
                             'dt_emis': po.dt_emis.isoformat() if po.dt_emis else None,
-                            'total_pedido': adjusted_total,
+                            'total_pedido': po.adjusted_total,
                             'func_nome': po.func_nome,
                             'vlr_icms_st': po.vlr_icms_st,
                             'moeped': po.moeped,
@@ -7,8 +7,6 @@ from sqlalchemy import extract
 
 from app import db
 from app.models import (
-    PurchaseAdjustment,
-    PurchaseItem,
     PurchaseOrder,
     PurchaseOrderCategoryOverride,
     NFEntry,
@@ -16,7 +14,6 @@ from app.models import (
     User,
 )
 from app.routes.routes import bp
-from app.utils import apply_adjustments
 
 
 def _normalize_text(text):
@@ -147,15 +144,12 @@ def get_purchase_category_report():
         i = 0
         for order in orders:
             vlr_c_ipi = order.total_pedido_com_ipi or 0.0
-            # Calculate total summing non-cancelled items
-            items = PurchaseItem.query.filter_by(purchase_order_id=order.id).all()
-            effective_total = 0.0
-            for item in items:
-                qty = float(item.quantidade or 0)
-                canc = float(item.qtde_canc or 0)
-                # TODO calcular um item cancelado parcialmente
-                if include_cancelled or qty > canc:
-                    effective_total += float(item.total or 0)
+            # Item totals maintained by refresh_order_summaries, cancelled items only when requested
+            # TODO calcular um item cancelado parcialmente
+            if include_cancelled:
+                effective_total = order.items_total or 0.0
+            else:
+                effective_total = order.effective_total_excl_cancelled or 0.0
 
             if effective_total <= 0 and not include_cancelled:
                 continue
@@ -163,20 +157,15 @@ def get_purchase_category_report():
                 i+=1
                 print(f"{order.cod_pedc}; valor pedidos itens: {round(effective_total, 2)}; valor total: {round(vlr_c_ipi, 2)}")
             # TODO verificar se o valor do frete estão relativos ao valor do item cancelado de maneira correta
-            adjustments_query = PurchaseAdjustment.query.filter_by(
-                purchase_order_id=order.id
-            ).all()
             if order.cod_pedc == '39208':
                 print(f"Valor do frete para o pedido 39208: {order.vlr_frete_tra}")
-            adjusted_total = apply_adjustments(round(vlr_c_ipi, 2), adjustments_query) + (
-                order.vlr_frete_tra or 0
-            )
+            adjusted_total = order.adjusted_total or 0.0
               
                 
            
             #TODO consertar o calculo de effective total pora usar seu valor
-            # Use adjusted_total for the report
-            report_total = adjusted_total
+            # Use adjusted_total for the report, in cents (it is stored unrounded for the other endpoints)
+            report_total = round(adjusted_total, 2)
 
             # 1. Check for manual override
             override = PurchaseOrderCategoryOverride.query.filter_by(
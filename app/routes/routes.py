@@ -9,9 +9,9 @@ from sqlalchemy import and_, or_, func, cast, tuple_
 from sqlalchemy.sql import exists
 from sqlalchemy.orm import joinedload
 from flask_login import login_user, logout_user, login_required, current_user
-from app.models import LoginHistory, NFEData, NFEDestinatario, NFEntry, PurchaseOrder, PurchaseItem, PurchaseItemNFEMatch, Quotation, RequestLog, Supplier, User
+from app.models import LoginHistory, NFEData, NFEDestinatario, NFEMonthlyRollup, NFEntry, PurchaseMonthlyRollup, PurchaseOrder, PurchaseItem, PurchaseItemNFEMatch, Quotation, RequestLog, Supplier, User
 from app.routes.auth import token_required
-from app.utils import  apply_adjustments, check_order_fulfillment, fuzzy_search, import_rcot0300, import_rfor0302, import_rpdc0250c, import_ruah,_parse_date
+from app.utils import  PURCHASE_ROLLUP_COLUMNS, apply_adjustments, check_order_fulfillment, fuzzy_search, import_rcot0300, import_rfor0302, import_rpdc0250c, import_ruah, nfe_rollup_rows, purchase_rollup_rows, _parse_date
 from app import db
 import tempfile
 import os
@@ -141,6 +141,44 @@ def extract_xml_value(root, xpath):
         return ''
     
     
+def _period_segments(start_date, end_date):
+    """
+    Split [start_date, end_date] into the whole months it covers (as year * 100 + month) and the
+    partial months at its edges (as [start, end) date ranges).
+    """
+    from datetime import timedelta
+
+    whole_months, partial = [], []
+    month_start = start_date.replace(day=1)
+    stop = end_date + timedelta(days=1)
+    while month_start < stop:
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        segment = (max(month_start, start_date), min(next_month, stop))
+        if segment == (month_start, next_month):
+            whole_months.append(month_start.year * 100 + month_start.month)
+        else:
+            partial.append(segment)
+        month_start = next_month
+    return whole_months, partial
+
+
+def _rollup_period_rows(model, columns, base_rows, start_date, end_date):
+    """
+    Rollup rows for exactly [start_date, end_date]: whole months are read from the rollup table and
+    the partial edge months are aggregated from the base tables by base_rows(start, end), so every
+    dashboard section covers the same window. Returns a subquery with the rollup columns.
+    """
+    from sqlalchemy import select, union_all
+
+    whole_months, partial = _period_segments(start_date, end_date)
+    rows = [
+        select(*(getattr(model, name) for name in columns))
+        .where((model.year * 100 + model.month).in_(whole_months))
+    ]
+    rows.extend(base_rows(start, end) for start, end in partial)
+    return union_all(*rows).subquery()
+
+
 @bp.route('/dashboard_summary', methods=['GET'])
 @login_required
 def dashboard_summary():
@@ -173,65 +211,51 @@ def dashboard_summary():
         if buyer_filter and buyer_filter.lower() != 'all':
             order_filters.append(PurchaseOrder.func_nome == buyer_filter)
 
-        # Summary - with buyer filter
-        total_orders = db.session.query(func.count()).select_from(PurchaseOrder).filter(
-            *order_filters
-        ).scalar() or 0
-
-        total_items = db.session.query(func.count()).select_from(PurchaseItem).join(
-            PurchaseOrder, PurchaseItem.purchase_order_id == PurchaseOrder.id
-        ).filter(*order_filters).scalar() or 0
-
-        total_value = db.session.query(func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0)).filter(
-            *order_filters
-        ).scalar() or 0.0
+        # Aggregates come from the monthly rollups; partial edge months come from the orders
+        rollup = _rollup_period_rows(
+            PurchaseMonthlyRollup, PURCHASE_ROLLUP_COLUMNS, purchase_rollup_rows, start_date, end_date
+        )
+        rollup_filters = []
+        if buyer_filter and buyer_filter.lower() != 'all':
+            rollup_filters.append(rollup.c.func_nome == buyer_filter)
 
-        total_suppliers = db.session.query(func.count(func.distinct(PurchaseOrder.fornecedor_id))).filter(
-            *order_filters
-        ).scalar() or 0
+        # Summary - with buyer filter
+        totals = db.session.query(
+            func.coalesce(func.sum(rollup.c.order_count), 0).label('order_count'),
+            func.coalesce(func.sum(rollup.c.item_count), 0).label('item_count'),
+            func.coalesce(func.sum(rollup.c.total_value), 0).label('total_value'),
+            func.coalesce(func.sum(rollup.c.total_quantity), 0).label('total_quantity'),
+            func.coalesce(func.sum(rollup.c.fulfilled_count), 0).label('fulfilled_count'),
+            func.count(func.distinct(rollup.c.fornecedor_id)).label('supplier_count')
+        ).filter(*rollup_filters).one()
+
+        total_orders = int(totals.order_count or 0)
+        total_items = int(totals.item_count or 0)
+        total_value = float(totals.total_value or 0.0)
+        total_suppliers = int(totals.supplier_count or 0)
 
         avg_order_value = float(total_value) / total_orders if total_orders else 0.0
 
         # Monthly totals (group by year/month) - with buyer filter
         monthly_rows = db.session.query(
-            extract('year', PurchaseOrder.dt_emis).label('y'),
-            extract('month', PurchaseOrder.dt_emis).label('m'),
-            func.count(PurchaseOrder.id).label('order_count'),
-            func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).label('total_value')
-        ).filter(
-            *order_filters
-        ).group_by(
-            extract('year', PurchaseOrder.dt_emis),
-            extract('month', PurchaseOrder.dt_emis)
-        ).order_by(
-            extract('year', PurchaseOrder.dt_emis),
-            extract('month', PurchaseOrder.dt_emis)
-        ).all()
-
-        # Monthly items quantity - with buyer filter
-        item_filters = [PurchaseOrder.dt_emis >= start_date, PurchaseOrder.dt_emis <= end_date]
-        if buyer_filter and buyer_filter.lower() != 'all':
-            item_filters.append(PurchaseOrder.func_nome == buyer_filter)
-            
-        monthly_items_rows = db.session.query(
-            extract('year', PurchaseItem.dt_emis).label('y'),
-            extract('month', PurchaseItem.dt_emis).label('m'),
-            func.count(PurchaseItem.id).label('item_count'),
-            func.coalesce(func.sum(PurchaseItem.quantidade), 0).label('total_qty')
-        ).join(
-            PurchaseOrder, PurchaseItem.purchase_order_id == PurchaseOrder.id
+            rollup.c.year.label('y'),
+            rollup.c.month.label('m'),
+            func.sum(rollup.c.order_count).label('order_count'),
+            func.coalesce(func.sum(rollup.c.total_value), 0).label('total_value'),
+            func.sum(rollup.c.item_count).label('item_count'),
+            func.coalesce(func.sum(rollup.c.total_quantity), 0).label('total_qty')
         ).filter(
-            *item_filters
+            *rollup_filters
         ).group_by(
-            extract('year', PurchaseItem.dt_emis),
-            extract('month', PurchaseItem.dt_emis)
+            rollup.c.year,
+            rollup.c.month
         ).order_by(
-            extract('year', PurchaseItem.dt_emis),
-            extract('month', PurchaseItem.dt_emis)
+            rollup.c.year,
+            rollup.c.month
         ).all()
 
         monthly_items_map = {}
-        for r in monthly_items_rows:
+        for r in monthly_rows:
             k = (int(r.y), int(r.m))
             monthly_items_map[k] = {
                 'item_count': int(r.item_count or 0),
@@ -320,74 +344,41 @@ def dashboard_summary():
                 'unique_users': stats['unique_users']
             })
 
-        # Top buyers
-        if buyer_filter and buyer_filter.lower() != 'all':
-            # When filtering by a specific buyer, return only that buyer's data
-            buyer_rows = db.session.query(
-                PurchaseOrder.func_nome.label('name'),
-                func.count(PurchaseOrder.id).label('order_count'),
-                func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).label('total_value'),
-                func.coalesce(func.avg(PurchaseOrder.total_pedido_com_ipi), 0).label('avg_value'),
-                func.coalesce(
-                    func.sum(
-                        db.session.query(func.count(PurchaseItem.id))
-                        .filter(PurchaseItem.purchase_order_id == PurchaseOrder.id)
-                        .correlate(PurchaseOrder)
-                        .scalar_subquery()
-                    ), 0
-                ).label('item_count')
-            ).filter(
-                *order_filters,
-                PurchaseOrder.func_nome.isnot(None)
-            ).group_by(
-                PurchaseOrder.func_nome
-            ).order_by(
-                func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).desc()
-            ).limit(top_limit).all()
-        else:
-            buyer_rows = db.session.query(
-                PurchaseOrder.func_nome.label('name'),
-                func.count(PurchaseOrder.id).label('order_count'),
-                func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).label('total_value'),
-                func.coalesce(func.avg(PurchaseOrder.total_pedido_com_ipi), 0).label('avg_value'),
-                func.coalesce(
-                    func.sum(
-                        db.session.query(func.count(PurchaseItem.id))
-                        .filter(PurchaseItem.purchase_order_id == PurchaseOrder.id)
-                        .correlate(PurchaseOrder)
-                        .scalar_subquery()
-                    ), 0
-                ).label('item_count')
-            ).filter(
-                PurchaseOrder.dt_emis >= start_date,
-                PurchaseOrder.dt_emis <= end_date,
-                PurchaseOrder.func_nome.isnot(None)
-            ).group_by(
-                PurchaseOrder.func_nome
-            ).order_by(
-                func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).desc()
-            ).limit(top_limit).all()
+        # Top buyers (a buyer filter is already part of rollup_filters)
+        buyer_rows = db.session.query(
+            rollup.c.func_nome.label('name'),
+            func.sum(rollup.c.order_count).label('order_count'),
+            func.coalesce(func.sum(rollup.c.total_value), 0).label('total_value'),
+            func.coalesce(func.sum(rollup.c.item_count), 0).label('item_count')
+        ).filter(
+            *rollup_filters,
+            rollup.c.func_nome.isnot(None)
+        ).group_by(
+            rollup.c.func_nome
+        ).order_by(
+            func.coalesce(func.sum(rollup.c.total_value), 0).desc()
+        ).limit(top_limit).all()
 
         buyer_data = [{
             'name': r.name or '—',
             'order_count': int(r.order_count or 0),
             'total_value': float(r.total_value or 0.0),
-            'avg_value': float(r.avg_value or 0.0),
+            'avg_value': float(r.total_value or 0.0) / r.order_count if r.order_count else 0.0,
             'item_count': int(r.item_count or 0)  
         } for r in buyer_rows]
 
         # Top suppliers - with buyer filter
         supplier_rows = db.session.query(
-            PurchaseOrder.fornecedor_descricao.label('name'),
-            func.count(PurchaseOrder.id).label('order_count'),
-            func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).label('total_value')
+            rollup.c.fornecedor_descricao.label('name'),
+            func.sum(rollup.c.order_count).label('order_count'),
+            func.coalesce(func.sum(rollup.c.total_value), 0).label('total_value')
         ).filter(
-            *order_filters,
-            PurchaseOrder.fornecedor_descricao.isnot(None)
+            *rollup_filters,
+            rollup.c.fornecedor_descricao.isnot(None)
         ).group_by(
-            PurchaseOrder.fornecedor_descricao
+            rollup.c.fornecedor_descricao
         ).order_by(
-            func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).desc()
+            func.coalesce(func.sum(rollup.c.total_value), 0).desc()
         ).limit(top_limit).all()
 
         supplier_data = [{
@@ -429,49 +420,34 @@ def dashboard_summary():
         } for o in recent_orders_q]
 
         # Order fulfillment stats - with buyer filter
-        fulfilled_count = db.session.query(func.count()).select_from(PurchaseOrder).filter(
-            *order_filters,
-            PurchaseOrder.is_fulfilled == True
-        ).scalar() or 0
+        fulfilled_count = int(totals.fulfilled_count or 0)
         
         pending_count = total_orders - fulfilled_count
         fulfillment_rate = (fulfilled_count / total_orders * 100) if total_orders > 0 else 0
 
         # Total quantity of items purchased - with buyer filter
-        total_quantity = db.session.query(
-            func.coalesce(func.sum(PurchaseItem.quantidade), 0)
-        ).join(
-            PurchaseOrder, PurchaseItem.purchase_order_id == PurchaseOrder.id
-        ).filter(*order_filters).scalar() or 0.0
-
-        # NFE statistics (if available) - date filter only (NFE doesn't link to buyer directly)
-        nfe_count = 0
-        nfe_total_value = 0.0
-        try:
-            nfe_count = db.session.query(func.count()).select_from(NFEData).filter(
-                NFEData.data_emissao >= start_date,
-                NFEData.data_emissao <= end_date
-            ).scalar() or 0
-            nfe_total_value = db.session.query(
-                func.coalesce(func.sum(NFEData.valor_total), 0)
-            ).filter(
-                NFEData.data_emissao >= start_date,
-                NFEData.data_emissao <= end_date
-            ).scalar() or 0.0
-        except Exception:
-            pass 
+        total_quantity = float(totals.total_quantity or 0.0)
+
+        # NFE statistics - date filter only (NFE doesn't link to buyer directly)
+        nfe_rollup = _rollup_period_rows(
+            NFEMonthlyRollup, ('year', 'month', 'nfe_count', 'total_value'), nfe_rollup_rows, start_date, end_date
+        )
+        nfe_totals = db.session.query(
+            func.coalesce(func.sum(nfe_rollup.c.nfe_count), 0).label('nfe_count'),
+            func.coalesce(func.sum(nfe_rollup.c.total_value), 0).label('total_value')
+        ).one()
+        nfe_count = nfe_totals.nfe_count or 0
+        nfe_total_value = nfe_totals.total_value or 0.0
 
         # Always get all purchasers for dropdown (without buyer filter)
         all_purchasers_rows = db.session.query(
-            PurchaseOrder.func_nome.label('name')
+            rollup.c.func_nome.label('name')
         ).filter(
-            PurchaseOrder.dt_emis >= start_date,
-            PurchaseOrder.dt_emis <= end_date,
-            PurchaseOrder.func_nome.isnot(None)
+            rollup.c.func_nome.isnot(None)
         ).group_by(
-            PurchaseOrder.func_nome
+            rollup.c.func_nome
         ).order_by(
-            PurchaseOrder.func_nome
+            rollup.c.func_nome
         ).all()
         
         all_purchasers = [r.name for r in all_purchasers_rows if r.name]
@@ -552,5 +528,6 @@ from app.routes import nfe
 from app.routes import imports 
 from app.routes import quotations  
 from app.routes import tracking 
+from app.routes import jobs
 from app.routes import purchases
 from app.routes import report
\ No newline at end of file
@@ -8,8 +8,8 @@ from sqlalchemy.orm import joinedload
 from flask_login import login_required, current_user
 
 from app import db
-from app.models import PurchaseOrder, PurchaseItem, NFEntry, PurchaseItemNFEMatch, Supplier
-from app.utils import fuzzy_search, apply_adjustments
+from app.models import PurchaseOrder, PurchaseItem, PurchaseItemReceipt, NFEntry, PurchaseItemNFEMatch, Supplier
+from app.utils import fuzzy_search
 from app.routes.routes import bp
 
 
@@ -119,9 +119,8 @@ def _build_purchase_payload(items):
         order_nf_entries = nf_entries_by_order.get(order_key, [])
 
         if order_key not in grouped_results:
-            adjustments = getattr(order, 'adjustments', [])
-            base_total = order.total_pedido_com_ipi or 0
-            adjusted_total = apply_adjustments(base_total, adjustments) + (order.vlr_frete_tra or 0)
+            # Only loaded for users who see them; the totals come from the maintained summary columns
+            adjustments = order.adjustments if can_view_financials else []
 
             grouped_results[order_key] = {
                 'order': {
@@ -133,7 +132,7 @@ def _build_purchase_payload(items):
                     'fornecedor_descricao': order.fornecedor_descricao,
                     'total_bruto': order.total_bruto if can_view_financials else None,
                     'total_pedido_com_ipi': order.total_pedido_com_ipi if can_view_financials else None,
-                    'adjusted_total': adjusted_total if can_view_financials else None,
+                    'adjusted_total': order.adjusted_total if can_view_financials else None,
                     
                     'cnpj_cpf': supplier_cnpj_map.get(str(order.fornecedor_id)),
                     
@@ -176,7 +175,7 @@ def _build_purchase_payload(items):
                     'vlr_frete_red': order.vlr_frete_red,
                     'num_talao': order.num_talao,
                     'tipo': order.tipo,
-                    'total_items_in_order': len(order.items),
+                    'total_items_in_order': order.item_count,
                     'nfes': [
                         {
                             'num_nf': nf_entry.num_nf if can_view_nfes else None,
@@ -662,12 +661,8 @@ def search_advanced():
     
     if include_nf:
         base_query = base_query.outerjoin(
-            NFEntry,
-            and_(
-                NFEntry.cod_emp1 == PurchaseItem.cod_emp1,
-                NFEntry.cod_pedc == PurchaseItem.cod_pedc,
-                cast(NFEntry.linha, db.String) == cast(PurchaseItem.linha, db.String)
-            )
+            PurchaseItemReceipt,
+            PurchaseItemReceipt.purchase_item_id == PurchaseItem.id
         ).outerjoin(
             PurchaseItemNFEMatch,
             and_(
@@ -721,7 +716,7 @@ def search_advanced():
         term_clauses = [apply_ilike(column, pattern) for column in search_columns]             
             
         if include_nf:
-            term_clauses.append(apply_ilike(NFEntry.num_nf, pattern))
+            term_clauses.append(apply_ilike(PurchaseItemReceipt.num_nf, pattern))
             term_clauses.append(apply_ilike(PurchaseItemNFEMatch.nfe_numero, pattern))
 
         if include_cnpj_fornecedor and token in valid_cnpj_tokens:
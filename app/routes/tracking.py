@@ -5,7 +5,8 @@ from flask import request, jsonify
 from flask_login import login_required, current_user
 
 from app import db
-from app.models import Company, NFEData, NFEEmitente, NFEDestinatario, PurchaseOrder
+from app.jobs import job_handler, serialize_job, submit_job
+from app.models import BackgroundJob, Company, NFEData, NFEEmitente, NFEDestinatario, PurchaseOrder
 from config import Config
 from app.routes.routes import bp
 
@@ -115,8 +116,8 @@ def remove_tracked_company(company_id):
 @bp.route('/tracked_companies/<int:company_id>/nfe_count', methods=['GET'])
 @login_required
 def get_company_nfe_count(company_id):
-    """Get NFE count for a company from database."""
-    from app.models import Company, NFEData, NFEEmitente
+    """Get NFE count for a company from the per-CNPJ counters maintained at ingest."""
+    from app.models import Company, CompanyNFECount
     
     company = db.session.get(Company, company_id)
     if not company:
@@ -125,45 +126,16 @@ def get_company_nfe_count(company_id):
     try:
         # Count NFEs where this company's CNPJ is either emitente or destinatário
         cnpj_clean = ''.join(filter(str.isdigit, company.cnpj)) if company.cnpj else ''
-        
-        if not cnpj_clean:
-            nfe_count = 0
-        else:
-            # Count NFEs where company is emitente (sender)
-            nfe_count_emitente = db.session.query(NFEData).join(
-                NFEEmitente, NFEData.id == NFEEmitente.nfe_id
-            ).filter(
-                NFEEmitente.cnpj.ilike(f'%{cnpj_clean}%') 
-            ).count()
-            
-            # Count NFEs where company is destinatário (receiver)
-            nfe_count_destinatario = db.session.query(NFEData).join(
-                NFEDestinatario, NFEData.id == NFEDestinatario.nfe_id
-            ).filter(
-                NFEDestinatario.cnpj.ilike(f'%{cnpj_clean}%')
-            ).count()
-            
-            # Get unique NFE IDs (in case same NFE appears in both - shouldn't happen but just in case)
-            nfe_ids_emitente = set(nfe.id for nfe in db.session.query(NFEData.id).join(
-                NFEEmitente, NFEData.id == NFEEmitente.nfe_id
-            ).filter(
-                NFEEmitente.cnpj.ilike(f'%{cnpj_clean}%')
-            ).all())
-            
-            nfe_ids_destinatario = set(nfe.id for nfe in db.session.query(NFEData.id).join(
-                NFEDestinatario, NFEData.id == NFEDestinatario.nfe_id
-            ).filter(
-                NFEDestinatario.cnpj.ilike(f'%{cnpj_clean}%')
-            ).all())
-            
-            # Total unique NFEs
-            nfe_count = len(nfe_ids_emitente | nfe_ids_destinatario)
+        counts = db.session.get(CompanyNFECount, cnpj_clean) if cnpj_clean else None
+        nfe_count = counts.total_count if counts else 0
         
         return jsonify({
             'company_id': company_id,
             'company_name': company.name,
             'cnpj': company.cnpj,
             'nfe_count': nfe_count,
+            'nfe_count_emitente': counts.emitente_count if counts else 0,
+            'nfe_count_destinatario': counts.destinatario_count if counts else 0,
         }), 200
         
     except Exception as e:
@@ -232,18 +204,133 @@ def check_nfe_available():
 
 
 
-@bp.route('/tracked_companies/<int:company_id>/sync_nfes', methods=['POST'])
-@login_required
-def sync_company_nfes(company_id):
-    """Sync NFEs for a specific company within a date range (15-day chunks)."""
-    import requests
+def _fetch_company_nfe_chunk(cnpj_clean, chunk_start, chunk_end):
+    """
+    Download the NFEs addressed to a CNPJ for one date range from SIEG and store the new ones.
+    Returns a dict with found/new_nfes/already_existed/errors, plus 'error' if SIEG rejected the request.
+    """
     import base64
     import xml.etree.ElementTree as ET
-    from config import Config
-    from datetime import datetime, timedelta
-    from app.models import Company, NFEData
     from app.utils import parse_and_store_nfe_xml
-    
+
+    sieg_request_data = {
+        "XmlType": 1,
+        "DataEmissaoInicio": chunk_start,
+        "DataEmissaoFim": chunk_end,
+        "CnpjDest": cnpj_clean,
+    }
+
+    response = requests.post(
+        f'https://api.sieg.com/BaixarXmlsV2?api_key={Config.SIEG_API_KEY}',
+        json=sieg_request_data,
+        headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+        timeout=60
+    )
+
+    if response.status_code != 200:
+        return {'error': f'SIEG API error: {response.status_code}', 'found': 0, 'new_nfes': 0, 'already_existed': 0, 'errors': []}
+
+    xmls = response.json().get('xmls', [])
+    new_nfes = 0
+    already_existed = 0
+    errors = []
+
+    for xml_base64 in xmls:
+        try:
+            xml_content = base64.b64decode(xml_base64).decode('utf-8')
+
+            root = ET.fromstring(xml_content)
+            ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+
+            chave_elem = root.find('.//nfe:protNFe/nfe:infProt/nfe:chNFe', ns)
+            if chave_elem is None or not chave_elem.text:
+                continue
+
+            chave = chave_elem.text
+
+            existing = NFEData.query.filter_by(chave=chave).first()
+            if existing:
+                already_existed += 1
+                continue
+
+            parse_and_store_nfe_xml(xml_content)
+            new_nfes += 1
+
+        except Exception as e:
+            db.session.rollback()
+            errors.append(str(e))
+            continue
+
+    return {'found': len(xmls), 'new_nfes': new_nfes, 'already_existed': already_existed, 'errors': errors}
+
+
+@job_handler('tracked_company_nfe_backfill')
+def backfill_company_nfes(progress, company_id, cnpj, start_date, end_date):
+    """Background job: sync a company's NFEs over a date range in 15-day chunks."""
+    start = datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.strptime(end_date, '%Y-%m-%d')
+    chunk_size = timedelta(days=15)
+
+    chunks = []
+    current_start = start
+    while current_start < end:
+        current_end = min(current_start + chunk_size, end)
+        chunks.append((current_start.strftime('%Y-%m-%d'), current_end.strftime('%Y-%m-%d')))
+        current_start = current_end
+
+    new_nfes = 0
+    already_existed = 0
+    errors = []
+    chunk_results = []  # Per-period summary shown by the tracked companies dialog
+    progress.update(chunks_total=len(chunks), chunks_done=0, new_nfes=0, already_existed=0, errors=0, chunks=[])
+
+    for index, (chunk_start, chunk_end) in enumerate(chunks, start=1):
+        chunk_result = {'start': chunk_start, 'end': chunk_end}
+        try:
+            chunk = _fetch_company_nfe_chunk(cnpj, chunk_start, chunk_end)
+            if 'error' in chunk:
+                errors.append(f'Error fetching NFEs for {chunk_start} to {chunk_end}: {chunk["error"]}')
+                chunk_result.update(status='error', error=chunk['error'])
+            else:
+                chunk_result['status'] = 'success'
+            new_nfes += chunk['new_nfes']
+            already_existed += chunk['already_existed']
+            errors.extend(f'Error processing NFE: {e}' for e in chunk['errors'])
+            chunk_result.update(
+                found=chunk['found'], new_nfes=chunk['new_nfes'],
+                already_existed=chunk['already_existed'], errors=len(chunk['errors']),
+            )
+        except Exception as e:
+            db.session.rollback()
+            errors.append(f'Error fetching NFEs for {chunk_start} to {chunk_end}: {str(e)}')
+            chunk_result.update(status='error', error=str(e))
+        chunk_results.append(chunk_result)
+
+        progress.update(
+            chunks_done=index,
+            current_chunk=[chunk_start, chunk_end],
+            new_nfes=new_nfes,
+            already_existed=already_existed,
+            errors=len(errors),
+            chunks=list(chunk_results),
+        )
+
+    return {
+        'company_id': company_id,
+        'total_processed': new_nfes + already_existed,
+        'new_nfes': new_nfes,
+        'already_existed': already_existed,
+        'errors': errors[:10],  # Limit errors returned
+    }
+
+
+@bp.route('/tracked_companies/<int:company_id>/sync_nfes', methods=['POST'])
+@login_required
+def sync_company_nfes(company_id):
+    """
+    Queue a background NFE backfill for a company within a date range.
+    Returns 202 with the job id; follow progress at /api/jobs/<id> or /api/jobs/<id>/stream.
+    """
     company = db.session.get(Company, company_id)
     if not company:
         return jsonify({'error': 'Company not found'}), 404
@@ -259,110 +346,63 @@ def sync_company_nfes(company_id):
         return jsonify({'error': 'Date range is required'}), 400
     
     try:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+        datetime.strptime(start_date_str, '%Y-%m-%d')
+        datetime.strptime(end_date_str, '%Y-%m-%d')
     except ValueError:
         return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
     
     cnpj_clean = ''.join(filter(str.isdigit, company.cnpj))
     
-    total_nfes = 0
-    new_nfes = 0
-    errors = []
-    
     try:
-        # Process in 15-day chunks
-        current_start = start_date
-        chunk_size = timedelta(days=15)
-        
-        while current_start < end_date:
-            current_end = min(current_start + chunk_size, end_date)
-            
-            chunk_start_str = current_start.strftime('%Y-%m-%d')
-            chunk_end_str = current_end.strftime('%Y-%m-%d')
-            
-            # Call SIEG API
-            sieg_request_data = {
-                "XmlType": 1,
-                "DataEmissaoInicio": chunk_start_str,
-                "DataEmissaoFim": chunk_end_str,
-                "CnpjDest": cnpj_clean,
-            }
-            
-            response = requests.post(
-                f'https://api.sieg.com/BaixarXmlsV2?api_key={Config.SIEG_API_KEY}',
-                json=sieg_request_data,
-                headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-                timeout=60
-            )
-            
-            if response.status_code != 200:
-                errors.append(f'Error fetching NFEs for {chunk_start_str} to {chunk_end_str}')
-                current_start = current_end
-                continue
-            
-            result = response.json()
-            xmls = result.get('xmls', [])
-            
-            for xml_base64 in xmls:
-                try:
-                    xml_content = base64.b64decode(xml_base64).decode('utf-8')
-                    
-                    # Parse XML to get access key
-                    root = ET.fromstring(xml_content)
-                    ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                    
-                    chave_elem = root.find('.//nfe:protNFe/nfe:infProt/nfe:chNFe', ns)
-                    if chave_elem is None or not chave_elem.text:
-                        continue
-                    
-                    chave = chave_elem.text
-                    
-                    # Check if already exists
-                    existing = NFEData.query.filter_by(chave=chave).first()
-                    if existing:
-                        total_nfes += 1
-                        continue
-                    
-                    # Store NFE
-                    parse_and_store_nfe_xml(xml_content)
-                    new_nfes += 1
-                    total_nfes += 1
-                    
-                except Exception as e:
-                    errors.append(f'Error processing NFE: {str(e)}')
-                    continue
-            
-            current_start = current_end
-        
+        job = submit_job(
+            'tracked_company_nfe_backfill',
+            params={
+                'company_id': company_id,
+                'cnpj': cnpj_clean,
+                'start_date': start_date_str,
+                'end_date': end_date_str,
+            },
+            concurrency_key=f'cnpj:{cnpj_clean}',
+            user_id=current_user.id,
+        )
         return jsonify({
-            'status': 'success',
+            'status': job.status,
+            'job_id': job.id,
             'company_id': company_id,
             'company_name': company.name,
-            'total_processed': total_nfes,
-            'new_nfes': new_nfes,
-            'already_existed': total_nfes - new_nfes,
-            'errors': errors[:10] if errors else [],  # Limit errors returned
-        }), 200
+            'status_url': f'/api/jobs/{job.id}',
+            'stream_url': f'/api/jobs/{job.id}/stream',
+        }), 202
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@bp.route('/tracked_companies/<int:company_id>/sync_jobs', methods=['GET'])
+@login_required
+def get_company_sync_jobs(company_id):
+    """List the most recent NFE backfill jobs for a company."""
+    company = db.session.get(Company, company_id)
+    if not company:
+        return jsonify({'error': 'Company not found'}), 404
+
+    cnpj_clean = ''.join(filter(str.isdigit, company.cnpj or ''))
+    jobs = BackgroundJob.query.filter_by(
+        job_type='tracked_company_nfe_backfill',
+        concurrency_key=f'cnpj:{cnpj_clean}'
+    ).order_by(BackgroundJob.created_at.desc()).limit(10).all()
+
+    return jsonify({'jobs': [serialize_job(job) for job in jobs]}), 200
+
 
 @bp.route('/tracked_companies/<int:company_id>/sync_chunk', methods=['POST'])
 @login_required
 def sync_company_nfes_chunk(company_id):
-    """Sync a single 15-day chunk of NFEs for a company. Returns progress info."""
-    import requests
-    import base64
-    import xml.etree.ElementTree as ET
-    from config import Config
-    from datetime import datetime
-    from app.models import Company, NFEData
-    from app.utils import parse_and_store_nfe_xml
-    
+    """
+    Sync a single 15-day chunk of NFEs for a company inside the request. Superseded by the sync_nfes
+    background job, which the frontend uses; kept for existing API clients.
+    """
     company = db.session.get(Company, company_id)
     if not company:
         return jsonify({'error': 'Company not found'}), 404
@@ -379,69 +419,25 @@ def sync_company_nfes_chunk(company_id):
     
     cnpj_clean = ''.join(filter(str.isdigit, company.cnpj))
     
-    new_nfes = 0
-    already_existed = 0
-    errors = []
-    
     try:
-        sieg_request_data = {
-            "XmlType": 1,
-            "DataEmissaoInicio": chunk_start,
-            "DataEmissaoFim": chunk_end,
-            "CnpjDest": cnpj_clean,
-        }
+        chunk = _fetch_company_nfe_chunk(cnpj_clean, chunk_start, chunk_end)
         
-        response = requests.post(
-            f'https://api.sieg.com/BaixarXmlsV2?api_key={Config.SIEG_API_KEY}',
-            json=sieg_request_data,
-            headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
-            timeout=60
-        )
-        
-        if response.status_code != 200:
+        if 'error' in chunk:
             return jsonify({
                 'status': 'error',
-                'error': f'SIEG API error: {response.status_code}',
+                'error': chunk['error'],
                 'chunk_start': chunk_start,
                 'chunk_end': chunk_end,
             }), 200
         
-        result = response.json()
-        xmls = result.get('xmls', [])
-        
-        for xml_base64 in xmls:
-            try:
-                xml_content = base64.b64decode(xml_base64).decode('utf-8')
-                
-                root = ET.fromstring(xml_content)
-                ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
-                
-                chave_elem = root.find('.//nfe:protNFe/nfe:infProt/nfe:chNFe', ns)
-                if chave_elem is None or not chave_elem.text:
-                    continue
-                
-                chave = chave_elem.text
-                
-                existing = NFEData.query.filter_by(chave=chave).first()
-                if existing:
-                    already_existed += 1
-                    continue
-                
-                parse_and_store_nfe_xml(xml_content)
-                new_nfes += 1
-                
-            except Exception as e:
-                errors.append(str(e))
-                continue
-        
         return jsonify({
             'status': 'success',
             'chunk_start': chunk_start,
             'chunk_end': chunk_end,
-            'found': len(xmls),
-            'new_nfes': new_nfes,
-            'already_existed': already_existed,
-            'errors': len(errors),
+            'found': chunk['found'],
+            'new_nfes': chunk['new_nfes'],
+            'already_existed': chunk['already_existed'],
+            'errors': len(chunk['errors']),
         }), 200
         
     except Exception as e:
@@ -452,4 +448,3 @@ def sync_company_nfes_chunk(company_id):
             'chunk_start': chunk_start,
             'chunk_end': chunk_end,
         }), 200
-
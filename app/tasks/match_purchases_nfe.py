@@ -14,6 +14,8 @@ from datetime import datetime, timedelta
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
+from sqlalchemy import delete, exists, func, select
+
 from app import create_app, db
 from app.models import PurchaseOrder, PurchaseItem, NFEData, NFEItem, PurchaseItemNFEMatch
 #from app.utils import score_purchase_nfe_match
@@ -82,61 +84,62 @@ def get_unfulfilled_items_for_order(order):
     return unfulfilled
 
 
-def clean_fulfilled_items():
+def _delete_matches(criteria, dry_run=False):
+    """Delete (or, with dry_run, count) the PurchaseItemNFEMatch rows matching criteria in one statement."""
+    if dry_run:
+        return db.session.query(func.count(PurchaseItemNFEMatch.id)).filter(*criteria).scalar()
+    if db.engine.name == 'postgresql':
+        # Criteria on other tables render as DELETE ... USING
+        stmt = delete(PurchaseItemNFEMatch).where(*criteria)
+    else:
+        # SQLite has no DELETE ... USING
+        stmt = delete(PurchaseItemNFEMatch).where(
+            PurchaseItemNFEMatch.id.in_(select(PurchaseItemNFEMatch.id).where(*criteria))
+        )
+    return db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def clean_fulfilled_items(dry_run=False):
     """
     Remove entries from PurchaseItemNFEMatch for items that are now fulfilled.
     Also cleans matches for orders that are now fulfilled.
+
+    Runs as two set-based DELETEs: matches of fulfilled orders, then matches whose item has no
+    remaining quantity (quantity - canceled - attended <= 0) or no longer exists. With dry_run
+    nothing is deleted and the counts are what would be removed.
+
+    Returns {'fulfilled_orders': int, 'fulfilled_items': int, 'total': int} (matches deleted).
     """
-    deleted_count = 0
-    
-    # First, clean matches for fulfilled orders
-    fulfilled_order_matches = db.session.query(PurchaseItemNFEMatch).join(
-        PurchaseItem, PurchaseItemNFEMatch.purchase_item_id == PurchaseItem.id
-    ).join(
-        PurchaseOrder, PurchaseItem.purchase_order_id == PurchaseOrder.id
-    ).filter(
-        PurchaseOrder.is_fulfilled == True
-    ).all()
-    
-    for match in fulfilled_order_matches:
-        db.session.delete(match)
-        deleted_count += 1
-    
-    if fulfilled_order_matches:
-        db.session.commit()
-        logger.info(f"Cleaned {len(fulfilled_order_matches)} matches from fulfilled orders")
-    
-    # Get all unique purchase_item_ids from the match table
-    matches = db.session.query(PurchaseItemNFEMatch.purchase_item_id).distinct().all()
-    
-    for (item_id,) in matches:
-        # Check if the purchase item is now fulfilled
-        item = db.session.get(PurchaseItem, item_id)
-        
-        if item is None:
-            # Item was deleted, remove matches
-            PurchaseItemNFEMatch.query.filter_by(purchase_item_id=item_id).delete()
-            deleted_count += 1
-            continue
-        
-        qty = float(item.quantidade or 0)
-        atendida = float(item.qtde_atendida or 0)
-        canceled = float(item.qtde_canc or 0)
-        
-        effective_qty = qty - canceled
-        remaining = effective_qty - atendida
-        
-        if remaining <= 0:
-            # Item is fulfilled, delete matches
-            PurchaseItemNFEMatch.query.filter_by(purchase_item_id=item_id).delete()
-            deleted_count += 1
-            logger.info(f"Cleaned matches for fulfilled item {item_id}")
-    
-    if deleted_count > 0:
+    of_fulfilled_order = [
+        PurchaseItemNFEMatch.purchase_item_id == PurchaseItem.id,
+        PurchaseItem.purchase_order_id == PurchaseOrder.id,
+        PurchaseOrder.is_fulfilled == True,
+    ]
+    remaining = func.coalesce(PurchaseItem.quantidade, 0) \
+        - func.coalesce(PurchaseItem.qtde_canc, 0) \
+        - func.coalesce(PurchaseItem.qtde_atendida, 0)
+    without_open_item = [
+        ~exists().where(PurchaseItem.id == PurchaseItemNFEMatch.purchase_item_id, remaining > 0)
+    ]
+    if dry_run:
+        # Nothing is deleted by the first statement, so leave its rows out of the second count
+        without_open_item.append(
+            PurchaseItemNFEMatch.id.notin_(select(PurchaseItemNFEMatch.id).where(*of_fulfilled_order))
+        )
+
+    counts = {
+        'fulfilled_orders': _delete_matches(of_fulfilled_order, dry_run),
+        'fulfilled_items': _delete_matches(without_open_item, dry_run),
+    }
+    counts['total'] = counts['fulfilled_orders'] + counts['fulfilled_items']
+
+    action = 'Would clean' if dry_run else 'Cleaned'
+    logger.info(f"{action} {counts['fulfilled_orders']} matches from fulfilled orders and "
+                f"{counts['fulfilled_items']} matches from fulfilled or deleted items")
+    if counts['total'] > 0 and not dry_run:
         db.session.commit()
-        logger.info(f"Cleaned {deleted_count} fulfilled items from match table")
-    
-    return deleted_count
+
+    return counts
 
 
 def store_item_matches(order, nfe_match, unfulfilled_items, min_score=80):
@@ -356,7 +359,7 @@ def match_purchases_with_nfes(days=60, min_score=80):
         }
         
         # First, clean up fulfilled items from the match table
-        stats['items_cleaned'] = clean_fulfilled_items()
+        stats['items_cleaned'] = clean_fulfilled_items()['total']
         
         # Get unfulfilled orders
         unfulfilled_orders = get_unfulfilled_orders(days)
@@ -527,14 +530,16 @@ if __name__ == "__main__":
     parser.add_argument('--days', type=int, default=60, help='Number of days to look back (default: 60)')
     parser.add_argument('--min-score', type=int, default=80, help='Minimum score to store match (default: 80)')
     parser.add_argument('--clean-only', action='store_true', help='Only clean fulfilled items, do not match')
+    parser.add_argument('--dry-run', action='store_true', help='With --clean-only, only count what would be cleaned')
     
     args = parser.parse_args()
     
     if args.clean_only:
         app = create_app()
         with app.app_context():
-            cleaned = clean_fulfilled_items()
-            print(f"Cleaned {cleaned} fulfilled items from match table")
+            cleaned = clean_fulfilled_items(dry_run=args.dry_run)
+            print(f"{'Would clean' if args.dry_run else 'Cleaned'} {cleaned['total']} matches from match table "
+                  f"({cleaned['fulfilled_orders']} from fulfilled orders, {cleaned['fulfilled_items']} from fulfilled items)")
     else:
         stats = match_purchases_with_nfes(
             days=args.days,
@@ -0,0 +1,296 @@
+"""
+Drift detection between Oracle (Focco) and Postgres.
+
+Orders, items and NF entries are bucketed by month on both sides and each
+bucket is reduced to a fingerprint: the row count, sums of the Focco ID and of
+the synced numeric columns, and the sum of a row hash over the text and date
+columns (so a changed description or NF number is caught too). The row hash is
+MD5 on both engines (STANDARD_HASH in Oracle, md5() in Postgres) of the values
+rendered as text, dates as YYYY-MM-DD and NULLs as '', joined with '|'; its
+first 8 hex digits are summed as an integer. The hashes only agree when both
+databases hash the same bytes, i.e. when Oracle runs with an AL32UTF8 character
+set like Postgres' UTF8; free text is cut to HASH_TEXT_LENGTH characters on both
+sides to stay within Oracle's 4000-byte VARCHAR2 limit.
+
+These aggregates are computed inside each database, so only one small row per
+month crosses the wire. Only the buckets whose fingerprints differ are re-synced,
+through the regular stage functions restricted to those months.
+
+Usage:
+    python app/tasks/reconcile_oracle.py            # detect and resync drifted months
+    python app/tasks/reconcile_oracle.py --dry-run  # only report
+"""
+import hashlib
+import logging
+import sys
+from pathlib import Path
+
+from sqlalchemy import BigInteger, Date, Integer, String, cast, func, literal
+from sqlalchemy.dialects.postgresql import BIT
+
+current_file = Path(__file__).resolve()
+repo_root = current_file.parents[2]
+sys.path.insert(0, str(repo_root))
+
+from app import create_app, db
+from app.models import NFEntry, PurchaseItem, PurchaseOrder
+from app.tasks.sync_oracle import (
+    get_oracle_connection, sync_nf_entries, sync_purchase_items, sync_purchase_orders
+)
+
+logger = logging.getLogger(__name__)
+
+# Sums may differ in the last digits because the two databases add floats in a different order
+SUM_TOLERANCE = 0.01
+
+# Free-text columns are hashed up to this many characters (see the module docstring)
+HASH_TEXT_LENGTH = 400
+
+
+def oracle_row_hash(*expressions):
+    """Oracle SUM of the row hash of `expressions` (character values; NULL concatenates as '')."""
+    text = " || '|' || ".join(expressions)
+    return f"SUM(TO_NUMBER(SUBSTR(RAWTOHEX(STANDARD_HASH({text}, 'MD5')), 1, 8), 'XXXXXXXX'))"
+
+
+def row_hash(*values):
+    """Python version of the row hash, registered as a SQL function where the engine has no md5 (sqlite)."""
+    text = '|'.join('' if value is None else str(value) for value in values)
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _hash_text(column, length=None):
+    """Render a column as the row hash sees it: integers as digits, dates as YYYY-MM-DD, NULL as ''."""
+    if isinstance(column.type, Date):
+        if db.engine.name == 'postgresql':
+            column = func.to_char(column, 'YYYY-MM-DD')
+    elif not isinstance(column.type, String):
+        column = cast(column, String)
+    if length:
+        column = func.substr(column, 1, length)
+    return func.coalesce(column, '')
+
+
+def postgres_row_hash(columns):
+    """SUM of the row hash of `columns` in the local database."""
+    if db.engine.name != 'postgresql':
+        driver_connection = db.session.connection().connection.driver_connection
+        driver_connection.create_function('reconcile_row_hash', -1, row_hash, deterministic=True)
+        return func.sum(func.reconcile_row_hash(*columns))
+    digest = func.md5(func.concat_ws('|', *columns))
+    prefix = literal('x').op('||')(func.substr(digest, 1, 8))
+    return func.sum(cast(cast(prefix, BIT(32)), BigInteger))
+
+# Checked in this order: items and NF entries are resynced after the orders they belong to
+RECONCILE_ENTITIES = {
+    'purchase_orders': {
+        'stage': sync_purchase_orders,
+        'oracle_query': """
+            SELECT TO_CHAR(pdc.DT_EMIS, 'YYYY-MM') AS bucket,
+                   COUNT(*),
+                   SUM(pdc.ID),
+                   SUM(NVL(pdc.TOT_BRUTO, 0)),
+                   SUM(NVL(pdc.TOT_LIQUIDO, 0)),
+                   """ + oracle_row_hash(
+                       "TO_CHAR(pdc.ID)", "TO_CHAR(pdc.COD_PEDC)", "TO_CHAR(pdc.DT_EMIS, 'YYYY-MM-DD')",
+                       "pdc.POSICAO", "pdc.CONTATO", "TO_CHAR(pdc.NUM_TALAO)",
+                       f"SUBSTR(pdc.OBSERVACAO, 1, {HASH_TEXT_LENGTH})",
+                   ) + """
+            FROM FOCCO3I.TPED_COMPRA pdc
+            JOIN FOCCO3I.TEMPRESAS emp ON pdc.EMPR_ID = emp.ID
+            GROUP BY TO_CHAR(pdc.DT_EMIS, 'YYYY-MM')
+        """,
+        'model': PurchaseOrder,
+        'date_column': 'dt_emis',
+        'sums': lambda: [
+            PurchaseOrder.id_ped_focco,
+            func.coalesce(PurchaseOrder.total_bruto, 0),
+            func.coalesce(PurchaseOrder.total_liquido, 0),
+        ],
+        'hashed': lambda: [
+            _hash_text(PurchaseOrder.id_ped_focco), _hash_text(PurchaseOrder.cod_pedc),
+            _hash_text(PurchaseOrder.dt_emis), _hash_text(PurchaseOrder.posicao),
+            _hash_text(PurchaseOrder.contato), _hash_text(PurchaseOrder.num_talao),
+            _hash_text(PurchaseOrder.observacao, HASH_TEXT_LENGTH),
+        ],
+        'scope': lambda: [PurchaseOrder.id_ped_focco.isnot(None)],
+    },
+    'purchase_items': {
+        'stage': sync_purchase_items,
+        'oracle_query': """
+            SELECT TO_CHAR(pdc.DT_EMIS, 'YYYY-MM') AS bucket,
+                   COUNT(*),
+                   SUM(itpdc.ID),
+                   SUM(NVL(itpdc.QTDE, 0)),
+                   SUM(NVL(itpdc.QTDE_ATENDIDA, 0)),
+                   SUM(NVL(itpdc.QTDE_CANC, 0)),
+                   SUM(NVL(itpdc.TOT_BRUTO, 0)),
+                   """ + oracle_row_hash(
+                       "TO_CHAR(itpdc.ID)", "TO_CHAR(pdc.COD_PEDC)", "TO_CHAR(itpdc.LINHA)",
+                       "TO_CHAR(itpdc.DT_ENTREGA, 'YYYY-MM-DD')",
+                       f"SUBSTR(itpdc.DESCRICAO_ITEM, 1, {HASH_TEXT_LENGTH})",
+                       f"SUBSTR(itpdc.OBS, 1, {HASH_TEXT_LENGTH})",
+                   ) + """
+            FROM FOCCO3I.TPEDC_ITEM itpdc
+            JOIN FOCCO3I.TPED_COMPRA pdc ON itpdc.TPEDC_ID = pdc.ID
+            JOIN FOCCO3I.TEMPRESAS emp ON pdc.EMPR_ID = emp.ID
+            GROUP BY TO_CHAR(pdc.DT_EMIS, 'YYYY-MM')
+        """,
+        'model': PurchaseItem,
+        'date_column': 'dt_emis',
+        'sums': lambda: [
+            PurchaseItem.id_item_focco,
+            func.coalesce(PurchaseItem.quantidade, 0),
+            func.coalesce(PurchaseItem.qtde_atendida, 0),
+            func.coalesce(PurchaseItem.qtde_canc, 0),
+            func.coalesce(PurchaseItem.total, 0),
+        ],
+        'hashed': lambda: [
+            _hash_text(PurchaseItem.id_item_focco), _hash_text(PurchaseItem.cod_pedc),
+            _hash_text(PurchaseItem.linha), _hash_text(PurchaseItem.dt_entrega),
+            _hash_text(PurchaseItem.descricao, HASH_TEXT_LENGTH),
+            _hash_text(PurchaseItem.observacao, HASH_TEXT_LENGTH),
+        ],
+        'scope': lambda: [PurchaseItem.id_item_focco.isnot(None)],
+    },
+    'nf_entries': {
+        'stage': sync_nf_entries,
+        'oracle_query': """
+            SELECT TO_CHAR(nfe.DT_ENT, 'YYYY-MM') AS bucket,
+                   COUNT(*),
+                   SUM(itnfe.ID),
+                   """ + oracle_row_hash(
+                       "TO_CHAR(itnfe.ID)", "TO_CHAR(pdc.COD_PEDC)", "TO_CHAR(itpdc.LINHA)",
+                       "TO_CHAR(nfe.NUM_NF)", "TO_CHAR(nfe.DT_ENT, 'YYYY-MM-DD')", "nfe.CHAVE_ACESSO_NFEL",
+                       "TO_CHAR(itnfe.QTDE)",
+                   ) + """
+            FROM FOCCO3I.TNFS_ENTRADA nfe
+            JOIN FOCCO3I.TEMPRESAS emp ON nfe.EMPR_ID = emp.ID
+            JOIN FOCCO3I.TITENS_NFE itnfe ON itnfe.NFE_ID = nfe.ID
+            JOIN FOCCO3I.TPEDC_ITEM itpdc ON itnfe.PEDCITEM_ID = itpdc.ID
+            JOIN FOCCO3I.TPED_COMPRA pdc ON itpdc.TPEDC_ID = pdc.ID
+            GROUP BY TO_CHAR(nfe.DT_ENT, 'YYYY-MM')
+        """,
+        'model': NFEntry,
+        'date_column': 'dt_ent',
+        # itnfe_id holds TO_CHAR(itnfe.ID) for Focco rows; provisional XML rows are not in Oracle
+        'sums': lambda: [cast(NFEntry.itnfe_id, Integer)],
+        'hashed': lambda: [
+            _hash_text(NFEntry.itnfe_id), _hash_text(NFEntry.cod_pedc), _hash_text(NFEntry.linha),
+            _hash_text(NFEntry.num_nf), _hash_text(NFEntry.dt_ent), _hash_text(NFEntry.chave_acesso_nfel),
+            _hash_text(NFEntry.qtde),
+        ],
+        'scope': lambda: [NFEntry.origem == 'FOCCO'],
+    },
+}
+
+
+def normalize_fingerprint(row):
+    """(count, sum, ..., row hash sum) with the count as int and sums rounded, whatever the driver returned."""
+    count, *sums = row
+    return (int(count or 0),) + tuple(round(float(value or 0), 2) for value in sums)
+
+
+def fingerprints_match(expected, actual):
+    if expected is None or actual is None:
+        return expected == actual
+    if expected[0] != actual[0] or len(expected) != len(actual):
+        return False
+    return all(abs(a - b) <= SUM_TOLERANCE for a, b in zip(expected[1:], actual[1:]))
+
+
+def _month_bucket(column):
+    if db.engine.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+def postgres_fingerprints(entity):
+    """{month: fingerprint} for an entity's Postgres table."""
+    config = RECONCILE_ENTITIES[entity]
+    bucket = _month_bucket(getattr(config['model'], config['date_column']))
+    query = db.session.query(bucket, func.count(), *[func.sum(column) for column in config['sums']()],
+                             postgres_row_hash(config['hashed']()))\
+                      .filter(*config['scope']())\
+                      .group_by(bucket)
+    return {row[0]: normalize_fingerprint(row[1:]) for row in query.all()}
+
+
+class OracleReconcileSource:
+    """The Oracle side of a reconcile: bucket fingerprints and resync of selected months."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def fingerprints(self, entity):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(RECONCILE_ENTITIES[entity]['oracle_query'])
+            return {row[0]: normalize_fingerprint(row[1:]) for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def resync(self, entity, months):
+        return RECONCILE_ENTITIES[entity]['stage'](self.connection, None, months=months)
+
+
+def reconcile(source, entities=None, resync=True):
+    """
+    Compare per-month fingerprints of each entity and resync the drifted months from source.
+
+    Returns a report per entity: buckets compared, row totals on each side, the mismatched months
+    and, when resyncing, the rows re-synced and the months still mismatched afterwards (e.g. rows
+    deleted in Oracle, which the upsert-only stages never remove, or a changed NF number, which is
+    not among the columns the NF entries stage updates).
+    """
+    report = {}
+    for entity in entities or RECONCILE_ENTITIES:
+        expected = source.fingerprints(entity)
+        actual = postgres_fingerprints(entity)
+        buckets = set(expected) | set(actual)
+        mismatched = sorted(
+            (bucket for bucket in buckets if not fingerprints_match(expected.get(bucket), actual.get(bucket))),
+            key=lambda bucket: (bucket is None, bucket or '')
+        )
+        entry = {
+            'buckets': len(buckets),
+            'oracle_rows': sum(fingerprint[0] for fingerprint in expected.values()),
+            'postgres_rows': sum(fingerprint[0] for fingerprint in actual.values()),
+            'mismatched': mismatched,
+        }
+
+        if resync and mismatched:
+            stats = source.resync(entity, mismatched)
+            actual = postgres_fingerprints(entity)
+            entry['resynced_rows'] = stats['sent']
+            entry['still_mismatched'] = [
+                bucket for bucket in mismatched
+                if not fingerprints_match(expected.get(bucket), actual.get(bucket))
+            ]
+
+        logger.info(
+            f"Reconcile {entity}: {len(mismatched)}/{len(buckets)} months mismatched "
+            f"(oracle {entry['oracle_rows']} rows, postgres {entry['postgres_rows']} rows)"
+            + (f", {entry['resynced_rows']} rows resynced, {len(entry['still_mismatched'])} months still differ."
+               if 'resynced_rows' in entry else '.')
+        )
+        report[entity] = entry
+    return report
+
+
+def run_reconcile(resync=True):
+    app = create_app()
+    with app.app_context():
+        try:
+            oracle_conn = get_oracle_connection()
+            try:
+                return reconcile(OracleReconcileSource(oracle_conn), resync=resync)
+            finally:
+                oracle_conn.close()
+        except Exception as e:
+            logger.error(f"Error during reconcile: {str(e)}")
+            db.session.rollback()
+
+
+if __name__ == '__main__':
+    run_reconcile(resync='--dry-run' not in sys.argv[1:])
@@ -1,11 +1,14 @@
 import os
 import logging
+import queue
 import sys
+import threading
+import time
 import oracledb
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-from sqlalchemy import tuple_
-from sqlalchemy.dialects.postgresql import insert
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from sqlalchemy import select, tuple_, update
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -14,9 +17,14 @@ repo_root = current_file.parents[2]
 sys.path.insert(0, str(repo_root))
 
 from app import create_app, db
+from app.bulk_load import bulk_merge
+from app.utils import (
+    link_item_receipts, order_months, refresh_item_receipts, refresh_order_fulfillment, refresh_order_summaries,
+    refresh_purchase_rollups
+)
 from app.models import (
-    Company, PurchaseAdjustment, PurchasePaymentInstallment, PurchasePaymentInstallment, Supplier, PurchaseOrder, PurchaseItem, 
-    NFEntry
+    Company, PurchaseAdjustment, PurchasePaymentInstallment, Supplier, PurchaseOrder, PurchaseItem, 
+    NFEntry, SyncState
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,36 +42,376 @@ ORACLE_USER = os.getenv('ORACLE_USER', 'your_oracle_user')
 ORACLE_PASSWORD = os.getenv('ORACLE_PASSWORD', 'your_oracle_password')
 ORACLE_DSN = os.getenv('ORACLE_DSN', 'your_oracle_host:1521/your_service_name')
 
-def get_oracle_connection():
-    """Establish connection to Oracle DB."""
+# Streaming: rows per Oracle round-trip, rows per Postgres upsert and batches buffered between them
+ORACLE_ARRAYSIZE = int(os.getenv('ORACLE_ARRAYSIZE', 5000))
+ORACLE_PREFETCHROWS = int(os.getenv('ORACLE_PREFETCHROWS', ORACLE_ARRAYSIZE + 1))
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', 2000))
+SYNC_PREFETCH_BATCHES = int(os.getenv('SYNC_PREFETCH_BATCHES', 2))
+SYNC_FULL_RECONCILE_DAYS = int(os.getenv('SYNC_FULL_RECONCILE_DAYS', 7))
+# Stages running at once; also the size of the Oracle pool. Each stage checks out its own
+# Postgres connection from the SQLAlchemy engine pool (5 + 10 overflow by default).
+SYNC_MAX_PARALLEL_STAGES = int(os.getenv('SYNC_MAX_PARALLEL_STAGES', 4))
+# ID ranges fetched in parallel (each on its own pooled connection) by a stage during a full reconcile
+SYNC_STAGE_PARTITIONS = int(os.getenv('SYNC_STAGE_PARTITIONS', 1))
+
+COMPANY_UPDATE_COLUMNS = [
+    'name', 'cnpj', 'fantasy_name', 'address', 'neighborhood', 'zip_code', 'inscricao_estadual',
+]
+SUPPLIER_UPDATE_COLUMNS = [
+    'descricao', 'cnpj_cpf_normalized', 'uf', 'email', 'tel_ddd_tel_telefone', 'cf_fax',
+    'conta_itens', 'endereco', 'bairro', 'cep', 'cidade',
+]
+PURCHASE_ORDER_UPDATE_COLUMNS = [
+    'cod_pedc', 'cod_emp1', 'dt_emis', 'fornecedor_id', 'fornecedor_descricao', 'for_uf',
+    'func_nome', 'posicao', 'posicao_hist', 'observacao', 'contato', 'num_talao',
+    'total_pedido_com_ipi', 'total_bruto', 'total_liquido', 'total_liquido_ipi', 'vlr_icms_st',
+    'vlr_frete_tra', 'tp_frete_tra', 'tp_vlr_frete_tra', 'vlr_frete_red', 'tp_frete_red',
+    'tp_vlr_frete_red', 'cf_pgto', 'moeped',
+]
+PURCHASE_ITEM_UPDATE_COLUMNS = [
+    'linha', 'item_id', 'descricao', 'quantidade', 'preco_unitario', 'total', 'dt_entrega',
+    'qtde_atendida', 'qtde_canc', 'qtde_canc_toler', 'qtde_saldo', 'perc_ipi', 'tot_liquido_ipi', 'tot_descontos',
+    'tot_acrescimos', 'observacao', 'unidade_medida', 'dt_emis',
+]
+NF_ENTRY_UPDATE_COLUMNS = ['dt_ent', 'qtde', 'obs_conf', 'chave_acesso_nfel', 'origem']
+PURCHASE_ADJUSTMENT_UPDATE_COLUMNS = ['tp_apl', 'tp_dctacr1', 'tp_vlr1', 'vlr1']
+PURCHASE_INSTALLMENT_UPDATE_COLUMNS = ['num_dias', 'dt_vcto', 'perc_pgto']
+
+# Driving Oracle table and its ID column (as aliased in the stage query) used to split a stage into ranges
+SUPPLIER_PARTITION = ('FOCCO3I.TFORNECEDORES', 'forn.ID')
+PURCHASE_ORDER_PARTITION = ('FOCCO3I.TPED_COMPRA', 'pdc.ID')
+PURCHASE_ITEM_PARTITION = ('FOCCO3I.TPEDC_ITEM', 'itpdc.ID')
+NF_ENTRY_PARTITION = ('FOCCO3I.TITENS_NFE', 'itnfe.ID')
+PURCHASE_ADJUSTMENT_PARTITION = ('FOCCO3I.TPEDC_DCTACR', 'adj.ID')
+PURCHASE_INSTALLMENT_PARTITION = ('FOCCO3I.TPEDC_PGTO', 'pgto.ID')
+
+def init_oracle_client():
+    """Enable thick mode (needed by the Focco database) once per process."""
     try:
         oracledb.init_oracle_client(lib_dir="/opt/oracle/instantclient_23_4")
     except Exception as e:
         logger.warning(f"Thick mode init warning (safe to ignore if already init): {e}")
 
+
+def get_oracle_connection():
+    """Establish connection to Oracle DB."""
+    init_oracle_client()
     return oracledb.connect(user=ORACLE_USER, password=ORACLE_PASSWORD, dsn=ORACLE_DSN)
 
-def fetch_oracle_data(connection, query, start_date=None):
-    """Executes a query and returns a list of dictionaries matching the columns."""
+
+def get_oracle_pool(size=None):
+    """
+    Oracle connection pool shared by the stages of one sync run. A partitioned stage keeps its own
+    connection while its ranges use others, so the default size covers both without starving.
+    """
+    init_oracle_client()
+    size = size or SYNC_MAX_PARALLEL_STAGES * (SYNC_STAGE_PARTITIONS + 1)
+    return oracledb.create_pool(
+        user=ORACLE_USER, password=ORACLE_PASSWORD, dsn=ORACLE_DSN,
+        min=1, max=max(size, 1), increment=1
+    )
+
+def iter_oracle_batches(connection, query, params=None, batch_size=None):
+    """
+    Execute a query and yield lists of dictionaries of at most batch_size rows.
+    Rows are pulled with fetchmany using a tuned arraysize/prefetchrows, so memory is bounded by
+    the batch size instead of the size of the result set.
+    """
+    batch_size = batch_size or SYNC_BATCH_SIZE
     cursor = connection.cursor()
-    if start_date:
-        cursor.execute(query, start_date=start_date)
-    else:
-        cursor.execute(query)
-    columns = [col[0].lower() for col in cursor.description]
-    data = [dict(zip(columns, row)) for row in cursor.fetchall()]
-    
-    cursor.close()
-    return data
+    try:
+        cursor.arraysize = ORACLE_ARRAYSIZE
+        cursor.prefetchrows = ORACLE_PREFETCHROWS
+        cursor.execute(query, params or {})
+        columns = [col[0].lower() for col in cursor.description]
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [dict(zip(columns, row)) for row in rows]
+    finally:
+        cursor.close()
+
+
+def iter_pooled_batches(pool, query, params=None, batch_size=None):
+    """iter_oracle_batches on a connection acquired from the pool when iteration starts."""
+    connection = pool.acquire()
+    try:
+        yield from iter_oracle_batches(connection, query, params, batch_size)
+    finally:
+        pool.release(connection)
+
+
+def merge_batch_streams(streams, depth=None):
+    """
+    Consume batch generators in background threads (one per stream) and yield their batches as they
+    arrive, so Oracle fetches overlap with the Postgres write of the current batch. At most `depth`
+    batches per stream are buffered; a producer error is raised to the consumer.
+    """
+    streams = list(streams)
+    depth = depth or SYNC_PREFETCH_BATCHES
+    buffer = queue.Queue(maxsize=depth * max(len(streams), 1))
+    stop = threading.Event()
+    done = object()
+
+    def produce(batches):
+        try:
+            for batch in batches:
+                while not stop.is_set():
+                    try:
+                        buffer.put(batch, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put(done)
+        except BaseException as e:
+            buffer.put(e)
+        finally:
+            close = getattr(batches, 'close', None)
+            if close:
+                close()
+
+    producers = [
+        threading.Thread(target=produce, args=(batches,), name=f'oracle-prefetch-{position}', daemon=True)
+        for position, batches in enumerate(streams)
+    ]
+    for producer in producers:
+        producer.start()
+    try:
+        remaining = len(producers)
+        while remaining:
+            item = buffer.get()
+            if item is done:
+                remaining -= 1
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Drain so producers blocked on a full buffer (or putting their final item) can exit
+        while any(producer.is_alive() for producer in producers):
+            try:
+                buffer.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for producer in producers:
+            producer.join()
+
+
+def prefetch_batches(batches, depth=None):
+    """Prefetch a single batch generator in a background thread (see merge_batch_streams)."""
+    return merge_batch_streams([batches], depth)
+
+
+def id_ranges(connection, table, partitions):
+    """Split the ID span of an Oracle table into at most `partitions` contiguous (start, end) ranges."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT MIN(ID), MAX(ID) FROM {table}")
+        low, high = cursor.fetchone()
+    finally:
+        cursor.close()
+    if low is None:
+        return []
+    low, high = int(low), int(high)
+    step = -(-(high - low + 1) // partitions)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def stage_batches(oracle_conn, query, change_sql, params, partition=None, pool=None, partitions=1):
+    """
+    Batches for a stage query whose WHERE clause is the {change_filter} placeholder.
+
+    With a pool, a partition spec (table, ID column) and partitions > 1, the table's ID span is split
+    into ranges fetched concurrently on pooled connections and merged into one stream; otherwise the
+    query runs on oracle_conn with a single prefetch thread.
+    """
+    if not (pool and partition and partitions > 1):
+        return prefetch_batches(iter_oracle_batches(oracle_conn, query.format(change_filter=change_sql), params))
+
+    table, id_column = partition
+    ranges = id_ranges(oracle_conn, table, partitions)
+    ranged_query = query.format(change_filter=f"{change_sql} AND {id_column} BETWEEN :range_start AND :range_end")
+    logger.info(f"Fetching {table} in {len(ranges)} parallel ID ranges.")
+    return merge_batch_streams(
+        iter_pooled_batches(pool, ranged_query, {**params, 'range_start': start, 'range_end': end})
+        for start, end in ranges
+    )
+
+
+def change_filter(predicates, since_scn):
+    """
+    Build the WHERE fragment selecting rows changed after since_scn.
+    predicates are alternatives such as 'pdc.ORA_ROWSCN > :since_scn'; since_scn=None selects every row.
+
+    ORA_ROWSCN is tracked per block unless the table was created with ROWDEPENDENCIES, so this may
+    return some unchanged rows too; it never misses a committed change.
+    """
+    if since_scn is None:
+        return '1 = 1', {}
+    return '(' + ' OR '.join(predicates) + ')', {'since_scn': since_scn}
+
+
+def month_filter(change_sql, params, date_column, months):
+    """
+    Narrow a stage's change filter to rows whose date_column falls in the given 'YYYY-MM' months
+    (None selects rows without a date). Used to resync individual reconcile buckets.
+    """
+    if not months:
+        return change_sql, params
+    params = dict(params)
+    alternatives = []
+    named = sorted(month for month in months if month is not None)
+    if named:
+        for position, month in enumerate(named):
+            params[f'month_{position}'] = month
+        placeholders = ', '.join(f':month_{position}' for position in range(len(named)))
+        alternatives.append(f"TO_CHAR({date_column}, 'YYYY-MM') IN ({placeholders})")
+    if None in months:
+        alternatives.append(f"{date_column} IS NULL")
+    return f"{change_sql} AND ({' OR '.join(alternatives)})", params
+
+
+def get_current_scn(connection):
+    """
+    Current Oracle SCN, captured before a stage runs and stored as its next watermark. Read exactly from
+    DBMS_FLASHBACK (the sync user needs EXECUTE on it): TIMESTAMP_TO_SCN maps a time to an SCN with a
+    granularity of seconds, and a watermark ahead of the real SCN would skip rows committed in between.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT DBMS_FLASHBACK.GET_SYSTEM_CHANGE_NUMBER FROM DUAL")
+        return int(cursor.fetchone()[0])
+    finally:
+        cursor.close()
 
-def chunk_data(data_list, chunk_size=2000):
-    """Yield successive chunks from a list to avoid DB parameter limits."""
-    for i in range(0, len(data_list), chunk_size):
-        yield data_list[i:i + chunk_size]
 
+def attach_order_ids(rows):
+    """
+    Translate (cod_emp1, cod_pedc) into the Postgres purchase_order_id for one batch.
+    Returns (rows that matched an order, rows without a matching order). The row_scn column of the
+    order-bound queries is only kept on the unmatched rows (see retry_scn).
+    """
+    order_keys = list(set((row['cod_emp1'], row['cod_pedc']) for row in rows))
+
+    pg_orders = db.session.query(PurchaseOrder.id, PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc)\
+                          .filter(tuple_(PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc).in_(order_keys))\
+                          .all()
+
+    order_id_map = {(o.cod_emp1, o.cod_pedc): o.id for o in pg_orders}
+
+    matched = []
+    unmatched = []
+    for row in rows:
+        pg_order_id = order_id_map.get((row['cod_emp1'], row['cod_pedc']))
+        if pg_order_id:
+            row['purchase_order_id'] = pg_order_id
+            row.pop('row_scn', None)
+            matched.append(row)
+        else:
+            unmatched.append(row)
+    return matched, unmatched
 
 
-def sync_purchase_adjustments(oracle_conn, start_date):
+def stage_watermark(stage):
+    """The stored watermark SCN of a stage, or None before its first run."""
+    state = db.session.get(SyncState, stage)
+    return state.watermark_scn if state else None
+
+
+def retry_scn(unmatched, orders_scn, current=None):
+    """
+    Lowest row_scn among unmatched rows whose order may still reach Postgres, combined with current.
+
+    A row changed after the purchase_orders stage captured its watermark (orders_scn) may belong to an
+    order created after that snapshot: the stage must not advance its watermark past it, or the row is
+    never fetched again. Older unmatched rows belong to orders the orders query does not return at
+    all, so they are only counted; holding the watermark for them would pin it forever.
+    """
+    scns = [row['row_scn'] for row in unmatched if orders_scn is None or row['row_scn'] > orders_scn]
+    if current is not None:
+        scns.append(current)
+    return min(scns, default=None)
+
+
+def order_ids_for_focco(focco_ids, chunk_size=5000):
+    """Postgres ids of the orders with the given id_ped_focco values."""
+    focco_ids = sorted(set(focco_ids))
+    order_ids = []
+    for start in range(0, len(focco_ids), chunk_size):
+        order_ids.extend(db.session.scalars(
+            select(PurchaseOrder.id).where(PurchaseOrder.id_ped_focco.in_(focco_ids[start:start + chunk_size]))
+        ))
+    return order_ids
+
+
+def adopt_imported_suppliers(rows):
+    """
+    Give suppliers created by an RFOR0302 import without ID_FOR the id_for of the Oracle row with
+    the same cod_for, so the id_for upsert updates them instead of inserting a row that would
+    collide on uq_supplier_cod_for. Returns the number of suppliers adopted.
+    """
+    id_for_by_cod = {row['cod_for']: row['id_for'] for row in rows if row['cod_for'] and row['id_for'] is not None}
+    if not id_for_by_cod:
+        return 0
+    stored_ids = set(db.session.scalars(select(Supplier.id_for).where(Supplier.id_for.in_(id_for_by_cod.values()))))
+    imported = db.session.execute(
+        select(Supplier.id, Supplier.cod_for)
+        .where(Supplier.cod_for.in_(id_for_by_cod), Supplier.id_for.is_(None))
+    ).all()
+    adopted = [
+        {'id': supplier_id, 'id_for': id_for_by_cod[cod_for]}
+        for supplier_id, cod_for in imported if id_for_by_cod[cod_for] not in stored_ids
+    ]
+    if adopted:
+        db.session.execute(update(Supplier), adopted)
+    return len(adopted)
+
+
+def upsert_rows(model, rows, index_elements, update_columns, extra_set=None, **merge_options):
+    """
+    Upsert one batch of rows into model's table (COPY + staging merge), updating update_columns on conflict
+    only for rows that actually changed. Returns the batch's merge stats (sent/changed/unchanged).
+    """
+    return bulk_merge(model, rows, index_elements, update_columns, extra_set=extra_set, **merge_options)
+
+
+def refresh_synced_orders(order_ids):
+    """
+    Recompute the columns purchase_orders derives from its items, receipts and adjustments for the
+    orders a sync touched: receipt links, is_fulfilled, the summary columns and the monthly rollups of
+    their months. Runs once after all order-bound stages, so only one transaction updates
+    purchase_orders and every stage's rows are in place when it does. Commits.
+    """
+    order_ids = set(order_ids)
+    if not order_ids:
+        return 0
+    link_item_receipts(order_ids)
+    refreshed = refresh_order_fulfillment(order_ids)
+    refresh_order_summaries(order_ids)
+    refresh_purchase_rollups(order_months(order_ids))
+    db.session.commit()
+    logger.info(f"Refreshed {len(order_ids)} synced orders; fulfillment status changed for {refreshed}.")
+    return len(order_ids)
+
+
+def defer_order_refresh(order_ids, pending_orders):
+    """
+    Hand the orders a stage touched to refresh_synced_orders. In a sync run pending_orders collects
+    them for the final refresh step; a stage called on its own (e.g. by the reconcile resync) gets
+    None and refreshes them itself.
+    """
+    if pending_orders is None:
+        refresh_synced_orders(order_ids)
+    else:
+        pending_orders.update(order_ids)
+
+
+
+def sync_purchase_adjustments(oracle_conn, since_scn=None, pool=None, partitions=1, pending_orders=None):
     """Step 3.5: Sync Purchase Adjustments com Tradutor de IDs"""
     logger.info("Syncing Purchase Adjustments...")
     
@@ -92,61 +440,44 @@ def sync_purchase_adjustments(oracle_conn, start_date):
             
             adj.VLR AS vlr1,
             TO_CHAR(pdc.EMPR_ID) AS cod_emp1,
-            TO_CHAR(pdc.COD_PEDC) AS cod_pedc
+            TO_CHAR(pdc.COD_PEDC) AS cod_pedc,
+            adj.ORA_ROWSCN AS row_scn
             
         FROM FOCCO3I.TPEDC_DCTACR adj
         JOIN FOCCO3I.TPED_COMPRA pdc ON adj.TPEDC_ID = pdc.ID
-        WHERE pdc.DT_EMIS >= :start_date
+        WHERE {change_filter}
     """
-    raw_data = fetch_oracle_data(oracle_conn, query, start_date)
-    if not raw_data: 
-        logger.info("No new purchase adjustments found.")
-        return
-
-    order_keys = list(set((row['cod_emp1'], row['cod_pedc']) for row in raw_data))
-
-    pg_orders = db.session.query(PurchaseOrder.id, PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc)\
-                          .filter(tuple_(PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc).in_(order_keys))\
-                          .all()
+    change_sql, params = change_filter(['adj.ORA_ROWSCN > :since_scn'], since_scn)
+    stats = Counter()
+    batch_count = 0
+    orders_scn = stage_watermark('purchase_orders')
+    waiting_scn = None
+    batches = stage_batches(oracle_conn, query, change_sql, params, PURCHASE_ADJUSTMENT_PARTITION, pool, partitions)
+    touched_orders = set()
+    for batch in batches:
+        rows, unmatched = attach_order_ids(batch)
+        stats['unmatched'] += len(unmatched)
+        waiting_scn = retry_scn(unmatched, orders_scn, waiting_scn)
+        if rows:
+            stats.update(upsert_rows(PurchaseAdjustment, rows, ['id'], PURCHASE_ADJUSTMENT_UPDATE_COLUMNS))
+            touched_orders.update(row['purchase_order_id'] for row in rows)
+            batch_count += 1
 
-    order_id_map = {(o.cod_emp1, o.cod_pedc): o.id for o in pg_orders}
-
-    valid_adjustments = []
-    for row in raw_data:
-        key = (row['cod_emp1'], row['cod_pedc'])
-        pg_order_id = order_id_map.get(key)
-        
-        if pg_order_id:
-            row['purchase_order_id'] = pg_order_id
-            valid_adjustments.append(row)
-
-    if not valid_adjustments:
-        logger.warning("Nenhum ajuste pôde ser vinculado a um pedido existente no banco.")
-        return
-    chunk_count = 0
-    for chunk in chunk_data(valid_adjustments, chunk_size=2000):
-        stmt = insert(PurchaseAdjustment).values(chunk)
-        
-        on_conflict = stmt.on_conflict_do_update(
-            index_elements=['id'],
-            set_={
-                'tp_apl': stmt.excluded.tp_apl,
-                'tp_dctacr1': stmt.excluded.tp_dctacr1,
-                'tp_vlr1': stmt.excluded.tp_vlr1,
-                'vlr1': stmt.excluded.vlr1
-            }
-        )
-        db.session.execute(on_conflict)
-        chunk_count += 1
-        
     db.session.commit()
-    logger.info(f"Successfully synced {len(valid_adjustments)} purchase adjustments across {chunk_count} batches.")
+    defer_order_refresh(touched_orders, pending_orders)
+    if waiting_scn is not None:
+        stats['retry_scn'] = waiting_scn
+    if stats['unmatched']:
+        logger.warning(f"{stats['unmatched']} ajustes não puderam ser vinculados a um pedido existente no banco.")
+    logger.info(f"Successfully synced {stats['sent']} purchase adjustments across {batch_count} batches ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
     
     
     
     
     
-def sync_companies(oracle_conn):    
+
+def sync_companies(oracle_conn, since_scn=None, pool=None, partitions=1):
     """Step 1: Sync Companies (Warehouses) based strictly on TEMPRESAS DDL"""
     logger.info("Syncing Companies...")
     query = """
@@ -163,30 +494,22 @@ def sync_companies(oracle_conn):
             FROM FOCCO3I.TEMPRESAS emp
             LEFT JOIN FOCCO3I.TCIDADES cid ON emp.CID_ID = cid.ID
             WHERE emp.CNPJ != '00000000000'
+              AND {change_filter}
         """
-        
-    data = fetch_oracle_data(oracle_conn, query)
-    if not data: return
-
-    stmt = insert(Company).values(data)
-    on_conflict = stmt.on_conflict_do_update(
-        index_elements=['cod_emp1'],
-        set_={
-            'name': stmt.excluded.name,
-            'cnpj': stmt.excluded.cnpj,
-            'fantasy_name': stmt.excluded.fantasy_name,
-            'address': stmt.excluded.address,
-            'neighborhood': stmt.excluded.neighborhood,
-            'zip_code': stmt.excluded.zip_code,
-            'inscricao_estadual': stmt.excluded.inscricao_estadual,
-            'updated_at': datetime.now()
-        }
-    )
-    db.session.execute(on_conflict)
+    change_sql, params = change_filter(['emp.ORA_ROWSCN > :since_scn', 'cid.ORA_ROWSCN > :since_scn'], since_scn)
+
+    stats = Counter()
+    batches = stage_batches(oracle_conn, query, change_sql, params, None, pool, partitions)
+    for batch in batches:
+        stats.update(upsert_rows(
+            Company, batch, ['cod_emp1'], COMPANY_UPDATE_COLUMNS,
+            extra_set={'updated_at': datetime.now()}
+        ))
     db.session.commit()
-    logger.info(f"Successfully synced {len(data)} companies.")
+    logger.info(f"Successfully synced {stats['sent']} companies ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
 
-def sync_suppliers(oracle_conn):
+def sync_suppliers(oracle_conn, since_scn=None, pool=None, partitions=1):
     """Step 1.5: Sync Suppliers com todos os campos de contato e UF"""
     logger.info("Syncing Suppliers...")
     
@@ -219,37 +542,24 @@ def sync_suppliers(oracle_conn):
         FROM FOCCO3I.TFORNECEDORES forn
         LEFT JOIN FOCCO3I.TCIDADES cid ON forn.CID_ID = cid.ID
         LEFT JOIN FOCCO3I.TUFS uf ON cid.UF_ID = uf.ID  -- CORREÇÃO 2: A tabela é TUFS (plural)
+        WHERE {change_filter}
     """
+    change_sql, params = change_filter(['forn.ORA_ROWSCN > :since_scn', 'cid.ORA_ROWSCN > :since_scn'], since_scn)
     
-    data = fetch_oracle_data(oracle_conn, query)
-    if not data: return
-
-    for chunk in chunk_data(data, chunk_size=2000):
-        stmt = insert(Supplier).values(chunk)
-        on_conflict = stmt.on_conflict_do_update(
-            index_elements=['id_for'],
-            set_={
-                'descricao': stmt.excluded.descricao,
-                'cnpj_cpf_normalized': stmt.excluded.cnpj_cpf_normalized,
-                'uf': stmt.excluded.uf,
-                'email': stmt.excluded.email,
-                'tel_ddd_tel_telefone': stmt.excluded.tel_ddd_tel_telefone,
-                'cf_fax': stmt.excluded.cf_fax,
-                'conta_itens': stmt.excluded.conta_itens,
-                'endereco': stmt.excluded.endereco,
-                'bairro': stmt.excluded.bairro,
-                'cep': stmt.excluded.cep,
-                'cidade': stmt.excluded.cidade
-            }
-        )
-        db.session.execute(on_conflict)
+    stats = Counter()
+    batches = stage_batches(oracle_conn, query, change_sql, params, SUPPLIER_PARTITION, pool, partitions)
+    for batch in batches:
+        adopt_imported_suppliers(batch)
+        stats.update(upsert_rows(Supplier, batch, ['id_for'], SUPPLIER_UPDATE_COLUMNS))
         
     db.session.commit()
-    logger.info(f"Successfully synced {len(data)} suppliers.")
+    logger.info(f"Successfully synced {stats['sent']} suppliers ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
     
-def sync_purchase_orders(oracle_conn, start_date):
+
+def sync_purchase_orders(oracle_conn, since_scn=None, pool=None, partitions=1, months=None, pending_orders=None):
     """Step 2: Sync Purchase Orders usando id_ped_focco e cálculo nativo de Fulfillment"""
-    logger.info(f"Syncing Purchase Orders since {start_date.strftime('%Y-%m-%d')}...")
+    logger.info(f"Syncing Purchase Orders ({'changes since SCN ' + str(since_scn) if since_scn else 'full'})...")
     
     query = """
         SELECT 
@@ -284,18 +594,7 @@ def sync_purchase_orders(oracle_conn, start_date):
             
             -- Condição Pagamento e Moeda
             TO_CHAR(pdc.TP_PGTO) AS cf_pgto, 
-            moe.SIGLA AS moeped,
-            
-            CASE WHEN 
-                (SELECT COUNT(1) FROM FOCCO3I.TPEDC_ITEM itm WHERE itm.TPEDC_ID = pdc.ID) > 0 
-                AND 
-                (SELECT COUNT(1) 
-                 FROM FOCCO3I.TPEDC_ITEM itm 
-                 WHERE itm.TPEDC_ID = pdc.ID 
-                   AND itm.QTDE > 0 
-                   AND (NVL(itm.QTDE_ATENDIDA, 0) + NVL(itm.QTDE_CANC, 0) + NVL(itm.QTDE_CANC_TOLER, 0)) < itm.QTDE
-                ) = 0 
-            THEN 1 ELSE 0 END AS is_fulfilled_raw
+            moe.SIGLA AS moeped
             
         FROM FOCCO3I.TPED_COMPRA pdc
         JOIN FOCCO3I.TEMPRESAS emp ON pdc.EMPR_ID = emp.ID
@@ -304,58 +603,27 @@ def sync_purchase_orders(oracle_conn, start_date):
         LEFT JOIN FOCCO3I.TUFS uf ON cid.UF_ID = uf.ID     
         LEFT JOIN FOCCO3I.TFUNCIONARIOS func ON pdc.FUNC_ID = func.ID
         LEFT JOIN FOCCO3I.TMOEDAS moe ON pdc.MOE_ID = moe.ID
-        WHERE pdc.DT_EMIS >= :start_date
+        WHERE {change_filter}
     """
-    raw_data = fetch_oracle_data(oracle_conn, query, start_date)
-    if not raw_data: 
-        return
-
-    valid_orders = []
-    for row in raw_data:
-        row['is_fulfilled'] = bool(row.pop('is_fulfilled_raw', 0))
-        valid_orders.append(row)
-
-    for chunk in chunk_data(valid_orders, chunk_size=2000):
-        stmt = insert(PurchaseOrder).values(chunk)
-        
-        on_conflict = stmt.on_conflict_do_update(
-            index_elements=['id_ped_focco'], 
-            set_={
-                'cod_pedc': stmt.excluded.cod_pedc,
-                'cod_emp1': stmt.excluded.cod_emp1,
-                'dt_emis': stmt.excluded.dt_emis,
-                'fornecedor_id': stmt.excluded.fornecedor_id,
-                'fornecedor_descricao': stmt.excluded.fornecedor_descricao,
-                'for_uf': stmt.excluded.for_uf,
-                'func_nome': stmt.excluded.func_nome,
-                'posicao': stmt.excluded.posicao,
-                'posicao_hist': stmt.excluded.posicao_hist,
-                'observacao': stmt.excluded.observacao,
-                'contato': stmt.excluded.contato,
-                'num_talao': stmt.excluded.num_talao,
-                'total_pedido_com_ipi': stmt.excluded.total_pedido_com_ipi,
-                'total_bruto': stmt.excluded.total_bruto,
-                'total_liquido': stmt.excluded.total_liquido,
-                'total_liquido_ipi': stmt.excluded.total_liquido_ipi,
-                'vlr_icms_st': stmt.excluded.vlr_icms_st,
-                'vlr_frete_tra': stmt.excluded.vlr_frete_tra,
-                'tp_frete_tra': stmt.excluded.tp_frete_tra,
-                'tp_vlr_frete_tra': stmt.excluded.tp_vlr_frete_tra,
-                'vlr_frete_red': stmt.excluded.vlr_frete_red,
-                'tp_frete_red': stmt.excluded.tp_frete_red,
-                'tp_vlr_frete_red': stmt.excluded.tp_vlr_frete_red,
-                'cf_pgto': stmt.excluded.cf_pgto,
-                'moeped': stmt.excluded.moeped,
-                'is_fulfilled': stmt.excluded.is_fulfilled  
-            }
-        )
-        db.session.execute(on_conflict)
+    # is_fulfilled and the summary columns are derived in Postgres (refresh_synced_orders)
+    change_sql, params = change_filter(['pdc.ORA_ROWSCN > :since_scn'], since_scn)
+    stats = Counter()
+    change_sql, params = month_filter(change_sql, params, 'pdc.DT_EMIS', months)
+    batches = stage_batches(oracle_conn, query, change_sql, params, PURCHASE_ORDER_PARTITION, pool, partitions)
+    synced_focco_ids = set()
+    for batch in batches:
+        stats.update(upsert_rows(PurchaseOrder, batch, ['id_ped_focco'], PURCHASE_ORDER_UPDATE_COLUMNS))
+        synced_focco_ids.update(row['id_ped_focco'] for row in batch)
     db.session.commit()
-    logger.info(f"Successfully synced {len(valid_orders)} purchase orders.")
+    # adjusted_total depends on the order total and freight; new orders also get their zeroed summary
+    defer_order_refresh(order_ids_for_focco(synced_focco_ids), pending_orders)
+    logger.info(f"Successfully synced {stats['sent']} purchase orders ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
     
     
     
-def sync_purchase_items(oracle_conn, start_date):
+
+def sync_purchase_items(oracle_conn, since_scn=None, pool=None, partitions=1, months=None, pending_orders=None):
     """Step 3: Sync Purchase Items usando id_item_focco como chave única absoluta"""
     logger.info("Syncing Purchase Items...")
     
@@ -388,7 +656,8 @@ def sync_purchase_items(oracle_conn, start_date):
             NVL(itpdc.PERC_IPI, 0) AS perc_ipi,
             itpdc.TOT_LIQUIDO_IPI AS tot_liquido_ipi,      
             NVL(itpdc.TOT_DESCONTOS, 0) AS tot_descontos,  
-            NVL(itpdc.TOT_ACRESCIMOS, 0) AS tot_acrescimos 
+            NVL(itpdc.TOT_ACRESCIMOS, 0) AS tot_acrescimos,
+            GREATEST(itpdc.ORA_ROWSCN, pdc.ORA_ROWSCN) AS row_scn
             
         FROM FOCCO3I.TPEDC_ITEM itpdc
         JOIN FOCCO3I.TPED_COMPRA pdc ON itpdc.TPEDC_ID = pdc.ID
@@ -397,68 +666,37 @@ def sync_purchase_items(oracle_conn, start_date):
         LEFT JOIN FOCCO3I.TITENS_EMPR itempr ON itsup.ITEMPR_ID = itempr.ID
         LEFT JOIN FOCCO3I.TITENS item ON itempr.ITEM_ID = item.ID
         LEFT JOIN FOCCO3I.TUNID_MED um ON itpdc.UNID_MED_ID = um.ID  
-        WHERE pdc.DT_EMIS >= :start_date
+        WHERE {change_filter}
     """
-    raw_data = fetch_oracle_data(oracle_conn, query, start_date=start_date)
-    if not raw_data: 
-        logger.info("No new purchase items found.")
-        return
-    
-    order_keys = list(set((row['cod_emp1'], row['cod_pedc']) for row in raw_data))
+    change_sql, params = change_filter(['itpdc.ORA_ROWSCN > :since_scn', 'pdc.ORA_ROWSCN > :since_scn'], since_scn)
+    stats = Counter()
+    batch_count = 0
+    orders_scn = stage_watermark('purchase_orders')
+    waiting_scn = None
+    change_sql, params = month_filter(change_sql, params, 'pdc.DT_EMIS', months)
+    batches = stage_batches(oracle_conn, query, change_sql, params, PURCHASE_ITEM_PARTITION, pool, partitions)
+    touched_orders = set()
+    for batch in batches:
+        rows, unmatched = attach_order_ids(batch)
+        stats['unmatched'] += len(unmatched)
+        waiting_scn = retry_scn(unmatched, orders_scn, waiting_scn)
+        if rows:
+            stats.update(upsert_rows(PurchaseItem, rows, ['id_item_focco'], PURCHASE_ITEM_UPDATE_COLUMNS))
+            touched_orders.update(row['purchase_order_id'] for row in rows)
+            batch_count += 1
 
-    pg_orders = db.session.query(PurchaseOrder.id, PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc)\
-                          .filter(tuple_(PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc).in_(order_keys))\
-                          .all()
-
-    order_id_map = {(o.cod_emp1, o.cod_pedc): o.id for o in pg_orders}
-
-    valid_items = []
-    for row in raw_data:
-        key = (row['cod_emp1'], row['cod_pedc'])
-        pg_order_id = order_id_map.get(key)
-        
-        if pg_order_id:
-            row['purchase_order_id'] = pg_order_id
-            valid_items.append(row)
-
-    if not valid_items:
-        logger.warning("Nenhum item pôde ser vinculado a um pedido existente no banco.")
-        return
-
-    chunk_count = 0
-    for chunk in chunk_data(valid_items, chunk_size=2000):
-        stmt = insert(PurchaseItem).values(chunk)
-        
-        on_conflict = stmt.on_conflict_do_update(
-            index_elements=['id_item_focco'],  
-            set_={
-                'linha': stmt.excluded.linha,
-                'item_id': stmt.excluded.item_id,
-                'descricao': stmt.excluded.descricao,
-                'quantidade': stmt.excluded.quantidade,
-                'preco_unitario': stmt.excluded.preco_unitario,
-                'total': stmt.excluded.total,
-                'dt_entrega': stmt.excluded.dt_entrega,
-                'qtde_atendida': stmt.excluded.qtde_atendida,
-                'qtde_canc': stmt.excluded.qtde_canc,
-                'qtde_saldo': stmt.excluded.qtde_saldo,
-                'perc_ipi': stmt.excluded.perc_ipi,
-                'tot_liquido_ipi': stmt.excluded.tot_liquido_ipi,
-                'tot_descontos': stmt.excluded.tot_descontos,
-                'tot_acrescimos': stmt.excluded.tot_acrescimos,
-                'observacao': stmt.excluded.observacao,
-                'unidade_medida': stmt.excluded.unidade_medida,
-                'dt_emis': stmt.excluded.dt_emis
-            }
-        )
-        db.session.execute(on_conflict)
-        chunk_count += 1
-        
     db.session.commit()
-    logger.info(f"Successfully synced {len(valid_items)} purchase items across {chunk_count} batches.")
+    defer_order_refresh(touched_orders, pending_orders)
+    if waiting_scn is not None:
+        stats['retry_scn'] = waiting_scn
+    if stats['unmatched']:
+        logger.warning(f"{stats['unmatched']} itens não puderam ser vinculados a um pedido existente no banco.")
+    logger.info(f"Successfully synced {stats['sent']} purchase items across {batch_count} batches ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
     
     
-def sync_purchase_installments(oracle_conn, start_date):
+
+def sync_purchase_installments(oracle_conn, since_scn=None, pool=None, partitions=1):
     """Step 3.6: Sync Purchase Payment Installments com Tradutor de IDs"""
     logger.info("Syncing Purchase Installments...")
     
@@ -470,57 +708,37 @@ def sync_purchase_installments(oracle_conn, start_date):
             TO_CHAR(pdc.EMPR_ID) AS cod_emp1,
             pgto.NUM_DIAS AS num_dias,      
             pgto.DT_VCTO AS dt_vcto,
-            pgto.PERC_PGTO AS perc_pgto
+            pgto.PERC_PGTO AS perc_pgto,
+            pgto.ORA_ROWSCN AS row_scn
         FROM FOCCO3I.TPEDC_PGTO pgto
         JOIN FOCCO3I.TPED_COMPRA pdc ON pgto.TPEDC_ID = pdc.ID
-        WHERE pdc.DT_EMIS >= :start_date
+        WHERE {change_filter}
     """
-    raw_data = fetch_oracle_data(oracle_conn, query, start_date)
-    if not raw_data: 
-        logger.info("No new installments found.")
-        return
-
-    order_keys = list(set((row['cod_emp1'], row['cod_pedc']) for row in raw_data))
-
-    pg_orders = db.session.query(PurchaseOrder.id, PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc)\
-                          .filter(tuple_(PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc).in_(order_keys))\
-                          .all()
-
-    order_id_map = {(o.cod_emp1, o.cod_pedc): o.id for o in pg_orders}
-
-    valid_installments = []
-    for row in raw_data:
-        key = (row['cod_emp1'], row['cod_pedc'])
-        pg_order_id = order_id_map.get(key)
-        
-        if pg_order_id:
-            row['purchase_order_id'] = pg_order_id
-            valid_installments.append(row)
-
-    if not valid_installments:
-        logger.warning("Nenhuma parcela pôde ser vinculada a um pedido existente no banco.")
-        return
-
-    chunk_count = 0
-    for chunk in chunk_data(valid_installments, chunk_size=2000):
-        stmt = insert(PurchasePaymentInstallment).values(chunk)
-        
-        on_conflict = stmt.on_conflict_do_update(
-            index_elements=['id'],
-            set_={
-                'num_dias': stmt.excluded.num_dias,
-                'dt_vcto': stmt.excluded.dt_vcto,
-                'perc_pgto': stmt.excluded.perc_pgto
-            }
-        )
-        db.session.execute(on_conflict)
-        chunk_count += 1
+    change_sql, params = change_filter(['pgto.ORA_ROWSCN > :since_scn'], since_scn)
+    stats = Counter()
+    batch_count = 0
+    orders_scn = stage_watermark('purchase_orders')
+    waiting_scn = None
+    batches = stage_batches(oracle_conn, query, change_sql, params, PURCHASE_INSTALLMENT_PARTITION, pool, partitions)
+    for batch in batches:
+        rows, unmatched = attach_order_ids(batch)
+        stats['unmatched'] += len(unmatched)
+        waiting_scn = retry_scn(unmatched, orders_scn, waiting_scn)
+        if rows:
+            stats.update(upsert_rows(PurchasePaymentInstallment, rows, ['id'], PURCHASE_INSTALLMENT_UPDATE_COLUMNS))
+            batch_count += 1
         
     db.session.commit()
-    logger.info(f"Successfully synced {len(valid_installments)} installments across {chunk_count} batches.")
+    if waiting_scn is not None:
+        stats['retry_scn'] = waiting_scn
+    if stats['unmatched']:
+        logger.warning(f"{stats['unmatched']} parcelas não puderam ser vinculadas a um pedido existente no banco.")
+    logger.info(f"Successfully synced {stats['sent']} installments across {batch_count} batches ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
     
     
-def sync_nf_entries(oracle_conn, start_date):
+
+def sync_nf_entries(oracle_conn, since_scn=None, pool=None, partitions=1, months=None, pending_orders=None):
     """Step 4: Sync Invoices garantindo a substituição de dados provisórios do XML"""
     logger.info("Syncing NF Entries from db...")
     
@@ -541,67 +759,221 @@ def sync_nf_entries(oracle_conn, start_date):
         JOIN FOCCO3I.TITENS_NFE itnfe ON itnfe.NFE_ID = nfe.ID
         JOIN FOCCO3I.TPEDC_ITEM itpdc ON itnfe.PEDCITEM_ID = itpdc.ID
         JOIN FOCCO3I.TPED_COMPRA pdc ON itpdc.TPEDC_ID = pdc.ID
-        WHERE nfe.DT_ENT >= :start_date
+        WHERE {change_filter}
     """
-    entries = fetch_oracle_data(oracle_conn, query_entries, start_date)
-    if not entries: 
-        logger.info("No NF Entries found in this window.")
-        return
-
-    notas_coletadas = list(set([row['num_nf'] for row in entries]))
-    if notas_coletadas:
-        db.session.query(NFEntry).filter(
-            NFEntry.num_nf.in_(notas_coletadas),
-            NFEntry.origem == 'XML'
-        ).delete(synchronize_session=False)
-        db.session.commit()
-        
-    chunk_count = 0
-    for chunk in chunk_data(entries, chunk_size=2000):
-        stmt_e = insert(NFEntry).values(chunk)
-        
-        on_conflict_e = stmt_e.on_conflict_do_update(
-            index_elements=['itnfe_id'],  
-            set_={
-                'dt_ent': stmt_e.excluded.dt_ent,
-                'qtde': stmt_e.excluded.qtde,
-                'obs_conf': stmt_e.excluded.obs_conf,
-                'chave_acesso_nfel': stmt_e.excluded.chave_acesso_nfel,
-                'origem': stmt_e.excluded.origem
-            }
-        )
-        db.session.execute(on_conflict_e)
-        chunk_count += 1
-        
+    change_sql, params = change_filter(['nfe.ORA_ROWSCN > :since_scn', 'itnfe.ORA_ROWSCN > :since_scn'], since_scn)
+    stats = Counter()
+    batch_count = 0
+    change_sql, params = month_filter(change_sql, params, 'nfe.DT_ENT', months)
+    batches = stage_batches(oracle_conn, query_entries, change_sql, params, NF_ENTRY_PARTITION, pool, partitions)
+    touched_orders = set()
+    for batch in batches:
+        # Provisional XML rows for these invoices are deleted by the same merge statement
+        stats.update(upsert_rows(
+            NFEntry, batch, ['itnfe_id'], NF_ENTRY_UPDATE_COLUMNS,
+            purge_match='num_nf', purge_filter={'origem': 'XML'}
+        ))
+        touched_orders.update((row['cod_emp1'], row['cod_pedc']) for row in batch)
+        batch_count += 1
+
+    # Receipts of purged XML rows go with them (ON DELETE CASCADE); the ledger is its own table, so it
+    # is kept here and only the orders' received_qty_ratio waits for the final refresh
+    receipt_orders = refresh_item_receipts(touched_orders)
     db.session.commit()
-    logger.info(f"Successfully synced {len(entries)} precise NF entries from Oracle.")
+    defer_order_refresh(receipt_orders, pending_orders)
+    if not stats['sent']:
+        logger.info("No NF Entries found in this window.")
+    logger.info(f"Successfully synced {stats['sent']} precise NF entries from Oracle across {batch_count} batches ({stats['changed']} changed, {stats['unchanged']} unchanged).")
+    return stats
     
 
-def run_sync():
-    """Main execution function."""
-    app = create_app()
+
+# Stage name (sync_state key), function and the stages it depends on. Companies, suppliers and orders
+# are independent (no FKs between them); the order-bound stages need purchase_orders to resolve ids.
+# NF entries need not wait for the items: receipts are linked to their items by the final refresh.
+SYNC_STAGES = [
+    ('companies', sync_companies, ()),
+    ('suppliers', sync_suppliers, ()),
+    ('purchase_orders', sync_purchase_orders, ()),
+    ('purchase_items', sync_purchase_items, ('purchase_orders',)),
+    ('nf_entries', sync_nf_entries, ('purchase_orders',)),
+    ('purchase_adjustments', sync_purchase_adjustments, ('purchase_orders',)),
+    ('purchase_installments', sync_purchase_installments, ('purchase_orders',)),
+]
+
+# Stages whose rows feed the derived purchase_orders columns. In a stage graph they only collect the
+# orders they touched; refresh_synced_orders runs once after all of them, and their watermarks are
+# saved only after it succeeds, so a failed refresh re-pulls their rows on the next run.
+ORDER_BOUND_STAGES = {'purchase_orders', 'purchase_items', 'nf_entries', 'purchase_adjustments'}
+
+
+def needs_full_reconcile(state):
+    """A stage runs in full mode on its first run and every SYNC_FULL_RECONCILE_DAYS afterwards."""
+    if state is None or state.watermark_scn is None or state.last_full_sync_at is None:
+        return True
+    return datetime.now() - state.last_full_sync_at >= timedelta(days=SYNC_FULL_RECONCILE_DAYS)
+
+
+def save_watermark(stage, watermark, rows_synced, full):
+    """Store a stage's new watermark and run stats. Commits."""
+    state = db.session.get(SyncState, stage)
+    if state is None:
+        state = SyncState(stage=stage)
+        db.session.add(state)
+    now = datetime.now()
+    state.watermark_scn = watermark
+    state.last_run_at = now
+    state.rows_synced = rows_synced
+    if full:
+        state.last_full_sync_at = now
+    db.session.commit()
+
+
+def run_stage(oracle_conn, stage, func, full=False, pool=None, pending_orders=None):
+    """
+    Run one stage incrementally from its watermark (or in full) and advance the watermark on success.
+    Full runs are split into SYNC_STAGE_PARTITIONS ID ranges when a pool is given; incremental runs
+    filter on ORA_ROWSCN, which an ID range cannot narrow, so they use a single query. A stage that
+    reports a retry_scn (rows whose order is not in Postgres yet) keeps its watermark just below it,
+    so those rows are fetched again by the next run.
+    With pending_orders the stage only collects the orders it touched, and the watermark is left to
+    the caller (stats 'watermark_scn' and 'full_sync') until those orders are refreshed.
+    Returns the stage's merge stats (rows sent, changed and unchanged).
+    """
+    started = time.monotonic()
+    state = db.session.get(SyncState, stage)
+    full = full or needs_full_reconcile(state)
+    since_scn = None if full else state.watermark_scn
+
+    # Captured before extraction: rows committed while the stage runs are picked up again next time
+    next_scn = get_current_scn(oracle_conn)
+    partitions = SYNC_STAGE_PARTITIONS if full else 1
+    options = {} if pending_orders is None else {'pending_orders': pending_orders}
+    stats = func(oracle_conn, since_scn, pool=pool, partitions=partitions, **options)
+
+    watermark = next_scn
+    if stats.get('retry_scn'):
+        watermark = min(next_scn, stats['retry_scn'] - 1)
+        logger.warning(
+            f"Stage {stage}: watermark held at SCN {watermark} for rows whose purchase order is not synced yet."
+        )
+    if pending_orders is None:
+        save_watermark(stage, watermark, stats['sent'], full)
+    else:
+        stats['watermark_scn'] = watermark
+        stats['full_sync'] = full
+
+    elapsed = time.monotonic() - started
+    rate = stats['sent'] / elapsed if elapsed > 0 else 0
+    logger.info(
+        f"Stage {stage} finished in {elapsed:.1f}s: {stats['sent']} rows ({rate:.0f} rows/s), "
+        f"{stats['changed']} changed, {stats['unchanged']} unchanged."
+    )
+    return stats
+
+
+def _run_pooled_stage(app, pool, stage, func, full, pending_orders=None):
+    """Run a stage in its own app context (own Postgres session) on a connection from the Oracle pool."""
     with app.app_context():
+        oracle_conn = pool.acquire()
         try:
-            logger.info("Starting Oracle to Postgres Sync...")
-            oracle_conn = get_oracle_connection()
-            
-            # Calculate the window (last 1 month)
-            start_date = datetime.now() - relativedelta(months=1)
-            
-            sync_companies(oracle_conn)
-            sync_suppliers(oracle_conn)
-            sync_purchase_orders(oracle_conn, start_date)
-            sync_purchase_items(oracle_conn, start_date)
-            sync_nf_entries(oracle_conn, start_date)
-            sync_purchase_adjustments(oracle_conn, start_date)
-            sync_purchase_installments(oracle_conn, start_date)
-            
-            oracle_conn.close()
-            logger.info("Sync completed successfully.")
-            
-        except Exception as e:
-            logger.error(f"Error during synchronization: {str(e)}")
+            return run_stage(oracle_conn, stage, func, full=full, pool=pool, pending_orders=pending_orders)
+        except Exception:
             db.session.rollback()
+            raise
+        finally:
+            pool.release(oracle_conn)
+
+
+def run_stage_graph(app, pool, stages=None, full=False, max_workers=None):
+    """
+    Run stages concurrently as soon as all of their dependencies have completed.
+    A failed stage does not stop independent stages; the stages depending on it are skipped.
+    Once no stage is left, the orders touched by the completed ORDER_BOUND_STAGES are refreshed in a
+    single step (refresh_synced_orders) and only then are those stages' watermarks saved; if the
+    refresh fails they count as failed and their rows are pulled again by the next run.
+
+    Returns:
+        tuple: ({stage: stats} for completed stages, set of failed or skipped stages)
+    """
+    stages = stages or SYNC_STAGES
+    pending = {stage: (func, set(depends_on)) for stage, func, depends_on in stages}
+    completed = {}
+    failed = set()
+    running = {}
+    # One set per stage: each is only written by its own worker thread
+    touched_orders = {stage: set() for stage in pending if stage in ORDER_BOUND_STAGES}
+
+    with ThreadPoolExecutor(max_workers=max_workers or SYNC_MAX_PARALLEL_STAGES,
+                            thread_name_prefix='sync-stage') as executor:
+        while pending or running:
+            for stage, (func, depends_on) in list(pending.items()):
+                if depends_on & failed:
+                    logger.error(f"Skipping stage {stage}: dependency {', '.join(sorted(depends_on & failed))} failed.")
+                    failed.add(stage)
+                    del pending[stage]
+                elif depends_on <= completed.keys():
+                    future = executor.submit(_run_pooled_stage, app, pool, stage, func, full, touched_orders.get(stage))
+                    running[future] = stage
+                    del pending[stage]
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Unsatisfiable stage dependencies: {', '.join(sorted(pending))}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    completed[stage] = future.result()
+                except Exception as e:
+                    logger.error(f"Stage {stage} failed: {str(e)}")
+                    failed.add(stage)
+
+    order_stages = [stage for stage in touched_orders if stage in completed]
+    if order_stages:
+        with app.app_context():
+            try:
+                refresh_synced_orders(set().union(*(touched_orders[stage] for stage in order_stages)))
+                for stage in order_stages:
+                    stats = completed[stage]
+                    save_watermark(stage, stats.pop('watermark_scn'), stats['sent'], stats.pop('full_sync'))
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Order refresh failed, watermarks of {', '.join(sorted(order_stages))} kept: {str(e)}")
+                for stage in order_stages:
+                    completed.pop(stage)
+                    failed.add(stage)
+
+    return completed, failed
+
+
+def run_sync(full=False):
+    """
+    Main execution function.
+    Each stage pulls only Oracle rows changed since its stored watermark, for any date; full=True
+    (or a stale last full reconcile) re-pulls everything. Independent stages run in parallel.
+    """
+    app = create_app()
+    started = time.monotonic()
+    try:
+        logger.info(f"Starting Oracle to Postgres Sync ({'full reconcile' if full else 'incremental'})...")
+        pool = get_oracle_pool()
+        try:
+            completed, failed = run_stage_graph(app, pool, full=full)
+        finally:
+            pool.close()
+
+        elapsed = time.monotonic() - started
+        total = sum(stats['sent'] for stats in completed.values())
+        if failed:
+            logger.error(f"Sync finished with failed stages ({', '.join(sorted(failed))}) in {elapsed:.1f}s.")
+        else:
+            logger.info(f"Sync completed successfully: {total} rows in {elapsed:.1f}s.")
+
+    except Exception as e:
+        logger.error(f"Error during synchronization: {str(e)}")
 
 if __name__ == '__main__':
-    run_sync()
\ No newline at end of file
+    run_sync(full='--full' in sys.argv[1:])
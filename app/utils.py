@@ -1,11 +1,15 @@
+import io
 import logging
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime, date
 import os
 import re
 from flask import jsonify, current_app, has_app_context
-from app.models import NFEntry, PurchaseAdjustment, PurchaseItem, PurchaseOrder, Quotation, PurchaseItemNFEMatch, Company
+from sqlalchemy import and_, delete, insert, or_, select, tuple_, update
+from app.models import NFEntry, PurchaseAdjustment, PurchaseItem, PurchaseItemReceipt, PurchaseMonthlyRollup, PurchaseOrder, PurchasePaymentInstallment, Quotation, PurchaseItemNFEMatch, Company
 from app import db
+from app.bulk_load import bulk_merge
+from app.xml_mapping import Field, RecordMapping, decimal, lenient
 from fuzzywuzzy import fuzz
 from flask_mail import Mail, Message
 from config import Config
@@ -40,6 +44,134 @@ def _parse_date(value):
     return None
 
 
+RUAH_COMPANY_FIELDS = RecordMapping(
+    Field('cod_emp1', 'EMPR_ID2', convert=str.strip),
+    Field('name', 'RAZAO_SOCIAL', default=''),
+    Field('cnpj', 'CNPJ1', 'CNPJ'),
+    Field('address', 'ENDERECO'),
+    Field('neighborhood', 'BAIRRO'),
+    Field('city', 'CIDADE'),
+    Field('state', 'UF'),
+    Field('zip_code', 'CEP'),
+    Field('inscricao_estadual', 'INSEST'),
+    Field('phone', 'CF_TEL'),
+    Field('email', 'CF_EMAIL'),
+)
+
+RUAH_ORDER_FIELDS = RecordMapping(
+    Field('cod_pedc', 'COD_PEDC'),
+    Field('dt_emis', 'DT_EMIS'),
+    Field('fornecedor_id', 'FOR_COD', convert=int),
+    Field('fornecedor_descricao', 'FOR_DESCRICAO'),
+    Field('total_bruto', 'TOT_BRUTO1', convert=decimal),
+    Field('total_liquido', 'TOT_LIQUIDO1', convert=decimal),
+    Field('total_liquido_ipi', 'CP_TOT_IPI', convert=decimal),
+    Field('total_pedido_com_ipi', 'TOT_LIQUIDO_IPI1', convert=decimal),
+    Field('posicao', 'POSICAO1'),
+    Field('posicao_hist', 'POSICAO_HIST1'),
+    Field('observacao', 'OBSERVACAO'),
+    Field('contato', 'CONTATO'),
+    Field('func_nome', 'FUNC_NOME'),
+    Field('cf_pgto', 'CF_PGTO'),
+    Field('cod_emp1', 'EMPR_ID'),
+    Field('vlr_icms_st', 'VLR_ICMS_ST', convert=decimal),
+    Field('moeped', 'MOEPED'),
+    Field('for_uf', 'FOR_UF'),
+    Field('tra_cod', 'TRA_COD'),
+    Field('tra_descricao', 'TRA_DESCRICAO'),
+    Field('tra_uf', 'TRA_UF'),
+    Field('red_cod', 'RED_COD'),
+    Field('red_descricao2', 'RED_DESCRICAO2'),
+    Field('red_uf', 'RED_UF'),
+    Field('tp_frete_tra', 'TP_FRETE_TRA'),
+    Field('tp_vlr_frete_tra', 'TP_VLR_FRETE_TRA'),
+    Field('moetra', 'MOETRA'),
+    Field('vlr_frete_tra', 'VLR_FRETE_TRA', convert=decimal),
+    Field('tp_frete_red', 'TP_FRETE_RED'),
+    Field('tp_vlr_frete_red', 'TP_VLR_FRETE_RED'),
+    Field('moered', 'MOERED'),
+    Field('vlr_frete_red', 'VLR_FRETE_RED', convert=decimal),
+    Field('num_talao', 'NUM_TALAO'),
+    Field('tipo', 'TIPO'),
+    Field('id_ped_focco', 'ID2', convert=int),
+)
+
+RUAH_ADJUSTMENT_FIELDS = RecordMapping(
+    Field('tp_apl', 'TP_APL'),
+    Field('tp_dctacr1', 'TP_DCTACR1'),
+    Field('tp_vlr1', 'TP_VLR1'),
+    Field('vlr1', 'VLR1', convert=decimal),
+)
+
+RUAH_INSTALLMENT_FIELDS = RecordMapping(
+    Field('num_dias', 'NUM_DIAS', convert=lenient(int)),
+    Field('dt_vcto', 'DT_VCTO'),
+    Field('tpedc_id1', 'TPEDC_ID1'),
+    Field('id3', 'ID3'),
+)
+
+# Newer RUAH layouts renamed a few item tags; the first alias is preferred when both are present
+RUAH_ITEM_FIELDS = RecordMapping(
+    Field('item_id', 'ITEM_COD', 'ITEM_ID'),
+    Field('linha', 'LINHA1', convert=int),
+    Field('descricao', 'ITEM_DESC_TECNICA', 'DESCRICAO'),
+    Field('quantidade', 'QTDE', 'QTD', convert=decimal),
+    Field('preco_unitario', 'PRECO_UNITARIO', convert=decimal),
+    Field('total', 'TOT_BRUTO', 'TOTAL', convert=decimal),
+    Field('unidade_medida', 'UNID_MED', 'UNIDADE_MEDIDA'),
+    Field('dt_entrega', 'DT_ENTREGA'),
+    Field('perc_ipi', 'PERC_IPI', convert=decimal),
+    Field('tot_liquido_ipi', 'TOT_LIQUIDO_IPI', convert=decimal),
+    Field('tot_descontos', 'TOT_DESCONTOS', convert=decimal),
+    Field('tot_acrescimos', 'TOT_ACRESCIMOS', convert=decimal),
+    Field('qtde_canc', 'QTDE_CANC', convert=decimal),
+    Field('qtde_canc_toler', 'QTDE_CANC_TOLER', convert=decimal),
+    Field('perc_toler', 'PERC_TOLER', convert=decimal),
+    Field('qtde_atendida', 'QTDE_ATENDIDA', convert=decimal),
+    Field('qtde_saldo', 'QTDE_SALDO', convert=decimal),
+    Field('cod_emp1', 'COD_EMP1'),
+    Field('observacao', 'OBS'),
+    Field('id_item_focco', 'ID5', convert=int),
+)
+
+
+def _parse_ruah_company(g_cod_emp1):
+    """Company data from a RUAH G_COD_EMP1 element, or None when it has no EMPR_ID2."""
+    company_data = RUAH_COMPANY_FIELDS.read(g_cod_emp1)
+    if not company_data['cod_emp1']:
+        return None
+
+    company_data['name'] = re.sub(r'\s*\(\d+\)\s*$', '', company_data['name'].strip()).strip()
+    if company_data['phone']:
+        company_data['phone'] = re.sub(r'^Fone:\s*', '', company_data['phone']).strip()
+    return company_data
+
+
+def _parse_ruah_order(order):
+    """Order dict (with its adjustments, installments and items) from a RUAH TPED_COMPRA element."""
+    order_data = RUAH_ORDER_FIELDS.read(order)
+
+    order_data['adjustments'] = []
+    dctacr_list = order.find('LIST_TPEDC_DCTACR')
+    if dctacr_list is not None:
+        for idx, dctacr in enumerate(dctacr_list.findall('TPEDC_DCTACR')):
+            adjustment = RUAH_ADJUSTMENT_FIELDS.read(dctacr)
+            adjustment['order_index'] = idx
+            order_data['adjustments'].append(adjustment)
+
+    pgto_list = order.find('LIST_TPEDC_PGTO')
+    order_data['installments'] = [
+        RUAH_INSTALLMENT_FIELDS.read(pgto) for pgto in pgto_list.findall('TPEDC_PGTO')
+    ] if pgto_list is not None else []
+
+    order_data['items'] = []
+    for item in order.findall('.//TPEDC_ITEM'):
+        item_data = RUAH_ITEM_FIELDS.read(item)
+        item_data['cod_pedc'] = order_data['cod_pedc']
+        order_data['items'].append(item_data)
+    return order_data
+
+
 def parse_xml(xml_data):
     import xml.etree.ElementTree as ET
 
@@ -52,140 +184,12 @@ def parse_xml(xml_data):
 
         # Extract company data from G_COD_EMP1 elements
         for g_cod_emp1 in root.findall('.//G_COD_EMP1'):
-            razao_social = g_cod_emp1.find('RAZAO_SOCIAL').text if g_cod_emp1.find('RAZAO_SOCIAL') is not None else None
-            empr_id = g_cod_emp1.find('EMPR_ID2').text if g_cod_emp1.find('EMPR_ID2') is not None else None
-            
-            if empr_id:
-                name = razao_social.strip() if razao_social else ''
-                import re
-                name = re.sub(r'\s*\(\d+\)\s*$', '', name).strip()
-                
-                cnpj_val = g_cod_emp1.find('CNPJ1').text if g_cod_emp1.find('CNPJ1') is not None else (g_cod_emp1.find('CNPJ').text if g_cod_emp1.find('CNPJ') is not None else None)
-                
-                phone_val = g_cod_emp1.find('CF_TEL').text if g_cod_emp1.find('CF_TEL') is not None else None
-                if phone_val:
-                    phone_val = re.sub(r'^Fone:\s*', '', phone_val).strip()
-                    
-                email_val = g_cod_emp1.find('CF_EMAIL').text if g_cod_emp1.find('CF_EMAIL') is not None else None
-
-                company_data = {
-                    'cod_emp1': empr_id.strip(),
-                    'name': name,
-                    'cnpj': cnpj_val,
-                    'address': g_cod_emp1.find('ENDERECO').text if g_cod_emp1.find('ENDERECO') is not None else None,
-                    'neighborhood': g_cod_emp1.find('BAIRRO').text if g_cod_emp1.find('BAIRRO') is not None else None,
-                    'city': g_cod_emp1.find('CIDADE').text if g_cod_emp1.find('CIDADE') is not None else None,
-                    'state': g_cod_emp1.find('UF').text if g_cod_emp1.find('UF') is not None else None,
-                    'zip_code': g_cod_emp1.find('CEP').text if g_cod_emp1.find('CEP') is not None else None,
-                    'inscricao_estadual': g_cod_emp1.find('INSEST').text if g_cod_emp1.find('INSEST') is not None else None,
-                    'phone': phone_val,
-                    'email': email_val,
-                }
+            company_data = _parse_ruah_company(g_cod_emp1)
+            if company_data:
                 companies.append(company_data)
 
         for order in root.findall('.//TPED_COMPRA'):
-            cod_pedc = order.find('COD_PEDC').text if order.find('COD_PEDC') is not None else None
-
-            adjustments = []
-            dctacr_list = order.find('LIST_TPEDC_DCTACR')
-            if dctacr_list is not None:
-                for idx, dctacr in enumerate(dctacr_list.findall('TPEDC_DCTACR')):
-                    adjustments.append({
-                        'tp_apl': dctacr.find('TP_APL').text if dctacr.find('TP_APL') is not None else None,
-                        'tp_dctacr1': dctacr.find('TP_DCTACR1').text if dctacr.find('TP_DCTACR1') is not None else None,
-                        'tp_vlr1': dctacr.find('TP_VLR1').text if dctacr.find('TP_VLR1') is not None else None,
-                        'vlr1': float(dctacr.find('VLR1').text.replace(',', '.')) if dctacr.find('VLR1') is not None and dctacr.find('VLR1').text else None,
-                        'order_index': idx,
-                    })
-            installments = []
-            pgto_list = order.find('LIST_TPEDC_PGTO')
-            if pgto_list is not None:
-                for pgto in pgto_list.findall('TPEDC_PGTO'):
-                    num_dias = pgto.find('NUM_DIAS').text if pgto.find('NUM_DIAS') is not None else None
-                    if num_dias:
-                        try:
-                            num_dias = int(num_dias)
-                        except ValueError:
-                            num_dias = None
-                    installments.append({
-                        'num_dias': num_dias,
-                        'dt_vcto': pgto.find('DT_VCTO').text if pgto.find('DT_VCTO') is not None else None,
-                        'tpedc_id1': pgto.find('TPEDC_ID1').text if pgto.find('TPEDC_ID1') is not None else None,
-                        'id3': pgto.find('ID3').text if pgto.find('ID3') is not None else None,
-                    })
-
-            order_data = {
-                'cod_pedc': cod_pedc,
-                'dt_emis': order.find('DT_EMIS').text if order.find('DT_EMIS') is not None else None,
-                'fornecedor_id': int(order.find('FOR_COD').text) if order.find('FOR_COD') is not None else None,
-                'fornecedor_descricao': order.find('FOR_DESCRICAO').text if order.find('FOR_DESCRICAO') is not None else None,
-                'total_bruto': float(order.find('TOT_BRUTO1').text.replace(',', '.')) if order.find('TOT_BRUTO1') is not None and order.find('TOT_BRUTO1').text else None,
-                'total_liquido': float(order.find('TOT_LIQUIDO1').text.replace(',', '.')) if order.find('TOT_LIQUIDO1') is not None and order.find('TOT_LIQUIDO1').text else None,
-                'total_liquido_ipi': float(order.find('CP_TOT_IPI').text.replace(',', '.')) if order.find('CP_TOT_IPI') is not None and order.find('CP_TOT_IPI').text else None,
-                'total_pedido_com_ipi': float(order.find('TOT_LIQUIDO_IPI1').text.replace(',', '.')) if order.find('TOT_LIQUIDO_IPI1') is not None and order.find('TOT_LIQUIDO_IPI1').text else None,
-                'posicao': order.find('POSICAO1').text if order.find('POSICAO1') is not None else None,
-                'posicao_hist': order.find('POSICAO_HIST1').text if order.find('POSICAO_HIST1') is not None else None,
-                'observacao': order.find('OBSERVACAO').text if order.find('OBSERVACAO') is not None else None,
-                'contato': order.find('CONTATO').text if order.find('CONTATO') is not None else None,
-                'func_nome': order.find('FUNC_NOME').text if order.find('FUNC_NOME') is not None else None,
-                'cf_pgto': order.find('CF_PGTO').text if order.find('CF_PGTO') is not None else None,
-                'cod_emp1': order.find('EMPR_ID').text if order.find('EMPR_ID') is not None else None,
-                'vlr_icms_st': float(order.find('VLR_ICMS_ST').text.replace(',', '.')) if order.find('VLR_ICMS_ST') is not None and order.find('VLR_ICMS_ST').text else None,
-                'moeped': order.find('MOEPED').text if order.find('MOEPED') is not None else None,
-                'for_uf': order.find('FOR_UF').text if order.find('FOR_UF') is not None else None,
-                'tra_cod': order.find('TRA_COD').text if order.find('TRA_COD') is not None else None,
-                'tra_descricao': order.find('TRA_DESCRICAO').text if order.find('TRA_DESCRICAO') is not None else None,
-                'tra_uf': order.find('TRA_UF').text if order.find('TRA_UF') is not None else None,
-                'red_cod': order.find('RED_COD').text if order.find('RED_COD') is not None else None,
-                'red_descricao2': order.find('RED_DESCRICAO2').text if order.find('RED_DESCRICAO2') is not None else None,
-                'red_uf': order.find('RED_UF').text if order.find('RED_UF') is not None else None,
-                'tp_frete_tra': order.find('TP_FRETE_TRA').text if order.find('TP_FRETE_TRA') is not None else None,
-                'tp_vlr_frete_tra': order.find('TP_VLR_FRETE_TRA').text if order.find('TP_VLR_FRETE_TRA') is not None else None,
-                'moetra': order.find('MOETRA').text if order.find('MOETRA') is not None else None,
-                'vlr_frete_tra': float(order.find('VLR_FRETE_TRA').text.replace(',', '.')) if order.find('VLR_FRETE_TRA') is not None and order.find('VLR_FRETE_TRA').text else None,
-                'tp_frete_red': order.find('TP_FRETE_RED').text if order.find('TP_FRETE_RED') is not None else None,
-                'tp_vlr_frete_red': order.find('TP_VLR_FRETE_RED').text if order.find('TP_VLR_FRETE_RED') is not None else None,
-                'moered': order.find('MOERED').text if order.find('MOERED') is not None else None,
-                'vlr_frete_red': float(order.find('VLR_FRETE_RED').text.replace(',', '.')) if order.find('VLR_FRETE_RED') is not None and order.find('VLR_FRETE_RED').text else None,
-                'num_talao': order.find('NUM_TALAO').text if order.find('NUM_TALAO') is not None else None,
-                'tipo': order.find('TIPO').text if order.find('TIPO') is not None else None,
-                'id_ped_focco': order.find('ID2').text if order.find('ID2') is not None else None,
-                'adjustments': adjustments,
-                'installments': installments,
-                'items': []
-            }
-
-            for item in order.findall('.//TPEDC_ITEM'):
-                item_id_tag = item.find('ITEM_COD') if item.find('ITEM_COD') is not None else item.find('ITEM_ID')
-                descricao_tag = item.find('ITEM_DESC_TECNICA') if item.find('ITEM_DESC_TECNICA') is not None else item.find('DESCRICAO')
-                quantidade_tag = item.find('QTDE') if item.find('QTDE') is not None else item.find('QTD')
-                total_tag = item.find('TOT_BRUTO') if item.find('TOT_BRUTO') is not None else item.find('TOTAL')
-                unidade_tag = item.find('UNID_MED') if item.find('UNID_MED') is not None else item.find('UNIDADE_MEDIDA')
-                item_data = {
-                    'item_id': item_id_tag.text if item_id_tag is not None and item_id_tag.text else None,
-                    'cod_pedc': cod_pedc,
-                    'linha': item.find('LINHA1').text if item.find('LINHA1') is not None else None,
-                    'descricao': descricao_tag.text if descricao_tag is not None else None,
-                    'quantidade': float(quantidade_tag.text.replace(',', '.')) if quantidade_tag is not None and quantidade_tag.text else None,
-                    'preco_unitario': float(item.find('PRECO_UNITARIO').text.replace(',', '.')) if item.find('PRECO_UNITARIO') is not None and item.find('PRECO_UNITARIO').text else None,
-                    'total': float(total_tag.text.replace(',', '.')) if total_tag is not None and total_tag.text else None,
-                    'unidade_medida': unidade_tag.text if unidade_tag is not None else None,
-                    'dt_entrega': item.find('DT_ENTREGA').text if item.find('DT_ENTREGA') is not None else None,
-                    'perc_ipi': float(item.find('PERC_IPI').text.replace(',', '.')) if item.find('PERC_IPI') is not None and item.find('PERC_IPI').text else None,
-                    'tot_liquido_ipi': float(item.find('TOT_LIQUIDO_IPI').text.replace(',', '.')) if item.find('TOT_LIQUIDO_IPI') is not None and item.find('TOT_LIQUIDO_IPI').text else None,
-                    'tot_descontos': float(item.find('TOT_DESCONTOS').text.replace(',', '.')) if item.find('TOT_DESCONTOS') is not None and item.find('TOT_DESCONTOS').text else None,
-                    'tot_acrescimos': float(item.find('TOT_ACRESCIMOS').text.replace(',', '.')) if item.find('TOT_ACRESCIMOS') is not None and item.find('TOT_ACRESCIMOS').text else None,
-                    'qtde_canc': float(item.find('QTDE_CANC').text.replace(',', '.')) if item.find('QTDE_CANC') is not None and item.find('QTDE_CANC').text else None,
-                    'qtde_canc_toler': float(item.find('QTDE_CANC_TOLER').text.replace(',', '.')) if item.find('QTDE_CANC_TOLER') is not None and item.find('QTDE_CANC_TOLER').text else None,
-                    'perc_toler': float(item.find('PERC_TOLER').text.replace(',', '.')) if item.find('PERC_TOLER') is not None and item.find('PERC_TOLER').text else None,
-                    'qtde_atendida': float(item.find('QTDE_ATENDIDA').text.replace(',', '.')) if item.find('QTDE_ATENDIDA') is not None and item.find('QTDE_ATENDIDA').text else None,
-                    'qtde_saldo': float(item.find('QTDE_SALDO').text.replace(',', '.')) if item.find('QTDE_SALDO') is not None and item.find('QTDE_SALDO').text else None,
-                    'cod_emp1': item.find('COD_EMP1').text if item.find('COD_EMP1') is not None else None,
-                    'observacao': item.find('OBS').text if item.find('OBS') is not None else None,
-                    'id_item_focco': item.find('ID5').text if item.find('ID5') is not None else None
-                }
-                order_data['items'].append(item_data)
-
+            order_data = _parse_ruah_order(order)
             total_items += len(order_data['items'])
             purchase_orders.append(order_data)
 
@@ -296,275 +300,332 @@ def format_for_db(data):
     except Exception:
         raise Exception('Failed to format data for DB')
 
+RPDC0250C_COMPANY_FIELDS = RecordMapping(Field('cod_emp1', 'COD_EMP'))
+
+RPDC0250C_ITEM_FIELDS = RecordMapping(
+    Field('cod_pedc', 'CODIGO_PEDIDO'),
+    Field('linha', 'LINHA1'),
+)
+
+RPDC0250C_NFE_FIELDS = RecordMapping(
+    Field('num_nf', 'NUM_NF'),
+    Field('dt_ent', 'DT_ENT', convert=lenient(lambda text: datetime.strptime(text, '%d/%m/%y').date())),
+    Field('qtde', 'QTDE1', convert=lenient(decimal)),
+)
+
+
 def format_for_db_rpdc0250c(xml_data):
     formatted_items = []
     import xml.etree.ElementTree as ET
 
     data = ET.fromstring(xml_data)
     for g_cod_emp1 in data.findall('.//G_COD_EMP1'):
-        cod_emp1 = g_cod_emp1.find('COD_EMP').text
+        company = RPDC0250C_COMPANY_FIELDS.read(g_cod_emp1)
         for cgg_tpedc_item in g_cod_emp1.findall('.//CGG_TPEDC_ITEM'):
-            cod_pedc = cgg_tpedc_item.find('CODIGO_PEDIDO').text
-            linha = cgg_tpedc_item.find('LINHA1').text
-            
+            item = RPDC0250C_ITEM_FIELDS.read(cgg_tpedc_item)
+
             for g_nfe in cgg_tpedc_item.findall('.//G_NFE'):
-                num_nf = g_nfe.find('NUM_NF').text if g_nfe.find('NUM_NF') is not None else None
-                dt_ent = g_nfe.find('DT_ENT').text if g_nfe.find('DT_ENT') is not None else None
-                qtde = g_nfe.find('QTDE1').text if g_nfe.find('QTDE1') is not None else None
-                
-                if not num_nf or not num_nf.strip():
+                nfe = RPDC0250C_NFE_FIELDS.read(g_nfe)
+                if not nfe['num_nf'] or not nfe['num_nf'].strip():
                     continue
-                    
-                if dt_ent:
-                    try:
-                        dt_ent = datetime.strptime(dt_ent, '%d/%m/%y').date()
-                    except ValueError:
-                        dt_ent = None
-                
-                if qtde:
-                    try:
-                        qtde = float(qtde.replace(',', '.'))
-                    except (ValueError, AttributeError):
-                        qtde = None
-                
-                formatted_items.append({
-                    'cod_emp1': cod_emp1,
-                    'cod_pedc': cod_pedc,
-                    'linha': linha,
-                    'num_nf': num_nf,
-                    'dt_ent': dt_ent,
-                    'qtde': qtde  
-                })
+
+                formatted_items.append({**company, **item, **nfe})
     return formatted_items
 
-def import_ruah(file_content):
-    formatted_orders = []
-    formatted_items = []
-    formatted_adjustments = []
-    itemcount = 0
-    purchasecount = 0
-    updated = 0
-    companies_created = 0
+RUAH_ELEMENT_TAGS = ('G_COD_EMP1', 'TPED_COMPRA')
 
-    try:
-        data = parse_xml(file_content)
-
-        # Process company data - create or update
-        companies_data = data.get('companies', [])
-        if companies_data:
-            cod_emp1_list = [c['cod_emp1'] for c in companies_data if c.get('cod_emp1')]
-            existing_companies = Company.query.filter(Company.cod_emp1.in_(cod_emp1_list)).all()
-            existing_companies_map = {c.cod_emp1: c for c in existing_companies}
-            
-            for company_data in companies_data:
-                cod_emp1 = company_data.get('cod_emp1')
-                if not cod_emp1:
-                    continue
-                    
-                if cod_emp1 not in existing_companies_map:
-                    # Create new company
-                    company = Company(
-                        cod_emp1=cod_emp1,
-                        name=company_data.get('name') or f'Company {cod_emp1}',
-                        cnpj=company_data.get('cnpj'),
-                        address=company_data.get('address'),
-                        neighborhood=company_data.get('neighborhood'),
-                        city=company_data.get('city'),
-                        state=company_data.get('state'),
-                        zip_code=company_data.get('zip_code'),
-                        inscricao_estadual=company_data.get('inscricao_estadual'),
-                        phone=company_data.get('phone'),
-                        email=company_data.get('email'),
-                    )
-                    db.session.add(company)
-                    companies_created += 1
-                else:
-                    comp = existing_companies_map[cod_emp1]
-                    comp.name = company_data.get('name') or comp.name
-                    comp.cnpj = company_data.get('cnpj') or comp.cnpj
-                    comp.phone = company_data.get('phone') or comp.phone
-                    comp.email = company_data.get('email') or comp.email
-                    comp.address = company_data.get('address') or comp.address
-                    comp.city = company_data.get('city') or comp.city
-                    comp.state = company_data.get('state') or comp.state
-                    comp.zip_code = company_data.get('zip_code') or comp.zip_code
-                    comp.inscricao_estadual = company_data.get('inscricao_estadual') or comp.inscricao_estadual
-
-        formatted_orders, formatted_items, formatted_adjustments, formatted_installments = format_for_db(data)
-
-        # Group items and adjustments once to avoid repeatedly scanning entire lists per order.
-        items_by_key = defaultdict(list)
-        for item in formatted_items:
-            key = (item['purchase_order_id'], item['cod_emp1'])
-            items_by_key[key].append(item)
-
-        adjustments_by_key = defaultdict(list)
-        for adj in formatted_adjustments:
-            key = (adj['cod_pedc'], adj['cod_emp1'])
-            adjustments_by_key[key].append(adj)
-
-        installments_by_key = defaultdict(list)
-        for inst in formatted_installments:
-            key = (inst['cod_pedc'], inst['cod_emp1'])
-            installments_by_key[key].append(inst)
-
-        # Bulk fetch existing orders - need to match by both cod_pedc AND cod_emp1
-        incoming_keys = [(o['cod_pedc'], o['cod_emp1']) for o in formatted_orders]
-        # Build query conditions for all (cod_pedc, cod_emp1) pairs
-        from sqlalchemy import and_, or_
-        if incoming_keys:
-            conditions = [
-                and_(PurchaseOrder.cod_pedc == key[0], PurchaseOrder.cod_emp1 == key[1])
-                for key in incoming_keys
-            ]
-            existing_orders = PurchaseOrder.query.filter(or_(*conditions)).all()
-        else:
-            existing_orders = []
-        existing_orders_map = {(o.cod_pedc, o.cod_emp1): o for o in existing_orders}
-
-        orders_to_update_ids = []
-        processed_orders = []
-
-        for order_data in formatted_orders:
-            order_key = (order_data['cod_pedc'], order_data['cod_emp1'])
-            existing_order = existing_orders_map.get(order_key)
-
-            order_details = {
-                'cod_pedc': order_data['cod_pedc'],
-                'dt_emis': order_data['dt_emis'],
-                'fornecedor_id': order_data['fornecedor_id'],
-                'fornecedor_descricao': order_data['fornecedor_descricao'],
-                'total_bruto': order_data['total_bruto'],
-                'total_liquido': order_data['total_liquido'],
-                'total_liquido_ipi': order_data['total_liquido_ipi'],
-                'total_pedido_com_ipi': order_data['total_pedido_com_ipi'],
-                'posicao': order_data['posicao'],
-                'posicao_hist': order_data['posicao_hist'],
-                'observacao': order_data['observacao'],
-                'contato': order_data['contato'],
-                'func_nome': order_data['func_nome'],
-                'cf_pgto': order_data['cf_pgto'],
-                'cod_emp1': order_data['cod_emp1'],
-                'vlr_icms_st': order_data.get('vlr_icms_st'),
-                'moeped': order_data.get('moeped'),
-                'for_uf': order_data.get('for_uf'),
-                'tra_cod': order_data.get('tra_cod'),
-                'tra_descricao': order_data.get('tra_descricao'),
-                'tra_uf': order_data.get('tra_uf'),
-                'red_cod': order_data.get('red_cod'),
-                'red_descricao2': order_data.get('red_descricao2'),
-                'red_uf': order_data.get('red_uf'),
-                'tp_frete_tra': order_data.get('tp_frete_tra'),
-                'tp_vlr_frete_tra': order_data.get('tp_vlr_frete_tra'),
-                'moetra': order_data.get('moetra'),
-                'vlr_frete_tra': order_data.get('vlr_frete_tra'),
-                'tp_frete_red': order_data.get('tp_frete_red'),
-                'tp_vlr_frete_red': order_data.get('tp_vlr_frete_red'),
-                'moered': order_data.get('moered'),
-                'vlr_frete_red': order_data.get('vlr_frete_red'),
-                'num_talao': order_data.get('num_talao'),
-                'tipo': order_data.get('tipo'),
-                'id_ped_focco': order_data.get('id_ped_focco')
-            }
 
-            if existing_order:
-                for field, value in order_details.items():
-                    setattr(existing_order, field, value)
-                orders_to_update_ids.append(existing_order.id)
-                order = existing_order
-                updated += 1
+class InvalidXMLError(Exception):
+    """An XML report that is not well-formed."""
+
+
+def iter_ruah_elements(source):
+    """
+    Stream the companies and purchase orders of a RUAH (RPDC0250) XML document.
+
+    source is a path or a binary file object. Yields ('company', company_data) and
+    ('order', order_data) as each element is closed, then clears it, so memory stays
+    flat whatever the file size. Malformed XML is reported when the parser reaches it.
+    """
+    from lxml import etree
+
+    try:
+        for _, element in etree.iterparse(source, events=('end',), tag=RUAH_ELEMENT_TAGS,
+                                          resolve_entities=False, no_network=True, huge_tree=True):
+            if element.tag == 'TPED_COMPRA':
+                yield 'order', _parse_ruah_order(element)
             else:
-                order = PurchaseOrder(**order_details)
-                db.session.add(order)
-            
-            processed_orders.append((order, order_data))
-            purchasecount += 1
-
-        # Bulk delete items and adjustments for updated orders
-        if orders_to_update_ids:
-            PurchaseItem.query.filter(PurchaseItem.purchase_order_id.in_(orders_to_update_ids)).delete(synchronize_session=False)
-            PurchaseAdjustment.query.filter(PurchaseAdjustment.purchase_order_id.in_(orders_to_update_ids)).delete(synchronize_session=False)
-            from app.models import PurchasePaymentInstallment
-            PurchasePaymentInstallment.query.filter(PurchasePaymentInstallment.purchase_order_id.in_(orders_to_update_ids)).delete(synchronize_session=False)
+                company_data = _parse_ruah_company(element)
+                if company_data:
+                    yield 'company', company_data
+
+            element.clear()
+            # Drop the already parsed siblings; company fields around nested orders must survive
+            previous = element.getprevious()
+            while previous is not None and previous.tag == element.tag:
+                element.getparent().remove(previous)
+                previous = element.getprevious()
+    except etree.XMLSyntaxError as e:
+        raise InvalidXMLError(f'Failed to parse XML data: {e}')
+
+
+def parse_ruah(file_content):
+    """The companies and orders of a RUAH document as a list of (kind, record), for store_ruah."""
+    return list(iter_ruah_elements(io.BytesIO(file_content)))
+
+
+RUAH_ORDER_COLUMNS = (
+    'cod_pedc', 'dt_emis', 'fornecedor_id', 'fornecedor_descricao', 'total_bruto', 'total_liquido',
+    'total_liquido_ipi', 'total_pedido_com_ipi', 'posicao', 'posicao_hist', 'observacao', 'contato',
+    'func_nome', 'cf_pgto', 'cod_emp1', 'vlr_icms_st', 'moeped', 'for_uf', 'tra_cod', 'tra_descricao',
+    'tra_uf', 'red_cod', 'red_descricao2', 'red_uf', 'tp_frete_tra', 'tp_vlr_frete_tra', 'moetra',
+    'vlr_frete_tra', 'tp_frete_red', 'tp_vlr_frete_red', 'moered', 'vlr_frete_red', 'num_talao', 'tipo',
+    'id_ped_focco',
+)
+
+RUAH_ITEM_COLUMNS = (
+    'item_id', 'dt_emis', 'linha', 'cod_pedc', 'descricao', 'quantidade', 'preco_unitario', 'total',
+    'unidade_medida', 'dt_entrega', 'perc_ipi', 'tot_liquido_ipi', 'tot_descontos', 'tot_acrescimos',
+    'qtde_canc', 'qtde_canc_toler', 'perc_toler', 'qtde_atendida', 'qtde_saldo', 'cod_emp1', 'observacao',
+    'id_item_focco',
+)
+
+RUAH_ADJUSTMENT_COLUMNS = ('cod_pedc', 'cod_emp1', 'tp_apl', 'tp_dctacr1', 'tp_vlr1', 'vlr1', 'order_index')
+
+RUAH_INSTALLMENT_COLUMNS = ('cod_pedc', 'cod_emp1', 'num_dias', 'dt_vcto', 'tpedc_id1', 'id3')
+
+
+def _fetch_ruah_orders(keys):
+    """Stored purchase_orders rows by (cod_pedc, cod_emp1), resolved with a tuple IN."""
+    keys = list(keys)
+    conditions = []
+    scoped = [key for key in keys if key[1] is not None]
+    if scoped:
+        conditions.append(tuple_(PurchaseOrder.cod_pedc, PurchaseOrder.cod_emp1).in_(scoped))
+    unscoped = [cod_pedc for cod_pedc, cod_emp1 in keys if cod_emp1 is None]
+    if unscoped:
+        conditions.append(and_(PurchaseOrder.cod_emp1.is_(None), PurchaseOrder.cod_pedc.in_(unscoped)))
+    if not conditions:
+        return {}
+    rows = db.session.execute(select(PurchaseOrder.__table__).where(or_(*conditions))).mappings()
+    return {(row['cod_pedc'], row['cod_emp1']): row for row in rows}
+
+
+def _row_differs(current, row, columns):
+    return any(current[column] != row[column] for column in columns)
+
+
+def _row_set(rows):
+    return Counter(tuple(row.values()) for row in rows)
+
+
+def _store_ruah_batch(data, counters):
+    """
+    Write a batch of parsed RUAH companies and orders. Orders, items, adjustments and installments
+    are diffed against the stored rows and written with bulk INSERT/UPDATE/DELETE statements.
+    Returns the ids of the batch's orders.
+    """
+    # Process company data - create or update
+    companies_data = data.get('companies', [])
+    if companies_data:
+        cod_emp1_list = [c['cod_emp1'] for c in companies_data if c.get('cod_emp1')]
+        existing_companies = Company.query.filter(Company.cod_emp1.in_(cod_emp1_list)).all()
+        existing_companies_map = {c.cod_emp1: c for c in existing_companies}
         
-        # Flush to ensure new orders get proper IDs
-        db.session.flush()
-
-        for order, order_data in processed_orders:
-            order_key = (order_data['cod_pedc'], order_data['cod_emp1'])
-            order_items = items_by_key.get(order_key, [])
-            order_adjustments = adjustments_by_key.get(order_key, [])
-
-            for item_data in order_items:
-                item = PurchaseItem(
-                    purchase_order=order,
-                    item_id=item_data['item_id'],
-                    dt_emis=item_data['dt_emis'],
-                    linha=item_data['linha'],
-                    cod_pedc=item_data['cod_pedc'],
-                    descricao=item_data['descricao'],
-                    quantidade=item_data['quantidade'],
-                    preco_unitario=item_data['preco_unitario'],
-                    total=item_data['total'],
-                    unidade_medida=item_data['unidade_medida'],
-                    dt_entrega=item_data['dt_entrega'],
-                    perc_ipi=item_data['perc_ipi'],
-                    tot_liquido_ipi=item_data['tot_liquido_ipi'],
-                    tot_descontos=item_data['tot_descontos'],
-                    tot_acrescimos=item_data['tot_acrescimos'],
-                    qtde_canc=item_data['qtde_canc'],
-                    qtde_canc_toler=item_data['qtde_canc_toler'],
-                    perc_toler=item_data['perc_toler'],
-                    qtde_atendida=item_data['qtde_atendida'],
-                    qtde_saldo=item_data['qtde_saldo'],
-                    cod_emp1=item_data['cod_emp1'],
-                    observacao=item_data.get('observacao'),
-                    id_item_focco=item_data.get('id_item_focco')
-                )
-                itemcount += 1
-                db.session.add(item)
-
-            for adj_data in order_adjustments:
-                adjustment = PurchaseAdjustment(
-                    purchase_order=order,
-                    cod_pedc=adj_data['cod_pedc'],
-                    cod_emp1=adj_data['cod_emp1'],
-                    tp_apl=adj_data['tp_apl'],
-                    tp_dctacr1=adj_data['tp_dctacr1'],
-                    tp_vlr1=adj_data['tp_vlr1'],
-                    vlr1=adj_data['vlr1'],
-                    order_index=adj_data['order_index']
-                )
-                db.session.add(adjustment)
-
-            order_installments = installments_by_key.get(order_key, [])
-            for inst_data in order_installments:
-                from app.models import PurchasePaymentInstallment
-                installment = PurchasePaymentInstallment(
-                    purchase_order=order,
-                    cod_pedc=inst_data['cod_pedc'],
-                    cod_emp1=inst_data['cod_emp1'],
-                    num_dias=inst_data['num_dias'],
-                    dt_vcto=inst_data['dt_vcto'],
-                    tpedc_id1=inst_data['tpedc_id1'],
-                    id3=inst_data['id3']
+        for company_data in companies_data:
+            cod_emp1 = company_data.get('cod_emp1')
+            if not cod_emp1:
+                continue
+                
+            if cod_emp1 not in existing_companies_map:
+                # Create new company
+                company = Company(
+                    cod_emp1=cod_emp1,
+                    name=company_data.get('name') or f'Company {cod_emp1}',
+                    cnpj=company_data.get('cnpj'),
+                    address=company_data.get('address'),
+                    neighborhood=company_data.get('neighborhood'),
+                    city=company_data.get('city'),
+                    state=company_data.get('state'),
+                    zip_code=company_data.get('zip_code'),
+                    inscricao_estadual=company_data.get('inscricao_estadual'),
+                    phone=company_data.get('phone'),
+                    email=company_data.get('email'),
                 )
-                db.session.add(installment)
+                db.session.add(company)
+                counters['companies_created'] += 1
+            else:
+                comp = existing_companies_map[cod_emp1]
+                comp.name = company_data.get('name') or comp.name
+                comp.cnpj = company_data.get('cnpj') or comp.cnpj
+                comp.phone = company_data.get('phone') or comp.phone
+                comp.email = company_data.get('email') or comp.email
+                comp.address = company_data.get('address') or comp.address
+                comp.city = company_data.get('city') or comp.city
+                comp.state = company_data.get('state') or comp.state
+                comp.zip_code = company_data.get('zip_code') or comp.zip_code
+                comp.inscricao_estadual = company_data.get('inscricao_estadual') or comp.inscricao_estadual
+
+    formatted_orders, formatted_items, formatted_adjustments, formatted_installments = format_for_db(data)
+
+    # Group items and adjustments once to avoid repeatedly scanning entire lists per order.
+    items_by_key = defaultdict(list)
+    for item in formatted_items:
+        key = (item['purchase_order_id'], item['cod_emp1'])
+        items_by_key[key].append(item)
+
+    adjustments_by_key = defaultdict(list)
+    for adj in formatted_adjustments:
+        key = (adj['cod_pedc'], adj['cod_emp1'])
+        adjustments_by_key[key].append(adj)
+
+    installments_by_key = defaultdict(list)
+    for inst in formatted_installments:
+        key = (inst['cod_pedc'], inst['cod_emp1'])
+        installments_by_key[key].append(inst)
+
+    # Last occurrence wins when an order is repeated in the batch
+    orders_by_key = {(o['cod_pedc'], o['cod_emp1']): o for o in formatted_orders}
+    counters['purchases'] += len(orders_by_key)
+
+    existing_orders = _fetch_ruah_orders(orders_by_key)
+    new_orders = []
+    changed_orders = []
+    for order_key, order_data in orders_by_key.items():
+        row = {column: order_data.get(column) for column in RUAH_ORDER_COLUMNS}
+        current = existing_orders.get(order_key)
+        if current is None:
+            new_orders.append(row)
+            continue
+        counters['updated'] += 1
+        if _row_differs(current, row, RUAH_ORDER_COLUMNS):
+            changed_orders.append({'id': current['id'], **row})
+
+    if new_orders:
+        db.session.execute(insert(PurchaseOrder), new_orders)
+        existing_orders.update(_fetch_ruah_orders([(o['cod_pedc'], o['cod_emp1']) for o in new_orders]))
+    if changed_orders:
+        db.session.execute(update(PurchaseOrder), changed_orders)
+    order_ids = {order_key: existing_orders[order_key]['id'] for order_key in orders_by_key}
+    batch_order_ids = list(order_ids.values())
+
+    # Items keep their id when their line is still in the file, so NFE matches stay linked
+    stored_items = {}
+    stale_item_ids = []
+    for row in db.session.execute(
+        select(PurchaseItem.__table__).where(PurchaseItem.purchase_order_id.in_(batch_order_ids))
+    ).mappings():
+        item_key = (row['purchase_order_id'], row['linha'])
+        if row['linha'] is None or item_key in stored_items:
+            # Not addressable by line: replaced like before
+            stale_item_ids.append(row['id'])
+        else:
+            stored_items[item_key] = row
+
+    new_items = []
+    changed_items = []
+    for order_key, order_id in order_ids.items():
+        for item_data in items_by_key.get(order_key, []):
+            row = {column: item_data.get(column) for column in RUAH_ITEM_COLUMNS}
+            row['purchase_order_id'] = order_id
+            counters['items'] += 1
+            current = stored_items.pop((order_id, row['linha']), None) if row['linha'] is not None else None
+            if current is None:
+                new_items.append(row)
+            elif _row_differs(current, row, RUAH_ITEM_COLUMNS):
+                changed_items.append({'id': current['id'], **row})
+    stale_item_ids.extend(row['id'] for row in stored_items.values())
+
+    if stale_item_ids:
+        db.session.execute(delete(PurchaseItem).where(PurchaseItem.id.in_(stale_item_ids)))
+    if changed_items:
+        db.session.execute(update(PurchaseItem), changed_items)
+    if new_items:
+        db.session.execute(insert(PurchaseItem), new_items)
+
+    # Adjustments and installments have no stable line key: an order's set is rewritten only when it changed
+    for model, columns, rows_by_key in (
+        (PurchaseAdjustment, RUAH_ADJUSTMENT_COLUMNS, adjustments_by_key),
+        (PurchasePaymentInstallment, RUAH_INSTALLMENT_COLUMNS, installments_by_key),
+    ):
+        stored = defaultdict(list)
+        for row in db.session.execute(
+            select(model.__table__).where(model.purchase_order_id.in_(batch_order_ids))
+        ).mappings():
+            stored[row['purchase_order_id']].append(row)
+
+        replaced_order_ids = []
+        new_rows = []
+        for order_key, order_id in order_ids.items():
+            incoming = [
+                {'purchase_order_id': order_id, **{column: row.get(column) for column in columns}}
+                for row in rows_by_key.get(order_key, [])
+            ]
+            current = [{column: row[column] for column in ('purchase_order_id',) + columns} for row in stored[order_id]]
+            if _row_set(incoming) != _row_set(current):
+                replaced_order_ids.append(order_id)
+                new_rows.extend(incoming)
+
+        if replaced_order_ids:
+            db.session.execute(delete(model).where(model.purchase_order_id.in_(replaced_order_ids)))
+        if new_rows:
+            db.session.execute(insert(model), new_rows)
+
+    db.session.flush()
+    refresh_order_fulfillment(batch_order_ids)
+    link_item_receipts(batch_order_ids)
+    refresh_order_summaries(batch_order_ids)
+    return batch_order_ids
+
+
+def import_ruah_stream(source, batch_size=None, on_progress=None):
+    """
+    Import a RUAH (RPDC0250) document from a path or binary file object.
+
+    Orders are parsed one TPED_COMPRA at a time and written every batch_size orders
+    (RUAH_IMPORT_BATCH_SIZE), so the file is never held in memory. Everything is
+    committed once at the end: an invalid document imports nothing. on_progress, when
+    given, is called as on_progress(phase, counters) after each batch ('importing') and
+    before the NFE matches are relinked ('relinking').
+    """
+    return store_ruah(iter_ruah_elements(source), batch_size=batch_size, on_progress=on_progress)
+
 
-            order.is_fulfilled = check_order_fulfillment_memory(order_items)
+def store_ruah(records, batch_size=None, on_progress=None):
+    """Write RUAH (kind, record) pairs, as yielded by iter_ruah_elements, in one transaction."""
+    batch_size = batch_size or int(current_app.config.get('RUAH_IMPORT_BATCH_SIZE', 500))
+    counters = defaultdict(int)
+    order_ids = []
+    batch = {'purchase_orders': [], 'companies': []}
 
+    try:
+        for kind, record in records:
+            if kind == 'company':
+                batch['companies'].append(record)
+                continue
+            batch['purchase_orders'].append(record)
+            if len(batch['purchase_orders']) >= batch_size:
+                order_ids.extend(_store_ruah_batch(batch, counters))
+                batch = {'purchase_orders': [], 'companies': []}
+                if on_progress:
+                    on_progress('importing', counters)
+        if batch['purchase_orders'] or batch['companies']:
+            order_ids.extend(_store_ruah_batch(batch, counters))
+        refresh_purchase_rollups(order_months(order_ids))
         db.session.commit()
-        
+
+        if on_progress:
+            on_progress('relinking', counters)
         # Re-link any PurchaseItemNFEMatch records that were orphaned
-        relinked_count = relink_purchase_item_nfe_matches()
-        
+        relinked_count = relink_purchase_item_nfe_matches(order_ids)
+
         message = 'Data imported successfully purchases {}, items {}, updated {}'.format(
-            purchasecount - updated,
-            itemcount,
-            updated,
+            counters['purchases'] - counters['updated'],
+            counters['items'],
+            counters['updated'],
         )
-        if companies_created > 0:
-            message += f', created {companies_created} companies'
+        if counters['companies_created'] > 0:
+            message += f", created {counters['companies_created']} companies"
         if relinked_count > 0:
             message += f', relinked {relinked_count} NFE matches'
         return jsonify({'message': message}), 201
@@ -576,71 +637,104 @@ def import_ruah(file_content):
         logging.error(f"Failed to import RUAH data: {error_detail}\n{tb}")
         raise Exception(f'Failed to import RUAH data: {error_detail}')
 
-        
+
+def import_ruah(file_content):
+    return import_ruah_stream(io.BytesIO(file_content))
+
+
+# Rows per INSERT ... ON CONFLICT statement of the report importers
+IMPORT_UPSERT_CHUNK_SIZE = 1000
+
+
+def _upsert_import_rows(model, rows, index_elements, update_columns, fill_columns=None):
+    """
+    Upsert rows into model in chunks of IMPORT_UPSERT_CHUNK_SIZE; a stored row is only rewritten
+    when one of update_columns changed or one of fill_columns gets its first value. Returns
+    (inserted, updated) as counted by RETURNING.
+    """
+    stats = Counter()
+    for start in range(0, len(rows), IMPORT_UPSERT_CHUNK_SIZE):
+        stats.update(bulk_merge(model, rows[start:start + IMPORT_UPSERT_CHUNK_SIZE], index_elements,
+                                update_columns, count_inserts=True, fill_columns=fill_columns))
+    return stats['inserted'], stats['updated']
 
 
 def import_rpdc0250c(file_content):
-    formatted_items = format_for_db_rpdc0250c(file_content) 
-    itemcount = 0
-    updated = 0
-    
-    unique_combinations = {}
+    return store_rpdc0250c(format_for_db_rpdc0250c(file_content))
+
+
+def store_rpdc0250c(formatted_items):
+    # One provisional row per NF line, keyed by a synthetic itnfe_id built from (cod_emp1, cod_pedc, linha, num_nf)
+    rows = {}
     for item_data in formatted_items:
         if item_data and item_data['num_nf']:
-            # Agrupamento lógico tradicional do XML continua igual
-            key = (item_data['cod_emp1'], item_data['cod_pedc'], item_data['linha'], item_data['num_nf'])
-            
-            if key not in unique_combinations:
-                # Injeta o ID sintético e a origem XML
-                item_data['itnfe_id'] = f"XML-{item_data['cod_emp1']}-{item_data['cod_pedc']}-{item_data['linha']}-{item_data['num_nf']}"
-                item_data['origem'] = 'XML'
-                unique_combinations[key] = item_data
+            itnfe_id = f"XML-{item_data['cod_emp1']}-{item_data['cod_pedc']}-{item_data['linha']}-{item_data['num_nf']}"
+            rows.setdefault(itnfe_id, {
+                'itnfe_id': itnfe_id,
+                'origem': 'XML',
+                'cod_emp1': item_data['cod_emp1'],
+                'cod_pedc': item_data['cod_pedc'],
+                'linha': item_data['linha'],
+                'num_nf': item_data['num_nf'],
+                'dt_ent': item_data.get('dt_ent'),
+                'qtde': item_data.get('qtde'),
+            })
+
+    # NF lines already stored under another itnfe_id: rows synced from Focco are authoritative (the Oracle
+    # sync replaces provisional rows, not the other way round), older XML rows are replaced by the upsert
+    stored_keys = set()
+    stale_ids = []
+    keys = list({(row['cod_emp1'], row['cod_pedc'], row['linha'], row['num_nf']) for row in rows.values()})
+    for start in range(0, len(keys), IMPORT_UPSERT_CHUNK_SIZE):
+        entries = db.session.execute(
+            select(NFEntry.id, NFEntry.itnfe_id, NFEntry.origem,
+                   NFEntry.cod_emp1, NFEntry.cod_pedc, NFEntry.linha, NFEntry.num_nf)
+            .where(tuple_(NFEntry.cod_emp1, NFEntry.cod_pedc, NFEntry.linha, NFEntry.num_nf)
+                   .in_(keys[start:start + IMPORT_UPSERT_CHUNK_SIZE]))
+        )
+        for entry_id, itnfe_id, origem, *key in entries:
+            if itnfe_id in rows:
+                continue
+            if origem == 'XML':
+                stale_ids.append(entry_id)
+            else:
+                stored_keys.add(tuple(key))
 
-    cod_pedcs = {item['cod_pedc'] for item in unique_combinations.values()}
-    existing_entries = NFEntry.query.filter(NFEntry.cod_pedc.in_(cod_pedcs)).all()
-    existing_map = {(e.cod_emp1, e.cod_pedc, e.linha, e.num_nf): e for e in existing_entries}
+    for start in range(0, len(stale_ids), IMPORT_UPSERT_CHUNK_SIZE):
+        db.session.execute(delete(NFEntry).where(NFEntry.id.in_(stale_ids[start:start + IMPORT_UPSERT_CHUNK_SIZE])))
 
-    for key, item_data in unique_combinations.items():
-        existing_entry = existing_map.get(key)
+    inserted, updated = _upsert_import_rows(
+        NFEntry,
+        [row for row in rows.values()
+         if (row['cod_emp1'], row['cod_pedc'], row['linha'], row['num_nf']) not in stored_keys],
+        ['itnfe_id'],
+        ['origem', 'dt_ent', 'qtde'],
+    )
+    order_ids = refresh_item_receipts({(row['cod_emp1'], row['cod_pedc']) for row in rows.values()})
+    refresh_order_summaries(order_ids)
+    db.session.commit()
+    return jsonify({'message': f'Data imported successfully: {inserted} new entries, {updated} updated'}), 201
 
-        if existing_entry:
-            has_changes = False
-            
-            # Se uma linha antiga do XML ainda não tiver a string itnfe_id gravada
-            if existing_entry.itnfe_id != item_data['itnfe_id']:
-                existing_entry.itnfe_id = item_data['itnfe_id']
-                has_changes = True
-                
-            if existing_entry.origem != 'XML':
-                existing_entry.origem = 'XML'
-                has_changes = True
 
-            if existing_entry.dt_ent != item_data.get('dt_ent'):
-                existing_entry.dt_ent = item_data.get('dt_ent', '')
-                has_changes = True
-                
-            if getattr(existing_entry, 'qtde', None) != item_data.get('qtde'):
-                existing_entry.qtde = item_data.get('qtde')
-                has_changes = True
-            
-            if has_changes:
-                updated += 1
-        else:
-            nf_entry = NFEntry(
-                itnfe_id=item_data['itnfe_id'],
-                origem=item_data['origem'],
-                cod_emp1=item_data['cod_emp1'],
-                cod_pedc=item_data['cod_pedc'],
-                linha=item_data['linha'],
-                num_nf=item_data['num_nf'],
-                dt_ent=item_data.get('dt_ent', ''),
-                qtde=item_data.get('qtde')  
-            )
-            itemcount += 1
-            db.session.add(nf_entry)
+RCOT0300_QUOTATION_FIELDS = RecordMapping(
+    Field('cod_cot', 'COD_COT'),
+    Field('dt_emissao', 'DT_EMISSAO', convert=_parse_date),
+)
 
-    db.session.commit()
-    return jsonify({'message': f'Data imported successfully: {itemcount} new entries, {updated} updated'}), 201
+RCOT0300_SUPPLIER_FIELDS = RecordMapping(
+    Field('fornecedor_id', 'ID_FORN'),
+    Field('fornecedor_descricao', 'FORNECEDOR'),
+)
+
+RCOT0300_ITEM_FIELDS = RecordMapping(
+    Field('item_id', 'COD_ITEM'),
+    Field('descricao', 'DESC_ITEM'),
+    Field('quantidade', 'QTDE', convert=decimal),
+    Field('unidade_medida', 'UNID_MED'),
+    Field('preco_unitario', 'PRECO_UNITARIO', convert=decimal),
+    Field('dt_entrega', 'DT_ENTREGA', convert=_parse_date),
+    Field('cod_emp1', 'COD_EMP'),
+)
 
 
 def parse_rcot0300(xml_data):
@@ -650,88 +744,37 @@ def parse_rcot0300(xml_data):
     quotations = []
 
     for g1 in root.findall('.//G_1'):
-        cod_cot = g1.find('COD_COT').text if g1.find('COD_COT') is not None else None
-        dt_emissao = g1.find('DT_EMISSAO').text if g1.find('DT_EMISSAO') is not None else None
-        dt_emissao = _parse_date(dt_emissao)
+        quotation = RCOT0300_QUOTATION_FIELDS.read(g1)
 
         for g2 in g1.findall('.//G_2'):
             for g3 in g2.findall('.//G_3'):
-                fornecedor_id = g3.find('ID_FORN').text if g3.find('ID_FORN') is not None else None
-                fornecedor_descricao = g3.find('FORNECEDOR').text if g3.find('FORNECEDOR') is not None else None
+                supplier = RCOT0300_SUPPLIER_FIELDS.read(g3)
 
                 for g4 in g3.findall('.//G_4'):
-                    item_id = g4.find('COD_ITEM').text if g4.find('COD_ITEM') is not None else None
-                    descricao = g4.find('DESC_ITEM').text if g4.find('DESC_ITEM') is not None else None
-                    quantidade = g4.find('QTDE').text if g4.find('QTDE') is not None else None
-                    quantidade = float(quantidade.replace(',', '.')) if quantidade else None
-                    preco_unitario = g4.find('PRECO_UNITARIO').text if g4.find('PRECO_UNITARIO') is not None else None
-                    preco_unitario = float(preco_unitario.replace(',', '.')) if preco_unitario else None
-                    unidade_medida = g4.find('UNID_MED').text if g4.find('UNID_MED') is not None else None
-                    dt_entrega = g4.find('DT_ENTREGA').text if g4.find('DT_ENTREGA') is not None else None
-                    dt_entrega = _parse_date(dt_entrega)
-                    cod_emp1 = g4.find('COD_EMP').text if g4.find('COD_EMP') is not None else None
-
-                    quotation_data = {
-                        'cod_cot': cod_cot,
-                        'dt_emissao': dt_emissao,
-                        'fornecedor_id': fornecedor_id,
-                        'fornecedor_descricao': fornecedor_descricao,
-                        'item_id': item_id,
-                        'descricao': descricao,
-                        'quantidade': quantidade,
-                        'unidade_medida': unidade_medida,
-                        'preco_unitario': preco_unitario,
-                        'dt_entrega': dt_entrega,
-                        'cod_emp1': cod_emp1
-                    }
-                    quotations.append(quotation_data)
+                    quotations.append({**quotation, **supplier, **RCOT0300_ITEM_FIELDS.read(g4)})
 
     return {'quotations': quotations}
 
 def import_rcot0300(file_content):
-    data = parse_rcot0300(file_content)
-    quotations = data['quotations']
-    new_count = 0
-    updated_count = 0
+    return store_rcot0300(parse_rcot0300(file_content))
 
-    cod_cots = {q['cod_cot'] for q in quotations}
-    existing_quotations = Quotation.query.filter(Quotation.cod_cot.in_(cod_cots)).all()
-    existing_map = {(q.cod_cot, q.item_id, str(q.fornecedor_id)): q for q in existing_quotations}
 
-    for quotation_data in quotations:
-        # Check if quotation already exists
-        key = (quotation_data['cod_cot'], quotation_data['item_id'], str(quotation_data['fornecedor_id']))
-        existing_quotation = existing_map.get(key)
-        
-        if existing_quotation:
-            # Update existing quotation
-            existing_quotation.dt_emissao = quotation_data['dt_emissao']
-            existing_quotation.fornecedor_descricao = quotation_data['fornecedor_descricao']
-            existing_quotation.descricao = quotation_data['descricao']
-            existing_quotation.quantidade = quotation_data['quantidade']
-            existing_quotation.unidade_medida = quotation_data['unidade_medida']
-            existing_quotation.preco_unitario = quotation_data['preco_unitario']
-            existing_quotation.dt_entrega = quotation_data['dt_entrega']
-            existing_quotation.cod_emp1 = quotation_data['cod_emp1']
-            updated_count += 1
-        else:
-            # Create new quotation
-            quotation = Quotation(
-                cod_cot=quotation_data['cod_cot'],
-                dt_emissao=quotation_data['dt_emissao'],
-                fornecedor_id=quotation_data['fornecedor_id'],
-                fornecedor_descricao=quotation_data['fornecedor_descricao'],
-                item_id=quotation_data['item_id'],
-                descricao=quotation_data['descricao'],
-                quantidade=quotation_data['quantidade'],
-                unidade_medida=quotation_data['unidade_medida'],
-                preco_unitario=quotation_data['preco_unitario'],
-                dt_entrega=quotation_data['dt_entrega'],
-                cod_emp1=quotation_data['cod_emp1']
-            )
-            db.session.add(quotation)
-            new_count += 1
+def store_rcot0300(data):
+    from app.models import Quotation
 
+    quotations = data['quotations']
+    # A repeated (quotation, item, supplier) in the file keeps its last occurrence
+    rows = {
+        (quotation['cod_cot'], quotation['item_id'], str(quotation['fornecedor_id'])): quotation
+        for quotation in quotations
+    }
+    new_count, updated_count = _upsert_import_rows(
+        Quotation,
+        list(rows.values()),
+        ['cod_cot', 'item_id', 'fornecedor_id'],
+        ['dt_emissao', 'fornecedor_descricao', 'descricao', 'quantidade', 'unidade_medida',
+         'preco_unitario', 'dt_entrega', 'cod_emp1'],
+    )
     db.session.commit()
     return jsonify({
         'message': f'Data imported successfully: {len(quotations)} total quotations ({new_count} new, {updated_count} updated)'
@@ -778,9 +821,32 @@ def send_login_notification_email(user, ip_address):
     except Exception as e:
         print(f"Erro ao enviar email: {str(e)}")
 
+RFOR0302_SUPPLIER_FIELDS = RecordMapping(
+    Field('cod_for', 'COD_FOR'),
+    Field('tip_forn', 'TIP_FORN'),
+    Field('conta_itens', 'CONTA_ITENS'),
+    Field('insc_est', 'INSC_EST'),
+    Field('insc_mun', 'INSC_MUN'),
+    Field('email', 'EMAIL'),
+    Field('tel_ddd_tel_telefone', 'TEL_DDD_TEL_TELEFONE'),
+    Field('endereco', 'ENDERECO'),
+    Field('cep', 'CEP'),
+    Field('cidade', 'CIDADE'),
+    Field('uf', 'UF'),
+    Field('id_for', 'ID_FOR'),
+    Field('nvl_forn_cnpj_forn_cpf', 'NVL_FORN_CNPJ_FORN_CPF'),
+    Field('descricao', 'DESCRICAO'),
+    Field('bairro', 'BAIRRO'),
+    Field('cf_fax', 'CF_FAX'),
+)
+
+
 def import_rfor0302(file_content):
+    return store_rfor0302(parse_rfor0302(file_content))
+
+
+def parse_rfor0302(file_content):
     import xml.etree.ElementTree as ET
-    from app.models import Supplier
 
     def normalize_cnpj_val(cnpj_str):
         import re
@@ -793,69 +859,154 @@ def import_rfor0302(file_content):
     suppliers_data = []
     
     for g_fornec in root.findall('.//G_FORNEC'):
-        cnpj_val = g_fornec.findtext('NVL_FORN_CNPJ_FORN_CPF')
-        suppliers_data.append({
-            'cod_for': g_fornec.findtext('COD_FOR'),
-            'tip_forn': g_fornec.findtext('TIP_FORN'),
-            'conta_itens': g_fornec.findtext('CONTA_ITENS'),
-            'insc_est': g_fornec.findtext('INSC_EST'),
-            'insc_mun': g_fornec.findtext('INSC_MUN'),
-            'email': g_fornec.findtext('EMAIL'),
-            'tel_ddd_tel_telefone': g_fornec.findtext('TEL_DDD_TEL_TELEFONE'),
-            'endereco': g_fornec.findtext('ENDERECO'),
-            'cep': g_fornec.findtext('CEP'),
-            'cidade': g_fornec.findtext('CIDADE'),
-            'uf': g_fornec.findtext('UF'),
-            'id_for': g_fornec.findtext('ID_FOR'),
-            'nvl_forn_cnpj_forn_cpf': cnpj_val,
-            'cnpj_cpf_normalized': normalize_cnpj_val(cnpj_val),
-            'descricao': g_fornec.findtext('DESCRICAO'),
-            'bairro': g_fornec.findtext('BAIRRO'),
-            'cf_fax': g_fornec.findtext('CF_FAX')
-        })
-
-    cod_fors = {s['cod_for'] for s in suppliers_data if s['cod_for']}
-    existing_suppliers = Supplier.query.filter(Supplier.cod_for.in_(cod_fors)).all()
-    existing_map = {s.cod_for: s for s in existing_suppliers}
-
-    new_count = 0
-    updated_count = 0
-    
-    for s_data in suppliers_data:
-        cod_for = s_data['cod_for']
-        if not cod_for:
-            continue
-            
-        existing_supplier = existing_map.get(cod_for)
-        
-        if existing_supplier:
-            existing_supplier.tip_forn = s_data['tip_forn']
-            existing_supplier.conta_itens = s_data['conta_itens']
-            existing_supplier.insc_est = s_data['insc_est']
-            existing_supplier.insc_mun = s_data['insc_mun']
-            existing_supplier.email = s_data['email']
-            existing_supplier.tel_ddd_tel_telefone = s_data['tel_ddd_tel_telefone']
-            existing_supplier.endereco = s_data['endereco']
-            existing_supplier.cep = s_data['cep']
-            existing_supplier.cidade = s_data['cidade']
-            existing_supplier.uf = s_data['uf']
-            existing_supplier.nvl_forn_cnpj_forn_cpf = s_data['nvl_forn_cnpj_forn_cpf']
-            existing_supplier.cnpj_cpf_normalized = s_data['cnpj_cpf_normalized']
-            existing_supplier.descricao = s_data['descricao']
-            existing_supplier.bairro = s_data['bairro']
-            existing_supplier.cf_fax = s_data['cf_fax']
-            updated_count += 1
-        else:
-            # Create new supplier
-            supplier = Supplier(**s_data)
-            db.session.add(supplier)
-            new_count += 1
-            
+        supplier_data = RFOR0302_SUPPLIER_FIELDS.read(g_fornec)
+        supplier_data['cnpj_cpf_normalized'] = normalize_cnpj_val(supplier_data['nvl_forn_cnpj_forn_cpf'])
+        suppliers_data.append(supplier_data)
+    return suppliers_data
+
+
+def store_rfor0302(suppliers_data):
+    from app.models import Supplier
+
+    rows = {s_data['cod_for']: s_data for s_data in suppliers_data if s_data['cod_for']}
+    new_count, updated_count = _upsert_import_rows(
+        Supplier,
+        list(rows.values()),
+        ['cod_for'],
+        [field.name for field in RFOR0302_SUPPLIER_FIELDS.fields if field.name not in ('cod_for', 'id_for')]
+        + ['cnpj_cpf_normalized'],
+        # id_for is the Oracle sync's key: never overwritten, but filled in for rows imported without it
+        fill_columns=['id_for'],
+    )
     db.session.commit()
     return jsonify({
         'message': f'Suppliers imported: {len(suppliers_data)} total ({new_count} new, {updated_count} updated)'
     }), 201
 
+
+# Document type -> (parser run in the worker processes, writer run in the request's session)
+XML_IMPORTERS = {
+    'RPDC0250': (parse_ruah, store_ruah),
+    'RPDC0250C': (format_for_db_rpdc0250c, store_rpdc0250c),
+    'RCOT0300': (parse_rcot0300, store_rcot0300),
+    'RFOR0302': (parse_rfor0302, store_rfor0302),
+}
+
+
+# The root element of a report always sits within its first few KB
+XML_SNIFF_BYTES = 4096
+
+XML_ROOT_DOCUMENT_TYPES = {
+    b'RPDC0250': 'RPDC0250',
+    b'RPDC0250_RUAH': 'RPDC0250',
+    b'RPDC0250C': 'RPDC0250C',
+    b'RCOT0300': 'RCOT0300',
+    b'RFOR0302': 'RFOR0302',
+}
+
+_XML_COMMENT_PATTERN = re.compile(rb'<!--.*?-->', re.DOTALL)
+# Declarations (<?xml ...?>) and doctypes (<!DOCTYPE ...>) do not start with a name character
+_XML_ROOT_PATTERN = re.compile(rb'<([A-Za-z_][\w.-]*)')
+
+
+def detect_xml_document_type(content):
+    """
+    FoccoERP report type of an XML document (a key of XML_IMPORTERS), or None. Only the root
+    tag in the first XML_SNIFF_BYTES is looked at; content can be bytes or any buffer (e.g. an mmap).
+    """
+    head = _XML_COMMENT_PATTERN.sub(b'', bytes(content[:XML_SNIFF_BYTES]))
+    match = _XML_ROOT_PATTERN.search(head)
+    return XML_ROOT_DOCUMENT_TYPES.get(match.group(1)) if match else None
+
+
+def sniff_xml_document_type(path):
+    """detect_xml_document_type() for a file, reading only its head."""
+    with open(path, 'rb') as f:
+        return detect_xml_document_type(f.read(XML_SNIFF_BYTES))
+
+
+def _parse_import_file(filename, doc_type, content):
+    """Process-pool worker: parse one FoccoERP XML report. Returns (filename, doc_type, parsed, error)."""
+    import xml.etree.ElementTree as ET
+
+    try:
+        if doc_type is None:
+            ET.fromstring(content)
+            return filename, doc_type, None, 'Unsupported XML document type'
+        return filename, doc_type, XML_IMPORTERS[doc_type][0](content), None
+    except (ET.ParseError, InvalidXMLError):
+        return filename, doc_type, None, 'Invalid XML structure'
+    except Exception as e:
+        return filename, doc_type, None, str(e)
+
+
+def import_xml_files(files, workers=None):
+    """
+    Import several FoccoERP XML reports, given as a list of (filename, content).
+
+    Files are parsed concurrently in a process pool (XML_IMPORT_WORKERS), so the wall time
+    stays close to that of the slowest file. The writes happen in this process, one
+    transaction per file; files of the same document type are written in upload order, so
+    a later report still wins over an earlier one. A failing file is rolled back alone.
+
+    Returns:
+        dict: {'successful': [...], 'failed': [...]} in upload order
+    """
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    config = current_app.config if has_app_context() else {}
+    workers = workers or int(config.get('XML_IMPORT_WORKERS') or os.cpu_count() or 1)
+    workers = min(workers, len(files))
+
+    outcomes = {}
+    doc_types = [detect_xml_document_type(content) for _, content in files]
+    # Upload positions of each document type still waiting to be written
+    write_queues = defaultdict(deque)
+    for position, doc_type in enumerate(doc_types):
+        write_queues[doc_type].append(position)
+    parsed_files = {}
+
+    def store(position, filename, doc_type, parsed, error):
+        if error:
+            outcomes[position] = ('failed', {'filename': filename, 'reason': error})
+            return
+        try:
+            response, _ = XML_IMPORTERS[doc_type][1](parsed)
+            outcomes[position] = ('successful', {
+                'filename': filename, 'document_type': doc_type, 'details': response.get_json()
+            })
+        except Exception as e:
+            db.session.rollback()
+            logging.exception(f"XML import failure | filename={filename}")
+            outcomes[position] = ('failed', {'filename': filename, 'reason': str(e)})
+
+    def collect(position, outcome):
+        parsed_files[position] = outcome
+        queue = write_queues[doc_types[position]]
+        while queue and queue[0] in parsed_files:
+            next_position = queue.popleft()
+            store(next_position, *parsed_files.pop(next_position))
+
+    if workers <= 1:
+        for position, (filename, content) in enumerate(files):
+            collect(position, _parse_import_file(filename, doc_types[position], content))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {
+                pool.submit(_parse_import_file, filename, doc_types[position], content): position
+                for position, (filename, content) in enumerate(files)
+            }
+            for future in as_completed(futures):
+                collect(futures[future], future.result())
+
+    results = {'successful': [], 'failed': []}
+    for position in sorted(outcomes):
+        status, entry = outcomes[position]
+        results[status].append(entry)
+    return results
+
 def apply_adjustments(base_value, adjustments):
     value = base_value
     for adj in adjustments:
@@ -891,18 +1042,13 @@ def apply_adjustments(base_value, adjustments):
     return value
 
 
-def parse_and_store_nfe_xml(xml_content):
+def parse_nfe_xml(xml_content):
     """
-    Parse NFE XML content and store all data in the database
-    Returns the NFEData object
+    Parse NFE XML content into plain dicts of column values, without touching the database.
+    Safe to run in a worker process; build_nfe_records turns the result into models.
     """
     import xml.etree.ElementTree as ET
     from datetime import datetime
-    from app.models import (
-        NFEData, NFEEmitente, NFEDestinatario, NFEItem, 
-        NFETransportadora, NFEVolume, NFEPagamento, NFEDuplicata
-    )
-    from app import db
     
     # Parse XML
     ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
@@ -921,11 +1067,6 @@ def parse_and_store_nfe_xml(xml_content):
     # Extract chave from ID (format: "NFe12345...")
     chave = inf_nfe.attrib.get('Id', '')[3:] if 'Id' in inf_nfe.attrib else ''
     
-    # Check if NFE already exists
-    existing_nfe = NFEData.query.filter_by(chave=chave).first()
-    if existing_nfe:
-        return existing_nfe
-    
     # Extract basic NFE data
     ide = inf_nfe.find('.//nfe:ide', ns)
     emit = inf_nfe.find('.//nfe:emit', ns)
@@ -967,7 +1108,7 @@ def parse_and_store_nfe_xml(xml_content):
             return ''
     
     # Create NFE main record
-    nfe_data = NFEData(
+    nfe_data = dict(
         chave=chave,
         xml_content=xml_content,
         versao=inf_nfe.attrib.get('versao', ''),
@@ -1011,11 +1152,22 @@ def parse_and_store_nfe_xml(xml_content):
         data_autorizacao=parse_date(safe_text(prot_nfe, './/nfe:infProt/nfe:dhRecbto')) if prot_nfe is not None else None
     )
     
+    parsed = {
+        'chave': chave,
+        'nfe': nfe_data,
+        'emitente': None,
+        'destinatario': None,
+        'itens': [],
+        'transportadora': None,
+        'volumes': [],
+        'pagamentos': [],
+        'duplicatas': [],
+    }
+    
     # Create emitter record
     if emit is not None:
         ender_emit = emit.find('.//nfe:enderEmit', ns)
-        emitente = NFEEmitente(
-            nfe=nfe_data,
+        emitente = dict(
             cnpj=safe_text(emit, './/nfe:CNPJ'),
             cpf=safe_text(emit, './/nfe:CPF'),
             nome=safe_text(emit, './/nfe:xNome'),
@@ -1037,13 +1189,12 @@ def parse_and_store_nfe_xml(xml_content):
             codigo_pais=safe_text(ender_emit, './/nfe:cPais') if ender_emit is not None else '',
             telefone=safe_text(ender_emit, './/nfe:fone') if ender_emit is not None else ''
         )
-        db.session.add(emitente)
+        parsed['emitente'] = emitente
     
     # Create recipient record
     if dest is not None:
         ender_dest = dest.find('.//nfe:enderDest', ns)
-        destinatario = NFEDestinatario(
-            nfe=nfe_data,
+        destinatario = dict(
             cnpj=safe_text(dest, './/nfe:CNPJ'),
             cpf=safe_text(dest, './/nfe:CPF'),
             id_estrangeiro=safe_text(dest, './/nfe:idEstrangeiro'),
@@ -1066,7 +1217,7 @@ def parse_and_store_nfe_xml(xml_content):
             codigo_pais=safe_text(ender_dest, './/nfe:cPais') if ender_dest is not None else '',
             telefone=safe_text(ender_dest, './/nfe:fone') if ender_dest is not None else ''
         )
-        db.session.add(destinatario)
+        parsed['destinatario'] = destinatario
     
     # Process all items
     itens = inf_nfe.findall('.//nfe:det', ns)
@@ -1098,8 +1249,7 @@ def parse_and_store_nfe_xml(xml_content):
         # Special elements for fuels, medicines, vehicles, etc.
         comb_elem = prod.find('.//nfe:comb', ns) if prod is not None else None
         
-        item = NFEItem(
-            nfe=nfe_data,
+        item = dict(
             numero_item=num_item,
             codigo=safe_text(prod, './/nfe:cProd') if prod is not None else '',
             codigo_ean=safe_text(prod, './/nfe:cEAN') if prod is not None else '',
@@ -1152,12 +1302,11 @@ def parse_and_store_nfe_xml(xml_content):
             # Additional info
             inf_ad_prod=safe_text(item_elem, './/nfe:infAdProd')
         )
-        db.session.add(item)
+        parsed['itens'].append(item)
     
     # Create transportadora record if present
     if transp_info is not None:
-        transportadora = NFETransportadora(
-            nfe=nfe_data,
+        transportadora = dict(
             cnpj=safe_text(transp_info, './/nfe:CNPJ'),
             cpf=safe_text(transp_info, './/nfe:CPF'),
             nome=safe_text(transp_info, './/nfe:xNome'),
@@ -1166,20 +1315,19 @@ def parse_and_store_nfe_xml(xml_content):
             municipio=safe_text(transp_info, './/nfe:xMun'),
             uf=safe_text(transp_info, './/nfe:UF')
         )
-        db.session.add(transportadora)
+        parsed['transportadora'] = transportadora
         
         # Add vehicle information if present
         veic_transp = transp.find('.//nfe:veicTransp', ns)
         if veic_transp is not None:
-            transportadora.placa = safe_text(veic_transp, './/nfe:placa')
-            transportadora.uf_veiculo = safe_text(veic_transp, './/nfe:UF')
-            transportadora.rntc = safe_text(veic_transp, './/nfe:RNTC')
+            transportadora['placa'] = safe_text(veic_transp, './/nfe:placa')
+            transportadora['uf_veiculo'] = safe_text(veic_transp, './/nfe:UF')
+            transportadora['rntc'] = safe_text(veic_transp, './/nfe:RNTC')
     
     # Add volume information if present
     vol_elems = transp.findall('.//nfe:vol', ns) if transp is not None else []
     for vol_elem in vol_elems:
-        volume = NFEVolume(
-            nfe=nfe_data,
+        volume = dict(
             quantidade=int(safe_text(vol_elem, './/nfe:qVol')) if safe_text(vol_elem, './/nfe:qVol') else 0,
             especie=safe_text(vol_elem, './/nfe:esp'),
             marca=safe_text(vol_elem, './/nfe:marca'),
@@ -1187,38 +1335,354 @@ def parse_and_store_nfe_xml(xml_content):
             peso_liquido=safe_float(vol_elem, './/nfe:pesoL'),
             peso_bruto=safe_float(vol_elem, './/nfe:pesoB')
         )
-        db.session.add(volume)
+        parsed['volumes'].append(volume)
     
     # Add payment information
     pag_elem = inf_nfe.find('.//nfe:pag', ns)
     if pag_elem is not None:
         for det_pag in pag_elem.findall('.//nfe:detPag', ns):
-            pagamento = NFEPagamento(
-                nfe=nfe_data,
+            pagamento = dict(
                 indicador=safe_text(det_pag, './/nfe:indPag'),
                 tipo=safe_text(det_pag, './/nfe:tPag'),
                 valor=safe_float(det_pag, './/nfe:vPag')
             )
-            db.session.add(pagamento)
+            parsed['pagamentos'].append(pagamento)
     
     # Add installment information (duplicatas)
     cobr_elem = inf_nfe.find('.//nfe:cobr', ns)
     if cobr_elem is not None:
         for dup_elem in cobr_elem.findall('.//nfe:dup', ns):
-            duplicata = NFEDuplicata(
-                nfe=nfe_data,
+            duplicata = dict(
                 numero=safe_text(dup_elem, './/nfe:nDup'),
                 data_vencimento=parse_date(safe_text(dup_elem, './/nfe:dVenc')),
                 valor=safe_float(dup_elem, './/nfe:vDup')
             )
-            db.session.add(duplicata)
+            parsed['duplicatas'].append(duplicata)
     
+    return parsed
+
+
+def build_nfe_records(parsed):
+    """Build an NFEData model with all its child records from parse_nfe_xml output (not yet added to the session)."""
+    from app.models import (
+        NFEData, NFEEmitente, NFEDestinatario, NFEItem,
+        NFETransportadora, NFEVolume, NFEPagamento, NFEDuplicata
+    )
+
+    nfe_data = NFEData(**parsed['nfe'])
+    if parsed['emitente'] is not None:
+        nfe_data.emitente = NFEEmitente(**parsed['emitente'])
+    if parsed['destinatario'] is not None:
+        nfe_data.destinatario = NFEDestinatario(**parsed['destinatario'])
+    if parsed['transportadora'] is not None:
+        nfe_data.transportadora = NFETransportadora(**parsed['transportadora'])
+    nfe_data.itens = [NFEItem(**item) for item in parsed['itens']]
+    nfe_data.volumes = [NFEVolume(**volume) for volume in parsed['volumes']]
+    nfe_data.pagamentos = [NFEPagamento(**pagamento) for pagamento in parsed['pagamentos']]
+    nfe_data.duplicatas = [NFEDuplicata(**duplicata) for duplicata in parsed['duplicatas']]
+    return nfe_data
+
+
+def parse_and_store_nfe_xml(xml_content):
+    """
+    Parse NFE XML content and store all data in the database
+    Returns the NFEData object
+    """
+    from app.models import NFEData
+
+    parsed = parse_nfe_xml(xml_content)
+
+    # Check if NFE already exists
+    existing_nfe = NFEData.query.filter_by(chave=parsed['chave']).first()
+    if existing_nfe:
+        return existing_nfe
+
+    nfe_data = build_nfe_records(parsed)
+
     # Add to database
     db.session.add(nfe_data)
+    increment_company_nfe_counts(
+        parsed['emitente']['cnpj'] if parsed['emitente'] else None,
+        parsed['destinatario']['cnpj'] if parsed['destinatario'] else None,
+    )
+    increment_nfe_monthly_rollups([parsed['nfe']])
     db.session.commit()
+
+    from app.danfe_cache import schedule_prerender
+    schedule_prerender(nfe_data.chave, xml_content)
     
     return nfe_data
 
+
+def _parse_nfe_archive_entry(filename, data):
+    """Process-pool worker: parse one NFe XML from an archive. Returns (filename, parsed, error)."""
+    try:
+        try:
+            xml_content = data.decode('utf-8')
+        except UnicodeDecodeError:
+            xml_content = data.decode('latin-1')
+        parsed = parse_nfe_xml(xml_content)
+        if not parsed['chave']:
+            return filename, None, 'NFe access key (infNFe Id) not found'
+        return filename, parsed, None
+    except Exception as e:
+        return filename, None, f'Invalid NFe XML: {e}'
+
+
+def _store_nfe_batch(batch, results):
+    """Insert a batch of parsed NFes in one transaction, skipping chaves that already exist."""
+    from app.models import NFEData
+    from app.danfe_cache import schedule_prerender
+
+    chaves = [parsed['chave'] for _, parsed in batch]
+    existing = {
+        chave for (chave,) in db.session.query(NFEData.chave).filter(NFEData.chave.in_(chaves)).all()
+    }
+
+    new_entries = []
+    for filename, parsed in batch:
+        if parsed['chave'] in existing:
+            results['successful'].append({'filename': filename, 'chave': parsed['chave'], 'status': 'already_exists'})
+        else:
+            new_entries.append((filename, parsed))
+
+    if not new_entries:
+        return
+
+    try:
+        db.session.add_all([build_nfe_records(parsed) for _, parsed in new_entries])
+        increment_company_nfe_counts_bulk([
+            (
+                parsed['emitente']['cnpj'] if parsed['emitente'] else None,
+                parsed['destinatario']['cnpj'] if parsed['destinatario'] else None,
+            )
+            for _, parsed in new_entries
+        ])
+        increment_nfe_monthly_rollups([parsed['nfe'] for _, parsed in new_entries])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        if len(new_entries) == 1:
+            results['failed'].append({'filename': new_entries[0][0], 'reason': str(e)})
+            return
+        # Isolate the offending file(s) by retrying one by one
+        for entry in new_entries:
+            _store_nfe_batch([entry], results)
+        return
+
+    for filename, parsed in new_entries:
+        results['successful'].append({'filename': filename, 'chave': parsed['chave'], 'status': 'imported'})
+        schedule_prerender(parsed['chave'], parsed['nfe']['xml_content'])
+
+
+def import_nfe_archive(file_obj, workers=None, batch_size=None, max_entry_bytes=None):
+    """
+    Import a ZIP archive of NFe XMLs.
+
+    Entries are read from the archive one at a time (nothing is extracted to disk), parsed in a
+    process pool and inserted in batches of batch_size NFes per transaction. NFes whose chave is
+    already stored are reported as 'already_exists'.
+
+    Returns:
+        dict: {'successful': [...], 'failed': [...], 'total_processed': int}
+    """
+    import zipfile
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    config = current_app.config if has_app_context() else {}
+    workers = workers or int(config.get('NFE_IMPORT_WORKERS') or os.cpu_count() or 1)
+    batch_size = batch_size or int(config.get('NFE_IMPORT_BATCH_SIZE', 200))
+    max_entry_bytes = max_entry_bytes or int(config.get('NFE_IMPORT_MAX_ENTRY_MB', 10)) * 1024 * 1024
+
+    results = {'successful': [], 'failed': [], 'total_processed': 0}
+    batch = []
+    seen_chaves = set()
+
+    def handle(filename, parsed, error):
+        if error:
+            results['failed'].append({'filename': filename, 'reason': error})
+            return
+        if parsed['chave'] in seen_chaves:
+            results['successful'].append({'filename': filename, 'chave': parsed['chave'], 'status': 'duplicate_in_archive'})
+            return
+        seen_chaves.add(parsed['chave'])
+        batch.append((filename, parsed))
+        if len(batch) >= batch_size:
+            _store_nfe_batch(batch, results)
+            batch.clear()
+
+    def entries(archive):
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            results['total_processed'] += 1
+            if not info.filename.lower().endswith('.xml'):
+                results['failed'].append({'filename': info.filename, 'reason': 'Must be XML format'})
+                continue
+            if info.file_size > max_entry_bytes:
+                results['failed'].append({'filename': info.filename, 'reason': 'File exceeds size limit'})
+                continue
+            yield info.filename, archive.read(info)
+
+    with zipfile.ZipFile(file_obj) as archive:
+        if workers <= 1:
+            for filename, data in entries(archive):
+                handle(*_parse_nfe_archive_entry(filename, data))
+        else:
+            # Keep a bounded number of entries in flight so memory stays flat for large archives
+            max_in_flight = workers * 4
+            in_flight = deque()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                for filename, data in entries(archive):
+                    in_flight.append(pool.submit(_parse_nfe_archive_entry, filename, data))
+                    if len(in_flight) >= max_in_flight:
+                        handle(*in_flight.popleft().result())
+                while in_flight:
+                    handle(*in_flight.popleft().result())
+
+    if batch:
+        _store_nfe_batch(batch, results)
+
+    return results
+
+
+def _upsert_insert(table):
+    """Dialect-specific INSERT supporting on_conflict_do_update (PostgreSQL and SQLite)."""
+    if db.engine.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def increment_company_nfe_counts(emit_cnpj, dest_cnpj):
+    """
+    Add one NFe to the per-CNPJ counters in the current transaction.
+    The caller commits together with the NFe itself, so counters never drift from nfe_data.
+    """
+    increment_company_nfe_counts_bulk([(emit_cnpj, dest_cnpj)])
+
+
+def increment_company_nfe_counts_bulk(parties):
+    """Add a batch of NFes, given as (emit_cnpj, dest_cnpj) pairs, to the per-CNPJ counters."""
+    from app.models import CompanyNFECount
+
+    deltas = {}
+    for emit_cnpj, dest_cnpj in parties:
+        nfe_cnpjs = set()
+        for cnpj, column in ((emit_cnpj, 'emitente_count'), (dest_cnpj, 'destinatario_count')):
+            cnpj = ''.join(filter(str.isdigit, cnpj or ''))
+            if not cnpj:
+                continue
+            delta = deltas.setdefault(cnpj, {'emitente_count': 0, 'destinatario_count': 0, 'total_count': 0})
+            delta[column] += 1
+            if cnpj not in nfe_cnpjs:
+                delta['total_count'] += 1
+                nfe_cnpjs.add(cnpj)
+
+    table = CompanyNFECount.__table__
+    for cnpj, delta in deltas.items():
+        stmt = _upsert_insert(table).values(cnpj=cnpj, updated_at=datetime.now(), **delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.cnpj],
+            set_={
+                'emitente_count': table.c.emitente_count + stmt.excluded.emitente_count,
+                'destinatario_count': table.c.destinatario_count + stmt.excluded.destinatario_count,
+                'total_count': table.c.total_count + stmt.excluded.total_count,
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+        db.session.execute(stmt)
+
+
+def increment_nfe_monthly_rollups(nfes):
+    """Add a batch of NFes (parse_nfe_xml 'nfe' dicts) to the per-month counters; NFes without a date are left out."""
+    from app.models import NFEMonthlyRollup
+
+    deltas = {}
+    for nfe in nfes:
+        emitted = nfe.get('data_emissao')
+        if emitted is None:
+            continue
+        delta = deltas.setdefault((emitted.year, emitted.month), {'nfe_count': 0, 'total_value': 0.0})
+        delta['nfe_count'] += 1
+        delta['total_value'] += nfe.get('valor_total') or 0
+
+    table = NFEMonthlyRollup.__table__
+    for (year, month), delta in deltas.items():
+        stmt = _upsert_insert(table).values(year=year, month=month, updated_at=datetime.now(), **delta)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.year, table.c.month],
+            set_={
+                'nfe_count': table.c.nfe_count + stmt.excluded.nfe_count,
+                'total_value': table.c.total_value + stmt.excluded.total_value,
+                'updated_at': stmt.excluded.updated_at,
+            }
+        )
+        db.session.execute(stmt)
+
+
+def nfe_rollup_rows(start=None, end=None):
+    """
+    nfe_monthly_rollups rows (year, month, nfe_count, total_value) aggregated from nfe_data, for the
+    NFes emitted in [start, end) when given. Used to rebuild the rollups and to read partial months.
+    """
+    from sqlalchemy import Integer, cast, extract, func
+    from app.models import NFEData
+
+    year = cast(extract('year', NFEData.data_emissao), Integer)
+    month = cast(extract('month', NFEData.data_emissao), Integer)
+    rows = select(
+        year.label('year'), month.label('month'),
+        func.count(NFEData.id).label('nfe_count'),
+        func.coalesce(func.sum(NFEData.valor_total), 0).label('total_value'),
+    ).where(NFEData.data_emissao.isnot(None)).group_by(year, month)
+    if start is not None:
+        rows = rows.where(NFEData.data_emissao >= start)
+    if end is not None:
+        rows = rows.where(NFEData.data_emissao < end)
+    return rows
+
+
+def rebuild_nfe_monthly_rollups():
+    """Recompute nfe_monthly_rollups from nfe_data in one set-based statement."""
+    from sqlalchemy import func
+    from app.models import NFEMonthlyRollup
+
+    db.session.execute(delete(NFEMonthlyRollup))
+    db.session.execute(insert(NFEMonthlyRollup).from_select(
+        ['year', 'month', 'nfe_count', 'total_value', 'updated_at'],
+        nfe_rollup_rows().add_columns(func.now())
+    ))
+    db.session.commit()
+
+
+def rebuild_company_nfe_counts():
+    """Recompute company_nfe_counts from the NFe tables in one set-based statement."""
+    from sqlalchemy import text
+
+    db.session.execute(text('DELETE FROM company_nfe_counts'))
+    db.session.execute(text("""
+        INSERT INTO company_nfe_counts (cnpj, emitente_count, destinatario_count, total_count, updated_at)
+        SELECT cnpj,
+               SUM(is_emitente),
+               SUM(is_destinatario),
+               COUNT(DISTINCT nfe_id),
+               CURRENT_TIMESTAMP
+        FROM (
+            SELECT cnpj, nfe_id, 1 AS is_emitente, 0 AS is_destinatario
+            FROM nfe_emitentes WHERE cnpj IS NOT NULL AND cnpj <> ''
+            UNION ALL
+            SELECT cnpj, nfe_id, 0 AS is_emitente, 1 AS is_destinatario
+            FROM nfe_destinatarios WHERE cnpj IS NOT NULL AND cnpj <> ''
+        ) parties
+        GROUP BY cnpj
+    """))
+    db.session.commit()
+
+
 def check_order_fulfillment(order_id):
     """Check if all items in a purchase order are fulfilled or fully canceled."""
 
@@ -1255,82 +1719,385 @@ def check_order_fulfillment(order_id):
 
     return True
 
-def check_order_fulfillment_memory(items_data):
-    """Check fulfillment based on item data dicts."""
-    if not items_data:
-        return False
+def refresh_order_fulfillment(order_ids=None, chunk_size=5000):
+    """
+    Recompute purchase_orders.is_fulfilled with one set-based UPDATE per chunk of orders.
 
-    for item in items_data:
-        quantity = item.get('quantidade')
-        if quantity is None:
-            return False
-        if quantity <= 0:
-            continue
+    Same rule as check_order_fulfillment: an order is fulfilled when it has items and every item with
+    a positive quantity is covered by attended + canceled + tolerance-canceled quantities (an item
+    without quantity keeps it pending). order_ids=None recomputes every order. Only rows whose status
+    actually changes are written. The caller commits. Returns the number of orders updated.
+    """
+    from sqlalchemy import and_, case, func, or_, select, update
+
+    coalesce = lambda column: func.coalesce(column, 0)
+    pending_item = case(
+        (or_(
+            PurchaseItem.quantidade.is_(None),
+            and_(
+                PurchaseItem.quantidade > 0,
+                coalesce(PurchaseItem.qtde_atendida) + coalesce(PurchaseItem.qtde_canc)
+                + coalesce(PurchaseItem.qtde_canc_toler) < PurchaseItem.quantidade
+            ),
+        ), 1),
+        else_=0
+    )
 
-        attended = item.get('qtde_atendida') or 0.0
-        canceled = item.get('qtde_canc') or 0.0
-        canceled_tolerance = item.get('qtde_canc_toler') or 0.0
-        total_canceled = canceled + canceled_tolerance
+    def refresh(scope):
+        status = select(
+            PurchaseOrder.id.label('order_id'),
+            and_(func.count(PurchaseItem.id) > 0, func.sum(pending_item) == 0).label('fulfilled')
+        ).select_from(PurchaseOrder)\
+         .outerjoin(PurchaseItem, PurchaseItem.purchase_order_id == PurchaseOrder.id)\
+         .group_by(PurchaseOrder.id)
+        if scope is not None:
+            status = status.where(PurchaseOrder.id.in_(scope))
+        status = status.subquery()
 
-        if attended >= quantity:
-            continue
-        if total_canceled >= quantity:
-            continue
-        if attended + total_canceled >= quantity:
-            continue
+        stmt = update(PurchaseOrder)\
+            .where(PurchaseOrder.id == status.c.order_id)\
+            .where(PurchaseOrder.is_fulfilled.is_distinct_from(status.c.fulfilled))\
+            .values(is_fulfilled=status.c.fulfilled)\
+            .execution_options(synchronize_session=False)
+        return db.session.execute(stmt).rowcount
 
-        return False
+    if order_ids is None:
+        return refresh(None)
 
-    return True
+    order_ids = sorted(set(order_ids))
+    return sum(refresh(order_ids[start:start + chunk_size]) for start in range(0, len(order_ids), chunk_size))
 
 
-def relink_purchase_item_nfe_matches():
+def refresh_order_summaries(order_ids=None, chunk_size=5000):
+    """
+    Recompute the derived summary columns of purchase_orders so that read endpoints only project them:
+
+    - item_count: number of items;
+    - items_total: sum of the totals of every item, canceled ones included;
+    - effective_total_excl_cancelled: sum of the totals of items not fully canceled (quantidade > qtde_canc);
+    - received_qty_ratio: received quantity in the purchase_item_receipts ledger over ordered quantity
+      (NULL when no item has a quantity);
+    - adjusted_total: apply_adjustments(total_pedido_com_ipi) + vlr_frete_tra, unrounded (the category
+      report rounds it to cents).
+
+    The item aggregates, and adjusted_total for orders without adjustments, come from one set-based
+    UPDATE per chunk. Adjustments compound in order (a percentage applies to the running value), so
+    orders that have them are folded with apply_adjustments from a single query per chunk and written
+    with one bulk UPDATE. Only rows whose values change are written. The caller commits.
+    order_ids=None recomputes every order. Returns the number of row updates written.
+    """
+    from sqlalchemy import case, exists, func
+
+    coalesce = lambda column: func.coalesce(column, 0)
+    has_adjustments = exists().where(PurchaseAdjustment.purchase_order_id == PurchaseOrder.id)
+    base_total = coalesce(PurchaseOrder.total_pedido_com_ipi) + coalesce(PurchaseOrder.vlr_frete_tra)
+
+    def refresh(scope):
+        received = select(
+            PurchaseItem.purchase_order_id.label('order_id'),
+            func.sum(PurchaseItemReceipt.quantity).label('quantity'),
+        ).join(PurchaseItemReceipt, PurchaseItemReceipt.purchase_item_id == PurchaseItem.id)\
+         .group_by(PurchaseItem.purchase_order_id)
+        if scope is not None:
+            received = received.where(PurchaseItem.purchase_order_id.in_(scope))
+        received = received.subquery()
+
+        summary = select(
+            PurchaseOrder.id.label('order_id'),
+            func.count(PurchaseItem.id).label('item_count'),
+            coalesce(func.sum(PurchaseItem.total)).label('items_total'),
+            coalesce(func.sum(case(
+                (coalesce(PurchaseItem.quantidade) > coalesce(PurchaseItem.qtde_canc), coalesce(PurchaseItem.total)),
+                else_=0
+            ))).label('effective_total'),
+            (
+                coalesce(func.max(received.c.quantity))
+                / func.nullif(func.sum(case((PurchaseItem.quantidade > 0, PurchaseItem.quantidade), else_=0)), 0)
+            ).label('received_ratio'),
+        ).select_from(PurchaseOrder)\
+         .outerjoin(PurchaseItem, PurchaseItem.purchase_order_id == PurchaseOrder.id)\
+         .outerjoin(received, received.c.order_id == PurchaseOrder.id)\
+         .group_by(PurchaseOrder.id)
+        if scope is not None:
+            summary = summary.where(PurchaseOrder.id.in_(scope))
+        summary = summary.subquery()
+
+        # Orders with adjustments keep their adjusted_total here; it is folded below
+        adjusted = case((has_adjustments, PurchaseOrder.adjusted_total), else_=base_total)
+        stmt = update(PurchaseOrder)\
+            .where(PurchaseOrder.id == summary.c.order_id)\
+            .where(or_(
+                PurchaseOrder.item_count.is_distinct_from(summary.c.item_count),
+                PurchaseOrder.items_total.is_distinct_from(summary.c.items_total),
+                PurchaseOrder.effective_total_excl_cancelled.is_distinct_from(summary.c.effective_total),
+                PurchaseOrder.received_qty_ratio.is_distinct_from(summary.c.received_ratio),
+                PurchaseOrder.adjusted_total.is_distinct_from(adjusted),
+            ))\
+            .values(
+                item_count=summary.c.item_count,
+                items_total=summary.c.items_total,
+                effective_total_excl_cancelled=summary.c.effective_total,
+                received_qty_ratio=summary.c.received_ratio,
+                adjusted_total=adjusted,
+            )\
+            .execution_options(synchronize_session=False)
+        count = db.session.execute(stmt).rowcount
+
+        adjustments = select(PurchaseAdjustment).order_by(
+            PurchaseAdjustment.purchase_order_id, PurchaseAdjustment.order_index, PurchaseAdjustment.id
+        )
+        if scope is not None:
+            adjustments = adjustments.where(PurchaseAdjustment.purchase_order_id.in_(scope))
+        adjustments_by_order = defaultdict(list)
+        for adjustment in db.session.execute(adjustments).scalars():
+            adjustments_by_order[adjustment.purchase_order_id].append(adjustment)
+        if not adjustments_by_order:
+            return count
+
+        changed = []
+        orders = db.session.execute(
+            select(PurchaseOrder.id, PurchaseOrder.total_pedido_com_ipi, PurchaseOrder.vlr_frete_tra,
+                   PurchaseOrder.adjusted_total)
+            .where(PurchaseOrder.id.in_(list(adjustments_by_order)))
+        )
+        for order in orders:
+            total = apply_adjustments(order.total_pedido_com_ipi or 0, adjustments_by_order[order.id])\
+                + (order.vlr_frete_tra or 0)
+            if order.adjusted_total != total:
+                changed.append({'id': order.id, 'adjusted_total': total})
+        if changed:
+            db.session.execute(update(PurchaseOrder), changed)
+        return count + len(changed)
+
+    if order_ids is None:
+        return refresh(None)
+
+    order_ids = sorted(set(order_ids))
+    return sum(refresh(order_ids[start:start + chunk_size]) for start in range(0, len(order_ids), chunk_size))
+
+
+def link_item_receipts(order_ids=None, chunk_size=5000):
+    """
+    Point purchase_item_receipts at their items through (cod_emp1, cod_pedc, linha), with one
+    UPDATE ... FROM purchase_items per chunk of orders. Run after items are (re)created, e.g. by a
+    RUAH import. order_ids=None links against every item. The caller commits. Returns the number
+    of receipts linked.
+    """
+    def link(scope):
+        stmt = update(PurchaseItemReceipt)\
+            .where(PurchaseItem.cod_emp1 == PurchaseItemReceipt.cod_emp1)\
+            .where(PurchaseItem.cod_pedc == PurchaseItemReceipt.cod_pedc)\
+            .where(PurchaseItem.linha == PurchaseItemReceipt.linha)\
+            .where(PurchaseItemReceipt.purchase_item_id.is_distinct_from(PurchaseItem.id))\
+            .values(purchase_item_id=PurchaseItem.id)\
+            .execution_options(synchronize_session=False)
+        if scope is not None:
+            stmt = stmt.where(PurchaseItem.purchase_order_id.in_(scope))
+        return db.session.execute(stmt).rowcount
+
+    if order_ids is None:
+        return link(None)
+
+    order_ids = sorted(set(order_ids))
+    return sum(link(order_ids[start:start + chunk_size]) for start in range(0, len(order_ids), chunk_size))
+
+
+RECEIPT_UPDATE_COLUMNS = ['cod_emp1', 'cod_pedc', 'linha', 'num_nf', 'dt_ent', 'quantity']
+
+_receipt_quantity = lenient(decimal)
+_receipt_line = lenient(int)
+
+
+def refresh_item_receipts(order_keys=None, chunk_size=IMPORT_UPSERT_CHUNK_SIZE):
+    """
+    Derive the typed received-quantity ledger (purchase_item_receipts) from nf_entries.
+
+    NFEntry keeps qtde and linha as the text Focco and the RPDC0250C report deliver. They are parsed
+    once here (decimal comma; malformed values become NULL) so that received quantities can be summed,
+    and joined on purchase_item_id, in SQL. order_keys restricts the refresh to the entries of those
+    (cod_emp1, cod_pedc) orders; None rebuilds the whole ledger. Receipts are upserted on nf_entry_id,
+    receipts whose entry is gone are deleted and the scope's receipts are linked to their items.
+
+    The caller commits. Returns the ids of the orders in scope (None for a full rebuild), for
+    refresh_order_summaries.
+    """
+    from sqlalchemy import exists
+
+    def refresh(scope):
+        stale = delete(PurchaseItemReceipt)\
+            .where(~exists().where(NFEntry.id == PurchaseItemReceipt.nf_entry_id))\
+            .execution_options(synchronize_session=False)
+        entries = select(
+            NFEntry.id, NFEntry.cod_emp1, NFEntry.cod_pedc, NFEntry.linha, NFEntry.num_nf, NFEntry.dt_ent, NFEntry.qtde
+        )
+        if scope is not None:
+            stale = stale.where(tuple_(PurchaseItemReceipt.cod_emp1, PurchaseItemReceipt.cod_pedc).in_(scope))
+            entries = entries.where(tuple_(NFEntry.cod_emp1, NFEntry.cod_pedc).in_(scope))
+        db.session.execute(stale)
+
+        result = db.session.execute(entries.execution_options(yield_per=chunk_size))
+        for batch in result.partitions():
+            bulk_merge(PurchaseItemReceipt, [
+                {
+                    'nf_entry_id': entry.id,
+                    'cod_emp1': entry.cod_emp1,
+                    'cod_pedc': entry.cod_pedc,
+                    'linha': _receipt_line(entry.linha) if entry.linha else None,
+                    'num_nf': entry.num_nf,
+                    'dt_ent': entry.dt_ent,
+                    'quantity': _receipt_quantity(entry.qtde) if entry.qtde else None,
+                }
+                for entry in batch
+            ], ['nf_entry_id'], RECEIPT_UPDATE_COLUMNS)
+
+    if order_keys is None:
+        refresh(None)
+        link_item_receipts()
+        return None
+
+    order_keys = sorted(set(order_keys))
+    order_ids = []
+    for start in range(0, len(order_keys), chunk_size):
+        scope = order_keys[start:start + chunk_size]
+        refresh(scope)
+        order_ids.extend(db.session.scalars(
+            select(PurchaseOrder.id).where(tuple_(PurchaseOrder.cod_emp1, PurchaseOrder.cod_pedc).in_(scope))
+        ))
+    link_item_receipts(order_ids)
+    return order_ids
+
+
+def _month_range(year, month):
+    """[first day, first day of the next month) of a (year, month) pair."""
+    start = date(year, month, 1)
+    return start, date(year + month // 12, month % 12 + 1, 1)
+
+
+def order_months(order_ids, chunk_size=5000):
+    """The (year, month) emission periods of the given orders, for refresh_purchase_rollups."""
+    from sqlalchemy import extract
+
+    order_ids = sorted(set(order_ids))
+    months = set()
+    for start in range(0, len(order_ids), chunk_size):
+        rows = db.session.execute(
+            select(extract('year', PurchaseOrder.dt_emis), extract('month', PurchaseOrder.dt_emis))
+            .where(PurchaseOrder.id.in_(order_ids[start:start + chunk_size]))
+            .distinct()
+        )
+        months.update((int(year), int(month)) for year, month in rows)
+    return months
+
+
+PURCHASE_ROLLUP_COLUMNS = (
+    'year', 'month', 'cod_emp1', 'func_nome', 'fornecedor_id', 'fornecedor_descricao',
+    'order_count', 'fulfilled_count', 'total_value', 'item_count', 'total_quantity',
+)
+
+
+def purchase_rollup_rows(start=None, end=None):
+    """
+    purchase_monthly_rollups rows (PURCHASE_ROLLUP_COLUMNS, in order) aggregated from the orders
+    emitted in [start, end), or from every order. Each row covers one (year, month, cod_emp1,
+    func_nome, fornecedor_id): order count, fulfilled orders, total_pedido_com_ipi, items (the
+    maintained item_count) and item quantity.
+    """
+    from sqlalchemy import Integer, case, cast, extract, func
+
+    in_period = []
+    if start is not None:
+        in_period.append(PurchaseOrder.dt_emis >= start)
+    if end is not None:
+        in_period.append(PurchaseOrder.dt_emis < end)
+
+    year = cast(extract('year', PurchaseOrder.dt_emis), Integer)
+    month = cast(extract('month', PurchaseOrder.dt_emis), Integer)
+    quantities = select(
+        PurchaseItem.purchase_order_id.label('order_id'),
+        func.sum(PurchaseItem.quantidade).label('quantity'),
+    ).join(PurchaseOrder, PurchaseOrder.id == PurchaseItem.purchase_order_id)\
+     .where(*in_period)\
+     .group_by(PurchaseItem.purchase_order_id)\
+     .subquery()
+    return select(
+        year.label('year'), month.label('month'), PurchaseOrder.cod_emp1, PurchaseOrder.func_nome,
+        PurchaseOrder.fornecedor_id,
+        func.max(PurchaseOrder.fornecedor_descricao).label('fornecedor_descricao'),
+        func.count(PurchaseOrder.id).label('order_count'),
+        func.sum(case((PurchaseOrder.is_fulfilled == True, 1), else_=0)).label('fulfilled_count'),
+        func.coalesce(func.sum(PurchaseOrder.total_pedido_com_ipi), 0).label('total_value'),
+        func.coalesce(func.sum(PurchaseOrder.item_count), 0).label('item_count'),
+        func.coalesce(func.sum(func.coalesce(quantities.c.quantity, 0)), 0).label('total_quantity'),
+    ).select_from(PurchaseOrder)\
+     .outerjoin(quantities, quantities.c.order_id == PurchaseOrder.id)\
+     .where(*in_period)\
+     .group_by(year, month, PurchaseOrder.cod_emp1, PurchaseOrder.func_nome, PurchaseOrder.fornecedor_id)
+
+
+def refresh_purchase_rollups(months=None):
+    """
+    Rebuild purchase_monthly_rollups for the given (year, month) periods, or for every period when
+    months is None, with one DELETE and one INSERT ... SELECT (purchase_rollup_rows) per period.
+
+    item_count comes from the maintained order column, so run after refresh_order_summaries. An
+    order whose dt_emis moves to another month leaves its old period stale until that period is
+    refreshed again. The caller commits. Returns the number of rollup rows written.
+    """
+    def rebuild(period):
+        stale = delete(PurchaseMonthlyRollup)
+        if period is None:
+            rows = purchase_rollup_rows()
+        else:
+            rows = purchase_rollup_rows(*_month_range(*period))
+            stale = stale.where(PurchaseMonthlyRollup.year == period[0], PurchaseMonthlyRollup.month == period[1])
+
+        db.session.execute(stale.execution_options(synchronize_session=False))
+        return db.session.execute(
+            insert(PurchaseMonthlyRollup).from_select(list(PURCHASE_ROLLUP_COLUMNS), rows)
+        ).rowcount
+
+    if months is None:
+        return rebuild(None)
+    return sum(rebuild(period) for period in sorted(set(months)))
+
+
+def relink_purchase_item_nfe_matches(order_ids=None, chunk_size=5000):
     """
     Re-link PurchaseItemNFEMatch records to newly created PurchaseItem records.
-    
-    This function finds all PurchaseItemNFEMatch records with purchase_item_id = NULL
-    and attempts to link them back to PurchaseItem records using the business keys:
-    cod_pedc, cod_emp1, and item_seq (which maps to linha).
-    
-    Should be called after import_ruah to restore the relationships.
+
+    Matches with purchase_item_id = NULL are linked back to PurchaseItem records through the
+    business keys (cod_pedc, cod_emp1, and item_seq, which maps to linha) with one
+    UPDATE ... FROM purchase_items per chunk. order_ids restricts it to the items of those
+    orders (the ones an import touched); None relinks against every order.
+
+    Should be called after import_ruah to restore the relationships. Returns the number of
+    matches relinked.
     """
-    unlinked_matches = PurchaseItemNFEMatch.query.filter(
-        PurchaseItemNFEMatch.purchase_item_id.is_(None)
-    ).all()
-    
-    if not unlinked_matches:
-        return 0
-    
-    relinked_count = 0
-    
-    from collections import defaultdict
-    matches_by_order = defaultdict(list)
-    
-    for match in unlinked_matches:
-        key = (match.cod_pedc, match.cod_emp1)
-        matches_by_order[key].append(match)
-    
-    for (cod_pedc, cod_emp1), matches in matches_by_order.items():
-        purchase_items = PurchaseItem.query.filter_by(
-            cod_pedc=cod_pedc,
-            cod_emp1=cod_emp1
-        ).all()
-        
-        if not purchase_items:
-            continue
-        
-        items_by_linha = {item.linha: item for item in purchase_items}
-        
-        for match in matches:
-            purchase_item = items_by_linha.get(match.item_seq)
-            
-            if purchase_item:
-                match.purchase_item_id = purchase_item.id
-                relinked_count += 1
-    
+    from sqlalchemy import update
+
+    def relink(scope):
+        stmt = update(PurchaseItemNFEMatch)\
+            .where(PurchaseItemNFEMatch.purchase_item_id.is_(None))\
+            .where(PurchaseItem.cod_pedc == PurchaseItemNFEMatch.cod_pedc)\
+            .where(PurchaseItem.cod_emp1 == PurchaseItemNFEMatch.cod_emp1)\
+            .where(PurchaseItem.linha == PurchaseItemNFEMatch.item_seq)\
+            .values(purchase_item_id=PurchaseItem.id)\
+            .execution_options(synchronize_session=False)
+        if scope is not None:
+            stmt = stmt.where(PurchaseItem.purchase_order_id.in_(scope))
+        return db.session.execute(stmt).rowcount
+
+    if order_ids is None:
+        relinked_count = relink(None)
+    else:
+        order_ids = sorted(set(order_ids))
+        relinked_count = sum(
+            relink(order_ids[start:start + chunk_size]) for start in range(0, len(order_ids), chunk_size)
+        )
+
     if relinked_count > 0:
         db.session.commit()
-    
+
     return relinked_count
 
 
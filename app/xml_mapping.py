@@ -0,0 +1,73 @@
+"""
+Declarative field mapping for the FoccoERP XML reports.
+
+Each record type (a RUAH order, an RPDC0250C NF line, an RCOT0300 item...) is
+described once as a list of Field specs: the output key, the child tags it may
+come from (first alias present wins), a converter and a default. The mapping
+is compiled into a tag lookup table, so reading an element is a single pass
+over its direct children instead of one or more find() calls per field.
+"""
+
+
+def decimal(text):
+    """Focco numbers use a decimal comma."""
+    return float(text.replace(',', '.'))
+
+
+def lenient(convert):
+    """Wrap a converter so that malformed values become None instead of failing the import."""
+    def wrapper(text):
+        try:
+            return convert(text)
+        except (ValueError, AttributeError):
+            return None
+    return wrapper
+
+
+class Field:
+    """One output key read from the first present child among tags."""
+
+    __slots__ = ('name', 'tags', 'convert', 'default')
+
+    def __init__(self, name, *tags, convert=None, default=None):
+        self.name = name
+        self.tags = tags
+        self.convert = convert
+        self.default = default
+
+
+class RecordMapping:
+    """A compiled set of Field specs turning an element's children into a dict."""
+
+    def __init__(self, *fields):
+        self.fields = fields
+        # Single-tag fields (the common case) skip the alias loop
+        self._specs = tuple(
+            (field.name, field.tags[0] if len(field.tags) == 1 else None, field.tags, field.convert, field.default)
+            for field in fields
+        )
+
+    def read(self, element):
+        """
+        Map the direct children of element. Missing and empty children get the field default;
+        the converter only sees non-empty text.
+        """
+        # Reversed so that, like find(), the first of repeated tags wins
+        texts = {child.tag: child.text for child in reversed(element)}
+        record = {}
+        for name, tag, tags, convert, default in self._specs:
+            if tag is not None:
+                text = texts.get(tag)
+            else:
+                text = None
+                for alias in tags:
+                    if alias in texts:
+                        text = texts[alias]
+                        break
+            if not text:
+                record[name] = default
+            elif convert is not None:
+                record[name] = convert(text)
+            else:
+                record[name] = text
+        return record
@@ -28,5 +28,26 @@ class Config:
     MAIL_USERNAME = os.getenv('MAIL_USERNAME')
     MAIL_PASSWORD = os.getenv('MAIL_PASSWORD')
 
+    DANFE_CACHE_DIR = os.getenv('DANFE_CACHE_DIR')  # Padrão: <tempdir>/danfe_cache
+    DANFE_CACHE_MAX_MB = int(os.getenv('DANFE_CACHE_MAX_MB', 512))
+    DANFE_PRERENDER = os.getenv('DANFE_PRERENDER', 'false').lower() == 'true'
+    DANFE_PRERENDER_WORKERS = int(os.getenv('DANFE_PRERENDER_WORKERS', 2))
+    NFE_RESPONSE_CACHE_SIZE = int(os.getenv('NFE_RESPONSE_CACHE_SIZE', 512))
+
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_MAX_PER_KEY = int(os.getenv('JOB_MAX_PER_KEY', 1))  # Jobs simultâneos por chave (ex.: por CNPJ)
+    JOB_STREAM_POLL_SECONDS = float(os.getenv('JOB_STREAM_POLL_SECONDS', 1))
+    JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', 30))
+    JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', 300))  # Job 'running' sem heartbeat há mais tempo é dado como órfão
+    JOBS_EAGER = os.getenv('JOBS_EAGER', 'false').lower() == 'true'  # Executa jobs na própria requisição (testes)
+
+    NFE_IMPORT_WORKERS = int(os.getenv('NFE_IMPORT_WORKERS', 0))  # 0 = um processo por CPU
+    NFE_IMPORT_BATCH_SIZE = int(os.getenv('NFE_IMPORT_BATCH_SIZE', 200))
+    NFE_IMPORT_MAX_ENTRY_MB = int(os.getenv('NFE_IMPORT_MAX_ENTRY_MB', 10))
+    RUAH_IMPORT_BATCH_SIZE = int(os.getenv('RUAH_IMPORT_BATCH_SIZE', 500))  # pedidos gravados por lote na importação RUAH
+    XML_IMPORT_WORKERS = int(os.getenv('XML_IMPORT_WORKERS', 0))  # /api/import?async=0: 0 = um processo por CPU
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # Usado quando o chunk chega sem offset
+    UPLOAD_MAX_MB = int(os.getenv('UPLOAD_MAX_MB', 2048))  # Tamanho máximo de um arquivo enviado por /api/upload_chunk
+
     
     
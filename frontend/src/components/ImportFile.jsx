@@ -4,6 +4,7 @@ import "./ImportFile.css";
 
 const CHUNK_SIZE = 1024 * 1024; // 1MB
 const ALLOWED_EXTENSIONS = ["xml"];
+const JOB_POLL_INTERVAL = 1500;
 
 const STATUS_LABELS = {
   pending: "Na fila",
@@ -147,12 +148,31 @@ const ImportFile = () => {
     notify("Arquivo marcado para reenvio.", "info");
   };
 
-  const uploadChunk = async (chunk, chunkIndex, totalChunks, fileId) => {
+  const sha256Hex = async (blob) => {
+    // crypto.subtle is only available in secure contexts (HTTPS or localhost)
+    if (!window.crypto?.subtle) return null;
+    const digest = await window.crypto.subtle.digest(
+      "SHA-256",
+      await blob.arrayBuffer()
+    );
+    return Array.from(new Uint8Array(digest))
+      .map((byte) => byte.toString(16).padStart(2, "0"))
+      .join("");
+  };
+
+  const uploadChunk = async (chunk, chunkIndex, totalChunks, fileId, file) => {
     const formData = new FormData();
     formData.append("file", chunk);
     formData.append("chunkIndex", chunkIndex);
     formData.append("totalChunks", totalChunks);
     formData.append("fileId", fileId);
+    formData.append("offset", chunkIndex * CHUNK_SIZE);
+    formData.append("totalSize", file.size);
+
+    const checksum = await sha256Hex(chunk);
+    if (checksum) {
+      formData.append("checksum", checksum);
+    }
 
     try {
       await axios.post(
@@ -175,6 +195,37 @@ const ImportFile = () => {
     }
   };
 
+  const describeJobProgress = (progress = {}) => {
+    if (progress.phase === "relinking") {
+      return "Vinculando notas fiscais aos pedidos...";
+    }
+    if (!progress.orders && !progress.items) {
+      return "Arquivo enviado. Processando informação...";
+    }
+    const rate = progress.orders_per_second
+      ? ` (${progress.orders_per_second} pedidos/s)`
+      : "";
+    return `Processando: ${progress.orders} pedidos, ${progress.items} itens${rate}`;
+  };
+
+  const waitForImportJob = async (fileId, job) => {
+    let current = job;
+    while (!["completed", "failed"].includes(current.status)) {
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+      const response = await axios.get(
+        `${import.meta.env.VITE_API_URL}/api/jobs/${job.job_id}`,
+        { withCredentials: true }
+      );
+      current = { ...response.data, job_id: job.job_id };
+      updateFile(fileId, { message: describeJobProgress(current.progress) });
+    }
+
+    if (current.status === "failed") {
+      throw new Error(current.error || "Falha na importação.");
+    }
+    return current.result;
+  };
+
   const uploadSingleFile = async (fileItem) => {
     const { id, file } = fileItem;
 
@@ -190,7 +241,7 @@ const ImportFile = () => {
       const totalChunks = Math.ceil(file.size / CHUNK_SIZE);
       for (let i = 0; i < totalChunks; i++) {
         const chunk = file.slice(i * CHUNK_SIZE, (i + 1) * CHUNK_SIZE);
-        await uploadChunk(chunk, i, totalChunks, id);
+        await uploadChunk(chunk, i, totalChunks, id, file);
         const progress = Math.round(((i + 1) / totalChunks) * 100);
         updateFile(id, { progress });
       }
@@ -202,14 +253,25 @@ const ImportFile = () => {
 
       const response = await axios.post(
         `${import.meta.env.VITE_API_URL}/api/process_file`,
-        { fileId: id },
+        { fileId: id, filename: file.name, totalChunks, totalSize: file.size },
         { withCredentials: true }
       );
 
+      if (response.data?.duplicate) {
+        updateFile(id, {
+          status: "completed",
+          progress: 100,
+          message: "Arquivo já importado anteriormente.",
+        });
+        return "success";
+      }
+
+      const result = await waitForImportJob(id, response.data);
+
       updateFile(id, {
         status: "completed",
         progress: 100,
-        message: response.data?.message || "Importação concluída com sucesso.",
+        message: result?.message || "Importação concluída com sucesso.",
       });
 
       return "success";
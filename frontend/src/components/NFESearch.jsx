@@ -368,57 +368,22 @@ const NFESearch = () => {
           withCredentials: true,
         });
 
-        // Then get the PDF
+        // Then get the PDF as raw bytes (revalidated by ETag)
         const pdfResponse = await axios.get(
           `${import.meta.env.VITE_API_URL}/api/get_danfe_pdf`,
           {
-            params: { xmlKey: nfeChave },
+            params: { xmlKey: nfeChave, raw: true },
+            responseType: "blob",
             withCredentials: true,
           },
         );
 
-        if (!pdfResponse.data) {
+        if (!pdfResponse.data || !pdfResponse.data.size) {
           newWindow.document.body.innerHTML =
             '<div style="color:red;">Erro ao carregar o PDF. Dados inválidos recebidos.</div>';
           return;
         }
-
-        let pdfBase64;
-        if (typeof pdfResponse.data === "string") {
-          pdfBase64 = pdfResponse.data;
-        } else if (pdfResponse.data.arquivo) {
-          pdfBase64 = pdfResponse.data.arquivo;
-        } else if (pdfResponse.data.pdf) {
-          pdfBase64 = pdfResponse.data.pdf;
-        } else if (pdfResponse.data.content) {
-          pdfBase64 = pdfResponse.data.content;
-        } else {
-          const possibleBase64 = Object.entries(pdfResponse.data)
-            .filter(
-              ([key, value]) => typeof value === "string" && value.length > 100,
-            )
-            .sort((a, b) => b[1].length - a[1].length)[0];
-
-          if (possibleBase64) {
-            pdfBase64 = possibleBase64[1];
-          } else {
-            newWindow.document.body.innerHTML =
-              '<div style="color:red;">Erro ao carregar o PDF. Formato de resposta não reconhecido.</div>';
-            return;
-          }
-        }
-
-        const byteCharacters = atob(pdfBase64);
-        const byteArrays = [];
-        for (let i = 0; i < byteCharacters.length; i += 512) {
-          const slice = byteCharacters.slice(i, i + 512);
-          const byteNumbers = new Array(slice.length);
-          for (let j = 0; j < slice.length; j++) {
-            byteNumbers[j] = slice.charCodeAt(j);
-          }
-          byteArrays.push(new Uint8Array(byteNumbers));
-        }
-        const blob = new Blob(byteArrays, { type: "application/pdf" });
+        const blob = new Blob([pdfResponse.data], { type: "application/pdf" });
         const blobUrl = URL.createObjectURL(blob);
 
         const number = nfe.numero || nfe.num_nf || nfe.number || nfe.numero_nf;
@@ -38,6 +38,8 @@ import {
   Error as ErrorIcon,
 } from "@mui/icons-material";
 
+const JOB_POLL_INTERVAL = 1500;
+
 const TrackedCompanies = ({ open, onClose }) => {
   const [companies, setCompanies] = useState([]);
   const [loading, setLoading] = useState(false);
@@ -180,57 +182,75 @@ const TrackedCompanies = ({ open, onClose }) => {
     setSyncing(true);
     setSyncProgress({ status: "starting", message: "Iniciando sincronização..." });
     setSyncResults([]);
-    
-    const chunks = generateChunks(syncStartDate, syncEndDate);
-    setTotalChunks(chunks.length);
+    setTotalChunks(generateChunks(syncStartDate, syncEndDate).length);
     setCurrentChunk(0);
     
-    const results = [];
-    
-    for (let i = 0; i < chunks.length; i++) {
-      const chunk = chunks[i];
-      setCurrentChunk(i + 1);
-      setSyncProgress({
-        status: "syncing",
-        message: `Sincronizando período ${chunk.start} a ${chunk.end}...`,
-        progress: ((i + 1) / chunks.length) * 100,
-      });
+    try {
+      // The backfill runs as a background job; the request returns 202 with its id
+      const response = await axios.post(
+        `${import.meta.env.VITE_API_URL}/api/tracked_companies/${syncCompany.id}/sync_nfes`,
+        {
+          start_date: syncStartDate,
+          end_date: syncEndDate,
+        },
+        { withCredentials: true }
+      );
+      const jobId = response.data.job_id;
       
-      try {
-        const response = await axios.post(
-          `${import.meta.env.VITE_API_URL}/api/tracked_companies/${syncCompany.id}/sync_chunk`,
-          {
-            chunk_start: chunk.start,
-            chunk_end: chunk.end,
-          },
+      let job = response.data;
+      while (!["completed", "failed"].includes(job.status)) {
+        await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+        const jobResponse = await axios.get(
+          `${import.meta.env.VITE_API_URL}/api/jobs/${jobId}`,
           { withCredentials: true }
         );
+        job = jobResponse.data;
         
-        results.push({
-          ...chunk,
-          ...response.data,
+        const progress = job.progress || {};
+        const [chunkStart, chunkEnd] = progress.current_chunk || [];
+        if (progress.chunks_total) {
+          setTotalChunks(progress.chunks_total);
+        }
+        setCurrentChunk(progress.chunks_done || 0);
+        setSyncResults(progress.chunks || []);
+        setSyncProgress({
+          status: "syncing",
+          message:
+            job.status === "queued"
+              ? "Aguardando outra sincronização desta empresa..."
+              : chunkStart
+                ? `Sincronizando período ${chunkStart} a ${chunkEnd}...`
+                : "Sincronizando...",
+          progress: progress.chunks_total
+            ? ((progress.chunks_done || 0) / progress.chunks_total) * 100
+            : 0,
         });
-        setSyncResults([...results]);
-      } catch (err) {
-        results.push({
-          ...chunk,
-          status: "error",
-          error: err.message,
-        });
-        setSyncResults([...results]);
       }
       
-      // Small delay between chunks to avoid overwhelming the API
-      await new Promise((resolve) => setTimeout(resolve, 500));
+      if (job.status === "failed") {
+        setSyncProgress({
+          status: "failed",
+          message: job.error || "Falha na sincronização.",
+          progress: 100,
+        });
+      } else {
+        setSyncResults((job.progress && job.progress.chunks) || []);
+        setSyncProgress({
+          status: "completed",
+          message: "Sincronização concluída!",
+          progress: 100,
+        });
+      }
+    } catch (err) {
+      setSyncProgress({
+        status: "failed",
+        message: err.response?.data?.error || err.message,
+        progress: 100,
+      });
+    } finally {
+      setSyncing(false);
     }
     
-    setSyncing(false);
-    setSyncProgress({
-      status: "completed",
-      message: "Sincronização concluída!",
-      progress: 100,
-    });
-    
     // Refresh company list to update NFE count
     fetchCompanies();
   };
@@ -556,6 +576,12 @@ const TrackedCompanies = ({ open, onClose }) => {
                 />
               </Box>
 
+              {syncProgress?.status === "failed" && (
+                <Alert severity="error" sx={{ mb: 3 }}>
+                  {syncProgress.message}
+                </Alert>
+              )}
+
               {syncProgress?.status === "completed" && (
                 <Card
                   elevation={0}
@@ -662,7 +688,7 @@ const TrackedCompanies = ({ open, onClose }) => {
             onClick={() => setShowSyncDialog(false)}
             disabled={syncing}
           >
-            {syncProgress?.status === "completed" ? "Fechar" : "Cancelar"}
+            {["completed", "failed"].includes(syncProgress?.status) ? "Fechar" : "Cancelar"}
           </Button>
           {!syncProgress?.status && (
             <Button
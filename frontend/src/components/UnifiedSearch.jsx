@@ -219,55 +219,22 @@ function PurchaseRow(props) {
         withCredentials: true,
       });
 
-      // Then get the PDF
+      // Then get the PDF as raw bytes (revalidated by ETag)
       const response = await axios.get(
         `${import.meta.env.VITE_API_URL}/api/get_danfe_pdf`,
         {
-          params: { xmlKey: nfe.chave },
+          params: { xmlKey: nfe.chave, raw: true },
+          responseType: "blob",
           withCredentials: true,
         },
       );
 
-      if (!response.data) {
+      if (!response.data || !response.data.size) {
         newWindow.document.body.innerHTML =
           '<div style="color:red;">Erro ao carregar o PDF. Dados inválidos recebidos.</div>';
         return;
       }
-      let pdfBase64;
-      if (typeof response.data === "string") {
-        pdfBase64 = response.data;
-      } else if (response.data.arquivo) {
-        pdfBase64 = response.data.arquivo;
-      } else if (response.data.pdf) {
-        pdfBase64 = response.data.pdf;
-      } else if (response.data.content) {
-        pdfBase64 = response.data.content;
-      } else {
-        const possibleBase64 = Object.entries(response.data)
-          .filter(
-            ([key, value]) => typeof value === "string" && value.length > 100,
-          )
-          .sort((a, b) => b[1].length - a[1].length)[0];
-
-        if (possibleBase64) {
-          pdfBase64 = possibleBase64[1];
-        } else {
-          newWindow.document.body.innerHTML =
-            '<div style="color:red;">Erro ao carregar o PDF. Formato de resposta não reconhecido.</div>';
-          return;
-        }
-      }
-      const byteCharacters = atob(pdfBase64);
-      const byteArrays = [];
-      for (let i = 0; i < byteCharacters.length; i += 512) {
-        const slice = byteCharacters.slice(i, i + 512);
-        const byteNumbers = new Array(slice.length);
-        for (let j = 0; j < slice.length; j++) {
-          byteNumbers[j] = slice.charCodeAt(j);
-        }
-        byteArrays.push(new Uint8Array(byteNumbers));
-      }
-      const blob = new Blob(byteArrays, { type: "application/pdf" });
+      const blob = new Blob([response.data], { type: "application/pdf" });
 
       const blobUrl = URL.createObjectURL(blob);
 
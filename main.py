@@ -1,6 +1,8 @@
 from app import create_app
+from app.jobs import runner
 
 app = create_app()
+runner.start(app)
 
 if __name__ == '__main__':
     app.run(debug=True,port=5000,host='0.0.0.0')
\ No newline at end of file
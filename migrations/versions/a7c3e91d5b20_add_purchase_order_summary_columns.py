@@ -0,0 +1,92 @@
+"""Add maintained summary columns to purchase_orders
+
+Revision ID: a7c3e91d5b20
+Revises: e41b7c2a9f58
+Create Date: 2026-10-19 18:04:12.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e91d5b20'
+down_revision = 'e41b7c2a9f58'
+branch_labels = None
+depends_on = None
+
+
+def _apply_adjustments(value, adjustments):
+    # Snapshot of app.utils.apply_adjustments at this revision ('Itens' percentages are not applied)
+    for tp_apl, tp_dctacr1, tp_vlr1, vlr1 in adjustments:
+        if tp_vlr1 == 'Percentual' and tp_apl == 'Pedido':
+            delta = value * ((vlr1 or 0) / 100)
+        elif tp_vlr1 == 'Valor' and tp_apl in ('Pedido', 'Itens'):
+            delta = vlr1 or 0
+        else:
+            continue
+        if tp_dctacr1 == 'Desconto':
+            value -= delta
+        elif tp_dctacr1 == 'Acréscimo':
+            value += delta
+    return value
+
+
+def upgrade():
+    with op.batch_alter_table('purchase_orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('item_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('effective_total_excl_cancelled', sa.Float(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('adjusted_total', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('received_qty_ratio', sa.Float(), nullable=True))
+
+    # Backfill: same rules as app.utils.refresh_order_summaries
+    op.execute("""
+        UPDATE purchase_orders po
+        SET item_count = summary.item_count,
+            effective_total_excl_cancelled = summary.effective_total,
+            received_qty_ratio = summary.received_ratio
+        FROM (
+            SELECT purchase_order_id,
+                   COUNT(*) AS item_count,
+                   COALESCE(SUM(CASE WHEN COALESCE(quantidade, 0) > COALESCE(qtde_canc, 0)
+                                     THEN COALESCE(total, 0) ELSE 0 END), 0) AS effective_total,
+                   SUM(CASE WHEN quantidade > 0 THEN COALESCE(qtde_atendida, 0) ELSE 0 END)
+                       / NULLIF(SUM(CASE WHEN quantidade > 0 THEN quantidade ELSE 0 END), 0) AS received_ratio
+            FROM purchase_items
+            GROUP BY purchase_order_id
+        ) summary
+        WHERE po.id = summary.purchase_order_id
+    """)
+    op.execute("""
+        UPDATE purchase_orders
+        SET adjusted_total = COALESCE(total_pedido_com_ipi, 0) + COALESCE(vlr_frete_tra, 0)
+    """)
+
+    # Adjustments compound in order, so orders that have them are folded here
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("""
+        SELECT po.id, po.total_pedido_com_ipi, po.vlr_frete_tra,
+               adj.tp_apl, adj.tp_dctacr1, adj.tp_vlr1, adj.vlr1
+        FROM purchase_adjustments adj
+        JOIN purchase_orders po ON po.id = adj.purchase_order_id
+        ORDER BY po.id, adj.order_index, adj.id
+    """))
+    orders = {}
+    for order_id, total, freight, *adjustment in rows:
+        orders.setdefault(order_id, (total, freight, []))[2].append(adjustment)
+    if orders:
+        bind.execute(
+            sa.text("UPDATE purchase_orders SET adjusted_total = :adjusted_total WHERE id = :id"),
+            [
+                {'id': order_id, 'adjusted_total': _apply_adjustments(total or 0, adjustments) + (freight or 0)}
+                for order_id, (total, freight, adjustments) in orders.items()
+            ]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('purchase_orders', schema=None) as batch_op:
+        batch_op.drop_column('received_qty_ratio')
+        batch_op.drop_column('adjusted_total')
+        batch_op.drop_column('effective_total_excl_cancelled')
+        batch_op.drop_column('item_count')
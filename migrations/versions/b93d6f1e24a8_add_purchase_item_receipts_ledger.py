@@ -0,0 +1,82 @@
+"""Add the purchase_item_receipts received-quantity ledger
+
+Revision ID: b93d6f1e24a8
+Revises: a7c3e91d5b20
+Create Date: 2026-10-19 19:21:47.603118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b93d6f1e24a8'
+down_revision = 'a7c3e91d5b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('purchase_item_receipts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('nf_entry_id', sa.Integer(), nullable=False),
+    sa.Column('purchase_item_id', sa.Integer(), nullable=True),
+    sa.Column('cod_emp1', sa.String(length=20), nullable=False),
+    sa.Column('cod_pedc', sa.String(length=20), nullable=False),
+    sa.Column('linha', sa.Integer(), nullable=True),
+    sa.Column('num_nf', sa.String(length=20), nullable=False),
+    sa.Column('dt_ent', sa.Date(), nullable=True),
+    sa.Column('quantity', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['nf_entry_id'], ['nf_entries.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['purchase_item_id'], ['purchase_items.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('nf_entry_id')
+    )
+    with op.batch_alter_table('purchase_item_receipts', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_purchase_item_receipts_purchase_item_id'), ['purchase_item_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_purchase_item_receipts_num_nf'), ['num_nf'], unique=False)
+        batch_op.create_index('ix_purchase_item_receipts_order_line', ['cod_emp1', 'cod_pedc', 'linha'], unique=False)
+
+    # Backfill with the parsing rules of app.utils.refresh_item_receipts: decimal comma, malformed values as NULL
+    op.execute(r"""
+        INSERT INTO purchase_item_receipts (nf_entry_id, cod_emp1, cod_pedc, linha, num_nf, dt_ent, quantity)
+        SELECT id, cod_emp1, cod_pedc,
+               CASE WHEN btrim(linha) ~ '^-?\d+$' THEN btrim(linha)::integer END,
+               num_nf, dt_ent,
+               CASE WHEN replace(btrim(qtde), ',', '.') ~ '^-?\d*\.?\d+$'
+                    THEN replace(btrim(qtde), ',', '.')::double precision END
+        FROM nf_entries
+    """)
+    op.execute("""
+        UPDATE purchase_item_receipts r
+        SET purchase_item_id = pi.id
+        FROM purchase_items pi
+        WHERE pi.cod_emp1 = r.cod_emp1 AND pi.cod_pedc = r.cod_pedc AND pi.linha = r.linha
+    """)
+    op.execute("""
+        UPDATE purchase_orders po
+        SET received_qty_ratio = summary.received_ratio
+        FROM (
+            SELECT pi.purchase_order_id,
+                   COALESCE(MAX(received.quantity), 0)
+                       / NULLIF(SUM(CASE WHEN pi.quantidade > 0 THEN pi.quantidade ELSE 0 END), 0) AS received_ratio
+            FROM purchase_items pi
+            LEFT JOIN (
+                SELECT item.purchase_order_id, SUM(r.quantity) AS quantity
+                FROM purchase_item_receipts r
+                JOIN purchase_items item ON item.id = r.purchase_item_id
+                GROUP BY item.purchase_order_id
+            ) received ON received.purchase_order_id = pi.purchase_order_id
+            GROUP BY pi.purchase_order_id
+        ) summary
+        WHERE po.id = summary.purchase_order_id
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('purchase_item_receipts', schema=None) as batch_op:
+        batch_op.drop_index('ix_purchase_item_receipts_order_line')
+        batch_op.drop_index(batch_op.f('ix_purchase_item_receipts_num_nf'))
+        batch_op.drop_index(batch_op.f('ix_purchase_item_receipts_purchase_item_id'))
+
+    op.drop_table('purchase_item_receipts')
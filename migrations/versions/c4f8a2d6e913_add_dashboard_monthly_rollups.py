@@ -0,0 +1,84 @@
+"""Add monthly rollup tables for the dashboard
+
+Revision ID: c4f8a2d6e913
+Revises: b93d6f1e24a8
+Create Date: 2026-10-19 20:37:05.914462
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f8a2d6e913'
+down_revision = 'b93d6f1e24a8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('purchase_monthly_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('cod_emp1', sa.String(), nullable=True),
+    sa.Column('func_nome', sa.String(), nullable=True),
+    sa.Column('fornecedor_id', sa.Integer(), nullable=False),
+    sa.Column('fornecedor_descricao', sa.String(), nullable=True),
+    sa.Column('order_count', sa.Integer(), nullable=False),
+    sa.Column('fulfilled_count', sa.Integer(), nullable=False),
+    sa.Column('total_value', sa.Float(), nullable=False),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.Column('total_quantity', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('purchase_monthly_rollups', schema=None) as batch_op:
+        batch_op.create_index('ix_purchase_monthly_rollups_period', ['year', 'month'], unique=False)
+
+    op.create_table('nfe_monthly_rollups',
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Integer(), nullable=False),
+    sa.Column('nfe_count', sa.Integer(), nullable=False),
+    sa.Column('total_value', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('year', 'month')
+    )
+
+    # Backfill: same aggregates as app.utils.refresh_purchase_rollups and rebuild_nfe_monthly_rollups
+    op.execute("""
+        INSERT INTO purchase_monthly_rollups (
+            year, month, cod_emp1, func_nome, fornecedor_id, fornecedor_descricao,
+            order_count, fulfilled_count, total_value, item_count, total_quantity
+        )
+        SELECT EXTRACT(YEAR FROM po.dt_emis), EXTRACT(MONTH FROM po.dt_emis),
+               po.cod_emp1, po.func_nome, po.fornecedor_id, MAX(po.fornecedor_descricao),
+               COUNT(po.id),
+               SUM(CASE WHEN po.is_fulfilled THEN 1 ELSE 0 END),
+               COALESCE(SUM(po.total_pedido_com_ipi), 0),
+               COALESCE(SUM(po.item_count), 0),
+               COALESCE(SUM(COALESCE(quantities.quantity, 0)), 0)
+        FROM purchase_orders po
+        LEFT JOIN (
+            SELECT purchase_order_id, SUM(quantidade) AS quantity
+            FROM purchase_items
+            GROUP BY purchase_order_id
+        ) quantities ON quantities.purchase_order_id = po.id
+        GROUP BY EXTRACT(YEAR FROM po.dt_emis), EXTRACT(MONTH FROM po.dt_emis),
+                 po.cod_emp1, po.func_nome, po.fornecedor_id
+    """)
+    op.execute("""
+        INSERT INTO nfe_monthly_rollups (year, month, nfe_count, total_value, updated_at)
+        SELECT EXTRACT(YEAR FROM data_emissao), EXTRACT(MONTH FROM data_emissao),
+               COUNT(id), COALESCE(SUM(valor_total), 0), CURRENT_TIMESTAMP
+        FROM nfe_data
+        WHERE data_emissao IS NOT NULL
+        GROUP BY EXTRACT(YEAR FROM data_emissao), EXTRACT(MONTH FROM data_emissao)
+    """)
+
+
+def downgrade():
+    op.drop_table('nfe_monthly_rollups')
+    with op.batch_alter_table('purchase_monthly_rollups', schema=None) as batch_op:
+        batch_op.drop_index('ix_purchase_monthly_rollups_period')
+
+    op.drop_table('purchase_monthly_rollups')
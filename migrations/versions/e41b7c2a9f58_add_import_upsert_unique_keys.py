@@ -0,0 +1,53 @@
+"""Add unique keys for the quotation and supplier upserts
+
+Revision ID: e41b7c2a9f58
+Revises: c5a8e3b94d17
+Create Date: 2026-10-19 16:12:40.531904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41b7c2a9f58'
+down_revision = 'c5a8e3b94d17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Earlier imports could store the same key more than once; the most recent row is kept
+    op.execute("""
+        DELETE FROM quotations older USING quotations newer
+        WHERE newer.cod_cot = older.cod_cot
+          AND newer.item_id = older.item_id
+          AND newer.fornecedor_id = older.fornecedor_id
+          AND newer.id > older.id
+    """)
+    # Per cod_for, a row the Oracle sync keys (id_for set) wins over imported rows without ID_FOR
+    op.execute("""
+        DELETE FROM suppliers older USING suppliers newer
+        WHERE newer.cod_for = older.cod_for
+          AND (newer.id_for IS NOT NULL, newer.id) > (older.id_for IS NOT NULL, older.id)
+    """)
+    op.execute("""
+        DELETE FROM suppliers older USING suppliers newer
+        WHERE newer.id_for = older.id_for AND newer.id > older.id
+    """)
+
+    with op.batch_alter_table('quotations', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_quotation_cot_item_fornecedor', ['cod_cot', 'item_id', 'fornecedor_id'])
+
+    with op.batch_alter_table('suppliers', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_supplier_id_for', ['id_for'])
+        batch_op.create_unique_constraint('uq_supplier_cod_for', ['cod_for'])
+
+
+def downgrade():
+    with op.batch_alter_table('suppliers', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_supplier_cod_for', type_='unique')
+        batch_op.drop_constraint('uq_supplier_id_for', type_='unique')
+
+    with op.batch_alter_table('quotations', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_quotation_cot_item_fornecedor', type_='unique')
@@ -0,0 +1,38 @@
+"""Add items_total to purchase_orders
+
+Revision ID: f06b2d8c4e17
+Revises: c4f8a2d6e913
+Create Date: 2026-10-19 21:52:40.316207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f06b2d8c4e17'
+down_revision = 'c4f8a2d6e913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('purchase_orders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('items_total', sa.Float(), nullable=False, server_default='0'))
+
+    # Backfill: same rules as app.utils.refresh_order_summaries
+    op.execute("""
+        UPDATE purchase_orders po
+        SET items_total = summary.items_total
+        FROM (
+            SELECT purchase_order_id, COALESCE(SUM(total), 0) AS items_total
+            FROM purchase_items
+            GROUP BY purchase_order_id
+        ) summary
+        WHERE po.id = summary.purchase_order_id
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('purchase_orders', schema=None) as batch_op:
+        batch_op.drop_column('items_total')
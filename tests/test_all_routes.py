@@ -3,7 +3,10 @@ Comprehensive test suite for all Flask-FoccoERP routes.
 This file includes all existing tests plus new tests for endpoints lacking coverage.
 """
 
+import hashlib
+import os
 import pytest
+import tempfile
 from io import BytesIO
 from datetime import date, datetime, timedelta
 from flask import Flask
@@ -25,6 +28,7 @@ def app():
         "TESTING": True,
         "WTF_CSRF_ENABLED": False,
         "MAIL_SUPPRESS_SEND": True,
+        "JOBS_EAGER": True,
     })
 
     with app.app_context():
@@ -163,6 +167,111 @@ def test_import_rejects_invalid_xml(auth_client: FlaskClient):
     assert 'error' in response.json
 
 
+def test_import_nfe_zip_reports_per_file(auth_client: FlaskClient):
+    """Test ZIP import of NFe XMLs stores new NFes and reports every entry."""
+    import zipfile
+
+    def nfe_xml(chave, numero):
+        return (
+            '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe>'
+            f'<infNFe Id="NFe{chave}" versao="4.00"><ide><nNF>{numero}</nNF></ide>'
+            '<emit><CNPJ>11111111000111</CNPJ><xNome>Emit</xNome></emit>'
+            '<dest><CNPJ>34028316000107</CNPJ><xNome>Dest</xNome></dest>'
+            '<det nItem="1"><prod><cProd>P1</cProd><xProd>Parafuso</xProd><qCom>2</qCom></prod></det>'
+            '</infNFe></NFe></nfeProc>'
+        )
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('nfes/a.xml', nfe_xml('1' * 44, '10'))
+        archive.writestr('nfes/b.xml', nfe_xml('2' * 44, '20'))
+        archive.writestr('nfes/b_copy.xml', nfe_xml('2' * 44, '20'))
+        archive.writestr('nfes/broken.xml', '<nfeProc>')
+        archive.writestr('readme.txt', 'not an nfe')
+    buffer.seek(0)
+
+    auth_client.application.config['NFE_IMPORT_WORKERS'] = 2
+    token = auth_client.post('/auth/generate_jwt_token', json={'expires_in': 60}).json['token']
+    response = auth_client.post(
+        '/api/import_nfe_zip',
+        data={'file': (buffer, 'nfes.zip')},
+        content_type='multipart/form-data',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+
+    assert response.status_code == 207
+    data = response.json
+    assert data['total_processed'] == 5
+    statuses = {entry['filename']: entry['status'] for entry in data['successful']}
+    assert statuses == {
+        'nfes/a.xml': 'imported',
+        'nfes/b.xml': 'imported',
+        'nfes/b_copy.xml': 'duplicate_in_archive',
+    }
+    assert {entry['filename'] for entry in data['failed']} == {'nfes/broken.xml', 'readme.txt'}
+
+    with auth_client.application.app_context():
+        nfe = NFEData.query.filter_by(chave='1' * 44).first()
+        assert nfe.numero == '10'
+        assert nfe.emitente.cnpj == '11111111000111'
+        assert nfe.itens[0].descricao == 'Parafuso'
+
+
+def test_import_nfe_zip_rejects_non_zip(auth_client: FlaskClient):
+    """Test ZIP import rejects files that are not ZIP archives."""
+    token = auth_client.post('/auth/generate_jwt_token', json={'expires_in': 60}).json['token']
+    response = auth_client.post(
+        '/api/import_nfe_zip',
+        data={'file': (BytesIO(b'not-a-zip'), 'nfes.zip')},
+        content_type='multipart/form-data',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 400
+
+
+def test_bulk_merge_replaces_provisional_nf_entries(app: Flask):
+    """Test bulk_merge upserts rows, skips unchanged ones and purges provisional XML entries for the same NF."""
+    from app.bulk_load import bulk_merge, _copy_buffer
+
+    with app.app_context():
+        db.session.add_all([
+            NFEntry(itnfe_id='XML-1-100-1-555', origem='XML', cod_emp1='1', cod_pedc='100', linha='1', num_nf='555'),
+            NFEntry(itnfe_id='XML-1-100-1-777', origem='XML', cod_emp1='1', cod_pedc='100', linha='1', num_nf='777'),
+            NFEntry(itnfe_id='9001', origem='FOCCO', cod_emp1='1', cod_pedc='100', linha='2', num_nf='555', qtde='1'),
+        ])
+        db.session.commit()
+
+        rows = [
+            {'itnfe_id': '9000', 'origem': 'FOCCO', 'cod_emp1': '1', 'cod_pedc': '100', 'linha': '1',
+             'num_nf': '555', 'dt_ent': date(2025, 1, 10), 'qtde': '5', 'obs_conf': None, 'chave_acesso_nfel': None},
+            {'itnfe_id': '9001', 'origem': 'FOCCO', 'cod_emp1': '1', 'cod_pedc': '100', 'linha': '2',
+             'num_nf': '555', 'dt_ent': date(2025, 1, 10), 'qtde': '2', 'obs_conf': 'ok', 'chave_acesso_nfel': None},
+        ]
+        update_columns = ['dt_ent', 'qtde', 'obs_conf', 'chave_acesso_nfel', 'origem']
+        stats = bulk_merge(
+            NFEntry, rows, ['itnfe_id'], update_columns,
+            purge_match='num_nf', purge_filter={'origem': 'XML'}
+        )
+        db.session.commit()
+
+        assert stats == {'sent': 2, 'changed': 2, 'unchanged': 0}
+        entries = {e.itnfe_id: e for e in NFEntry.query.all()}
+        assert set(entries) == {'9000', '9001', 'XML-1-100-1-777'}
+        assert entries['9001'].qtde == '2'
+        assert entries['9001'].obs_conf == 'ok'
+
+        # Only the row that actually differs is rewritten
+        rows[1]['qtde'] = '3'
+        stats = bulk_merge(NFEntry, rows, ['itnfe_id'], update_columns)
+        db.session.commit()
+        assert stats == {'sent': 2, 'changed': 1, 'unchanged': 1}
+        assert NFEntry.query.filter_by(itnfe_id='9001').one().qtde == '3'
+
+    buffer = _copy_buffer([{'a': None, 'b': 'say "hi"', 'c': True, 'd': date(2025, 1, 2), 'e': ''}],
+                          ['a', 'b', 'c', 'd', 'e'])
+    assert buffer.read() == ',"say ""hi""",t,2025-01-02,""\n'
+
+
 # ==================== BASIC SEARCH TESTS ====================
 
 def test_get_purchases(auth_client: FlaskClient):
@@ -794,6 +903,99 @@ def test_get_danfe_pdf(auth_client: FlaskClient):
     assert response.status_code in (200, 404)
 
 
+def test_danfe_pdf_served_from_disk_cache(auth_client: FlaskClient, tmp_path, monkeypatch):
+    """Test DANFE PDF is rendered once, cached on disk and revalidated by ETag."""
+    from app import danfe_cache
+
+    chave = '12345678901234567890123456789012345678901234'
+    renders = []
+
+    def fake_render(xml_content):
+        renders.append(xml_content)
+        return b'%PDF-1.4 fake'
+
+    monkeypatch.setattr(danfe_cache, 'render_danfe_pdf', fake_render)
+    auth_client.application.config['DANFE_CACHE_DIR'] = str(tmp_path)
+
+    with auth_client.application.app_context():
+        db.session.add(NFEData(chave=chave, xml_content='<xml />', numero='001'))
+        db.session.commit()
+
+    response = auth_client.get(f'/api/danfe_pdf/{chave}')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.data == b'%PDF-1.4 fake'
+    etag = response.headers['ETag']
+
+    response = auth_client.get(f'/api/danfe_pdf/{chave}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    # SIEG stays the primary source; the cached render only backs the fallback
+    import requests
+    from app.routes import nfe as nfe_routes
+
+    def sieg_timeout(*args, **kwargs):
+        raise requests.Timeout('slow')
+
+    monkeypatch.setattr(nfe_routes.requests, 'get', sieg_timeout)
+    response = auth_client.get('/api/get_danfe_pdf', query_string={'xmlKey': chave})
+    assert response.status_code == 200
+    assert response.json['source'] == 'fallback_timeout'
+    assert len(renders) == 1
+
+
+def test_get_danfe_pdf_prefers_sieg_and_serves_raw_bytes(auth_client: FlaskClient, tmp_path, monkeypatch):
+    """Test a cached local render does not replace the SIEG DANFE, and raw=true returns PDF bytes."""
+    import base64
+    from app import danfe_cache
+    from app.routes import nfe as nfe_routes
+
+    chave = '12345678901234567890123456789012345678901234'
+    sieg_pdf = b'%PDF-1.4 sieg'
+    auth_client.application.config['DANFE_CACHE_DIR'] = str(tmp_path)
+    danfe_cache.store_pdf(chave, b'%PDF-1.4 local', str(tmp_path))
+
+    class SiegResponse:
+        status_code = 200
+        text = ''
+
+        def json(self):
+            return {'arquivo': base64.b64encode(sieg_pdf).decode('ascii')}
+
+    monkeypatch.setattr(nfe_routes.requests, 'get', lambda *args, **kwargs: SiegResponse())
+
+    with auth_client.application.app_context():
+        db.session.add(NFEData(chave=chave, xml_content='<xml />', numero='001'))
+        db.session.commit()
+
+    response = auth_client.get('/api/get_danfe_pdf', query_string={'xmlKey': chave})
+    assert response.status_code == 200
+    assert base64.b64decode(response.json['arquivo']) == sieg_pdf
+
+    response = auth_client.get('/api/get_danfe_pdf', query_string={'xmlKey': chave, 'raw': 'true'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/pdf'
+    assert response.headers['X-Danfe-Source'] == 'sieg'
+    assert response.data == sieg_pdf
+
+    response = auth_client.get('/api/get_danfe_pdf', query_string={'xmlKey': chave, 'raw': 'true'},
+                               headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_danfe_cache_evicts_least_recently_used(tmp_path):
+    """Test the DANFE cache drops the oldest files once over its size cap."""
+    import os
+    from app import danfe_cache
+
+    old_path = danfe_cache.store_pdf('A1', b'x' * 10, str(tmp_path), max_bytes=100)
+    os.utime(old_path, (1, 1))
+    danfe_cache.store_pdf('B2', b'x' * 10, str(tmp_path), max_bytes=15)
+
+    assert not os.path.exists(old_path)
+    assert os.path.exists(danfe_cache.cache_path('B2', str(tmp_path)))
+
+
 def test_get_nfe_data(auth_client: FlaskClient):
     """Test getting NFE data from API."""
     response = auth_client.get('/api/get_nfe_data', query_string={
@@ -1031,6 +1233,65 @@ def test_view_danfe_template(auth_client: FlaskClient):
     assert response.status_code in (200, 404)
 
 
+def test_nfe_payload_cached_with_immutable_etag(auth_client: FlaskClient):
+    """Test stored NFe payloads are served once-built with a strong ETag."""
+    chave = '35240112345678000190550010000012341000012345'
+    with auth_client.application.app_context():
+        nfe = NFEData(chave=chave, xml_content='<xml />', numero='1234', serie='1')
+        nfe.emitente = NFEEmitente(cnpj='12345678000190', nome='Fornecedor Teste')
+        nfe.itens = [NFEItem(numero_item=1, codigo='P1', descricao='Parafuso', quantidade_comercial=10.0)]
+        db.session.add(nfe)
+        db.session.commit()
+        nfe_id = nfe.id
+
+    for path, params in (
+        ('/api/get_danfe_data', {'chave': chave}),
+        ('/api/get_nfe_data', {'xmlKey': chave}),
+        (f'/api/view_danfe_template/{nfe_id}', {}),
+    ):
+        response = auth_client.get(path, query_string=params)
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        etag = response.headers['ETag']
+
+        cached = auth_client.get(path, query_string=params)
+        assert cached.data == response.data
+        assert cached.headers['ETag'] == etag
+
+        revalidated = auth_client.get(path, query_string=params, headers={'If-None-Match': etag})
+        assert revalidated.status_code == 304
+
+    response = auth_client.get('/api/get_danfe_data', query_string={'chave': chave})
+    assert response.json['emitente']['nome'] == 'Fornecedor Teste'
+    assert response.json['items'][0]['descricao'] == 'Parafuso'
+    assert 'logo_url' not in response.json['emitente']
+
+
+def test_danfe_logo_served_outside_immutable_payload(auth_client: FlaskClient):
+    """Test a changed Company.logo_path is visible without invalidating the cached DANFE data."""
+    chave = '35240112345678000190550010000012341000012345'
+    with auth_client.application.app_context():
+        nfe = NFEData(chave=chave, xml_content='<xml />', numero='1234', serie='1')
+        nfe.emitente = NFEEmitente(cnpj='12345678000190', nome='Fornecedor Teste')
+        company = Company(cod_emp1='90', name='Fornecedor Teste', cnpj='12345678000190', logo_path='/logos/a.png')
+        db.session.add_all([nfe, company])
+        db.session.commit()
+
+    danfe = auth_client.get('/api/get_danfe_data', query_string={'chave': chave})
+    response = auth_client.get('/api/get_danfe_logo', query_string={'chave': chave})
+    assert response.status_code == 200
+    assert response.json['logo_url'] == '/logos/a.png'
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+    with auth_client.application.app_context():
+        Company.query.filter_by(cod_emp1='90').update({'logo_path': '/logos/b.png'})
+        db.session.commit()
+
+    response = auth_client.get('/api/get_danfe_logo', query_string={'chave': chave})
+    assert response.json['logo_url'] == '/logos/b.png'
+    assert auth_client.get('/api/get_danfe_data', query_string={'chave': chave}).data == danfe.data
+
+
 # ==================== TRACKED COMPANIES TESTS ====================
 
 def test_get_tracked_companies(auth_client: FlaskClient):
@@ -1107,6 +1368,46 @@ def test_tracked_company_nfe_count(auth_client: FlaskClient):
     assert 'nfe_count' in data
 
 
+def test_tracked_company_nfe_count_maintained_at_ingest(auth_client: FlaskClient):
+    """Test NFE counters are updated when NFEs are stored and match a full rebuild."""
+    from app.models import CompanyNFECount
+    from app.utils import parse_and_store_nfe_xml, rebuild_company_nfe_counts
+
+    def nfe_xml(chave, emit_cnpj, dest_cnpj):
+        return (
+            '<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe>'
+            f'<infNFe Id="NFe{chave}" versao="4.00"><ide><nNF>1</nNF></ide>'
+            f'<emit><CNPJ>{emit_cnpj}</CNPJ><xNome>Emit</xNome></emit>'
+            f'<dest><CNPJ>{dest_cnpj}</CNPJ><xNome>Dest</xNome></dest>'
+            '</infNFe></NFe></nfeProc>'
+        )
+
+    with auth_client.application.app_context():
+        company = Company(cod_emp1='TEST003', name='Counted', cnpj='34.028.316/0001-07')
+        db.session.add(company)
+        db.session.commit()
+        company_id = company.id
+
+        parse_and_store_nfe_xml(nfe_xml('1' * 44, '11111111000111', '34028316000107'))
+        parse_and_store_nfe_xml(nfe_xml('2' * 44, '34028316000107', '22222222000122'))
+        parse_and_store_nfe_xml(nfe_xml('3' * 44, '34028316000107', '34028316000107'))
+        # Re-ingesting an existing chave must not count twice
+        parse_and_store_nfe_xml(nfe_xml('1' * 44, '11111111000111', '34028316000107'))
+
+    response = auth_client.get(f'/api/tracked_companies/{company_id}/nfe_count')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['nfe_count'] == 3
+    assert data['nfe_count_emitente'] == 2
+    assert data['nfe_count_destinatario'] == 2
+
+    with auth_client.application.app_context():
+        before = {c.cnpj: (c.emitente_count, c.destinatario_count, c.total_count) for c in CompanyNFECount.query.all()}
+        rebuild_company_nfe_counts()
+        after = {c.cnpj: (c.emitente_count, c.destinatario_count, c.total_count) for c in CompanyNFECount.query.all()}
+    assert before == after
+
+
 def test_tracked_company_nfe_count_not_found(auth_client: FlaskClient):
     """Test getting NFE count for non-existent company."""
     response = auth_client.get('/api/tracked_companies/99999/nfe_count')
@@ -1167,8 +1468,116 @@ def test_sync_company_nfes(auth_client: FlaskClient):
         'start_date': '2024-01-01',
         'end_date': '2024-01-15'
     })
-    # May succeed or fail based on SIEG API availability
-    assert response.status_code in (200, 400, 500)
+    # Backfill is queued as a job; the job itself may fail based on SIEG API availability
+    assert response.status_code == 202
+    assert 'job_id' in response.json
+
+
+def test_sync_company_nfes_job_progress(auth_client: FlaskClient, monkeypatch):
+    """Test NFE backfill job persists chunk progress and can be polled."""
+    from app.routes import tracking
+
+    calls = []
+
+    def fake_fetch(cnpj_clean, chunk_start, chunk_end):
+        calls.append((cnpj_clean, chunk_start, chunk_end))
+        return {'found': 3, 'new_nfes': 2, 'already_existed': 1, 'errors': []}
+
+    monkeypatch.setattr(tracking, '_fetch_company_nfe_chunk', fake_fetch)
+
+    with auth_client.application.app_context():
+        company = Company(cod_emp1='SYNC003', name='Job Test', cnpj='34.028.316/0001-07')
+        db.session.add(company)
+        db.session.commit()
+        company_id = company.id
+
+    response = auth_client.post(f'/api/tracked_companies/{company_id}/sync_nfes', json={
+        'start_date': '2024-01-01',
+        'end_date': '2024-02-10'
+    })
+    assert response.status_code == 202
+    job_id = response.json['job_id']
+
+    response = auth_client.get(f'/api/jobs/{job_id}')
+    assert response.status_code == 200
+    job = response.json
+    assert job['status'] == 'completed'
+    assert job['concurrency_key'] == 'cnpj:34028316000107'
+    assert job['progress']['chunks_total'] == 3
+    assert job['progress']['chunks_done'] == 3
+    assert job['result']['new_nfes'] == 6
+    assert job['result']['already_existed'] == 3
+    assert calls[0] == ('34028316000107', '2024-01-01', '2024-01-16')
+
+    response = auth_client.get(f'/api/jobs/{job_id}/stream')
+    assert response.mimetype == 'text/event-stream'
+    assert 'event: done' in response.get_data(as_text=True)
+
+    response = auth_client.get(f'/api/tracked_companies/{company_id}/sync_jobs')
+    assert [j['id'] for j in response.json['jobs']] == [job_id]
+    assert [chunk['start'] for chunk in job['progress']['chunks']] == ['2024-01-01', '2024-01-16', '2024-01-31']
+    assert job['progress']['chunks'][0]['status'] == 'success'
+
+
+def test_job_runner_recovers_orphaned_jobs(app: Flask, monkeypatch):
+    """Test startup recovery fails stale running jobs and runs queued ones left by a stopped worker."""
+    from app import jobs
+    from app.models import BackgroundJob
+
+    ran = []
+    monkeypatch.setitem(jobs._handlers, 'test_echo', lambda progress, value: ran.append(value) or {'value': value})
+
+    stale_time = datetime.now() - timedelta(hours=1)
+    orphaned = BackgroundJob(job_type='test_echo', status='running', concurrency_key='cnpj:1',
+                             params={'value': 1}, started_at=stale_time, updated_at=stale_time)
+    alive = BackgroundJob(job_type='test_echo', status='running', concurrency_key='cnpj:2',
+                          params={'value': 2}, started_at=stale_time, updated_at=datetime.now())
+    waiting = BackgroundJob(job_type='test_echo', status='queued', concurrency_key='cnpj:1', params={'value': 3})
+    blocked = BackgroundJob(job_type='test_echo', status='queued', concurrency_key='cnpj:2', params={'value': 4})
+    db.session.add_all([orphaned, alive, waiting, blocked])
+    db.session.commit()
+    ids = [job.id for job in (orphaned, alive, waiting, blocked)]
+
+    failed, dispatched = jobs.JobRunner().recover(app)
+    assert (failed, dispatched) == (1, 1)
+
+    db.session.expire_all()
+    orphaned, alive, waiting, blocked = [db.session.get(BackgroundJob, job_id) for job_id in ids]
+    assert orphaned.status == 'failed'
+    assert 'stopped' in orphaned.error
+    assert alive.status == 'running'
+    # The orphan's slot is free again; cnpj:2 is still held by a live job, so its queued job waits
+    assert waiting.status == 'completed'
+    assert blocked.status == 'queued'
+    assert ran == [3]
+
+
+def test_get_job_not_found(auth_client: FlaskClient):
+    """Test polling a non-existent job."""
+    response = auth_client.get('/api/jobs/99999')
+    assert response.status_code == 404
+
+
+def test_jobs_are_only_visible_to_their_owner_and_admins(client: FlaskClient):
+    """Test that a job queued by another user reads as not found, except for admins."""
+    from app.models import BackgroundJob
+
+    with client.application.app_context():
+        admin = User.query.filter_by(username='admin').one()
+        job = BackgroundJob(job_type='xml_import', status='completed', params={'filename': 'private.xml'},
+                            result={'message': 'Data imported'}, created_by_id=admin.id)
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    client.post('/auth/login', json={'email': 'test@example.com', 'password': 'test123'})
+    assert client.get(f'/api/jobs/{job_id}').status_code == 404
+    assert client.get(f'/api/jobs/{job_id}/stream').status_code == 404
+
+    client.post('/auth/logout')
+    client.post('/auth/login', json={'email': 'admin@example.com', 'password': 'admin123'})
+    assert client.get(f'/api/jobs/{job_id}').json['params']['filename'] == 'private.xml'
+    assert 'event: done' in client.get(f'/api/jobs/{job_id}/stream').get_data(as_text=True)
 
 
 def test_sync_company_nfes_missing_dates(auth_client: FlaskClient):
@@ -1299,6 +1708,241 @@ def test_check_order_fulfillment_counts_canceled_items(auth_client: FlaskClient)
         assert check_order_fulfillment(pending_order.id) is False
 
 
+def test_refresh_order_fulfillment_set_based(app: Flask):
+    """Test the set-based fulfillment refresh agrees with check_order_fulfillment and respects its scope."""
+    from app.utils import refresh_order_fulfillment
+
+    def add_order(cod_pedc, items, is_fulfilled=False):
+        order = PurchaseOrder(cod_pedc=cod_pedc, dt_emis=date(2024, 3, 1), fornecedor_id=1, is_fulfilled=is_fulfilled)
+        db.session.add(order)
+        db.session.flush()
+        for linha, (quantidade, atendida, canc, toler) in enumerate(items, start=1):
+            db.session.add(PurchaseItem(
+                purchase_order_id=order.id, item_id=f'IT-{linha}', dt_emis=date(2024, 3, 1), cod_pedc=cod_pedc,
+                linha=linha, descricao='Item', quantidade=quantidade, preco_unitario=1, total=1,
+                qtde_atendida=atendida, qtde_canc=canc, qtde_canc_toler=toler
+            ))
+        return order
+
+    with app.app_context():
+        received = add_order('SET-001', [(5, 5, None, None), (7, None, 7, None), (0, None, None, None)])
+        tolerance = add_order('SET-002', [(10, 8, None, 2)])
+        pending = add_order('SET-003', [(10, 6, 2, None)], is_fulfilled=True)
+        empty = add_order('SET-004', [], is_fulfilled=True)
+        out_of_scope = add_order('SET-005', [(1, 1, None, None)])
+        db.session.commit()
+
+        scope = [received.id, tolerance.id, pending.id, empty.id]
+        assert refresh_order_fulfillment(scope) == 4
+        db.session.commit()
+        # Nothing left to change on a second run
+        assert refresh_order_fulfillment(scope) == 0
+
+        for order in (received, tolerance, pending, empty):
+            db.session.refresh(order)
+            assert order.is_fulfilled is check_order_fulfillment(order.id)
+        assert [received.is_fulfilled, tolerance.is_fulfilled, pending.is_fulfilled, empty.is_fulfilled] == \
+            [True, True, False, False]
+        db.session.refresh(out_of_scope)
+        assert out_of_scope.is_fulfilled is False
+
+
+def test_refresh_order_summaries(app: Flask):
+    """Test the maintained summary columns: item aggregates in SQL, ordered adjustments folded like apply_adjustments."""
+    from app.models import PurchaseAdjustment
+    from app.utils import apply_adjustments, refresh_item_receipts, refresh_order_summaries
+
+    with app.app_context():
+        order = PurchaseOrder(cod_pedc='SUM-001', cod_emp1='1', dt_emis=date(2024, 3, 1), fornecedor_id=1,
+                              total_pedido_com_ipi=1000.0, vlr_frete_tra=50.0)
+        plain = PurchaseOrder(cod_pedc='SUM-002', dt_emis=date(2024, 3, 1), fornecedor_id=1,
+                              total_pedido_com_ipi=200.0)
+        db.session.add_all([order, plain])
+        db.session.flush()
+        for linha, (quantidade, atendida, canc, total) in enumerate(
+            [(10, 5, None, 600.0), (4, 0, 4, 300.0), (2, 2, 1, 100.0)], start=1
+        ):
+            db.session.add(PurchaseItem(
+                purchase_order_id=order.id, item_id=f'IT-{linha}', dt_emis=date(2024, 3, 1), cod_pedc='SUM-001',
+                cod_emp1='1', linha=linha, descricao='Item', quantidade=quantidade, preco_unitario=1, total=total,
+                qtde_atendida=atendida, qtde_canc=canc
+            ))
+        for itnfe_id, linha, qtde in (('1', '1', '4,5'), ('2', '1', '0.5'), ('3', '3', '2'), ('4', '2', 'n/a')):
+            db.session.add(NFEntry(itnfe_id=itnfe_id, cod_emp1='1', cod_pedc='SUM-001', linha=linha,
+                                   num_nf=f'NF-{itnfe_id}', qtde=qtde))
+        # Percent then value: the order matters
+        db.session.add_all([
+            PurchaseAdjustment(purchase_order_id=order.id, tp_apl='Pedido', tp_dctacr1='Desconto',
+                               tp_vlr1='Percentual', vlr1=10, order_index=0),
+            PurchaseAdjustment(purchase_order_id=order.id, tp_apl='Pedido', tp_dctacr1='Acréscimo',
+                               tp_vlr1='Valor', vlr1=20, order_index=1),
+        ])
+        db.session.commit()
+
+        assert refresh_item_receipts([('1', 'SUM-001')]) == [order.id]
+        assert refresh_order_summaries([order.id, plain.id]) == 3
+        db.session.commit()
+        assert refresh_order_summaries([order.id, plain.id]) == 0
+
+        db.session.refresh(order)
+        db.session.refresh(plain)
+        assert order.item_count == 3
+        assert order.items_total == 1000.0
+        assert order.effective_total_excl_cancelled == 700.0
+        assert order.received_qty_ratio == pytest.approx(7 / 16)
+        assert order.adjusted_total == pytest.approx(apply_adjustments(1000.0, order.adjustments) + 50.0) == 970.0
+        assert (plain.item_count, plain.effective_total_excl_cancelled, plain.adjusted_total,
+                plain.received_qty_ratio) == (0, 0.0, 200.0, None)
+
+
+def test_purchase_category_report_include_cancelled(admin_client: FlaskClient):
+    """Test that fully cancelled orders only enter the category report with include_cancelled, totals adjusted from cents."""
+    from app.models import PurchaseAdjustment, ReportCategory
+    from app.utils import refresh_order_summaries
+
+    with admin_client.application.app_context():
+        buyer = User.query.filter_by(username='admin').first()
+        buyer.system_name = 'COMPRADOR'
+        buyer.report_categories.append(ReportCategory(name='Manutencao'))
+        active = PurchaseOrder(cod_pedc='REP-001', dt_emis=date(2024, 5, 2), fornecedor_id=1, func_nome='COMPRADOR',
+                               observacao='Pedido\nManutencao', total_pedido_com_ipi=100.004)
+        cancelled = PurchaseOrder(cod_pedc='REP-002', dt_emis=date(2024, 6, 3), fornecedor_id=1, func_nome='COMPRADOR',
+                                  observacao='Manutencao', total_pedido_com_ipi=50.0)
+        db.session.add_all([active, cancelled])
+        db.session.flush()
+        for order, linha, quantidade, canc, total in [
+            (active, 1, 6, 0, 60.0), (active, 2, 4, 4, 40.0), (cancelled, 1, 5, 5, 50.0)
+        ]:
+            db.session.add(PurchaseItem(
+                purchase_order_id=order.id, item_id=f'IT-{linha}', dt_emis=order.dt_emis, cod_pedc=order.cod_pedc,
+                linha=linha, descricao='Item', quantidade=quantidade, preco_unitario=1, total=total, qtde_canc=canc
+            ))
+        db.session.add(PurchaseAdjustment(purchase_order_id=active.id, tp_apl='Pedido', tp_dctacr1='Desconto',
+                                          tp_vlr1='Percentual', vlr1=10, order_index=0))
+        refresh_order_summaries([active.id, cancelled.id])
+        db.session.commit()
+        assert (active.items_total, active.effective_total_excl_cancelled) == (100.0, 60.0)
+        assert (cancelled.items_total, cancelled.effective_total_excl_cancelled) == (50.0, 0.0)
+        # Stored unrounded, as the search and NFe payloads always returned it; only the report rounds to cents
+        assert active.adjusted_total == pytest.approx(90.0036)
+        buyer_id = buyer.id
+
+    response = admin_client.get('/api/search_combined', query_string={
+        'query': 'REP-001', 'page': 1, 'per_page': 10, 'score_cutoff': 100, 'searchByCodPedc': True,
+        'selectedFuncName': 'todos',
+    })
+    assert response.status_code == 200
+    orders = [purchase['order'] for purchase in response.json['purchases'] if purchase['order']['cod_pedc'] == 'REP-001']
+    assert orders and orders[0]['adjusted_total'] == pytest.approx(90.0036)
+
+    def report(include_cancelled):
+        response = admin_client.get('/api/purchase-category-report', query_string={
+            'user_id': buyer_id, 'year': 2024, 'include_cancelled': include_cancelled
+        })
+        assert response.status_code == 200
+        return response.json
+
+    excluded = report('false')
+    assert [order['cod_pedc'] for order in excluded['all_orders']] == ['REP-001']
+    assert excluded['data']['Manutencao'][4:6] == [90.0, 0.0]
+    assert excluded['grand_total'] == 90.0
+
+    included = report('true')
+    assert sorted(order['cod_pedc'] for order in included['all_orders']) == ['REP-001', 'REP-002']
+    assert included['data']['Manutencao'][4:6] == [90.0, 50.0]
+    assert included['grand_total'] == 140.0
+
+
+def test_item_receipts_ledger_follows_nf_entries(app: Flask):
+    """Test that the receipt ledger parses NF quantities, links items and drops receipts of removed entries."""
+    from app.models import PurchaseItemReceipt
+    from app.utils import link_item_receipts, refresh_item_receipts
+
+    with app.app_context():
+        order = PurchaseOrder(cod_pedc='REC-001', cod_emp1='1', dt_emis=date(2024, 3, 1), fornecedor_id=1)
+        db.session.add(order)
+        db.session.flush()
+        item = PurchaseItem(purchase_order_id=order.id, item_id='IT-1', dt_emis=date(2024, 3, 1), cod_pedc='REC-001',
+                            cod_emp1='1', linha=1, descricao='Item', quantidade=10, preco_unitario=1, total=10)
+        provisional = NFEntry(itnfe_id='XML-1-REC-001-1-900', origem='XML', cod_emp1='1', cod_pedc='REC-001',
+                              linha='1', num_nf='900', qtde='2,5')
+        other_order = NFEntry(itnfe_id='77', cod_emp1='1', cod_pedc='REC-002', linha='1', num_nf='901', qtde='1')
+        db.session.add_all([item, provisional, other_order])
+        db.session.commit()
+
+        refresh_item_receipts([('1', 'REC-001')])
+        db.session.commit()
+        receipt = PurchaseItemReceipt.query.one()
+        assert (receipt.nf_entry_id, receipt.purchase_item_id, receipt.linha, receipt.quantity) == \
+            (provisional.id, item.id, 1, 2.5)
+
+        # The Focco row replaces the provisional one; the item is recreated under a new id
+        db.session.execute(db.delete(NFEntry).where(NFEntry.id == provisional.id))
+        db.session.execute(db.delete(PurchaseItem).where(PurchaseItem.id == item.id))
+        db.session.add(NFEntry(itnfe_id='78', cod_emp1='1', cod_pedc='REC-001', linha='1', num_nf='900', qtde='3'))
+        db.session.flush()
+        new_item = PurchaseItem(purchase_order_id=order.id, item_id='IT-1', dt_emis=date(2024, 3, 1),
+                                cod_pedc='REC-001', cod_emp1='1', linha=1, descricao='Item', quantidade=10,
+                                preco_unitario=1, total=10)
+        db.session.add(new_item)
+        db.session.commit()
+
+        refresh_item_receipts([('1', 'REC-001')])
+        assert link_item_receipts([order.id]) == 0
+        db.session.commit()
+        receipt = PurchaseItemReceipt.query.one()
+        assert (receipt.num_nf, receipt.purchase_item_id, receipt.quantity) == ('900', new_item.id, 3.0)
+
+
+def test_clean_fulfilled_items_set_based(app: Flask):
+    """Test that match cleanup removes fulfilled and orphaned matches in bulk, and that a dry run only counts."""
+    from app.tasks.match_purchases_nfe import clean_fulfilled_items
+
+    with app.app_context():
+        nfe = NFEData(chave='7' * 44, xml_content='<xml />', numero='700')
+        db.session.add(nfe)
+        fulfilled_order = PurchaseOrder(cod_pedc='CLN-001', dt_emis=date(2024, 3, 1), fornecedor_id=1, is_fulfilled=True)
+        open_order = PurchaseOrder(cod_pedc='CLN-002', dt_emis=date(2024, 3, 1), fornecedor_id=1)
+        db.session.add_all([fulfilled_order, open_order])
+        db.session.flush()
+
+        def add_item(order, linha, quantidade, atendida, canc=None):
+            item = PurchaseItem(
+                purchase_order_id=order.id, item_id=f'IT-{linha}', dt_emis=date(2024, 3, 1), cod_pedc=order.cod_pedc,
+                linha=linha, descricao='Item', quantidade=quantidade, preco_unitario=1, total=1,
+                qtde_atendida=atendida, qtde_canc=canc
+            )
+            db.session.add(item)
+            db.session.flush()
+            return item
+
+        def add_match(item_id, cod_pedc, item_seq):
+            db.session.add(PurchaseItemNFEMatch(
+                purchase_item_id=item_id, cod_pedc=cod_pedc, cod_emp1='1', item_seq=item_seq,
+                nfe_id=nfe.id, nfe_chave=nfe.chave, match_score=90
+            ))
+
+        # Pending item of a fulfilled order: removed with the order
+        add_match(add_item(fulfilled_order, 1, 10, 2).id, 'CLN-001', 1)
+        # Received and canceled items of an open order: removed as fulfilled items
+        add_match(add_item(open_order, 1, 10, 10).id, 'CLN-002', 1)
+        add_match(add_item(open_order, 2, 10, 4, canc=6).id, 'CLN-002', 2)
+        # Orphaned match: its item is gone
+        add_match(None, 'CLN-002', 9)
+        # Still pending: kept
+        add_match(add_item(open_order, 3, 10, 4).id, 'CLN-002', 3)
+        db.session.commit()
+
+        expected = {'fulfilled_orders': 1, 'fulfilled_items': 3, 'total': 4}
+        assert clean_fulfilled_items(dry_run=True) == expected
+        assert PurchaseItemNFEMatch.query.count() == 5
+
+        assert clean_fulfilled_items() == expected
+        remaining = PurchaseItemNFEMatch.query.one()
+        assert (remaining.cod_pedc, remaining.item_seq) == ('CLN-002', 3)
+        assert clean_fulfilled_items()['total'] == 0
+
+
 def test_search_combined_matches_num_nf_from_nfe_match(auth_client: FlaskClient):
     """Test that combined search matches NFE numbers from PurchaseItemNFEMatch."""
     with auth_client.application.app_context():
@@ -1914,6 +2558,360 @@ def test_import_ruah_purchase_orders(auth_client: FlaskClient):
     assert 'imported' in response.json['message'].lower() or 'success' in response.json['message'].lower()
 
 
+def test_record_mapping_aliases_and_converters():
+    """Test that field specs honour alias priority, converters and defaults in one pass."""
+    import xml.etree.ElementTree as ET
+    from app.xml_mapping import Field, RecordMapping, decimal, lenient
+
+    mapping = RecordMapping(
+        Field('descricao', 'ITEM_DESC_TECNICA', 'DESCRICAO'),
+        Field('quantidade', 'QTDE', 'QTD', convert=decimal),
+        Field('num_dias', 'NUM_DIAS', convert=lenient(int)),
+        Field('linha', 'LINHA1'),
+        Field('obs', 'OBS', default=''),
+    )
+    element = ET.fromstring(
+        '<TPEDC_ITEM><LINHA1>1</LINHA1><LINHA1>2</LINHA1><DESCRICAO>Old</DESCRICAO>'
+        '<ITEM_DESC_TECNICA>New</ITEM_DESC_TECNICA><QTD>1,5</QTD><NUM_DIAS>x</NUM_DIAS><OBS/></TPEDC_ITEM>'
+    )
+    assert mapping.read(element) == {
+        'descricao': 'New', 'quantidade': 1.5, 'num_dias': None, 'linha': '1', 'obs': ''
+    }
+
+
+def _ruah_order_xml(cod_pedc, items):
+    lines = ''.join(
+        f"""<TPEDC_ITEM><ITEM_ID>IT-{cod_pedc}-{linha}</ITEM_ID><LINHA1>{linha}</LINHA1>
+            <DESCRICAO>Item {linha}</DESCRICAO><QTD>2.00</QTD><PRECO_UNITARIO>5.00</PRECO_UNITARIO><TOTAL>10.00</TOTAL>
+            <UNIDADE_MEDIDA>UN</UNIDADE_MEDIDA><COD_EMP1>001</COD_EMP1></TPEDC_ITEM>"""
+        for linha in range(1, items + 1)
+    )
+    return f"""<TPED_COMPRA><COD_PEDC>{cod_pedc}</COD_PEDC><DT_EMIS>01/01/2024</DT_EMIS><FOR_COD>1</FOR_COD>
+        <EMPR_ID>001</EMPR_ID><LIST_TPEDC_ITEM>{lines}</LIST_TPEDC_ITEM></TPED_COMPRA>"""
+
+
+def test_process_file_streams_ruah_in_batches(auth_client: FlaskClient):
+    """Test that a chunked RUAH upload is imported in streamed batches, with orders nested in their company."""
+    auth_client.application.config['RUAH_IMPORT_BATCH_SIZE'] = 2
+    orders = ''.join(_ruah_order_xml(f'STR-{n}', items=n) for n in range(1, 6))
+    ruah_xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<RPDC0250><LIST_G_COD_EMP1><G_COD_EMP1>
+    <EMPR_ID2>001</EMPR_ID2><RAZAO_SOCIAL>Stream Company (1)</RAZAO_SOCIAL>
+    <LIST_TPED_COMPRA>{orders}</LIST_TPED_COMPRA>
+    <CNPJ1>12345678000199</CNPJ1>
+</G_COD_EMP1></LIST_G_COD_EMP1></RPDC0250>""".encode('utf-8')
+
+    middle = len(ruah_xml) // 2
+    # Sent out of order: each chunk lands at its offset in the preallocated file
+    for index, offset, chunk in ((1, middle, ruah_xml[middle:]), (0, 0, ruah_xml[:middle])):
+        response = auth_client.post('/api/upload_chunk', data={
+            'file': (BytesIO(chunk), 'blob'), 'chunkIndex': str(index), 'fileId': 'ruah-stream-test',
+            'offset': str(offset), 'totalSize': str(len(ruah_xml)), 'checksum': hashlib.sha256(chunk).hexdigest(),
+        }, content_type='multipart/form-data')
+        assert response.status_code == 200
+
+    response = auth_client.post('/api/process_file', json={
+        'fileId': 'ruah-stream-test', 'filename': 'stream.xml', 'totalChunks': 2, 'totalSize': len(ruah_xml),
+        'sha256': hashlib.sha256(ruah_xml).hexdigest(),
+    })
+    assert response.status_code == 202
+    assert response.json['duplicate'] is False
+
+    job = auth_client.get(response.json['status_url']).json
+    assert job['status'] == 'completed'
+    assert job['result']['status_code'] == 201
+    assert job['result']['message'].startswith('Data imported successfully purchases 5, items 15, updated 0')
+    assert job['progress']['phase'] == 'done'
+    assert job['progress']['filename'] == 'stream.xml'
+    assert (job['progress']['orders'], job['progress']['items']) == (5, 15)
+    assert 'items_per_second' in job['progress']
+
+    with auth_client.application.app_context():
+        assert PurchaseOrder.query.filter(PurchaseOrder.cod_pedc.like('STR-%')).count() == 5
+        assert PurchaseItem.query.filter(PurchaseItem.cod_pedc == 'STR-5').count() == 5
+        company = Company.query.filter_by(cod_emp1='001').one()
+        assert company.name == 'Stream Company'
+        assert company.cnpj == '12345678000199'
+
+
+def test_process_file_ruah_malformed_imports_nothing(auth_client: FlaskClient):
+    """Test that a RUAH file broken after several batches is rolled back entirely."""
+    auth_client.application.config['RUAH_IMPORT_BATCH_SIZE'] = 1
+    orders = ''.join(_ruah_order_xml(f'BRK-{n}', items=1) for n in range(1, 4))
+    ruah_xml = f'<RPDC0250>{orders}<TPED_COMPRA><COD_PEDC>BRK-4</COD_PEDC>'.encode('utf-8')
+
+    response = auth_client.post('/api/upload_chunk', data={
+        'file': (BytesIO(ruah_xml), 'blob'), 'chunkIndex': '0', 'fileId': 'ruah-broken-test'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    response = auth_client.post('/api/process_file', json={'fileId': 'ruah-broken-test'})
+    assert response.status_code == 202
+    assert response.json['status'] == 'failed'
+    assert 'Failed to parse XML data' in response.json['error']
+
+    job = auth_client.get(response.json['status_url']).json
+    assert job['progress']['phase'] == 'failed'
+    assert 'Failed to parse XML data' in job['progress']['errors'][0]
+    with auth_client.application.app_context():
+        assert PurchaseOrder.query.filter(PurchaseOrder.cod_pedc.like('BRK-%')).count() == 0
+
+
+def test_upload_chunk_verifies_checksums_and_completeness(auth_client: FlaskClient):
+    """Test that corrupted chunks are refused and that an incomplete upload is kept for a retry."""
+    document = b'<?xml version="1.0"?>\n<!-- <RPDC0250> -->\n<RFOR0302><LIST_G_FORNEC/></RFOR0302>'
+
+    response = auth_client.post('/api/upload_chunk', data={
+        'file': (BytesIO(document[:10]), 'blob'), 'chunkIndex': '0', 'fileId': 'chk-test', 'offset': '0',
+        'checksum': hashlib.sha256(b'something else').hexdigest(),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert response.json['error'] == 'Chunk checksum mismatch'
+
+    response = auth_client.post('/api/upload_chunk', data={
+        'file': (BytesIO(document[:10]), 'blob'), 'chunkIndex': '0', 'fileId': 'chk-test', 'offset': '0',
+        'totalSize': str(len(document)),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+
+    response = auth_client.post('/api/process_file', json={'fileId': 'chk-test', 'totalChunks': 2})
+    assert response.status_code == 400
+    assert response.json['missing'] == [1]
+
+    auth_client.post('/api/upload_chunk', data={
+        'file': (BytesIO(document[10:]), 'blob'), 'chunkIndex': '1', 'fileId': 'chk-test', 'offset': '10',
+    }, content_type='multipart/form-data')
+    response = auth_client.post('/api/process_file', json={
+        'fileId': 'chk-test', 'totalChunks': 2, 'totalSize': len(document),
+    })
+    assert response.status_code == 202
+    job = auth_client.get(response.json['status_url']).json
+    assert job['status'] == 'completed'
+    assert job['result']['message'].startswith('Suppliers imported: 0 total')
+
+    response = auth_client.post('/api/upload_chunk', data={
+        'file': (BytesIO(document), 'blob'), 'chunkIndex': '0', 'fileId': '../escape'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+def test_upload_chunk_rejects_positions_outside_the_upload(auth_client: FlaskClient):
+    """Test that chunk offsets and sizes are bounded by totalSize and UPLOAD_MAX_MB before anything is written."""
+    auth_client.application.config['UPLOAD_MAX_MB'] = 1
+
+    def send(file_id, chunk=b'<RFOR0302/>', **fields):
+        return auth_client.post('/api/upload_chunk', data={
+            'file': (BytesIO(chunk), 'blob'), 'chunkIndex': '0', 'fileId': file_id,
+            **{name: str(value) for name, value in fields.items()},
+        }, content_type='multipart/form-data')
+
+    assert send('bound-negative', offset=-1).status_code == 400
+    assert send('bound-sparse', offset=1024 * 1024).status_code == 400
+    assert send('bound-total', offset=0, totalSize=2 * 1024 * 1024).status_code == 400
+    assert send('bound-past', offset=5, totalSize=10).status_code == 400
+    assert send('bound-index', chunkIndex='x').status_code == 400
+    for file_id in ('bound-negative', 'bound-sparse', 'bound-total', 'bound-past'):
+        assert not os.path.exists(os.path.join(tempfile.gettempdir(), f'{file_id}.part'))
+
+    assert send('bound-same', chunk=b'<RFOR', offset=0, totalSize=11).status_code == 200
+    response = send('bound-same', chunk=b'0302/>', offset=5, totalSize=4096)
+    assert response.status_code == 400
+    assert response.json['totalSize'] == 11
+    # A chunk without totalSize is held to the one announced earlier
+    assert send('bound-same', chunk=b'0302/>!', offset=5).status_code == 400
+    assert send('bound-same', chunk=b'0302/>', offset=5).status_code == 200
+    response = auth_client.post('/api/process_file', json={'fileId': 'bound-same', 'totalChunks': 1, 'totalSize': 11})
+    assert response.status_code == 202
+
+
+def test_process_file_skips_already_imported_content(auth_client: FlaskClient):
+    """Test that re-uploading a file with the same content returns the earlier job instead of importing again."""
+    ruah_xml = f'<RPDC0250>{_ruah_order_xml("DUP-1", items=2)}</RPDC0250>'.encode('utf-8')
+
+    def upload(file_id, **options):
+        auth_client.post('/api/upload_chunk', data={
+            'file': (BytesIO(ruah_xml), 'blob'), 'chunkIndex': '0', 'fileId': file_id
+        }, content_type='multipart/form-data')
+        return auth_client.post('/api/process_file', json={'fileId': file_id, **options})
+
+    first = upload('dup-first')
+    assert first.status_code == 202
+
+    second = upload('dup-second')
+    assert second.status_code == 200
+    assert second.json['duplicate'] is True
+    assert second.json['job_id'] == first.json['job_id']
+    assert not os.path.exists(os.path.join(tempfile.gettempdir(), 'dup-second_complete.xml'))
+
+    forced = upload('dup-forced', force=True)
+    assert forced.status_code == 202
+    assert forced.json['job_id'] != first.json['job_id']
+    assert forced.json['status'] == 'completed'
+    assert 'updated 1' in forced.json['result']['message']
+
+
+def test_import_bulk_async_queues_jobs(auth_client: FlaskClient):
+    """Test that the bulk endpoint queues one job per file by default and skips repeated content."""
+    ruah_xml = f'<RPDC0250>{_ruah_order_xml("ASYNC-1", items=1)}</RPDC0250>'.encode('utf-8')
+    token = auth_client.post('/auth/generate_jwt_token', json={'expires_in': 60}).json['token']
+
+    response = auth_client.post('/api/import', data={
+        'files': [(BytesIO(ruah_xml), 'a.xml'), (BytesIO(ruah_xml), 'b.xml'), (BytesIO(b'<OTHER/>'), 'c.xml')]
+    }, headers={'Authorization': f'Bearer {token}'}, content_type='multipart/form-data')
+
+    assert response.status_code == 202
+    assert [entry['filename'] for entry in response.json['queued']] == ['a.xml']
+    assert response.json['queued'][0]['status'] == 'completed'
+    assert [entry['filename'] for entry in response.json['skipped']] == ['b.xml']
+    assert response.json['failed'] == [{'filename': 'c.xml', 'reason': 'Unsupported XML document type'}]
+    with auth_client.application.app_context():
+        assert PurchaseOrder.query.filter_by(cod_pedc='ASYNC-1').count() == 1
+
+
+def test_import_dedup_ignores_orphaned_and_failed_jobs(auth_client: FlaskClient):
+    """Test that only a completed import or a live in-flight job makes a re-upload of the same content a duplicate."""
+    from app.models import BackgroundJob
+
+    ruah_xml = f'<RPDC0250>{_ruah_order_xml("ORPH-1", items=1)}</RPDC0250>'.encode('utf-8')
+    key = f'import:{hashlib.sha256(ruah_xml).hexdigest()}'
+    token = auth_client.post('/auth/generate_jwt_token', json={'expires_in': 60}).json['token']
+
+    def upload():
+        return auth_client.post('/api/import', data={'files': [(BytesIO(ruah_xml), 'orphan.xml')]},
+                                headers={'Authorization': f'Bearer {token}'}, content_type='multipart/form-data')
+
+    with auth_client.application.app_context():
+        stale = datetime.now() - timedelta(hours=1)
+        db.session.add_all([
+            BackgroundJob(job_type='xml_import', status='running', concurrency_key=key, updated_at=stale),
+            BackgroundJob(job_type='xml_import', status='queued', concurrency_key=key, updated_at=stale),
+            BackgroundJob(job_type='xml_import', status='failed', concurrency_key=key),
+            BackgroundJob(job_type='xml_import', status='completed', concurrency_key=key,
+                          result={'status_code': 400, 'error': 'boom'}),
+        ])
+        db.session.commit()
+        live = BackgroundJob(job_type='xml_import', status='running', concurrency_key=key)
+        db.session.add(live)
+        db.session.commit()
+        live_id = live.id
+
+    response = upload()
+    assert response.json['skipped'][0]['job_id'] == live_id
+
+    with auth_client.application.app_context():
+        db.session.get(BackgroundJob, live_id).status = 'failed'
+        db.session.commit()
+
+    response = upload()
+    assert response.status_code == 202
+    assert response.json['queued'][0]['status'] == 'completed'
+    assert upload().json['skipped'][0]['job_id'] == response.json['queued'][0]['job_id']
+
+
+def test_import_bulk_parses_in_parallel(auth_client: FlaskClient):
+    """Test that bulk files parsed in worker processes are written per file, same-type files in upload order."""
+    auth_client.application.config['XML_IMPORT_WORKERS'] = 2
+    token = auth_client.post('/auth/generate_jwt_token', json={'expires_in': 60}).json['token']
+    first = f'<RPDC0250>{_ruah_order_xml("PAR-1", items=3)}</RPDC0250>'.encode('utf-8')
+    second = f'<RPDC0250>{_ruah_order_xml("PAR-1", items=1)}</RPDC0250>'.encode('utf-8')
+
+    response = auth_client.post('/api/import?async=0', data={'files': [
+        (BytesIO(first), 'first.xml'), (BytesIO(b'<RCOT0300><G_1>'), 'broken.xml'), (BytesIO(second), 'second.xml')
+    ]}, headers={'Authorization': f'Bearer {token}'}, content_type='multipart/form-data')
+
+    assert response.status_code == 207
+    assert response.json['total_processed'] == 3
+    assert [entry['filename'] for entry in response.json['successful']] == ['first.xml', 'second.xml']
+    assert response.json['successful'][0]['details']['message'].startswith('Data imported successfully purchases 1')
+    assert response.json['failed'] == [{'filename': 'broken.xml', 'reason': 'Invalid XML structure'}]
+    with auth_client.application.app_context():
+        assert PurchaseItem.query.filter_by(cod_pedc='PAR-1').count() == 1
+
+
+def test_report_importers_upsert_with_insert_counts(app: Flask):
+    """Test that RCOT0300, RFOR0302 and RPDC0250C imports upsert on their keys and count new rows apart from changed ones."""
+    from app.utils import import_rcot0300, import_rfor0302, import_rpdc0250c
+
+    def quotation(item_id, price):
+        return f"""<G_4><COD_ITEM>{item_id}</COD_ITEM><DESC_ITEM>Item</DESC_ITEM><QTDE>2,00</QTDE>
+            <PRECO_UNITARIO>{price}</PRECO_UNITARIO><COD_EMP>001</COD_EMP></G_4>"""
+
+    def rcot(*items):
+        return (f'<RCOT0300><G_1><COD_COT>UPS-1</COD_COT><DT_EMISSAO>01/01/2024</DT_EMISSAO><G_2><G_3>'
+                f'<ID_FORN>7</ID_FORN><FORNECEDOR>Forn</FORNECEDOR>{"".join(items)}</G_3></G_2></G_1></RCOT0300>').encode()
+
+    with app.app_context():
+        response, _ = import_rcot0300(rcot(quotation('A', '1,00'), quotation('B', '1,00'), quotation('B', '2,00')))
+        assert response.get_json()['message'].endswith('3 total quotations (2 new, 0 updated)')
+        response, _ = import_rcot0300(rcot(quotation('A', '1,00'), quotation('B', '3,00'), quotation('C', '1,00')))
+        assert response.get_json()['message'].endswith('3 total quotations (1 new, 1 updated)')
+        assert sorted((q.item_id, q.preco_unitario) for q in Quotation.query.filter_by(cod_cot='UPS-1')) == [
+            ('A', 1.0), ('B', 3.0), ('C', 1.0)
+        ]
+
+        rfor = b'<RFOR0302><G_FORNEC><COD_FOR>900</COD_FOR><DESCRICAO>%s</DESCRICAO>' \
+               b'<NVL_FORN_CNPJ_FORN_CPF>12.345.678/0001-95</NVL_FORN_CNPJ_FORN_CPF></G_FORNEC></RFOR0302>'
+        assert import_rfor0302(rfor % b'Old')[0].get_json()['message'] == 'Suppliers imported: 1 total (1 new, 0 updated)'
+        assert import_rfor0302(rfor % b'New')[0].get_json()['message'] == 'Suppliers imported: 1 total (0 new, 1 updated)'
+        supplier = Supplier.query.filter_by(cod_for='900').one()
+        assert (supplier.descricao, supplier.cnpj_cpf_normalized) == ('New', '12345678000195')
+
+        # A line already synced from Focco is kept; only the other NF becomes a provisional XML row
+        db.session.add(NFEntry(itnfe_id='555', origem='FOCCO', cod_emp1='001', cod_pedc='P1', linha='1', num_nf='10'))
+        db.session.commit()
+        rpdc = b"""<RPDC0250C><G_COD_EMP1><COD_EMP>001</COD_EMP><CGG_TPEDC_ITEM><CODIGO_PEDIDO>P1</CODIGO_PEDIDO>
+            <LINHA1>1</LINHA1><G_NFE><NUM_NF>10</NUM_NF></G_NFE><G_NFE><NUM_NF>11</NUM_NF><QTDE1>%s</QTDE1></G_NFE>
+            </CGG_TPEDC_ITEM></G_COD_EMP1></RPDC0250C>"""
+        assert import_rpdc0250c(rpdc % b'1,0')[0].get_json()['message'] == \
+            'Data imported successfully: 1 new entries, 0 updated'
+        assert import_rpdc0250c(rpdc % b'2,0')[0].get_json()['message'] == \
+            'Data imported successfully: 0 new entries, 1 updated'
+        assert sorted((e.itnfe_id, e.origem) for e in NFEntry.query.filter_by(cod_pedc='P1')) == [
+            ('555', 'FOCCO'), ('XML-001-P1-1-11', 'XML')
+        ]
+
+
+def test_import_ruah_reimport_diffs_items(app: Flask):
+    """Test that re-importing an order keeps unchanged item ids and their NFE matches, and drops vanished lines."""
+    from app.utils import import_ruah
+
+    def ruah_document(items, quantity='2.00'):
+        order = _ruah_order_xml('DIFF-1', items=items).replace(
+            '<QTD>2.00</QTD><PRECO_UNITARIO>5.00</PRECO_UNITARIO><TOTAL>10.00</TOTAL>\n'
+            '            <UNIDADE_MEDIDA>UN</UNIDADE_MEDIDA><COD_EMP1>001</COD_EMP1></TPEDC_ITEM>',
+            f'<QTD>{quantity}</QTD><PRECO_UNITARIO>5.00</PRECO_UNITARIO><TOTAL>10.00</TOTAL>\n'
+            '            <UNIDADE_MEDIDA>UN</UNIDADE_MEDIDA><COD_EMP1>001</COD_EMP1></TPEDC_ITEM>', 1
+        )
+        return f'<RPDC0250>{order}</RPDC0250>'.encode('utf-8')
+
+    with app.app_context():
+        import_ruah(ruah_document(items=3))
+        order = PurchaseOrder.query.filter_by(cod_pedc='DIFF-1', cod_emp1='001').one()
+        item_ids = {item.linha: item.id for item in PurchaseItem.query.filter_by(purchase_order_id=order.id)}
+        assert sorted(item_ids) == [1, 2, 3]
+
+        nfe_data = NFEData(chave='3' * 44, xml_content='<xml />', numero='777')
+        db.session.add(nfe_data)
+        db.session.flush()
+        db.session.add(PurchaseItemNFEMatch(
+            purchase_item_id=item_ids[2], cod_pedc='DIFF-1', cod_emp1='001', item_seq=2,
+            nfe_id=nfe_data.id, nfe_chave=nfe_data.chave, nfe_numero='777', match_score=90
+        ))
+        db.session.commit()
+
+        # Line 1 now has another quantity and line 3 left the order
+        response, status = import_ruah(ruah_document(items=2, quantity='4.00'))
+        assert status == 201
+        assert 'purchases 0, items 2, updated 1' in response.json['message']
+
+        items = {item.linha: item for item in PurchaseItem.query.filter_by(purchase_order_id=order.id)}
+        assert sorted(items) == [1, 2]
+        assert items[1].id == item_ids[1] and items[1].quantidade == 4.0
+        assert items[2].id == item_ids[2]
+        assert PurchaseItemNFEMatch.query.one().purchase_item_id == item_ids[2]
+        assert PurchaseOrder.query.filter_by(cod_pedc='DIFF-1').count() == 1
+
+
 # ==================== ADDITIONAL TESTS FROM test_routes.py ====================
 
 def test_get_last_update(auth_client: FlaskClient):
@@ -2149,6 +3147,108 @@ def test_dashboard_summary_with_buyer_filter(auth_client: FlaskClient):
     assert 'buyer_data' in response.json
 
 
+def test_dashboard_summary_reads_monthly_rollups(auth_client: FlaskClient):
+    """Test that the dashboard aggregates come from the rollups, refreshed per month after writes."""
+    from app.utils import (
+        increment_nfe_monthly_rollups, order_months, refresh_order_summaries, refresh_purchase_rollups
+    )
+
+    with auth_client.application.app_context():
+        orders = [
+            PurchaseOrder(cod_pedc='ROLL-001', cod_emp1='1', dt_emis=date(2024, 5, 3), fornecedor_id=7,
+                          fornecedor_descricao='Fornecedor Rollup', func_nome='Comprador A',
+                          total_pedido_com_ipi=100.0, is_fulfilled=True),
+            PurchaseOrder(cod_pedc='ROLL-002', cod_emp1='1', dt_emis=date(2024, 5, 20), fornecedor_id=7,
+                          fornecedor_descricao='Fornecedor Rollup', func_nome='Comprador A',
+                          total_pedido_com_ipi=300.0),
+            PurchaseOrder(cod_pedc='ROLL-003', cod_emp1='1', dt_emis=date(2024, 6, 1), fornecedor_id=8,
+                          fornecedor_descricao='Outro Fornecedor', func_nome='Comprador B',
+                          total_pedido_com_ipi=50.0),
+        ]
+        db.session.add_all(orders)
+        db.session.flush()
+        for order, quantities in zip(orders, [(2, 3), (5,), (1,)]):
+            for linha, quantidade in enumerate(quantities, start=1):
+                db.session.add(PurchaseItem(
+                    purchase_order_id=order.id, item_id=f'IT-{linha}', dt_emis=order.dt_emis, cod_pedc=order.cod_pedc,
+                    cod_emp1='1', linha=linha, descricao='Item', quantidade=quantidade, preco_unitario=1, total=1
+                ))
+        db.session.flush()
+        order_ids = [order.id for order in orders]
+        refresh_order_summaries(order_ids)
+        assert order_months(order_ids) == {(2024, 5), (2024, 6)}
+        assert refresh_purchase_rollups(order_months(order_ids)) == 2
+        increment_nfe_monthly_rollups([
+            {'data_emissao': datetime(2024, 5, 10), 'valor_total': 80.0},
+            {'data_emissao': datetime(2024, 6, 2), 'valor_total': 20.0},
+            {'data_emissao': None, 'valor_total': 999.0},
+        ])
+        db.session.commit()
+
+        # Refreshing a month rewrites its rows instead of adding to them
+        assert refresh_purchase_rollups({(2024, 5)}) == 1
+        db.session.commit()
+
+    response = auth_client.get('/api/dashboard_summary', query_string={
+        'start_date': '2024-05-01', 'end_date': '2024-06-30', 'months': 2
+    })
+    assert response.status_code == 200
+    summary = response.json['summary']
+    assert (summary['total_orders'], summary['total_items'], summary['total_value']) == (3, 4, 450.0)
+    assert (summary['total_quantity'], summary['total_suppliers'], summary['fulfilled_orders']) == (11.0, 2, 1)
+    assert (summary['nfe_count'], summary['nfe_total_value']) == (2, 100.0)
+    buyers = {buyer['name']: buyer for buyer in response.json['buyer_data']}
+    assert buyers['Comprador A'] == {
+        'name': 'Comprador A', 'order_count': 2, 'total_value': 400.0, 'avg_value': 200.0, 'item_count': 3
+    }
+    assert response.json['all_purchasers'] == ['Comprador A', 'Comprador B']
+
+    response = auth_client.get('/api/dashboard_summary', query_string={
+        'start_date': '2024-05-01', 'end_date': '2024-06-30', 'buyer': 'Comprador B'
+    })
+    assert response.json['summary']['total_orders'] == 1
+    assert response.json['summary']['nfe_count'] == 2
+
+
+def test_dashboard_summary_partial_months_use_exact_window(auth_client: FlaskClient):
+    """Test that a range starting or ending mid-month aggregates the edge months from the base tables, like the order lists."""
+    from app.utils import rebuild_nfe_monthly_rollups, refresh_order_summaries, refresh_purchase_rollups
+
+    with auth_client.application.app_context():
+        orders = [
+            PurchaseOrder(cod_pedc=cod_pedc, cod_emp1='1', dt_emis=dt_emis, fornecedor_id=7, fornecedor_descricao='Fornecedor',
+                          func_nome=buyer, total_pedido_com_ipi=total)
+            for cod_pedc, dt_emis, buyer, total in [
+                ('EDGE-001', date(2024, 5, 3), 'Comprador A', 100.0),
+                ('EDGE-002', date(2024, 5, 20), 'Comprador B', 300.0),
+                ('EDGE-003', date(2024, 6, 1), 'Comprador B', 50.0),
+                ('EDGE-004', date(2024, 7, 16), 'Comprador C', 70.0),
+            ]
+        ]
+        db.session.add_all(orders)
+        for index, emitted in enumerate([datetime(2024, 5, 5), datetime(2024, 5, 25, 14), datetime(2024, 6, 20),
+                                         datetime(2024, 7, 15, 23)]):
+            db.session.add(NFEData(chave=f'{index:044d}', xml_content='<xml />', data_emissao=emitted, valor_total=10.0))
+        db.session.flush()
+        refresh_order_summaries([order.id for order in orders])
+        refresh_purchase_rollups()
+        db.session.commit()
+        rebuild_nfe_monthly_rollups()
+
+    response = auth_client.get('/api/dashboard_summary', query_string={
+        'start_date': '2024-05-10', 'end_date': '2024-07-15', 'months': 3
+    })
+    assert response.status_code == 200
+    summary = response.json['summary']
+    assert (summary['total_orders'], summary['total_value']) == (2, 350.0)
+    assert (summary['nfe_count'], summary['nfe_total_value']) == (3, 30.0)
+    monthly = {month['month']: month['order_count'] for month in response.json['monthly_data']}
+    assert (monthly['May/24'], monthly['Jun/24']) == (1, 1)
+    assert response.json['all_purchasers'] == ['Comprador B']
+    assert [buyer['total_value'] for buyer in response.json['buyer_data']] == [350.0]
+    assert sorted(order['cod_pedc'] for order in response.json['recent_orders']) == ['EDGE-002', 'EDGE-003']
+
+
 def test_dashboard_summary_with_date_range_extended(auth_client: FlaskClient):
     """Test dashboard summary with custom date range."""
     response = auth_client.get('/api/dashboard_summary', query_string={
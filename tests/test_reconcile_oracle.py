@@ -0,0 +1,168 @@
+"""
+Tests for the Oracle/Postgres drift detection.
+
+The Oracle side is replaced by a local stand-in: fingerprints are computed in
+Python from a list of Focco rows, and the stage queries issued during a resync
+are answered by a fake connection that returns the rows of the requested months.
+"""
+import pytest
+from datetime import date
+from app import create_app, db
+from app.models import NFEntry, PurchaseOrder
+from app.tasks.reconcile_oracle import OracleReconcileSource, reconcile, row_hash
+
+
+@pytest.fixture
+def app():
+    """Create application for testing."""
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def focco_entry(itnfe_id, dt_ent, num_nf='100'):
+    return {
+        'itnfe_id': str(itnfe_id), 'origem': 'FOCCO', 'cod_emp1': '1', 'cod_pedc': '500', 'linha': '1',
+        'num_nf': num_nf, 'dt_ent': dt_ent, 'obs_conf': None, 'chave_acesso_nfel': None, 'qtde': '1',
+    }
+
+
+class StandInCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.description = []
+
+    def execute(self, query, params=None):
+        params = params or {}
+        self.connection.queries.append((query, params))
+        months = {value for key, value in params.items() if key.startswith('month_')}
+        rows = [row for row in self.connection.rows if row['dt_ent'].strftime('%Y-%m') in months]
+        columns = list(self.connection.rows[0])
+        self.description = [(column.upper(),) for column in columns]
+        self.rows = [tuple(row[column] for column in columns) for row in rows]
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        pass
+
+
+class StandInConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def cursor(self):
+        return StandInCursor(self)
+
+
+class StandInSource(OracleReconcileSource):
+    """Oracle stand-in holding Focco NF entry rows."""
+
+    def __init__(self, rows, fingerprints=None):
+        super().__init__(StandInConnection(rows))
+        self.rows = rows
+        self.extra_fingerprints = fingerprints or {}
+
+    def fingerprints(self, entity):
+        if entity != 'nf_entries':
+            return self.extra_fingerprints.get(entity, {})
+        buckets = {}
+        for row in self.rows:
+            count, total, hashes = buckets.get(row['dt_ent'].strftime('%Y-%m'), (0, 0.0, 0))
+            hashed = row_hash(row['itnfe_id'], row['cod_pedc'], row['linha'], row['num_nf'],
+                              row['dt_ent'].isoformat(), row['chave_acesso_nfel'], row['qtde'])
+            buckets[row['dt_ent'].strftime('%Y-%m')] = (count + 1, total + int(row['itnfe_id']), hashes + hashed)
+        return buckets
+
+
+def test_reconcile_resyncs_only_mismatched_months(app):
+    """Test that only drifted months are re-synced through the stage and that leftovers are reported."""
+    oracle_rows = [
+        focco_entry(1, date(2025, 1, 5)),
+        focco_entry(2, date(2025, 1, 6)),
+        focco_entry(3, date(2025, 2, 3)),
+        focco_entry(4, date(2025, 2, 4)),
+    ]
+    with app.app_context():
+        db.session.add_all([
+            NFEntry(**focco_entry(1, date(2025, 1, 5))),
+            NFEntry(**focco_entry(2, date(2025, 1, 6))),
+            NFEntry(**focco_entry(3, date(2025, 2, 3))),
+            # Deleted in Oracle: upsert-only stages cannot remove it
+            NFEntry(**focco_entry(9, date(2025, 3, 1))),
+            # Provisional XML rows are not part of the fingerprint
+            NFEntry(itnfe_id='XML-1-500-1-100', origem='XML', cod_emp1='1', cod_pedc='500', linha='1',
+                    num_nf='100', dt_ent=date(2025, 1, 5)),
+        ])
+        db.session.commit()
+
+        source = StandInSource(oracle_rows)
+        report = reconcile(source, entities=['nf_entries'])
+
+        entry = report['nf_entries']
+        assert entry['buckets'] == 3
+        assert entry['mismatched'] == ['2025-02', '2025-03']
+        assert entry['oracle_rows'] == 4
+        assert entry['postgres_rows'] == 4
+        assert entry['resynced_rows'] == 2
+        assert entry['still_mismatched'] == ['2025-03']
+
+        (query, params), = source.connection.queries
+        assert "TO_CHAR(nfe.DT_ENT, 'YYYY-MM') IN (:month_0, :month_1)" in query
+        assert params == {'month_0': '2025-02', 'month_1': '2025-03'}
+        assert NFEntry.query.filter_by(itnfe_id='4').count() == 1
+        # The stage also replaced the provisional XML row of the re-synced NF
+        assert NFEntry.query.filter_by(origem='XML').count() == 0
+        assert NFEntry.query.count() == 5
+
+
+def test_reconcile_dry_run_reports_without_resync(app):
+    """Test that a dry run compares order fingerprints without touching the data."""
+    with app.app_context():
+        db.session.add(PurchaseOrder(
+            cod_pedc='500', cod_emp1='1', dt_emis=date(2025, 1, 10), fornecedor_id=1,
+            total_bruto=100.0, total_liquido=90.0, id_ped_focco=77
+        ))
+        db.session.commit()
+
+        source = StandInSource([], fingerprints={'purchase_orders': {
+            '2025-01': (1, 77.0, 100.0, 90.0, row_hash('77', '500', '2025-01-10', None, None, None, None)),
+            '2025-02': (1, 78.0, 50.0, 50.0, row_hash('78', '501', '2025-02-03', None, None, None, None)),
+        }})
+        report = reconcile(source, entities=['purchase_orders'], resync=False)
+
+        assert report['purchase_orders']['mismatched'] == ['2025-02']
+        assert 'resynced_rows' not in report['purchase_orders']
+        assert source.connection.queries == []
+
+
+def test_reconcile_detects_text_only_drift(app):
+    """Test that a month whose rows differ only in text columns (same IDs and counts) is found and resynced."""
+    oracle_rows = [focco_entry(1, date(2025, 1, 5)), focco_entry(2, date(2025, 2, 3)), focco_entry(3, date(2025, 3, 4))]
+    oracle_rows[1]['chave_acesso_nfel'] = '4' * 44
+    with app.app_context():
+        db.session.add_all([
+            NFEntry(**focco_entry(1, date(2025, 1, 5))),
+            # Access key filled in Oracle after the row was synced
+            NFEntry(**focco_entry(2, date(2025, 2, 3))),
+            # NF number corrected in Oracle: detected, but not an update column of the stage
+            NFEntry(**focco_entry(3, date(2025, 3, 4), num_nf='99')),
+        ])
+        db.session.commit()
+
+        report = reconcile(StandInSource(oracle_rows), entities=['nf_entries'])
+
+        entry = report['nf_entries']
+        assert entry['mismatched'] == ['2025-02', '2025-03']
+        assert entry['still_mismatched'] == ['2025-03']
+        assert NFEntry.query.filter_by(itnfe_id='2').one().chave_acesso_nfel == '4' * 44
@@ -300,5 +300,60 @@ def test_relink_partial_matches(app):
         print("✅ Partial matches test passed!")
 
 
+def test_relink_many_orders_scoped_to_touched_orders(app):
+    """Test the set-based relink over many orders, restricted to the orders an import touched."""
+    with app.app_context():
+        nfe = NFEData(
+            chave='55555555555555555555555555555555555555555555',
+            xml_content='<test>xml</test>',
+            numero='555',
+            data_emissao=datetime(2025, 1, 15)
+        )
+        db.session.add(nfe)
+        db.session.flush()
+
+        orders = []
+        for number in range(200):
+            order = PurchaseOrder(
+                cod_pedc=f'SCALE-{number}',
+                cod_emp1='001',
+                dt_emis=date(2025, 1, 1),
+                fornecedor_id=100
+            )
+            orders.append(order)
+        db.session.add_all(orders)
+        db.session.flush()
+
+        for order in orders:
+            for linha in range(1, 6):
+                db.session.add(PurchaseItem(
+                    purchase_order_id=order.id, cod_pedc=order.cod_pedc, cod_emp1='001', item_id=f'ITEM{linha}',
+                    linha=linha, dt_emis=date(2025, 1, 1), descricao=f'Item {linha}',
+                    quantidade=1.0, preco_unitario=1.0, total=1.0
+                ))
+                # Orphaned match, as left behind by deleted items
+                db.session.add(PurchaseItemNFEMatch(
+                    purchase_item_id=None, cod_pedc=order.cod_pedc, cod_emp1='001', item_seq=linha,
+                    nfe_id=nfe.id, nfe_chave=nfe.chave, match_score=80.0
+                ))
+        db.session.commit()
+
+        touched = [order.id for order in orders[:50]]
+        assert relink_purchase_item_nfe_matches(touched) == 250
+        assert PurchaseItemNFEMatch.query.filter(PurchaseItemNFEMatch.purchase_item_id.is_(None)).count() == 750
+
+        # Every match points at the item with its own order and line
+        linked = db.session.query(PurchaseItemNFEMatch, PurchaseItem)\
+            .join(PurchaseItem, PurchaseItemNFEMatch.purchase_item_id == PurchaseItem.id).all()
+        assert len(linked) == 250
+        assert all(
+            (match.cod_pedc, match.item_seq) == (item.cod_pedc, item.linha) for match, item in linked
+        )
+
+        # Unscoped: the remaining orders are relinked, already linked matches are left alone
+        assert relink_purchase_item_nfe_matches() == 750
+        assert relink_purchase_item_nfe_matches() == 0
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v', '-s'])
@@ -0,0 +1,512 @@
+"""
+Tests for the Oracle sync plumbing.
+
+Oracle is replaced by fake cursors and connections that serve rows from
+Python lists, so the batching, prefetching and partitioning can be checked
+without an Oracle client.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app import create_app, db
+from app.models import PurchaseAdjustment, PurchaseOrder, Supplier, SyncState
+from app.tasks import sync_oracle
+from app.tasks.sync_oracle import (
+    change_filter, id_ranges, iter_oracle_batches, merge_batch_streams, needs_full_reconcile, prefetch_batches,
+    run_stage, run_stage_graph, stage_batches, sync_purchase_adjustments, sync_suppliers
+)
+from app.utils import import_rfor0302
+
+
+@pytest.fixture
+def app():
+    """Create application for testing."""
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+        self.description = []
+        self.fetch_sizes = []
+        self.closed = False
+
+    def execute(self, query, params=None):
+        params = params or {}
+        self.connection.queries.append((query, params))
+        ids = [row[0] for row in self.connection.rows]
+        if 'GET_SYSTEM_CHANGE_NUMBER' in query:
+            self.rows = [(self.connection.scn,)]
+            return
+        if query.startswith('SELECT MIN(ID), MAX(ID)'):
+            self.rows = [(min(ids), max(ids)) if ids else (None, None)]
+            return
+        self.description = [(column.upper(),) for column in self.connection.columns]
+        self.rows = [
+            row for row in self.connection.rows
+            if 'range_start' not in params or params['range_start'] <= row[0] <= params['range_end']
+        ]
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """Serves tuples of `columns` (id first, by default (id, name)) to any query, and a fixed current SCN."""
+
+    def __init__(self, rows, columns=('id', 'name'), scn=1000):
+        self.rows = rows
+        self.columns = columns
+        self.scn = scn
+        self.queries = []
+        self.cursors = []
+
+    def cursor(self):
+        cursor = FakeCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+
+class FakePool:
+    def __init__(self, rows):
+        self.rows = rows
+        self.acquired = 0
+        self.released = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return FakeConnection(self.rows)
+
+    def release(self, connection):
+        self.released += 1
+
+
+def run_with_timeout(target, timeout=5):
+    """Run target in a thread and return (finished, result or exception), so a hang fails the test."""
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = target()
+        except BaseException as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive(), outcome
+
+
+def test_iter_oracle_batches_is_bounded_by_batch_size():
+    """Test that rows are fetched with fetchmany in batches of at most batch_size, as lowercase dicts."""
+    connection = FakeConnection([(i, f'row {i}') for i in range(7)])
+
+    batches = list(iter_oracle_batches(connection, 'SELECT ID, NAME FROM T', batch_size=3))
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert batches[0][0] == {'id': 0, 'name': 'row 0'}
+    assert [row['id'] for batch in batches for row in batch] == list(range(7))
+    cursor = connection.cursors[0]
+    assert set(cursor.fetch_sizes) == {3}
+    assert cursor.closed
+
+
+def test_iter_oracle_batches_closes_cursor_when_abandoned():
+    """Test that the cursor is closed when the consumer stops early."""
+    connection = FakeConnection([(i, 'x') for i in range(10)])
+    batches = iter_oracle_batches(connection, 'SELECT ID, NAME FROM T', batch_size=2)
+
+    next(batches)
+    batches.close()
+
+    assert connection.cursors[0].closed
+
+
+def test_prefetch_batches_keeps_order():
+    """Test that a single prefetched stream yields every batch in its original order."""
+    batches = [[{'id': i}] for i in range(20)]
+
+    assert list(prefetch_batches(iter(batches), depth=2)) == batches
+
+
+def test_merge_batch_streams_delivers_every_row():
+    """Test that merged streams deliver all their batches, each stream's batches in order."""
+    def stream(position):
+        for seq in range(15):
+            yield [{'stream': position, 'seq': seq}]
+
+    merged = list(merge_batch_streams([stream(position) for position in range(3)], depth=2))
+
+    assert len(merged) == 45
+    for position in range(3):
+        assert [batch[0]['seq'] for batch in merged if batch[0]['stream'] == position] == list(range(15))
+
+
+def test_merge_batch_streams_buffers_at_most_depth_batches():
+    """Test that a producer runs at most `depth` batches ahead of the consumer, and stops when the consumer does."""
+    produced = []
+    finished = threading.Event()
+
+    def batches():
+        try:
+            for seq in range(100):
+                produced.append(seq)
+                yield [{'seq': seq}]
+        finally:
+            finished.set()
+
+    stream = prefetch_batches(batches(), depth=2)
+    assert next(stream) == [{'seq': 0}]
+    time.sleep(0.3)
+    # The batch handed over, `depth` buffered, and one waiting to be put
+    assert len(produced) <= 4
+
+    stream.close()
+    assert finished.wait(5)
+
+
+def test_merge_batch_streams_raises_producer_errors():
+    """Test that an exception in a producer reaches the consumer instead of leaving it waiting."""
+    def failing():
+        yield [{'id': 1}]
+        raise RuntimeError('ORA-03113: end-of-file on communication channel')
+
+    def healthy():
+        for seq in range(50):
+            yield [{'id': seq}]
+
+    finished, outcome = run_with_timeout(lambda: list(merge_batch_streams([healthy(), failing()], depth=1)))
+
+    assert finished
+    assert isinstance(outcome.get('error'), RuntimeError)
+    assert 'ORA-03113' in str(outcome['error'])
+
+
+def test_merge_batch_streams_raises_errors_before_first_batch():
+    """Test that a producer failing before its first batch also reaches the consumer."""
+    def failing():
+        raise ValueError('bad query')
+        yield
+
+    finished, outcome = run_with_timeout(lambda: list(prefetch_batches(failing())))
+
+    assert finished
+    assert isinstance(outcome.get('error'), ValueError)
+
+
+@pytest.mark.parametrize('low, high, partitions', [
+    (1, 100, 4), (1, 100, 3), (7, 7, 4), (1, 3, 8), (-5, 1000003, 7), (10, 11, 2),
+])
+def test_id_ranges_cover_span_without_gaps_or_overlaps(low, high, partitions):
+    """Test that the ranges tile MIN(ID)..MAX(ID) exactly and never exceed the requested count."""
+    ranges = id_ranges(FakeConnection([(low, 'a'), (high, 'b')]), 'T', partitions)
+
+    assert 1 <= len(ranges) <= partitions
+    assert ranges[0][0] == low and ranges[-1][1] == high
+    assert all(start <= end for start, end in ranges)
+    assert all(next_start == end + 1 for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+
+
+def test_id_ranges_more_partitions_than_rows():
+    """Test that asking for more partitions than IDs yields one range per ID, not empty ranges."""
+    assert id_ranges(FakeConnection([(1, 'a'), (2, 'b'), (3, 'c')]), 'T', 10) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_id_ranges_single_row_and_empty_table():
+    """Test the degenerate spans: one row is one range, an empty table has none."""
+    assert id_ranges(FakeConnection([(42, 'a')]), 'T', 4) == [(42, 42)]
+    assert id_ranges(FakeConnection([]), 'T', 4) == []
+
+
+def test_partitioned_stage_batches_match_single_cursor():
+    """Test that the ranged, pooled path returns the same rows as the single-cursor path."""
+    rows = [(row_id, f'row {row_id}') for row_id in (3, 4, 9, 10, 11, 250, 251, 999, 1000, 5000)]
+    query = 'SELECT ID, NAME FROM T WHERE {change_filter}'
+
+    single = stage_batches(FakeConnection(rows), query, '1 = 1', {})
+    pool = FakePool(rows)
+    partitioned = stage_batches(FakeConnection(rows), query, '1 = 1', {}, partition=('T', 'ID'), pool=pool, partitions=4)
+
+    single_rows = [row for batch in single for row in batch]
+    partitioned_rows = [row for batch in partitioned for row in batch]
+    assert sorted(partitioned_rows, key=lambda row: row['id']) == single_rows
+    assert len(single_rows) == len(rows)
+    assert pool.acquired == pool.released == 4
+
+
+def test_change_filter():
+    """Test that incremental filters OR their ORA_ROWSCN predicates and a full run selects every row."""
+    assert change_filter(['a.ORA_ROWSCN > :since_scn', 'b.ORA_ROWSCN > :since_scn'], 500) == (
+        '(a.ORA_ROWSCN > :since_scn OR b.ORA_ROWSCN > :since_scn)', {'since_scn': 500}
+    )
+    assert change_filter(['a.ORA_ROWSCN > :since_scn'], None) == ('1 = 1', {})
+
+
+def test_get_current_scn_reads_the_exact_scn():
+    """Test that the watermark SCN comes from DBMS_FLASHBACK rather than the time-based TIMESTAMP_TO_SCN."""
+    connection = FakeConnection([], scn=123456789)
+
+    assert sync_oracle.get_current_scn(connection) == 123456789
+    assert 'DBMS_FLASHBACK.GET_SYSTEM_CHANGE_NUMBER' in connection.queries[0][0]
+
+
+class RecordingStage:
+    """Stage function that records how it was called and returns preset stats (or raises)."""
+
+    def __init__(self, stats=None, error=None):
+        self.calls = []
+        self.stats = stats
+        self.error = error
+
+    def __call__(self, oracle_conn, since_scn, pool=None, partitions=1):
+        self.calls.append((since_scn, partitions))
+        if self.error:
+            raise self.error
+        return Counter(self.stats or {'sent': 3, 'changed': 1, 'unchanged': 2})
+
+
+def test_run_stage_advances_watermark_and_runs_incrementally(app, monkeypatch):
+    """Test that the first run is full, later runs start from the watermark captured before extraction."""
+    monkeypatch.setattr(sync_oracle, 'SYNC_STAGE_PARTITIONS', 4)
+    stage = RecordingStage()
+
+    with app.app_context():
+        run_stage(FakeConnection([], scn=1000), 'suppliers', stage)
+        state = db.session.get(SyncState, 'suppliers')
+        assert (state.watermark_scn, state.rows_synced) == (1000, 3)
+        assert state.last_full_sync_at is not None
+
+        run_stage(FakeConnection([], scn=1500), 'suppliers', stage)
+        assert stage.calls == [(None, 4), (1000, 1)]
+        assert db.session.get(SyncState, 'suppliers').watermark_scn == 1500
+
+
+def test_run_stage_keeps_watermark_when_stage_fails(app):
+    """Test that a failing stage leaves its watermark where it was, so the next run retries the same changes."""
+    with app.app_context():
+        db.session.add(SyncState(stage='suppliers', watermark_scn=700, last_full_sync_at=datetime.now()))
+        db.session.commit()
+
+        with pytest.raises(RuntimeError):
+            run_stage(FakeConnection([], scn=900), 'suppliers', RecordingStage(error=RuntimeError('ORA-01555')))
+        db.session.rollback()
+
+        assert db.session.get(SyncState, 'suppliers').watermark_scn == 700
+
+
+def test_run_stage_holds_watermark_below_rows_waiting_for_their_order(app):
+    """Test that a retry_scn reported by the stage caps the new watermark just below it."""
+    stage = RecordingStage({'sent': 1, 'changed': 1, 'unchanged': 0, 'unmatched': 2, 'retry_scn': 950})
+
+    with app.app_context():
+        db.session.add(SyncState(stage='purchase_items', watermark_scn=700, last_full_sync_at=datetime.now()))
+        db.session.commit()
+
+        run_stage(FakeConnection([], scn=1000), 'purchase_items', stage)
+        assert db.session.get(SyncState, 'purchase_items').watermark_scn == 949
+
+
+def test_periodic_full_reconcile(app, monkeypatch):
+    """Test that a stage runs in full on its first run and again once SYNC_FULL_RECONCILE_DAYS have passed."""
+    monkeypatch.setattr(sync_oracle, 'SYNC_FULL_RECONCILE_DAYS', 7)
+    assert needs_full_reconcile(None)
+    assert needs_full_reconcile(SyncState(stage='x', watermark_scn=None, last_full_sync_at=datetime.now()))
+    assert not needs_full_reconcile(SyncState(stage='x', watermark_scn=10, last_full_sync_at=datetime.now()))
+    stale = SyncState(stage='x', watermark_scn=10, last_full_sync_at=datetime.now() - timedelta(days=8))
+    assert needs_full_reconcile(stale)
+
+    stage = RecordingStage()
+    with app.app_context():
+        db.session.add(SyncState(stage='companies', watermark_scn=10,
+                                 last_full_sync_at=datetime.now() - timedelta(days=8)))
+        db.session.commit()
+        run_stage(FakeConnection([], scn=20), 'companies', stage)
+        run_stage(FakeConnection([], scn=30), 'companies', stage)
+        run_stage(FakeConnection([], scn=40), 'companies', stage, full=True)
+
+    assert [since for since, _ in stage.calls] == [None, 20, None]
+
+
+def test_unmatched_rows_hold_the_watermark_until_their_order_arrives(app):
+    """Test that rows whose order is missing are counted, and only those newer than the orders watermark are retried."""
+    columns = ('id', 'purchase_order_id', 'tp_apl', 'tp_dctacr1', 'tp_vlr1', 'vlr1', 'cod_emp1', 'cod_pedc', 'row_scn')
+    rows = [
+        (1, 91, 'Pedido', 'Desconto', 'Valor', 5.0, '1', 'ORD-1', 810),
+        (2, 92, 'Pedido', 'Desconto', 'Valor', 5.0, '1', 'NEW-1', 960),    # order created after the orders snapshot
+        (3, 93, 'Pedido', 'Desconto', 'Valor', 5.0, '1', 'GONE-1', 820),   # order the orders query never returns
+    ]
+
+    with app.app_context():
+        db.session.add(PurchaseOrder(cod_pedc='ORD-1', cod_emp1='1', dt_emis=date(2024, 1, 5), fornecedor_id=1))
+        db.session.add(SyncState(stage='purchase_orders', watermark_scn=900, last_full_sync_at=datetime.now()))
+        db.session.add(SyncState(stage='purchase_adjustments', watermark_scn=800, last_full_sync_at=datetime.now()))
+        db.session.commit()
+
+        stats = sync_purchase_adjustments(FakeConnection(rows, columns), 800)
+        assert (stats['sent'], stats['unmatched'], stats['retry_scn']) == (1, 2, 960)
+        assert PurchaseAdjustment.query.count() == 1
+
+        run_stage(FakeConnection(rows, columns, scn=1000), 'purchase_adjustments', sync_purchase_adjustments)
+        assert db.session.get(SyncState, 'purchase_adjustments').watermark_scn == 959
+
+
+def test_supplier_sync_adopts_suppliers_imported_without_id_for(app):
+    """Test that an RFOR0302 supplier stored without ID_FOR is updated by the id_for sync, not duplicated."""
+    rfor = b'<RFOR0302><G_FORNEC><COD_FOR>900</COD_FOR>%s<DESCRICAO>Imported</DESCRICAO></G_FORNEC></RFOR0302>'
+    columns = ('id_for', 'cod_for', 'descricao', 'cnpj_cpf_normalized')
+
+    with app.app_context():
+        import_rfor0302(rfor % b'')
+        assert Supplier.query.filter_by(cod_for='900').one().id_for is None
+
+        sync_suppliers(FakeConnection([(41, '900', 'Synced', '12345678000195')], columns))
+        sync_suppliers(FakeConnection([(41, '900', 'Renamed', '12345678000195')], columns))
+
+        supplier = Supplier.query.one()
+        assert (supplier.id_for, supplier.cod_for, supplier.descricao) == (41, '900', 'Renamed')
+
+        # A later import keeps the synced id_for and only fills it where it is missing
+        import_rfor0302(rfor % b'<ID_FOR>77</ID_FOR>')
+        import_rfor0302(b'<RFOR0302><G_FORNEC><COD_FOR>901</COD_FOR></G_FORNEC></RFOR0302>')
+        import_rfor0302(b'<RFOR0302><G_FORNEC><COD_FOR>901</COD_FOR><ID_FOR>42</ID_FOR></G_FORNEC></RFOR0302>')
+        assert {s.cod_for: s.id_for for s in Supplier.query} == {'900': 41, '901': 42}
+
+
+class OrderStage(RecordingStage):
+    """Order-bound stage: also reports the order ids it touched, and appends its name to a shared run log."""
+
+    def __init__(self, name, log, order_ids=(), **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.log = log
+        self.order_ids = set(order_ids)
+
+    def __call__(self, oracle_conn, since_scn, pool=None, partitions=1, pending_orders=None):
+        self.log.append(self.name)
+        stats = super().__call__(oracle_conn, since_scn, pool=pool, partitions=partitions)
+        if pending_orders is not None:
+            pending_orders.update(self.order_ids)
+        return stats
+
+
+def sync_graph(log, errors=None):
+    """The SYNC_STAGES shape with fake stages; errors maps stage names to the exception they raise."""
+    errors = errors or {}
+
+    def stage(name, order_ids=()):
+        return OrderStage(name, log, order_ids, error=errors.get(name))
+
+    return [
+        ('suppliers', stage('suppliers'), ()),
+        ('purchase_orders', stage('purchase_orders', {1, 2}), ()),
+        ('purchase_items', stage('purchase_items', {2, 3}), ('purchase_orders',)),
+        ('nf_entries', stage('nf_entries', {4}), ('purchase_orders',)),
+        ('purchase_installments', stage('purchase_installments'), ('purchase_orders',)),
+    ]
+
+
+def watermarks():
+    return {state.stage: state.watermark_scn for state in SyncState.query.all()}
+
+
+def test_stage_graph_runs_dependencies_first_and_refreshes_orders_once(app, monkeypatch):
+    """Test that dependents run after their dependencies, and the order refresh runs once, before any order-bound watermark is saved."""
+    log = []
+    refreshes = []
+
+    def refresh(order_ids):
+        refreshes.append((set(order_ids), watermarks()))
+        log.append('order_refresh')
+
+    monkeypatch.setattr(sync_oracle, 'refresh_synced_orders', refresh)
+
+    completed, failed = run_stage_graph(app, FakePool([]), sync_graph(log), max_workers=1)
+
+    assert failed == set()
+    assert set(completed) == {'suppliers', 'purchase_orders', 'purchase_items', 'nf_entries', 'purchase_installments'}
+    for dependent in ('purchase_items', 'nf_entries', 'purchase_installments'):
+        assert log.index('purchase_orders') < log.index(dependent)
+    assert log[-1] == 'order_refresh'
+    assert len(refreshes) == 1
+    order_ids, saved_before_refresh = refreshes[0]
+    assert order_ids == {1, 2, 3, 4}
+    assert not {'purchase_orders', 'purchase_items', 'nf_entries'} & saved_before_refresh.keys()
+    with app.app_context():
+        assert set(watermarks().values()) == {1000}
+        assert len(watermarks()) == 5
+    assert all('watermark_scn' not in stats for stats in completed.values())
+
+
+def test_stage_graph_skips_dependents_of_a_failed_stage(app, monkeypatch):
+    """Test that a failed stage fails its dependents without running them, while independent stages complete."""
+    log = []
+    refreshes = []
+    monkeypatch.setattr(sync_oracle, 'refresh_synced_orders', refreshes.append)
+
+    completed, failed = run_stage_graph(
+        app, FakePool([]), sync_graph(log, {'purchase_orders': RuntimeError('ORA-00028')}), max_workers=1
+    )
+
+    assert set(completed) == {'suppliers'}
+    assert failed == {'purchase_orders', 'purchase_items', 'nf_entries', 'purchase_installments'}
+    assert sorted(log) == ['purchase_orders', 'suppliers']
+    assert refreshes == []
+    with app.app_context():
+        assert watermarks() == {'suppliers': 1000}
+
+
+def test_stage_graph_keeps_watermark_of_a_failed_stage(app, monkeypatch):
+    """Test that a failing stage keeps its watermark while the orders of the stages that completed are still refreshed."""
+    refreshes = []
+    monkeypatch.setattr(sync_oracle, 'refresh_synced_orders', lambda order_ids: refreshes.append(set(order_ids)))
+    with app.app_context():
+        db.session.add(SyncState(stage='purchase_items', watermark_scn=500, last_full_sync_at=datetime.now()))
+        db.session.commit()
+
+    completed, failed = run_stage_graph(
+        app, FakePool([]), sync_graph([], {'purchase_items': RuntimeError('ORA-01555')}), max_workers=1
+    )
+
+    assert failed == {'purchase_items'}
+    assert refreshes == [{1, 2, 4}]
+    with app.app_context():
+        assert watermarks() == {
+            'suppliers': 1000, 'purchase_orders': 1000, 'purchase_items': 500, 'nf_entries': 1000,
+            'purchase_installments': 1000,
+        }
+
+
+def test_stage_graph_keeps_order_watermarks_when_the_refresh_fails(app, monkeypatch):
+    """Test that a failed order refresh fails the order-bound stages and leaves their watermarks unsaved."""
+    def refresh(order_ids):
+        raise RuntimeError('deadlock detected')
+
+    monkeypatch.setattr(sync_oracle, 'refresh_synced_orders', refresh)
+
+    completed, failed = run_stage_graph(app, FakePool([]), sync_graph([]), max_workers=1)
+
+    assert failed == {'purchase_orders', 'purchase_items', 'nf_entries'}
+    assert set(completed) == {'suppliers', 'purchase_installments'}
+    with app.app_context():
+        assert watermarks() == {'suppliers': 1000, 'purchase_installments': 1000}